@@ -42,22 +42,30 @@ from PyQt5.QtGui import QIcon, QRegion
 from PyQt5 import QtCore
 
 # from PyQt5.QtCore import QCoreApplication # programatic quit
-from wirelessengine import WirelessEngine, WirelessNetwork
-from sparrowcommon import BaseThreadClass, portOpen, stringtobool
+from wirelessengine import WirelessEngine, WirelessNetwork, MultiRadioScanner, ChannelScheduler
+from sparrowcommon import BaseThreadClass, DeltaState, portOpen, stringtobool
 from sparrowgps import GPSEngine, GPSStatus, SparrowGPS
 from telemetry import TelemetryDialog
 from sparrowtablewidgets import IntTableWidgetItem, DateTableWidgetItem
 from sparrowmap import MapMarker, MapEngine
+from sparrowstore import NetworkStore
+from sparrowwire import decodeNetworks, ACCEPT_BINARY, CONTENT_TYPE_BINARY
+from sparrowclient import agentClient
 from sparrowdialogs import MapSettingsDialog, TelemetryMapSettingsDialog, AgentListenerDialog, GPSCoordDialog
-from sparrowdialogs import AgentConfigDialog, RemoteFilesDialog, BluetoothDialog
+from sparrowdialogs import AgentConfigDialog, RemoteFilesDialog, BluetoothDialog, DBSettingsDialog, DBSettings
+from sparrowdb import SQLiteRecorder
 from sparrowwifiagent import AgentConfigSettings
-from sparrowbluetooth import SparrowBluetooth
+from sparrowbluetooth import SparrowBluetooth, BluetoothDevice
 from sparrowhackrf import SparrowHackrf
 
 # There are some "plugins" that are available for addons.  Let's see if they're present
 hasFalcon = False
 hasBluetooth = False
 hasUbertooth = False
+# Ask agents for scan results in the compact binary format (see sparrowwire.py) instead of JSON
+useBinaryNetworks = False
+# Hold a live stream open to agents for scan results instead of polling them
+useLiveStream = False
 
 try:
     from manuf import manuf
@@ -95,10 +103,11 @@ def getOUIDB():
     return ouidb
     
 # ------------------  Global functions for agent HTTP requests ------------------------------
-def makeGetRequest(url, waitTimeout=6):
+def makeGetRequest(url, waitTimeout=None):
+    # waitTimeout defaults to the endpoint's timeout in sparrowclient.ENDPOINT_TIMEOUTS
     try:
         # Not using a timeout can cause the request to hang indefinitely
-        response = requests.get(url, timeout=waitTimeout)
+        response = agentClient.get(url, waitTimeout)
     except:
         return -1, ""
         
@@ -136,19 +145,26 @@ def requestRemoteGPS(remoteIP, remotePort):
         return -1, "Error connecting to remote agent", None
 
 # ------------------  WiFi scan requests ------------------------------
-def requestRemoteNetworks(remoteIP, remotePort, remoteInterface, channelList=None):
+def requestRemoteNetworks(remoteIP, remotePort, remoteInterface, channelList=None, deltaState=None):
+    # With a DeltaState only networks added or changed since its cursor are returned and the state is updated
     url = "http://" + remoteIP + ":" + str(remotePort) + "/wireless/networks/" + remoteInterface
     
+    params = []
+    # since has to come before frequencies: agents take everything after frequencies= as the channel list
+    if deltaState is not None:
+        params.append("since=" + str(deltaState.getSince()))
+        
     if (channelList is not None) and (len(channelList) > 0):
-        url += "?frequencies="
-        for curChannel in channelList:
-            url += str(curChannel) + ','
-            
-    if url.endswith(','):
-        url = url[:-1]
+        params.append("frequencies=" + ','.join([str(curChannel) for curChannel in channelList]))
+        
+    if len(params) > 0:
+        url += "?" + '&'.join(params)
+        
+    if useBinaryNetworks:
+        return requestRemoteNetworksBinary(url, deltaState)
         
     # Pass a higher timeout since the scan may take a bit
-    statusCode, responsestr = makeGetRequest(url, 20)
+    statusCode, responsestr = makeGetRequest(url)
     
     if statusCode == 200:
         try:
@@ -159,12 +175,49 @@ def requestRemoteNetworks(remoteIP, remotePort, remoteInterface, channelList=Non
                 newNet = WirelessNetwork.createFromJsonDict(curNetDict)
                 wirelessNetworks[newNet.getKey()] = newNet
                 
+            if deltaState is not None:
+                wirelessNetworks = deltaState.mergeResponse(wirelessNetworks, networkjson)
+                
             return networkjson['errCode'], networkjson['errString'], wirelessNetworks
         except:
             return -2, "Error parsing remote agent response", None
     else:
         return -1, "Error connecting to remote agent", None
 
+def requestRemoteNetworksBinary(url, deltaState=None):
+    # Agents that don't know the binary format ignore the Accept header and send JSON
+    try:
+        response = agentClient.get(url, headers={'Accept': ACCEPT_BINARY + ', application/json;q=0.5'})
+    except:
+        return -1, "Error connecting to remote agent", None
+        
+    if response.status_code != 200:
+        return -1, "Error connecting to remote agent", None
+        
+    try:
+        if response.headers.get('Content-type', '').startswith(CONTENT_TYPE_BINARY):
+            delta = {}
+            errCode, errString, gpsdict, wirelessNetworks = decodeNetworks(response.content, delta)
+            
+            if deltaState is not None:
+                wirelessNetworks = deltaState.mergeResponse(wirelessNetworks, delta)
+                
+            return errCode, errString, wirelessNetworks
+            
+        networkjson = json.loads(response.text)
+        wirelessNetworks = {}
+        
+        for curNetDict in networkjson['networks']:
+            newNet = WirelessNetwork.createFromJsonDict(curNetDict)
+            wirelessNetworks[newNet.getKey()] = newNet
+            
+        if deltaState is not None:
+            wirelessNetworks = deltaState.mergeResponse(wirelessNetworks, networkjson)
+            
+        return networkjson['errCode'], networkjson['errString'], wirelessNetworks
+    except:
+        return -2, "Error parsing remote agent response", None
+
 # ------------------  HackRF requests ------------------------------
 def remoteHackrfStatus(agentIP, agentPort):
     url = "http://" + agentIP + ":" + str(agentPort) + "/spectrum/hackrfstatus"
@@ -205,7 +258,7 @@ def startRemoteSpectrumScan(agentIP, agentPort, scan5):
         
 def stopRemoteSpectrumScan(agentIP, agentPort):
     url = "http://" + agentIP + ":" + str(agentPort) + "/spectrum/scanstop"
-    statusCode, responsestr = makeGetRequest(url, 10)
+    statusCode, responsestr = makeGetRequest(url)
     
     if statusCode == 200:
         try:
@@ -220,7 +273,7 @@ def stopRemoteSpectrumScan(agentIP, agentPort):
             
 def getRemoteSpectrumScan(agentIP, agentPort):
     url = "http://" + agentIP + ":" + str(agentPort) + "/spectrum/scanstatus"
-    statusCode, responsestr = makeGetRequest(url, 10)
+    statusCode, responsestr = makeGetRequest(url)
     
     if statusCode == 200:
         try:
@@ -305,7 +358,7 @@ def startRemoteBluetoothScan(agentIP, agentPort):
         
 def stopRemoteBluetoothScan(agentIP, agentPort):
     url = "http://" + agentIP + ":" + str(agentPort) + "/bluetooth/scanstop"
-    statusCode, responsestr = makeGetRequest(url, 6)
+    statusCode, responsestr = makeGetRequest(url)
     
     if statusCode == 200:
         try:
@@ -490,18 +543,60 @@ class ScanThread(BaseThreadClass):
         self.scanDelay = 0.5  # seconds
         self.channelList = channelList
         
+        # Hunt mode picks channels by observed activity rather than round-robin
+        if (channelList is not None) and (len(channelList) > 0):
+            self.scheduler = ChannelScheduler(channelList)
+        else:
+            self.scheduler = None
+        
+    def streamScan(self, frequency=0):
+        scanStream = WirelessEngine.scanForNetworksStreaming(self.interface, frequency)
+        wirelessNetworks = self.emitStream(scanStream)
+        
+        if (self.scheduler is not None) and (frequency != 0):
+            if scanStream.retCode == 0:
+                self.scheduler.recordScan(frequency, scanStream.scanTime, wirelessNetworks)
+            else:
+                self.scheduler.recordFailure(frequency)
+            
+        return scanStream.retCode, scanStream.errString
+        
+    def streamMultiRadioScan(self):
+        # Comma-separated interface list.  The radios split the hunt channels (or the whole band) between them.
+        scanner = MultiRadioScanner(self.interface.split(','), self.channelList)
+        self.emitStream(scanner)
+        return scanner.retCode, scanner.errString
+        
+    def emitStream(self, scanStream):
+        # Returns everything that was found.  The UI only gets it if the scan succeeded, since a scan that fails
+        # part way through has only some of the networks.
+        wirelessNetworks = {}
+        
+        for curNet in scanStream:
+            if self.signalStop:
+                break
+                
+            wirelessNetworks[curNet.getKey()] = curNet
+            
+        if (scanStream.retCode == 0) and (len(wirelessNetworks) > 0) and (not self.signalStop):
+            self.mainWin.scanresults.emit(wirelessNetworks)
+            
+        return wirelessNetworks
+        
     def run(self):
         self.threadRunning = True
         
         while (not self.signalStop):
+            if ',' in self.interface:
+                retCode, errString = self.streamMultiRadioScan()
+                if (retCode != 0) and (retCode != WirelessNetwork.ERR_DEVICEBUSY):
+                    self.mainWin.errmsg.emit(retCode, errString)
+                    
+                sleep(self.scanDelay)
             # Scan all / normal mode
-            if (self.channelList is None) or (len(self.channelList) == 0):
-                retCode, errString, wirelessNetworks = WirelessEngine.scanForNetworks(self.interface)
-                if (retCode == 0):
-                    # self.statusBar().showMessage('Scan complete.  Found ' + str(len(wirelessNetworks)) + ' networks')
-                    if wirelessNetworks and (len(wirelessNetworks) > 0) and (not self.signalStop):
-                        self.mainWin.scanresults.emit(wirelessNetworks)
-                else:
+            elif (self.channelList is None) or (len(self.channelList) == 0):
+                retCode, errString = self.streamScan()
+                if (retCode != 0):
                         if (retCode != WirelessNetwork.ERR_DEVICEBUSY):
                             self.mainWin.errmsg.emit(retCode, errString)
             
@@ -513,24 +608,14 @@ class ScanThread(BaseThreadClass):
                 else:
                     sleep(self.scanDelay)
             else:
-                # Channel hunt mode
-                for curFrequency in self.channelList:
-                    retCode, errString, wirelessNetworks = WirelessEngine.scanForNetworks(self.interface, curFrequency)
-                    if (retCode == 0):
-                        # self.statusBar().showMessage('Scan complete.  Found ' + str(len(wirelessNetworks)) + ' networks')
-                        if wirelessNetworks and (len(wirelessNetworks) > 0) and (not self.signalStop):
-                            self.mainWin.scanresults.emit(wirelessNetworks)
-                    else:
-                            if (retCode != WirelessNetwork.ERR_DEVICEBUSY):
-                                self.mainWin.errmsg.emit(retCode, errString)
-                
-                    if (retCode == WirelessNetwork.ERR_DEVICEBUSY):
-                        # Shorter sleep for faster results
-                        # sleep(0.2)
-                        # Switched back for now.  Might be running too fast.
-                        sleep(self.scanDelay)
-                    else:
-                        sleep(self.scanDelay)
+                # Channel hunt mode.  The scheduler picks the next frequencies to scan together
+                # and how long to wait so scans start on a steady cycle.
+                retCode, errString = self.streamScan(self.scheduler.nextBatch())
+                if (retCode != 0):
+                        if (retCode != WirelessNetwork.ERR_DEVICEBUSY):
+                            self.mainWin.errmsg.emit(retCode, errString)
+                
+                sleep(self.scheduler.getCycleDelay())
                     
         self.threadRunning = False
 
@@ -567,12 +652,31 @@ class RemoteScanThread(BaseThreadClass):
         self.remoteAgentIP = "127.0.0.1"
         self.remoteAgentPort = 8020
         self.channelList = channelList
+        # Only networks that changed since the last request come back from the agent
+        self.deltaState = DeltaState()
+        
+        # Hunt mode picks channels by observed activity rather than asking for the whole list every time
+        if (channelList is not None) and (len(channelList) > 0):
+            self.scheduler = ChannelScheduler(channelList)
+        else:
+            self.scheduler = None
         
     def run(self):
         self.threadRunning = True
         
         while (not self.signalStop):
-            retCode, errString, wirelessNetworks = requestRemoteNetworks(self.remoteAgentIP, self.remoteAgentPort, self.interface, self.channelList)
+            if self.scheduler is not None:
+                # Scan time here includes the round trip to the agent
+                curBatch = self.scheduler.nextBatch()
+                startTime = datetime.datetime.now()
+                retCode, errString, wirelessNetworks = requestRemoteNetworks(self.remoteAgentIP, self.remoteAgentPort, self.interface, curBatch, self.deltaState)
+                if (retCode == 0) and (wirelessNetworks is not None):
+                    self.scheduler.recordScan(curBatch, (datetime.datetime.now() - startTime).total_seconds(), wirelessNetworks)
+                elif retCode != 0:
+                    self.scheduler.recordFailure(curBatch)
+            else:
+                retCode, errString, wirelessNetworks = requestRemoteNetworks(self.remoteAgentIP, self.remoteAgentPort, self.interface, self.channelList, self.deltaState)
+                
             if (retCode == 0):
                 # self.statusBar().showMessage('Scan complete.  Found ' + str(len(wirelessNetworks)) + ' networks')
                 if wirelessNetworks and (len(wirelessNetworks) > 0) and (not self.signalStop):
@@ -581,7 +685,9 @@ class RemoteScanThread(BaseThreadClass):
                     if (retCode != WirelessNetwork.ERR_DEVICEBUSY):
                         self.mainWin.errmsg.emit(retCode, errString)
             
-            if (retCode == WirelessNetwork.ERR_DEVICEBUSY):
+            if self.scheduler is not None:
+                sleep(self.scheduler.getCycleDelay())
+            elif (retCode == WirelessNetwork.ERR_DEVICEBUSY):
                 # Shorter sleep for faster results
                 sleep(0.2)
             else:
@@ -589,6 +695,119 @@ class RemoteScanThread(BaseThreadClass):
             
         self.threadRunning = False
 
+# ------------------  Remote agent live stream thread  ------------------------------
+def iterStreamLines(response):
+    # iter_lines waits for a full chunk_size read before handing anything back, which would hold up the stream.
+    # read1 returns whatever has arrived.
+    if not hasattr(response.raw, 'read1'):
+        for curLine in response.iter_lines(chunk_size=1):
+            yield curLine
+        return
+        
+    pending = b''
+    while True:
+        data = response.raw.read1(65536)
+        if not data:
+            break
+            
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for curLine in lines:
+            yield curLine
+            
+class RemoteStreamThread(RemoteScanThread):
+    # Same results as RemoteScanThread, but holds a /wireless/stream/ connection open and emits each scan as soon as the
+    # agent finishes it rather than polling.  The agent sends the networks as it hears them, so only the end of scan
+    # marker is left by then.  Agents without the stream get polled as before.
+    def __init__(self, interface, mainWin, channelList=None):
+        super().__init__(interface, mainWin, channelList)
+        self.reconnectDelay = 2.0  # seconds
+        # False once we've fallen back to polling
+        self.streaming = True
+        
+    def run(self):
+        url = "http://" + self.remoteAgentIP + ":" + str(self.remoteAgentPort) + "/wireless/stream/" + self.interface
+        params = []
+        if (self.channelList is not None) and (len(self.channelList) > 0):
+            params.append("frequencies=" + ','.join([str(curChannel) for curChannel in self.channelList]))
+        if self.mainWin.hasRemoteBluetooth:
+            # Device changes come down the stream while discovery's running rather than being polled for
+            params.append("bluetooth=1")
+        if len(params) > 0:
+            url += "?" + '&'.join(params)
+            
+        self.threadRunning = True
+        
+        while (not self.signalStop):
+            try:
+                # The agent sends a keepalive every couple of seconds, so a read timeout means the connection is gone
+                response = requests.get(url, stream=True, timeout=(5, 10))
+            except:
+                self.mainWin.errmsg.emit(-1, "Error connecting to remote agent")
+                sleep(self.reconnectDelay)
+                continue
+                
+            if (response.status_code != 200) or (not response.headers.get('Content-type', '').startswith('application/x-ndjson')):
+                # Agent doesn't have the stream
+                response.close()
+                self.streaming = False
+                super().run()
+                return
+                
+            wirelessNetworks = {}
+            try:
+                for curLine in iterStreamLines(response):
+                    if self.signalStop:
+                        break
+                        
+                    if len(curLine) == 0:
+                        continue
+                        
+                    linedict = json.loads(curLine)
+                    
+                    if linedict['type'] == 'network':
+                        newNet = WirelessNetwork.createFromJsonDict(linedict['network'])
+                        wirelessNetworks[newNet.getKey()] = newNet
+                    elif linedict['type'] == 'scan':
+                        if linedict['errCode'] == 0:
+                            if len(wirelessNetworks) > 0:
+                                self.mainWin.scanresults.emit(wirelessNetworks)
+                        elif linedict['errCode'] != WirelessNetwork.ERR_DEVICEBUSY:
+                            self.mainWin.errmsg.emit(linedict['errCode'], linedict['errString'])
+                            
+                        wirelessNetworks = {}
+                    elif linedict['type'] == 'gps':
+                        gpsResult = SparrowGPS()
+                        gpsResult.isValid = linedict['gps']['isValid']
+                        if gpsResult.isValid:
+                            gpsResult.latitude = linedict['gps']['latitude']
+                            gpsResult.longitude = linedict['gps']['longitude']
+                            gpsResult.altitude = linedict['gps']['altitude']
+                            gpsResult.speed = linedict['gps']['speed']
+                        self.mainWin.remotegpsresult.emit(gpsResult)
+                    elif linedict['type'] == 'bluetooth':
+                        devices = {}
+                        for curDevice in linedict['devices']:
+                            newDevice = BluetoothDevice()
+                            try:
+                                newDevice.fromJsondict(curDevice)
+                                devices[newDevice.macAddress] = newDevice
+                            except:
+                                pass
+                                
+                        if len(devices) > 0:
+                            self.mainWin.remotebluetoothresult.emit(devices)
+            except:
+                pass
+            finally:
+                response.close()
+                
+            if not self.signalStop:
+                self.mainWin.errmsg.emit(-1, "Lost the live stream from the remote agent.  Reconnecting.")
+                sleep(self.reconnectDelay)
+                
+        self.threadRunning = False
+
 # ------------------  GPSEngine override onGPSResult to notify the main window when the GPS goes synchnronized  ------------------------------
 class GPSEngineNotifyWin(GPSEngine):
     def __init__(self, mainWin):
@@ -618,6 +837,9 @@ class mainWindow(QMainWindow):
     scanresultsfromadvanced = QtCore.pyqtSignal(dict)
     errmsg = QtCore.pyqtSignal(int, str)
     gpsSynchronizedsignal = QtCore.pyqtSignal()
+    # GPS fixes and bluetooth device changes pushed over a remote agent's live stream
+    remotegpsresult = QtCore.pyqtSignal(object)
+    remotebluetoothresult = QtCore.pyqtSignal(dict)
     advScanClosed = QtCore.pyqtSignal()
     advScanUpdateSSIDs = QtCore.pyqtSignal(dict)
     agentListenerClosed = QtCore.pyqtSignal()
@@ -690,6 +912,9 @@ class mainWindow(QMainWindow):
         self.telemetryWindows = {}
         self.advancedScan = None
         
+        # Continuous save.  Every scan result is recorded here while it's set.
+        self.dbRecorder = None
+        
         self.scanMode="Normal"
         self.huntChannelList = []
         
@@ -715,6 +940,8 @@ class mainWindow(QMainWindow):
         self.scanThread = None
         self.scanDelay = 0.5
         self.scanresults.connect(self.scanResults)
+        self.remotegpsresult.connect(self.onRemoteGPSResult)
+        self.remotebluetoothresult.connect(self.onRemoteBluetoothResult)
         self.singleshotscanresults.connect(self.onSingleShotScanResults)
         self.scanresultsfromadvanced.connect(self.scanResultsFromAdvanced)
         self.errmsg.connect(self.onErrMsg)
@@ -727,6 +954,8 @@ class mainWindow(QMainWindow):
         self.remoteScanIsBlocking = False
         self.remoteScanThread = None
         self.remoteSingleShotThread = None
+        # Last fix from the live stream
+        self.remoteGPS = None
         self.remoteScanDelay = 0.5
         self.lastRemoteState = False
         self.remoteAgentUp = False
@@ -856,8 +1085,7 @@ class mainWindow(QMainWindow):
         interfaces=WirelessEngine.getInterfaces()
         
         if (len(interfaces) > 0):
-            for curInterface in interfaces:
-                self.combo.addItem(curInterface)
+            self.addInterfacesToCombo(interfaces)
         else:
             self.statusBar().showMessage('No wireless interfaces found.')
 
@@ -1050,6 +1278,12 @@ class mainWindow(QMainWindow):
         newAct.triggered.connect(self.onExportJSON)
         exportMenu.addAction(newAct)
         
+        self.menuContinuousSave = QAction('&Continuous Save to Database', self)
+        self.menuContinuousSave.setStatusTip('Record every scan result to a SQLite database')
+        self.menuContinuousSave.setCheckable(True)
+        self.menuContinuousSave.triggered.connect(self.onContinuousSave)
+        fileMenu.addAction(self.menuContinuousSave)
+        
         # exitAct = QAction(QIcon('exit.png'), '&Exit', self)        
         exitAct = QAction('&Exit', self)        
         exitAct.setShortcut('Ctrl+X')
@@ -1070,6 +1304,23 @@ class mainWindow(QMainWindow):
         self.menuRemoteFiles.triggered.connect(self.onRemoteFiles)
         helpMenu.addAction(self.menuRemoteFiles)
         
+        self.menuRemoteBinary = QAction('Compact Scan Transfer', self)        
+        self.menuRemoteBinary.setStatusTip('Request scan results from the agent in binary rather than JSON')
+        self.menuRemoteBinary.setCheckable(True)
+        self.menuRemoteBinary.changed.connect(self.onRemoteBinary)
+        helpMenu.addAction(self.menuRemoteBinary)
+        
+        self.menuRemoteStream = QAction('Live Scan Stream', self)        
+        self.menuRemoteStream.setStatusTip('Keep a connection open to the agent and get scan results as they happen instead of polling')
+        self.menuRemoteStream.setCheckable(True)
+        self.menuRemoteStream.changed.connect(self.onRemoteStream)
+        helpMenu.addAction(self.menuRemoteStream)
+        
+        self.menuRemoteLatency = QAction('Agent Request Latency', self)        
+        self.menuRemoteLatency.setStatusTip('Show response times for the requests made to agents')
+        self.menuRemoteLatency.triggered.connect(self.onRemoteLatency)
+        helpMenu.addAction(self.menuRemoteLatency)
+        
         helpMenu.addSeparator()
         
         self.menuRemoteAgentListener = QAction('Agent Discovery', self)        
@@ -2044,8 +2295,9 @@ class mainWindow(QMainWindow):
             QMessageBox.question(self, 'Error',"Please provide an output file.", QMessageBox.Ok)
             return
             
-        markerDict = {}
-        markers = []
+        # Pull the networks into a store and let it group them by location
+        networkStore = NetworkStore(rowPosition)
+        tableNetworks = []
         
         # Range goes to last # - 1
         for curRow in range(0, rowPosition):
@@ -2055,49 +2307,10 @@ class mainWindow(QMainWindow):
                 curData = None
             
             if (curData):
-                newMarker = MapMarker()
-                
-                newMarker.label = WirelessEngine.convertUnknownToString(curData.ssid)
-                newMarker.label = newMarker.label[:mapSettings.maxLabelLength]
+                tableNetworks.append(curData)
                 
-                if mapSettings.plotstrongest:
-                    if curData.strongestgps.isValid:
-                        newMarker.gpsValid = True
-                        newMarker.latitude = curData.strongestgps.latitude
-                        newMarker.longitude = curData.strongestgps.longitude
-                    else:
-                        newMarker.gpsValid = False
-                        newMarker.latitude = 0.0
-                        newMarker.longitude = 0.0
-                        
-                    newMarker.barCount = WirelessEngine.getSignalQualityFromDB0To5(curData.strongestsignal)
-                else:
-                    if curData.gps.isValid:
-                        newMarker.gpsValid = True
-                        newMarker.latitude = curData.gps.latitude
-                        newMarker.longitude = curData.gps.longitude
-                    else:
-                        newMarker.gpsValid = False
-                        newMarker.latitude = 0.0
-                        newMarker.longitude = 0.0
-                        
-                    newMarker.barCount = WirelessEngine.getSignalQualityFromDB0To5(curData.signal)
-                
-                markerKey = newMarker.getKey()
-                if markerKey in markerDict:
-                    curMarker = markerDict[markerKey]
-                    curMarker.addLabel(newMarker.label)
-                    if curMarker.barCount > newMarker.barCount:
-                        curMarker.barCount = newMarker.barCount
-                else:
-                    # Move label to list
-                    newMarker.addLabel(newMarker.label)
-                    newMarker.label = ''
-                    markerDict[markerKey] = newMarker
-
-        # Now send consolidated list
-        for curKey in markerDict.keys():
-            markers.append(markerDict[curKey])
+        networkStore.upsert(tableNetworks)
+        markers = networkStore.getMapMarkers(mapSettings.plotstrongest, mapSettings.maxLabelLength)
         
         if len(markers) > 0:
             retVal = MapEngine.createMap(mapSettings.outputfile,mapSettings.title,markers, connectMarkers=False, openWhenDone=True, mapType=mapSettings.mapType)
@@ -2180,6 +2393,9 @@ class mainWindow(QMainWindow):
         if (not self.remoteAgentUp):
             # Local
             retVal = self.gpsEngine.getLastCoord()
+        elif self.remoteStreamRunning() and (self.remoteGPS is not None):
+            # The live stream keeps us up to date
+            retVal = self.remoteGPS
         else:
             # Remote
             errCode, errMsg, gpsStatus = requestRemoteGPS(self.remoteAgentIP, self.remoteAgentPort)
@@ -2251,6 +2467,27 @@ class mainWindow(QMainWindow):
                     self.btnGPSStatus.setStyleSheet("background-color: red; border: 1px;")
             
 
+    def remoteStreamRunning(self):
+        return isinstance(self.remoteScanThread, RemoteStreamThread) and self.remoteScanThread.threadRunning and self.remoteScanThread.streaming
+        
+    def bluetoothStreaming(self):
+        # True if remote bluetooth discovery results are coming over the live stream
+        return self.remoteAgentUp and self.hasRemoteBluetooth and self.remoteStreamRunning()
+        
+    def onRemoteGPSResult(self, gpsResult):
+        self.remoteGPS = gpsResult
+        
+        if self.gpsSynchronized != gpsResult.isValid:
+            self.gpsSynchronized = gpsResult.isValid
+            if gpsResult.isValid:
+                self.btnGPSStatus.setStyleSheet("background-color: green; border: 1px;")
+            else:
+                self.btnGPSStatus.setStyleSheet("background-color: yellow; border: 1px;")
+                
+    def onRemoteBluetoothResult(self, devices):
+        if self.bluetoothWin:
+            self.bluetoothWin.onStreamDevices(devices)
+            
     def onGPSSyncChanged(self):
         # GPS status has changed
         self.onGPSStatus()
@@ -2415,10 +2652,15 @@ class mainWindow(QMainWindow):
             if (self.combo.count() > 0):
                 curInterface = str(self.combo.currentText())
                 self.statusBar().showMessage('Scanning on interface ' + curInterface)
+                if useLiveStream:
+                    scanThreadClass = RemoteStreamThread
+                else:
+                    scanThreadClass = RemoteScanThread
+                    
                 if self.scanMode == "Normal" or (len(self.huntChannelList) == 0):
-                    self.remoteScanThread = RemoteScanThread(curInterface, self)
+                    self.remoteScanThread = scanThreadClass(curInterface, self)
                 else:
-                    self.remoteScanThread = RemoteScanThread(curInterface, self, self.huntChannelList)
+                    self.remoteScanThread = scanThreadClass(curInterface, self, self.huntChannelList)
                     
                 self.remoteScanThread.scanDelay = self.remoteScanDelay
                 self.remoteScanThread.start()
@@ -2517,13 +2759,52 @@ class mainWindow(QMainWindow):
             if self.gpsSynchronized and (self.gpsEngine.lastCoord is not None) and (self.gpsEngine.lastCoord.isValid):
                 for curKey in wirelessNetworks.keys():
                     curNet = wirelessNetworks[curKey]
-                    curNet.gps.copy(self.gpsEngine.lastCoord)
-                    curNet.strongestgps.copy(self.gpsEngine.lastCoord)
+                    curNet.gps = self.gpsEngine.lastCoord
+                    curNet.strongestgps = self.gpsEngine.lastCoord
         
         if self.menuRemoteAgent.isChecked() or ((not self.menuRemoteAgent.isChecked()) and self.scanRunning):
             # If is to prevent a messaging issue on last iteration
             # Scan results will come over from the remote agent with the GPS fields already populated.
             self.populateTable(wirelessNetworks)
+            
+            if self.dbRecorder:
+                try:
+                    self.dbRecorder.recordNetworks(list(wirelessNetworks.values()), self.ouiLookup)
+                except Exception as e:
+                    self.stopContinuousSave()
+                    QMessageBox.question(self, 'Error',"Continuous save stopped.  Unable to write to the database: " + str(e), QMessageBox.Ok)
+        
+    def onContinuousSave(self):
+        if not self.menuContinuousSave.isChecked():
+            self.stopContinuousSave()
+            return
+            
+        dbSettings, accepted = DBSettingsDialog.getSettings(self)
+        
+        if (not accepted) or (len(dbSettings.db) == 0):
+            self.menuContinuousSave.setChecked(False)
+            return
+            
+        if dbSettings.dbMode == DBSettings.POSTGRES:
+            self.menuContinuousSave.setChecked(False)
+            QMessageBox.question(self, 'Error',"Only SQLite databases are supported for continuous save.", QMessageBox.Ok)
+            return
+            
+        try:
+            self.dbRecorder = SQLiteRecorder(dbSettings.db)
+        except Exception as e:
+            self.menuContinuousSave.setChecked(False)
+            QMessageBox.question(self, 'Error',"Unable to open " + dbSettings.db + ": " + str(e), QMessageBox.Ok)
+            return
+            
+        self.statusBar().showMessage('Saving scan results to ' + dbSettings.db)
+        
+    def stopContinuousSave(self):
+        if self.dbRecorder:
+            self.dbRecorder.close()
+            self.dbRecorder = None
+            
+        self.menuContinuousSave.setChecked(False)
         
     def onErrMsg(self, errCode, errMsg):
         self.statusBar().showMessage("Error ["+str(errCode) + "]: " + errMsg)
@@ -2779,7 +3060,7 @@ class mainWindow(QMainWindow):
                                 curNet.secondaryChannelLocation = curData.secondaryChannelLocation
                                 
                             self.networkTable.item(curRow, 8).setText(str(curNet.bandwidth))
-                            self.networkTable.item(curRow, 9).setText(curNet.lastSeen.strftime("%m/%d/%Y %H:%M:%S"))
+                            self.networkTable.item(curRow, 9).setText(curNet.getLastSeenString())
                             
                             # Carry forward firstSeen
                             curNet.firstSeen = curData.firstSeen # This is one field to carry forward
@@ -2795,7 +3076,7 @@ class mainWindow(QMainWindow):
                                 curNet.strongestgps.speed = curData.gps.speed
                                 curNet.strongestgps.isValid = curData.gps.isValid
                             
-                            self.networkTable.item(curRow, 10).setText(curNet.firstSeen.strftime("%m/%d/%Y %H:%M:%S"))
+                            self.networkTable.item(curRow, 10).setText(curNet.getFirstSeenString())
                             if curNet.gps.isValid:
                                 self.networkTable.item(curRow, 11).setText('Yes')
                             else:
@@ -2920,8 +3201,8 @@ class mainWindow(QMainWindow):
             self.networkTable.setItem(rowPosition, 6, IntTableWidgetItem(str(curNet.frequency)))
             self.networkTable.setItem(rowPosition, 7,  IntTableWidgetItem(str(curNet.signal)))
             self.networkTable.setItem(rowPosition, 8, IntTableWidgetItem(str(curNet.bandwidth)))
-            self.networkTable.setItem(rowPosition, 9, DateTableWidgetItem(curNet.lastSeen.strftime("%m/%d/%Y %H:%M:%S")))
-            self.networkTable.setItem(rowPosition, 10, DateTableWidgetItem(curNet.firstSeen.strftime("%m/%d/%Y %H:%M:%S")))
+            self.networkTable.setItem(rowPosition, 9, DateTableWidgetItem(curNet.getLastSeenString()))
+            self.networkTable.setItem(rowPosition, 10, DateTableWidgetItem(curNet.getFirstSeenString()))
             if curNet.gps.isValid:
                 self.networkTable.setItem(rowPosition, 11, QTableWidgetItem('Yes'))
             else:
@@ -3008,6 +3289,14 @@ class mainWindow(QMainWindow):
                     self.networkTable.removeRow(i)
 
         
+    def addInterfacesToCombo(self, interfaces):
+        for curInterface in interfaces:
+            self.combo.addItem(curInterface)
+            
+        if len(interfaces) > 1:
+            # Scan with all of the radios at once
+            self.combo.addItem(','.join(interfaces))
+            
     def onInterface(self):
         pass
             
@@ -3017,6 +3306,10 @@ class mainWindow(QMainWindow):
         self.spectrum24Line = None
         self.chart5.removeAllSeries()
         
+        if self.remoteScanThread:
+            # The next poll needs to send everything again to refill the table
+            self.remoteScanThread.deltaState.reset()
+        
         
     def openFileDialog(self, fileSpec="CSV Files (*.csv);;All Files (*)"):    
         options = QFileDialog.Options()
@@ -3260,7 +3553,7 @@ class mainWindow(QMainWindow):
 
             outputFile.write(curData.macAddr  + ',' + self.networkTable.item(i, 1).text() + ',"' + curData.ssid + '",' + curData.security + ',' + curData.privacy)
             outputFile.write(',' + curData.getChannelString() + ',' + str(curData.frequency) + ',' + str(curData.signal) + ',' + str(curData.strongestsignal) + ',' + str(curData.bandwidth) + ',' +
-                                    curData.lastSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + curData.firstSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + 
+                                    curData.getLastSeenString() + ',' + curData.getFirstSeenString() + ',' + 
                                     str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
                                     str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
             
@@ -3406,6 +3699,17 @@ class mainWindow(QMainWindow):
             self.hackrfLastSpectrumState5 = False
             self.menuHackrfSpectrum5.setChecked(False)
             
+    def onRemoteBinary(self):
+        global useBinaryNetworks
+        
+        useBinaryNetworks = self.menuRemoteBinary.isChecked()
+        
+    def onRemoteStream(self):
+        global useLiveStream
+        
+        # Takes effect the next time a remote scan starts
+        useLiveStream = self.menuRemoteStream.isChecked()
+        
     def onRemoteAgent(self):
         if (self.menuRemoteAgent.isChecked() == self.lastRemoteState):
             # There's an extra bounce in this for some reason.
@@ -3475,8 +3779,7 @@ class mainWindow(QMainWindow):
                 # Okay, we have interfaces.  Let's load them
                 self.combo.clear()
                 if (len(interfaces) > 0):
-                    for curInterface in interfaces:
-                        self.combo.addItem(curInterface)
+                    self.addInterfacesToCombo(interfaces)
                 else:
                     self.statusBar().showMessage('No wireless interfaces found.')
 
@@ -3566,8 +3869,7 @@ class mainWindow(QMainWindow):
             interfaces=WirelessEngine.getInterfaces()
             
             if (len(interfaces) > 0):
-                for curInterface in interfaces:
-                    self.combo.addItem(curInterface)
+                self.addInterfacesToCombo(interfaces)
             else:
                 self.statusBar().showMessage('No wireless interfaces found.')
 
@@ -3593,6 +3895,20 @@ class mainWindow(QMainWindow):
         self.checkNotifyBluetoothDiscovery()
         self.checkNotifyAdvancedScan()
 
+    def onRemoteLatency(self):
+        latencyStats = agentClient.getLatencyStats()
+        
+        if len(latencyStats) == 0:
+            latencyMsg = "No agent requests made yet."
+        else:
+            latencyMsg = "Endpoint: calls, errors, mean / min / max ms\n\n"
+            for curEndpoint in sorted(latencyStats.keys()):
+                curStats = latencyStats[curEndpoint]
+                latencyMsg += curEndpoint + ": " + str(curStats['count']) + ", " + str(curStats['errors']) + ", "
+                latencyMsg += "%.1f / %.1f / %.1f\n" % (curStats['mean']*1000.0, curStats['min']*1000.0, curStats['max']*1000.0)
+                
+        QMessageBox.question(self, 'Agent Request Latency', latencyMsg, QMessageBox.Ok)
+        
     def onAbout(self):
         aboutMsg = "Sparrow-wifi 802.11 WiFi Graphic Analyzer\n"
         aboutMsg += "Written by ghostop14\n"
@@ -3649,6 +3965,8 @@ class mainWindow(QMainWindow):
             
         self.hackrf.stopScanning()
         
+        self.stopContinuousSave()
+        
         event.accept()
 
 # -------  Main Routine and Bluetooth Function -------------------------
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# asyncio HTTP server that runs an existing BaseHTTPRequestHandler class, so the agent keeps one set of URL handlers
+# for both server modes.  Connections are coroutines rather than a thread each:
+#   - paths in inlinePaths are cheap and answered right on the event loop
+#   - asyncHandlers are coroutines for long-lived responses (the live stream) that shouldn't tie up a worker
+#   - everything else (scans, bluetooth reads, file sends) runs on a fixed pool of maxWorkers threads.  Once
+#     maxQueued requests are waiting on the pool, new ones get a 503 with Retry-After rather than piling up.
+
+import asyncio
+import io
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_HEADER_SIZE = 65536
+# Worker threads writing a big response wait for the client once this much is buffered
+WRITE_HIGH_WATER = 1048576
+
+class LoopWriter(object):
+    # wfile for handlers.  Writes from the event loop go straight to the transport, writes from a worker thread
+    # are handed to the loop in order.
+    def __init__(self, loop, transport):
+        self.loop = loop
+        self.transport = transport
+        self.loopThread = threading.get_ident()
+
+    def write(self, data):
+        if self.transport.is_closing():
+            raise BrokenPipeError('Client disconnected')
+
+        if threading.get_ident() == self.loopThread:
+            self.transport.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.transport.write, bytes(data))
+
+            while (self.transport.get_write_buffer_size() > WRITE_HIGH_WATER) and (not self.transport.is_closing()):
+                time.sleep(0.01)
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+class LoopQueue(object):
+    # Line queue a worker thread can put_nowait to (like queue.Queue) and a coroutine can await.  Past maxsize the
+    # oldest line is dropped to make room.
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, item):
+        self.loop.call_soon_threadsafe(self.putItem, item)
+
+    def putItem(self, item):
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+                
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout):
+        # Returns None on timeout
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+class AsyncRequest(object):
+    def __init__(self, method, path, version, headers, clientAddress):
+        self.method = method
+        self.path = path
+        self.version = version
+        # Header names lower case
+        self.headers = headers
+        self.clientAddress = clientAddress
+
+class AsyncHTTPServer(object):
+    def __init__(self, handlerClass, port, inlinePaths=None, asyncHandlers=None, maxWorkers=4, maxQueued=16, idleTimeout=60):
+        # asyncHandlers is a list of (path prefix, coroutine function(request, reader, writer)).  The connection is
+        # closed when the coroutine returns.
+        self.handlerClass = handlerClass
+        self.port = port
+
+        if inlinePaths is None:
+            self.inlinePaths = []
+        else:
+            self.inlinePaths = inlinePaths
+
+        if asyncHandlers is None:
+            self.asyncHandlers = []
+        else:
+            self.asyncHandlers = asyncHandlers
+
+        self.maxWorkers = maxWorkers
+        self.maxQueued = maxQueued
+        self.idleTimeout = idleTimeout
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='agentworker')
+        # Requests handed to the pool that haven't finished.  Only touched on the loop.
+        self.pending = 0
+        self.rejected = 0
+        self.loop = None
+        self.stopEvent = None
+
+    def serve_forever(self):
+        # Blocks until shutdown() or Ctrl-C
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+        self.executor.shutdown(wait=False)
+
+    def shutdown(self):
+        if (self.loop is not None) and (self.stopEvent is not None):
+            self.loop.call_soon_threadsafe(self.stopEvent.set)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopEvent = asyncio.Event()
+
+        server = await asyncio.start_server(self.handleConnection, '', self.port, limit=MAX_HEADER_SIZE, reuse_address=True)
+
+        async with server:
+            await self.stopEvent.wait()
+
+    def getQueueDepth(self):
+        # Requests waiting for a worker, not counting the ones running
+        return max(self.pending - self.maxWorkers, 0)
+
+    async def readRequest(self, reader, clientAddress):
+        # Returns the AsyncRequest and the raw bytes to feed the handler, or None, None when the client is done
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idleTimeout)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            return None, None
+
+        lines = head.decode('iso-8859-1').split('\r\n')
+        requestLine = lines[0].split()
+        if len(requestLine) < 2:
+            return None, None
+
+        headers = {}
+        for curLine in lines[1:]:
+            if ':' in curLine:
+                key, value = curLine.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+        body = b''
+        try:
+            length = int(headers.get('content-length', '0'))
+        except:
+            length = 0
+
+        if length > 0:
+            try:
+                body = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None, None
+
+        if len(requestLine) > 2:
+            version = requestLine[2]
+        else:
+            version = 'HTTP/0.9'
+
+        return AsyncRequest(requestLine[0], requestLine[1], version, headers, clientAddress), head + body
+
+    def runHandler(self, rawRequest, wfile, clientAddress):
+        # Runs one request through the BaseHTTPRequestHandler class without its socket setup.  Returns True if the
+        # connection can stay open.
+        handler = self.handlerClass.__new__(self.handlerClass)
+        handler.server = self
+        handler.request = None
+        handler.client_address = clientAddress
+        handler.rfile = io.BytesIO(rawRequest)
+        handler.wfile = wfile
+        handler.close_connection = True
+
+        try:
+            handler.handle_one_request()
+        except ConnectionError:
+            return False
+        except:
+            # Same as socketserver does for a handler that blows up
+            traceback.print_exc()
+            return False
+
+        return not handler.close_connection
+
+    def sendBusy(self, writer):
+        body = b'{"errcode": 503, "errmsg": "Agent busy.  Try again."}'
+        writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-type: application/json\r\nRetry-After: 1\r\n' +
+                     b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+
+    async def handleConnection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except:
+                pass
+
+        peer = writer.get_extra_info('peername')
+        if peer:
+            clientAddress = (peer[0], peer[1])
+        else:
+            clientAddress = ('', 0)
+
+        wfile = LoopWriter(self.loop, writer.transport)
+
+        try:
+            while not self.stopEvent.is_set():
+                request, rawRequest = await self.readRequest(reader, clientAddress)
+                if request is None:
+                    break
+
+                asyncHandler = None
+                for curPrefix, curHandler in self.asyncHandlers:
+                    if request.path.startswith(curPrefix):
+                        asyncHandler = curHandler
+                        break
+
+                if asyncHandler is not None:
+                    await asyncHandler(request, reader, writer)
+                    break
+
+                if request.path.split('?')[0] in self.inlinePaths:
+                    keepAlive = self.runHandler(rawRequest, wfile, clientAddress)
+                elif self.getQueueDepth() >= self.maxQueued:
+                    self.rejected += 1
+                    self.sendBusy(writer)
+                    keepAlive = True
+                else:
+                    self.pending += 1
+                    try:
+                        keepAlive = await self.loop.run_in_executor(self.executor, self.runHandler, rawRequest, wfile, clientAddress)
+                    finally:
+                        self.pending -= 1
+
+                await writer.drain()
+
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except:
+                pass
@@ -0,0 +1,971 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# Benchmarks for the sparrow-wifi engines.  Apart from scanbatch none of these need root or radio hardware, and load
+# needs a running agent.
+# Usage: python3 sparrowbenchmark.py iwparser [--capture <iw output file> ...]
+#        python3 sparrowbenchmark.py nl80211 [--replay <nl80211 capture file> ...]
+#        python3 sparrowbenchmark.py dumpparity [--corpus <directory>] [--maxage <seconds>]
+#        python3 sparrowbenchmark.py records [--count <number of records>]
+#        python3 sparrowbenchmark.py scheduler [--duration <seconds>] [--busy <number of busy channels>]
+#        python3 sparrowbenchmark.py store [--count <number of observations>] [--batchsize <networks per scan>]
+#        python3 sparrowbenchmark.py wire [--networks 500,5000]
+#        python3 sparrowbenchmark.py load [--agent http://127.0.0.1:8020] [--clients 50] [--duration 20] [--agentpid <pid>]
+#        sudo python3 sparrowbenchmark.py scanbatch --interface wlan0 [--frequencies <f1,f2,...>] [--batchsizes 1,4,8,0]
+
+import os
+import random
+import struct
+import argparse
+import copy
+import datetime
+import json
+import gzip
+import tracemalloc
+import threading
+import requests
+from time import perf_counter, sleep, time
+
+import numpy as np
+
+from wirelessengine import WirelessEngine, WirelessNetwork, ChannelScheduler, JsonNetworkEncoder, IWPARSER_DISPATCH, IWPARSER_REGEX, channelToFreq
+from sparrowbluetooth import BluetoothDevice
+from sparrowgps import SparrowGPS
+from sparrowstore import NetworkStore, DEG_SCALE
+from sparrowwire import BinaryNetworkEncoder, decodeNetworks
+from sparrownl80211 import escapeSSID, packAttr, packU32Attr, decodeScanMessages, loadCapture, cipherNames, authNames
+from sparrownl80211 import NLM_F_MULTI, NL80211_CMD_NEW_SCAN_RESULTS, NL80211_ATTR_IFINDEX, NL80211_ATTR_BSS
+from sparrownl80211 import NL80211_BSS_BSSID, NL80211_BSS_FREQUENCY, NL80211_BSS_CAPABILITY, NL80211_BSS_SIGNAL_MBM, NL80211_BSS_SEEN_MS_AGO, NL80211_BSS_INFORMATION_ELEMENTS
+from sparrownl80211 import IE_SSID, IE_DS_PARAMETER, IE_RSN, IE_HT_OPERATION, IE_VHT_OPERATION, IE_VENDOR
+
+# Captured scan dumps for dumpparity.  Record a new pair on a live interface (as root) with
+#   python3 sparrownl80211.py --interface wlan0 --dump --capture captures/<name>.nl80211
+#   iw dev wlan0 scan dump > captures/<name>.iw
+DUMP_CORPUS_DIR = os.path.dirname(os.path.abspath(__file__)) + '/captures'
+DUMP_CAPTURE_EXTENSION = '.nl80211'
+DUMP_IW_EXTENSION = '.iw'
+
+# ------------------  Synthetic data ------------------------------
+def syntheticBSS(rnd):
+    # Random parameters for one BSS.  Rendered either as iw text or as an nl80211 scan message.
+    bss = {}
+    if rnd.random() < 0.6:
+        bss['channel'] = rnd.choice([1, 6, 11, 3, 9])
+        bss['frequency'] = 2407 + 5 * bss['channel']
+    else:
+        bss['channel'] = rnd.choice([36, 40, 44, 48, 149, 153, 157, 161])
+        bss['frequency'] = 5000 + 5 * bss['channel']
+
+    ssid = rnd.choice(['HomeNet', 'CorpWiFi', 'Guest', 'xfinitywifi', 'Free Public WiFi', 'NETGEAR' + str(rnd.randint(10, 99))])
+    bss['ssid'] = ssid.encode('ASCII')
+    if rnd.random() < 0.05:
+        bss['ssid'] = b'\x00' * rnd.randint(1, 8)
+
+    bss['mac'] = bytes(rnd.randint(0, 255) for i in range(0, 6))
+    if rnd.random() < 0.7:
+        bss['capability'] = 0x0411
+    else:
+        bss['capability'] = 0x0421
+    bss['signal'] = rnd.randint(-95, -30)
+    bss['pairwise'] = rnd.choice([[4], [4, 2]])
+    bss['auth'] = [rnd.choice([2, 1, 8])]
+    bss['secondary'] = rnd.choice([0, 1, 3])
+    bss['ht40'] = rnd.random() < 0.5
+    return bss
+
+def syntheticIWBlock(rnd, interface='wlan0'):
+    return renderIWBlock(syntheticBSS(rnd), interface)
+
+def renderIWBlock(bss, interface='wlan0'):
+    # One BSS block laid out the way 'iw dev <interface> scan' prints it
+    channel = bss['channel']
+    capabilityNames = {0x0411: 'ESS Privacy ShortSlotTime', 0x0421: 'ESS ShortPreamble ShortSlotTime'}
+
+    lines = []
+    lines.append('BSS ' + ':'.join('%02x' % curByte for curByte in bss['mac']) + '(on ' + interface + ')')
+    lines.append('\tTSF: 12345678 usec (0d, 00:01:40)')
+    lines.append('\tfreq: ' + str(bss['frequency']))
+    lines.append('\tbeacon interval: 100 TUs')
+    lines.append('\tcapability: ' + capabilityNames[bss['capability']] + ' (0x%.4x)' % bss['capability'])
+    lines.append('\tsignal: ' + str(bss['signal']) + '.00 dBm')
+    lines.append('\tlast seen: ' + str(bss.get('seen', 100)) + ' ms ago')
+    lines.append('\tInformation elements from Probe Response frame:')
+    lines.append('\tSSID: ' + escapeSSID(bss['ssid']))
+    lines.append('\tSupported rates: 1.0* 2.0* 5.5* 11.0* 18.0 24.0 36.0 54.0 ')
+    lines.append('\tDS Parameter set: channel ' + str(channel))
+    lines.append('\tERP: Barker_Preamble_Mode')
+    lines.append('\tExtended supported rates: 6.0 9.0 12.0 48.0 ')
+    lines.append('\tRSN:\t * Version: 1')
+    lines.append('\t\t * Group cipher: CCMP')
+    lines.append('\t\t * Pairwise ciphers: ' + ' '.join(cipherNames[b'\x00\x0f\xac'][curSuite] for curSuite in bss['pairwise']))
+    lines.append('\t\t * Authentication suites: ' + ' '.join(authNames[b'\x00\x0f\xac'][curSuite] for curSuite in bss['auth']))
+    lines.append('\t\t * Capabilities: 16-PTKSA-RC 1-GTKSA-RC (0x000c)')
+    lines.append('\tBSS Load:')
+    lines.append('\t\t * station count: 3')
+    lines.append('\t\t * channel utilisation: 20/255')
+    lines.append('\t\t * available admission capacity: 0 [*32us]')
+    lines.append('\tHT capabilities:')
+    lines.append('\t\tCapabilities: 0x1ad')
+    lines.append('\t\t\tRX LDPC')
+    lines.append('\t\t\tHT20/HT40' if bss['ht40'] else '\t\t\tHT20')
+    lines.append('\t\t\tSM Power Save disabled')
+    lines.append('\t\t\tRX HT20 SGI')
+    lines.append('\t\tMaximum RX AMPDU length 65535 bytes (exponent: 0x003)')
+    lines.append('\t\tMinimum RX AMPDU time spacing: 4 usec (0x05)')
+    lines.append('\t\tHT RX MCS rate indexes supported: 0-15')
+    lines.append('\tHT operation:')
+    lines.append('\t\t * primary channel: ' + str(channel))
+    lines.append('\t\t * secondary channel offset: ' + ['no secondary', 'above', '[reserved!]', 'below'][bss['secondary']])
+    lines.append('\t\t * STA channel width: any')
+    lines.append('\t\t * RIFS: 0')
+    if channel > 14:
+        lines.append('\tVHT operation:')
+        lines.append('\t\t * channel width: 1 (80 MHz)')
+        lines.append('\t\t * center freq segment 1: ' + str(channel + 6))
+        lines.append('\t\t * center freq segment 2: 0')
+        lines.append('\t\t * VHT basic MCS set: 0xfffc')
+    lines.append('\tExtended capabilities:')
+    lines.append('\t\t * Extended Channel Switching')
+    lines.append('\t\t * BSS Transition')
+    lines.append('\tWMM:\t * Parameter version 1')
+    lines.append('\t\t * BE: CW 15-1023, AIFSN 3')
+    lines.append('\t\t * BK: CW 15-1023, AIFSN 7')
+    lines.append('\tWPS:\t * Version: 1.0')
+    lines.append('\t\t * Wi-Fi Protected Setup State: 2 (Configured)')
+    lines.append('\t\t * UUID: 4a8b3c2d-1e0f-5a6b-7c8d-9e0f1a2b3c4d')
+    lines.append('\tVendor specific: OUI 00:10:18, data: 02 00 00 1c 00 00')
+
+    return lines
+
+def renderNLMessage(bss, familyId=0x1c):
+    # The same BSS as the NL80211_CMD_NEW_SCAN_RESULTS message a GET_SCAN dump returns
+    channel = bss['channel']
+
+    ies = b''
+    ies += bytes([IE_SSID, len(bss['ssid'])]) + bss['ssid']
+    ies += bytes([1, 8, 0x82, 0x84, 0x8b, 0x96, 0x24, 0x30, 0x48, 0x6c])
+    ies += bytes([IE_DS_PARAMETER, 1, channel])
+    ies += bytes([42, 1, 0])
+    rsn = struct.pack('<H', 1) + b'\x00\x0f\xac\x04'
+    rsn += struct.pack('<H', len(bss['pairwise'])) + b''.join(b'\x00\x0f\xac' + bytes([curSuite]) for curSuite in bss['pairwise'])
+    rsn += struct.pack('<H', len(bss['auth'])) + b''.join(b'\x00\x0f\xac' + bytes([curSuite]) for curSuite in bss['auth'])
+    rsn += b'\x0c\x00'
+    ies += bytes([IE_RSN, len(rsn)]) + rsn
+    ies += bytes([11, 5, 3, 0, 20, 0, 0])
+    ies += bytes([45, 26, 0xad, 0x01]) + b'\x00' * 24
+    ies += bytes([IE_HT_OPERATION, 22, channel, bss['secondary']]) + b'\x00' * 20
+    if channel > 14:
+        ies += bytes([IE_VHT_OPERATION, 5, 1, channel + 6, 0, 0xfc, 0xff])
+    ies += bytes([127, 2, 0x04, 0x00])
+    ies += bytes([IE_VENDOR, 7, 0x00, 0x50, 0xf2, 0x02, 0x01, 0x01, 0x00])
+    ies += bytes([IE_VENDOR, 9, 0x00, 0x10, 0x18, 0x02, 0x00, 0x00, 0x1c, 0x00, 0x00])
+
+    bssAttrs = packAttr(NL80211_BSS_BSSID, bss['mac'])
+    bssAttrs += packU32Attr(NL80211_BSS_FREQUENCY, bss['frequency'])
+    bssAttrs += packAttr(NL80211_BSS_CAPABILITY, struct.pack('=H', bss['capability']))
+    bssAttrs += packAttr(NL80211_BSS_SIGNAL_MBM, struct.pack('=i', bss['signal'] * 100))
+    bssAttrs += packU32Attr(NL80211_BSS_SEEN_MS_AGO, bss.get('seen', 100))
+    bssAttrs += packAttr(NL80211_BSS_INFORMATION_ELEMENTS, ies)
+
+    payload = struct.pack('=BBH', NL80211_CMD_NEW_SCAN_RESULTS, 1, 0) + packU32Attr(NL80211_ATTR_IFINDEX, 3) + packAttr(NL80211_ATTR_BSS, bssAttrs)
+    return struct.pack('=IHHII', 16 + len(payload), familyId, NLM_F_MULTI, 1, 0) + payload
+
+def syntheticIWDump(numBlocks, seed=1):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(0, numBlocks):
+        lines += syntheticIWBlock(rnd)
+
+    return '\n'.join(lines) + '\n'
+
+def timeIt(func, *args, repeat=3):
+    # Best of N in seconds
+    bestTime = None
+    for i in range(0, repeat):
+        startTime = perf_counter()
+        func(*args)
+        elapsed = perf_counter() - startTime
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+
+    return bestTime
+
+def compareNetworkDicts(netsA, netsB):
+    # Returns True if both parses produced the same networks (timestamps excluded)
+    if netsA.keys() != netsB.keys():
+        return False
+
+    for curKey in netsA.keys():
+        dictA = netsA[curKey].toJsondict()
+        dictB = netsB[curKey].toJsondict()
+        for timeField in ['firstseen', 'lastseen']:
+            dictA.pop(timeField, None)
+            dictB.pop(timeField, None)
+
+        if dictA != dictB:
+            return False
+
+    return True
+
+# ------------------  iw parser benchmark ------------------------------
+def benchIWParser(captureFiles, blockCounts):
+    datasets = []
+
+    for curFile in captureFiles:
+        try:
+            with open(curFile, 'r') as f:
+                datasets.append((curFile, f.read()))
+        except:
+            print('ERROR: Unable to read ' + curFile)
+
+    for numBlocks in blockCounts:
+        datasets.append(('synthetic ' + str(numBlocks) + ' BSS', syntheticIWDump(numBlocks)))
+
+    print('%-30s %10s %12s %12s %9s %10s' % ('Dataset', 'Lines', 'regex (s)', 'dispatch (s)', 'Speedup', 'Identical'))
+
+    allIdentical = True
+
+    for curName, iwOutput in datasets:
+        numLines = iwOutput.count('\n')
+        regexNets = WirelessEngine.parseIWoutput(iwOutput, IWPARSER_REGEX)
+        dispatchNets = WirelessEngine.parseIWoutput(iwOutput, IWPARSER_DISPATCH)
+        identical = compareNetworkDicts(regexNets, dispatchNets)
+        allIdentical = allIdentical and identical
+
+        regexTime = timeIt(WirelessEngine.parseIWoutput, iwOutput, IWPARSER_REGEX)
+        dispatchTime = timeIt(WirelessEngine.parseIWoutput, iwOutput, IWPARSER_DISPATCH)
+
+        print('%-30s %10d %12.4f %12.4f %8.1fx %10s' % (curName[-30:], numLines, regexTime, dispatchTime, regexTime/max(dispatchTime, 1e-9), str(identical)))
+
+    return allIdentical
+
+# ------------------  nl80211 decoder benchmark ------------------------------
+def benchNL80211(captureFiles, blockCounts):
+    # Synthetic scans are rendered both as iw text and as nl80211 messages so the decoder can be checked against the text parser.
+    allIdentical = True
+
+    print('%-30s %10s %12s %12s %9s %10s' % ('Dataset', 'BSS', 'iw text (s)', 'nl80211 (s)', 'Speedup', 'Identical'))
+
+    for numBlocks in blockCounts:
+        rnd = random.Random(1)
+        iwLines = []
+        nlMessages = []
+        for i in range(0, numBlocks):
+            bss = syntheticBSS(rnd)
+            iwLines += renderIWBlock(bss)
+            nlMessages.append(renderNLMessage(bss))
+
+        iwOutput = '\n'.join(iwLines) + '\n'
+        identical = compareNetworkDicts(WirelessEngine.parseIWoutput(iwOutput), decodeScanMessages(nlMessages))
+        allIdentical = allIdentical and identical
+
+        iwTime = timeIt(WirelessEngine.parseIWoutput, iwOutput)
+        nlTime = timeIt(decodeScanMessages, nlMessages)
+
+        print('%-30s %10d %12.4f %12.4f %8.1fx %10s' % ('synthetic ' + str(numBlocks) + ' BSS', numBlocks, iwTime, nlTime, iwTime/max(nlTime, 1e-9), str(identical)))
+
+    for curFile in captureFiles:
+        try:
+            nlMessages = loadCapture(curFile)
+        except:
+            print('ERROR: Unable to read ' + curFile)
+            continue
+
+        nlTime = timeIt(decodeScanMessages, nlMessages)
+        numNetworks = len(decodeScanMessages(nlMessages))
+        print('%-30s %10d %12s %12.4f %9s %10s' % (curFile[-30:], numNetworks, '-', nlTime, '-', '-'))
+
+    return allIdentical
+
+# ------------------  Scan dump parity ------------------------------
+def loadDumpCorpus(corpusDir):
+    # (name, iw text, nl80211 messages) for each <name>.nl80211 capture in corpusDir with a <name>.iw next to it
+    retVal = []
+
+    for curFile in sorted(os.listdir(corpusDir)):
+        if not curFile.endswith(DUMP_CAPTURE_EXTENSION):
+            continue
+
+        name = curFile[:-len(DUMP_CAPTURE_EXTENSION)]
+        iwFile = corpusDir + '/' + name + DUMP_IW_EXTENSION
+
+        try:
+            with open(iwFile, 'r') as f:
+                iwOutput = f.read()
+
+            retVal.append((name, iwOutput, loadCapture(corpusDir + '/' + curFile)))
+        except:
+            print('ERROR: Unable to read ' + iwFile + ' or its capture')
+
+    return retVal
+
+def compareLastSeen(netsA, netsB, tolerance=1.0):
+    # Returns True if every network was last seen the same time ago in both.  The two parses ran a moment apart.
+    for curKey in netsA.keys():
+        if (curKey not in netsB) or (abs(netsA[curKey].lastSeenEpoch - netsB[curKey].lastSeenEpoch) > tolerance):
+            return False
+
+    return True
+
+def benchDumpParity(corpusDir, maxAge):
+    # Each scan in the corpus is the same kernel BSS cache read both ways:  'iw dev <interface> scan dump' text and the
+    # nl80211 GET_SCAN messages.  Hybrid scan mode reads the cache with whichever backend is set, so both have to give
+    # the same networks, the same ages, and keep the same ones once entries older than maxAge are dropped.
+    try:
+        corpus = loadDumpCorpus(corpusDir)
+    except:
+        print('ERROR: Unable to read ' + corpusDir)
+        return False
+
+    if len(corpus) == 0:
+        print('ERROR: No captures in ' + corpusDir)
+        return False
+
+    allIdentical = True
+
+    print('%-30s %6s %6s %12s %12s %10s %10s %10s' % ('Capture', 'BSS', 'Fresh', 'iw text (s)', 'nl80211 (s)', 'Identical', 'Ages', 'Filtered'))
+
+    for curName, iwOutput, nlMessages in corpus:
+        iwNets = WirelessEngine.parseIWoutput(iwOutput)
+        nlNets = decodeScanMessages(nlMessages)
+
+        identical = compareNetworkDicts(iwNets, nlNets)
+        sameAges = compareLastSeen(iwNets, nlNets)
+
+        iwFresh = WirelessEngine.filterCachedNetworks(iwNets, 0, maxAge)
+        nlFresh = WirelessEngine.filterCachedNetworks(nlNets, 0, maxAge)
+        sameFiltered = (iwFresh.keys() == nlFresh.keys())
+
+        allIdentical = allIdentical and identical and sameAges and sameFiltered
+
+        iwTime = timeIt(WirelessEngine.parseIWoutput, iwOutput)
+        nlTime = timeIt(decodeScanMessages, nlMessages)
+
+        print('%-30s %6d %6d %12.4f %12.4f %10s %10s %10s' % (curName[-30:], len(iwNets), len(iwFresh), iwTime, nlTime, str(identical), str(sameAges), str(sameFiltered)))
+
+    return allIdentical
+
+# ------------------  Record layout benchmark ------------------------------
+class LegacyWirelessNetwork(object):
+    # The previous WirelessNetwork layout: instance dict, nested SparrowGPS objects, datetime timestamps and deepcopy
+    def __init__(self):
+        self.macAddr = ""
+        self.ssid = ""
+        self.mode = ""
+        self.security = "Open"
+        self.privacy = "None"
+        self.cipher = ""
+        self.channel = 0
+        self.frequency = 0
+        self.signal = -1000
+        self.bandwidth = 20
+        self.secondaryChannel = 0
+        self.thirdChannel = 0
+        self.secondaryChannelLocation = ''
+        now=datetime.datetime.now()
+        self.firstSeen = now
+        self.lastSeen = now
+        self.gps = SparrowGPS()
+        self.strongestsignal = self.signal
+        self.strongestgps = SparrowGPS()
+        self.foundInList = False
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def getLastSeenString(self):
+        return self.lastSeen.strftime("%m/%d/%Y %H:%M:%S")
+
+class LegacyBluetoothDevice(object):
+    # The previous BluetoothDevice layout
+    def __init__(self):
+        self.uuid=""
+        self.macAddress = ""
+        self.name=""
+        self.company=""
+        self.manufacturer=""
+        self.bluetoothDescription = ""
+        self.btType = BluetoothDevice.BT_LE
+        self.rssi=-100
+        self.txPower = -60
+        self.txPowerValid = False
+        self.iBeaconRange = -1.0
+        self.firstSeen = datetime.datetime.now()
+        self.lastSeen = datetime.datetime.now()
+        self.gps = SparrowGPS()
+        self.strongestRssi = self.rssi
+        self.strongestgps = SparrowGPS()
+        self.foundInList = False
+
+    def getLastSeenString(self):
+        return self.lastSeen.strftime("%m/%d/%Y %H:%M:%S")
+
+def makeRecords(recordClass, count):
+    records = []
+    for i in range(0, count):
+        newRecord = recordClass()
+        if hasattr(newRecord, 'macAddr'):
+            newRecord.macAddr = '00:11:22:%02X:%02X:%02X' % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+            newRecord.ssid = 'Network ' + str(i)
+        else:
+            newRecord.macAddress = '00:11:22:%02X:%02X:%02X' % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+            newRecord.name = 'Device ' + str(i)
+        records.append(newRecord)
+
+    return records
+
+def measureRecordMemory(recordClass, count):
+    # Bytes per record, including its timestamps and GPS objects
+    tracemalloc.start()
+    startSize = tracemalloc.get_traced_memory()[0]
+    records = makeRecords(recordClass, count)
+    endSize = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (endSize - startSize) / len(records)
+
+def updateRecords(records, gpsData):
+    # What a scan result merge does to every record
+    now = datetime.datetime.now()
+    for curRecord in records:
+        curRecord.lastSeen = now
+        curRecord.gps.copy(gpsData)
+
+def updateSlottedRecords(records, gpsData):
+    # Same merge on the slotted records.  Assigning gps copies the values into the inline fields.
+    now = datetime.datetime.now()
+    for curRecord in records:
+        curRecord.lastSeen = now
+        curRecord.gps = gpsData
+
+def copyRecords(records):
+    for curRecord in records:
+        curRecord.copy()
+
+def formatRecords(records):
+    # What a table refresh does to every row
+    for curRecord in records:
+        curRecord.getLastSeenString()
+
+def benchRecords(count):
+    gpsData = SparrowGPS()
+    gpsData.latitude = 38.0
+    gpsData.longitude = -77.0
+    gpsData.isValid = True
+
+    print('%-20s %12s %12s %12s %12s %12s' % ('Record', 'Bytes/rec', 'Create (s)', 'Update (s)', 'Copy (s)', 'Format (s)'))
+
+    for recordName, recordClass in [('WirelessNetwork old', LegacyWirelessNetwork), ('WirelessNetwork', WirelessNetwork), 
+                                              ('BluetoothDevice old', LegacyBluetoothDevice), ('BluetoothDevice', BluetoothDevice)]:
+        bytesPerRecord = measureRecordMemory(recordClass, count)
+        createTime = timeIt(makeRecords, recordClass, count)
+        records = makeRecords(recordClass, count)
+        if recordClass in [WirelessNetwork, BluetoothDevice]:
+            updateTime = timeIt(updateSlottedRecords, records, gpsData)
+        else:
+            updateTime = timeIt(updateRecords, records, gpsData)
+
+        if recordClass is BluetoothDevice:
+            # BluetoothDevice.copy() fills in an existing device
+            copyTime = timeIt(lambda: [BluetoothDevice().copy(curRecord) for curRecord in records])
+        elif recordClass is LegacyBluetoothDevice:
+            copyTime = timeIt(lambda: [copy.deepcopy(curRecord) for curRecord in records])
+        else:
+            copyTime = timeIt(copyRecords, records)
+
+        formatTime = timeIt(formatRecords, records)
+
+        print('%-20s %12.0f %12.4f %12.4f %12.4f %12.4f' % (recordName, bytesPerRecord, createTime, updateTime, copyTime, formatTime))
+
+# ------------------  Channel scheduler benchmark ------------------------------
+class SimulatedAirspace(object):
+    # BSSs appear on each channel at its own rate and are heard by each scan with some probability.
+    # Scans cost a fixed setup time plus a dwell per channel, all on a simulated clock.
+    def __init__(self, channelList, busyChannels, seed=1):
+        self.rnd = random.Random(seed)
+        self.now = 0.0
+        self.setupTime = 0.05  # seconds per scan
+        self.dwellTime = 0.1  # seconds per channel
+        self.hearProbability = 0.6
+        self.arrivalRate = {}  # frequency -> new BSS per second
+        self.networks = {}  # frequency -> list of [key, appeared, signal]
+        self.firstReported = {}  # key -> time
+
+        for curFrequency in channelList:
+            if curFrequency in busyChannels:
+                self.arrivalRate[curFrequency] = 0.5
+                numNetworks = 20
+            else:
+                self.arrivalRate[curFrequency] = 0.005
+                numNetworks = 2
+
+            self.networks[curFrequency] = []
+            for i in range(0, numNetworks):
+                self.addNetwork(curFrequency)
+
+    def addNetwork(self, frequency):
+        curKey = '%02X:%02X:%02X:%02X:%02X:%02X' % tuple(self.rnd.randrange(256) for i in range(0, 6))
+        self.networks[frequency].append([curKey, self.now, self.rnd.randint(-90, -40)])
+
+    def advance(self, seconds):
+        self.now += seconds
+        for curFrequency in self.networks.keys():
+            numArrivals = 0
+            remaining = self.rnd.expovariate(self.arrivalRate[curFrequency])
+            while remaining < seconds:
+                numArrivals += 1
+                remaining += self.rnd.expovariate(self.arrivalRate[curFrequency])
+
+            for i in range(0, numArrivals):
+                self.addNetwork(curFrequency)
+
+    def scan(self, frequencyList):
+        scanTime = self.setupTime + self.dwellTime * len(frequencyList)
+        self.advance(scanTime)
+        wirelessNetworks = {}
+
+        for curFrequency in frequencyList:
+            for curKey, appeared, signal in self.networks[curFrequency]:
+                if self.rnd.random() < self.hearProbability:
+                    newNet = WirelessNetwork()
+                    newNet.macAddr = curKey
+                    newNet.ssid = curKey
+                    newNet.frequency = curFrequency
+                    newNet.signal = signal
+                    wirelessNetworks[newNet.getKey()] = newNet
+                    if curKey not in self.firstReported:
+                        self.firstReported[curKey] = self.now
+
+        return scanTime, wirelessNetworks
+
+    def getDiscovery(self):
+        # Fraction of all BSSs ever present that were reported, and mean seconds from appearing to first report
+        allNetworks = [curNet for curFrequency in self.networks.keys() for curNet in self.networks[curFrequency]]
+        latencies = [self.firstReported[curKey] - appeared for curKey, appeared, signal in allNetworks if curKey in self.firstReported]
+        if len(latencies) > 0:
+            meanLatency = sum(latencies) / len(latencies)
+        else:
+            meanLatency = 0.0
+
+        return len(latencies) / max(len(allNetworks), 1), meanLatency
+
+def benchScheduler(duration, numBusy, batchSize):
+    channelList = sorted(set(int(curFrequency) for curFrequency in channelToFreq.values() if int(curFrequency) > 5000))
+    rnd = random.Random(2)
+    busyChannels = rnd.sample(channelList, min(numBusy, len(channelList)))
+
+    print('%d channels, %d busy, batch size %d, %.0f s simulated' % (len(channelList), len(busyChannels), batchSize, duration))
+    print('%-12s %8s %12s %16s %12s %14s' % ('Scheduler', 'Scans', 'Airtime (s)', 'Found/airtime s', 'Found (%)', 'Latency (s)'))
+
+    for adaptive in [False, True]:
+        airspace = SimulatedAirspace(channelList, busyChannels)
+        scheduler = ChannelScheduler(channelList, batchSize=batchSize, adaptive=adaptive)
+        scheduler.clock = lambda: airspace.now
+        numScans = 0
+
+        while airspace.now < duration:
+            curBatch = scheduler.nextBatch()
+            scanTime, wirelessNetworks = airspace.scan(curBatch)
+            scheduler.recordScan(curBatch, scanTime, wirelessNetworks)
+            numScans += 1
+            airspace.advance(scheduler.getCycleDelay())
+
+        channelStats = scheduler.getStats()
+        airtime = sum(channelStats[curFrequency]['airtime'] for curFrequency in channelStats.keys())
+        foundFraction, meanLatency = airspace.getDiscovery()
+
+        if adaptive:
+            schedulerName = 'adaptive'
+        else:
+            schedulerName = 'round-robin'
+
+        print('%-12s %8d %12.1f %16.2f %12.1f %14.2f' % (schedulerName, numScans, airtime, scheduler.getDiscoveryRate(), foundFraction*100.0, meanLatency))
+
+    # Where the adaptive scheduler spent its time
+    print('')
+    print('%-10s %6s %8s %8s %10s %8s' % ('Frequency', 'Busy', 'Scans', 'Share', 'Yield/s', 'New'))
+    for curFrequency in channelList:
+        curStats = channelStats[curFrequency]
+        print('%-10d %6s %8d %7.1f%% %10.2f %8d' % (curFrequency, str(curFrequency in busyChannels), curStats['scans'], curStats['share']*100.0, curStats['yieldrate'], curStats['new']))
+
+# ------------------  Hunt scan batch benchmark ------------------------------
+def benchScanBatch(interfaceName, huntChannelList, batchSizes):
+    # Sweeps the hunt list once per batch size on a real interface.  Needs root.
+    print('%-10s %8s %12s %14s %10s' % ('Batch', 'Scans', 'Total (s)', 'Per freq (s)', 'Networks'))
+
+    for batchSize in batchSizes:
+        frequencyBatches = WirelessEngine.getFrequencyBatches(huntChannelList, batchSize)
+        wirelessNetworks = {}
+        startTime = perf_counter()
+
+        for curBatch in frequencyBatches:
+            retries = 0
+            retCode = WirelessNetwork.ERR_DEVICEBUSY
+            while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
+                retCode, errString, tmpWirelessNetworks = WirelessEngine.scanForNetworks(interfaceName, curBatch)
+                retries += 1
+                if retCode == WirelessNetwork.ERR_DEVICEBUSY:
+                    sleep(0.2)
+
+            if retCode != 0:
+                print('ERROR: ' + errString)
+                return False
+
+            wirelessNetworks.update(tmpWirelessNetworks)
+
+        elapsed = perf_counter() - startTime
+
+        if batchSize == 0:
+            batchName = 'all'
+        else:
+            batchName = str(batchSize)
+
+        print('%-10s %8d %12.2f %14.3f %10d' % (batchName, len(frequencyBatches), elapsed, elapsed/len(huntChannelList), len(wirelessNetworks)))
+
+    # Per-frequency radio time from the last sweep
+    scanTimings = WirelessEngine.getScanTimings(interfaceName)
+    print('')
+    print('%-10s %14s' % ('Frequency', 'Scan time (s)'))
+    for curFrequency in sorted(scanTimings.keys()):
+        print('%-10d %14.3f' % (curFrequency, scanTimings[curFrequency]))
+
+    return True
+
+# ------------------  Observation store benchmark ------------------------------
+def syntheticStoreBatch(store, macAddrs, numSSIDs, rnd):
+    # A column batch for the given MACs, the way NetworkStore.makeBatch() would build it from a scan.
+    # Channel and SSID are derived from the MAC so repeat sightings land on the same row.
+    numNetworks = len(macAddrs)
+    channels = np.array([1, 6, 11, 36, 40, 44, 48, 149, 153, 157, 161], dtype=np.int16)[macAddrs % 11]
+    now = time()
+
+    batch = store.makeBatch([])
+    batch['key'] = (macAddrs.astype(np.uint64) << np.uint64(8)) | channels.astype(np.uint64)
+    batch['ssid'] = (macAddrs % numSSIDs + 1).astype(np.uint32)
+    batch['profile'] = np.ones(numNetworks, dtype=np.uint32)
+    batch['channel'] = channels
+    batch['frequency'] = np.where(channels < 14, 2407 + 5 * channels, 5000 + 5 * channels).astype(np.uint16)
+    batch['signal'] = rnd.integers(-95, -30, numNetworks).astype(np.int16)
+    batch['strongestSignal'] = batch['signal']
+    batch['latitude'] = np.full(numNetworks, int(38.8895 * DEG_SCALE) + rnd.integers(0, 10000), dtype=np.int32)
+    batch['longitude'] = np.full(numNetworks, int(-77.0353 * DEG_SCALE) + rnd.integers(0, 10000), dtype=np.int32)
+    batch['altitude'] = np.full(numNetworks, 20.0, dtype=np.float32)
+    batch['speed'] = np.full(numNetworks, 1.5, dtype=np.float32)
+    for curName in ['latitude', 'longitude', 'altitude', 'speed']:
+        batch['strongest' + curName[0].upper() + curName[1:]] = batch[curName]
+    batch['firstSeen'] = np.full(numNetworks, now)
+    batch['lastSeen'] = np.full(numNetworks, now)
+    batch['flags'] = np.full(numNetworks, 3, dtype=np.uint8)
+
+    return batch
+
+def benchStore(count, batchSize):
+    # Fill a NetworkStore with count observations, then time scan-sized upserts into it
+    rnd = np.random.default_rng(1)
+    numSSIDs = 20000
+
+    store = NetworkStore()
+    for i in range(0, numSSIDs):
+        store.strings.getId('Network ' + str(i))
+    store.profiles.getId(('Master', 'WPA2', 'CCMP', 'CCMP', 20, 0, 0, ''))
+
+    macAddrs = np.unique(rnd.integers(0, 1 << 48, int(count * 1.01), dtype=np.int64))[:count]
+    rnd.shuffle(macAddrs)
+
+    startTime = perf_counter()
+    for i in range(0, len(macAddrs), batchSize):
+        store.upsertBatch(syntheticStoreBatch(store, macAddrs[i:i+batchSize], numSSIDs, rnd))
+    fillTime = perf_counter() - startTime
+
+    # Allocated bytes include the spare capacity left by the last column resize
+    allocatedBytes = store.getMemoryUsage()
+    rowBytes = sum(curColumn.itemsize for curColumn in store.columns.values())
+    usedBytes = allocatedBytes - rowBytes * (store.capacity - len(store))
+    print('Stored %d observations in %.2f s' % (len(store), fillTime))
+    print('Columns + index: %.1f MB (%.1f MB allocated, %.1f bytes/observation)' % (usedBytes / 1e6, allocatedBytes / 1e6, usedBytes / len(store)))
+    print('Same count as WirelessNetwork objects: about %.0f MB' % (measureRecordMemory(WirelessNetwork, 20000) * len(store) / 1e6))
+
+    # A scan that mostly re-sees known networks plus a few new ones
+    upsertTimes = []
+    for i in range(0, 200):
+        seenAgain = macAddrs[rnd.integers(0, len(macAddrs), int(batchSize * 0.95))]
+        newMacs = rnd.integers(1 << 47, 1 << 48, batchSize - len(seenAgain), dtype=np.int64)
+        batch = syntheticStoreBatch(store, np.unique(np.concatenate([seenAgain, newMacs])), numSSIDs, rnd)
+
+        startTime = perf_counter()
+        store.upsertBatch(batch)
+        upsertTimes.append(perf_counter() - startTime)
+
+    upsertTimes = np.array(upsertTimes) * 1000.0
+    print('Upsert %d networks: median %.3f ms, p95 %.3f ms, max %.3f ms' % (batchSize, np.median(upsertTimes), np.percentile(upsertTimes, 95), upsertTimes.max()))
+
+    # Converting a scan's WirelessNetwork objects to a column batch
+    scanNetworks = makeRecords(WirelessNetwork, batchSize)
+    convertTime = timeIt(store.makeBatch, scanNetworks)
+    print('Convert %d WirelessNetwork objects to a batch: %.3f ms' % (batchSize, convertTime * 1000.0))
+
+    startTime = perf_counter()
+    numRows = 0
+    for curNet in store.iterRecords():
+        numRows += 1
+    print('Read back %d observations as WirelessNetwork objects: %.2f s' % (numRows, perf_counter() - startTime))
+
+# ------------------  Wire format benchmark ------------------------------
+def encodeResponse(encoder, wirelessNetworks, gpsdict):
+    # The whole /wireless/networks response the way the agent streams it
+    return encoder.begin() + b''.join([encoder.encodeNetwork(curNet) for curNet in wirelessNetworks.values()]) + encoder.end(0, '', gpsdict)
+
+def decodeJsonResponse(responseBytes):
+    # What requestRemoteNetworks does with a JSON response
+    networkjson = json.loads(responseBytes.decode('UTF-8'))
+    wirelessNetworks = {}
+    for curNetDict in networkjson['networks']:
+        newNet = WirelessNetwork.createFromJsonDict(curNetDict)
+        wirelessNetworks[newNet.getKey()] = newNet
+
+    return wirelessNetworks
+
+def benchWire(networkCounts):
+    gpsData = SparrowGPS()
+    gpsData.latitude = 38.889484
+    gpsData.longitude = -77.035278
+    gpsData.altitude = 21.3
+    gpsData.speed = 1.25
+    gpsData.isValid = True
+    gpsdict = {'latitude': gpsData.latitude, 'longitude': gpsData.longitude, 'altitude': gpsData.altitude, 'speed': gpsData.speed}
+
+    print('%-10s %-8s %12s %12s %12s %12s %10s' % ('Networks', 'Format', 'Bytes', 'Gzip bytes', 'Encode (s)', 'Decode (s)', 'Identical'))
+
+    allIdentical = True
+
+    for numNetworks in networkCounts:
+        wirelessNetworks = WirelessEngine.parseIWoutput(syntheticIWDump(numNetworks))
+        for curNet in wirelessNetworks.values():
+            curNet.gps = gpsData
+            curNet.strongestgps = gpsData
+
+        jsonBytes = encodeResponse(JsonNetworkEncoder(), wirelessNetworks, gpsdict)
+        binaryBytes = encodeResponse(BinaryNetworkEncoder(), wirelessNetworks, gpsdict)
+
+        jsonNets = decodeJsonResponse(jsonBytes)
+        binaryNets = decodeNetworks(binaryBytes)[3]
+        identical = compareNetworkDicts(jsonNets, binaryNets)
+        for curKey in jsonNets.keys():
+            if abs(jsonNets[curKey].lastSeenEpoch - binaryNets[curKey].lastSeenEpoch) > 0.001:
+                identical = False
+        allIdentical = allIdentical and identical
+
+        jsonEncode = timeIt(lambda: encodeResponse(JsonNetworkEncoder(), wirelessNetworks, gpsdict))
+        binaryEncode = timeIt(lambda: encodeResponse(BinaryNetworkEncoder(), wirelessNetworks, gpsdict))
+        jsonDecode = timeIt(decodeJsonResponse, jsonBytes)
+        binaryDecode = timeIt(decodeNetworks, binaryBytes)
+
+        print('%-10d %-8s %12d %12d %12.4f %12.4f %10s' % (len(wirelessNetworks), 'json', len(jsonBytes), len(gzip.compress(jsonBytes)), jsonEncode, jsonDecode, ''))
+        print('%-10d %-8s %12d %12d %12.4f %12.4f %10s' % (len(wirelessNetworks), 'binary', len(binaryBytes), len(gzip.compress(binaryBytes)), binaryEncode, binaryDecode, str(identical)))
+
+    return allIdentical
+
+# ------------------  Agent load test ------------------------------
+def sampleThreadCount(agentPid, result, stopEvent):
+    # Peak thread count of the agent process from /proc
+    while not stopEvent.is_set():
+        try:
+            with open('/proc/' + str(agentPid) + '/status', 'r') as statusFile:
+                for curLine in statusFile:
+                    if curLine.startswith('Threads:'):
+                        result[0] = max(result[0], int(curLine.split()[1]))
+        except:
+            pass
+
+        sleep(0.05)
+
+def loadClient(agentURL, paths, endTime, seed, results, resultsLock):
+    # One client with its own kept-alive connection, asking for paths at random back to back
+    rnd = random.Random(seed)
+    session = requests.Session()
+    localResults = {}
+
+    while perf_counter() < endTime:
+        curPath = rnd.choice(paths)
+        startTime = perf_counter()
+        try:
+            response = session.get(agentURL + curPath, timeout=60)
+            statusCode = response.status_code
+        except:
+            statusCode = -1
+
+        elapsed = perf_counter() - startTime
+
+        if curPath not in localResults:
+            localResults[curPath] = []
+        localResults[curPath].append((elapsed, statusCode))
+
+        if statusCode == 503:
+            # Agent asked us to back off
+            sleep(float(response.headers.get('Retry-After', '1')))
+
+    session.close()
+
+    resultsLock.acquire()
+    for curPath in localResults.keys():
+        if curPath not in results:
+            results[curPath] = []
+        results[curPath] += localResults[curPath]
+    resultsLock.release()
+
+def benchLoad(agentURL, paths, numClients, duration, agentPid):
+    # Run against an agent started with --servermode threaded and again with --servermode asyncio
+    results = {}
+    resultsLock = threading.Lock()
+
+    maxThreads = [0]
+    stopEvent = threading.Event()
+    if agentPid is not None:
+        sampler = threading.Thread(target=sampleThreadCount, args=(agentPid, maxThreads, stopEvent))
+        sampler.daemon = True
+        sampler.start()
+
+    endTime = perf_counter() + duration
+    clients = []
+    for i in range(numClients):
+        clients.append(threading.Thread(target=loadClient, args=(agentURL, paths, endTime, i, results, resultsLock)))
+
+    for curClient in clients:
+        curClient.start()
+
+    for curClient in clients:
+        curClient.join()
+
+    stopEvent.set()
+
+    print('%d clients for %.0f s against %s' % (numClients, duration, agentURL))
+    print('%-28s %9s %9s %9s %9s %7s %7s' % ('Path', 'Requests', 'Req/s', 'p50 (ms)', 'p99 (ms)', 'Busy', 'Errors'))
+
+    allLatencies = []
+    # paths can repeat to weight the mix
+    for curPath in sorted(set(paths), key=paths.index):
+        if curPath not in results:
+            continue
+
+        okLatencies = sorted([curResult[0] for curResult in results[curPath] if curResult[1] == 200])
+        numBusy = len([curResult for curResult in results[curPath] if curResult[1] == 503])
+        numErrors = len([curResult for curResult in results[curPath] if curResult[1] not in (200, 503)])
+        allLatencies += okLatencies
+
+        if len(okLatencies) > 0:
+            p50 = np.percentile(okLatencies, 50) * 1000.0
+            p99 = np.percentile(okLatencies, 99) * 1000.0
+        else:
+            p50 = p99 = 0.0
+
+        print('%-28s %9d %9.1f %9.1f %9.1f %7d %7d' % (curPath, len(okLatencies), len(okLatencies) / duration, p50, p99, numBusy, numErrors))
+
+    if len(allLatencies) > 0:
+        print('%-28s %9d %9.1f %9.1f %9.1f' % ('All', len(allLatencies), len(allLatencies) / duration, np.percentile(allLatencies, 50) * 1000.0,
+                                                np.percentile(allLatencies, 99) * 1000.0))
+
+    if agentPid is not None:
+        print('Peak agent threads: %d' % maxThreads[0])
+
+# ----------------- Main -----------------------------
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Sparrow-wifi offline benchmarks')
+    subparsers = argparser.add_subparsers(dest='benchmark')
+
+    iwparser = subparsers.add_parser('iwparser', help='Compare the dispatch and reference regex iw output parsers')
+    iwparser.add_argument('--capture', help='Captured iw scan output file to include.  Can be given more than once', action='append', default=[], required=False)
+    iwparser.add_argument('--blocks', help='Comma-separated synthetic BSS block counts', default='1000,10000,50000', required=False)
+
+    nl80211 = subparsers.add_parser('nl80211', help='Compare the nl80211 message decoder against the iw text parser')
+    nl80211.add_argument('--replay', help='nl80211 capture file (see sparrownl80211.py --capture) to time.  Can be given more than once', action='append', default=[], required=False)
+    nl80211.add_argument('--blocks', help='Comma-separated synthetic BSS block counts', default='1000,10000', required=False)
+
+    dumpparity = subparsers.add_parser('dumpparity', help='Check the nl80211 decoder against the iw text parser on captured scan dumps')
+    dumpparity.add_argument('--corpus', help='Directory of <name>.nl80211 captures with the matching <name>.iw scan dump text', default=DUMP_CORPUS_DIR, required=False)
+    dumpparity.add_argument('--maxage', help='Hybrid mode max age in seconds to check the cache filtering with', default=10.0, type=float, required=False)
+
+    records = subparsers.add_parser('records', help='Compare memory and update/copy/format time of the slotted scan records against the previous layout')
+    records.add_argument('--count', help='Number of records', default=20000, type=int, required=False)
+
+    scheduler = subparsers.add_parser('scheduler', help='Compare the adaptive channel scheduler against round-robin on a simulated airspace')
+    scheduler.add_argument('--duration', help='Simulated seconds to run each scheduler', default=600.0, type=float, required=False)
+    scheduler.add_argument('--busy', help='Number of busy 5 GHz channels', default=4, type=int, required=False)
+    scheduler.add_argument('--batchsize', help='Frequencies per scan', default=4, type=int, required=False)
+
+    storeParser = subparsers.add_parser('store', help='Measure memory and scan upsert time of the columnar observation store')
+    storeParser.add_argument('--count', help='Number of observations', default=1000000, type=int, required=False)
+    storeParser.add_argument('--batchsize', help='Networks per scan', default=1000, type=int, required=False)
+
+    wire = subparsers.add_parser('wire', help='Compare size and encode/decode time of the binary and JSON scan responses')
+    wire.add_argument('--networks', help='Comma-separated network counts', default='500,5000', required=False)
+
+    load = subparsers.add_parser('load', help='Throughput and latency of a running agent under concurrent clients.  Run once per --servermode')
+    load.add_argument('--agent', help='Agent URL', default='http://127.0.0.1:8020', required=False)
+    load.add_argument('--clients', help='Concurrent clients', default=50, type=int, required=False)
+    load.add_argument('--duration', help='Seconds to run', default=20.0, type=float, required=False)
+    load.add_argument('--paths', help='Comma-separated paths the clients pick from at random', default='/gps/status,/gps/status,/gps/status,/spectrum/scanstatus,/wireless/networks/wlan0', required=False)
+    load.add_argument('--agentpid', help='Agent process id, to report its peak thread count (local agent only)', default=None, type=int, required=False)
+
+    scanbatch = subparsers.add_parser('scanbatch', help='Time hunt-list sweeps on a real interface at different scan batch sizes (needs root)')
+    scanbatch.add_argument('--interface', help='Wireless interface to scan with', required=True)
+    scanbatch.add_argument('--frequencies', help='Comma-separated hunt frequencies in MHz.  Default is every 5 GHz channel', default='', required=False)
+    scanbatch.add_argument('--batchsizes', help='Comma-separated batch sizes to try.  0 scans the whole list at once', default='1,4,8,0', required=False)
+
+    args = argparser.parse_args()
+
+    if args.benchmark == 'iwparser':
+        blockCounts = [int(curCount) for curCount in args.blocks.split(',') if len(curCount) > 0]
+        if not benchIWParser(args.capture, blockCounts):
+            print('ERROR: parser outputs differ.')
+            exit(1)
+    elif args.benchmark == 'nl80211':
+        blockCounts = [int(curCount) for curCount in args.blocks.split(',') if len(curCount) > 0]
+        if not benchNL80211(args.replay, blockCounts):
+            print('ERROR: nl80211 decoder and iw parser outputs differ.')
+            exit(1)
+    elif args.benchmark == 'dumpparity':
+        if not benchDumpParity(args.corpus, args.maxage):
+            print('ERROR: nl80211 decoder and iw parser disagree on a scan dump.')
+            exit(1)
+    elif args.benchmark == 'records':
+        benchRecords(args.count)
+    elif args.benchmark == 'scheduler':
+        benchScheduler(args.duration, args.busy, args.batchsize)
+    elif args.benchmark == 'store':
+        benchStore(args.count, args.batchsize)
+    elif args.benchmark == 'wire':
+        networkCounts = [int(curCount) for curCount in args.networks.split(',') if len(curCount) > 0]
+        if not benchWire(networkCounts):
+            print('ERROR: binary and JSON responses decode differently.')
+            exit(1)
+    elif args.benchmark == 'load':
+        paths = [curPath for curPath in args.paths.split(',') if len(curPath) > 0]
+        benchLoad(args.agent.rstrip('/'), paths, args.clients, args.duration, args.agentpid)
+    elif args.benchmark == 'scanbatch':
+        if len(args.frequencies) > 0:
+            huntChannelList = [int(curFrequency) for curFrequency in args.frequencies.split(',') if len(curFrequency) > 0]
+        else:
+            huntChannelList = sorted(set(int(curFrequency) for curFrequency in channelToFreq.values() if int(curFrequency) > 5000))
+
+        batchSizes = [int(curSize) for curSize in args.batchsizes.split(',') if len(curSize) > 0]
+        if not benchScanBatch(args.interface, huntChannelList, batchSizes):
+            exit(1)
+    else:
+        argparser.print_help()
@@ -24,6 +24,7 @@ import sys
 import re
 import signal
 from time import sleep
+import time
 from threading import Lock
 import datetime
 from dateutil import parser
@@ -32,8 +33,11 @@ import math # sqrt
 import sqlite3
 import uuid
 
-from sparrowcommon import BaseThreadClass, stringtobool
-from sparrowgps import SparrowGPS
+from sparrowcommon import BaseThreadClass, stringtobool, toEpoch, formatEpoch
+from sparrowmetrics import metrics, TimedLock, LineCounter
+from sparrowgps import SparrowGPSView
+
+blueHydraSeconds = metrics.histogram('sparrow_bluehydra_read_seconds', 'Time to read the device list from the blue_hydra database')
 
 # ------------------ Global Functions --------------------------------------
 def toHex(val):
@@ -48,6 +52,19 @@ class BluetoothDevice(object):
     BT_CLASSIC = 1
     BT_LE = 2
     
+    # Slotted like WirelessNetwork: inline GPS fields behind the gps/strongestgps views and
+    # float epoch timestamps behind firstSeen/lastSeen.
+    __slots__ = ('uuid', 'macAddress', 'name', 'company', 'manufacturer', 'bluetoothDescription', 'btType', 'rssi', 'txPower', 
+                        'txPowerValid', 'iBeaconRange', 'firstSeenEpoch', 'lastSeenEpoch', 'gpsLatitude', 'gpsLongitude', 'gpsAltitude', 
+                        'gpsSpeed', 'gpsValid', 'strongestRssi', 'strongestLatitude', 'strongestLongitude', 'strongestAltitude', 
+                        'strongestSpeed', 'strongestValid', 'foundInList')
+                        
+    GPS_FIELDS = ('gpsLatitude', 'gpsLongitude', 'gpsAltitude', 'gpsSpeed', 'gpsValid')
+    STRONGEST_GPS_FIELDS = ('strongestLatitude', 'strongestLongitude', 'strongestAltitude', 'strongestSpeed', 'strongestValid')
+    # Everything a delta sync compares (see sparrowcommon.ChangeLog).  lastSeen is handled separately and
+    # firstSeen is carried forward by whoever keeps the list, so neither counts as a change.
+    SIGNATURE_FIELDS = tuple(curField for curField in __slots__ if curField not in ('firstSeenEpoch', 'lastSeenEpoch', 'foundInList'))
+    
     def __init__(self):
         self.uuid=""
         self.macAddress = ""
@@ -60,15 +77,70 @@ class BluetoothDevice(object):
         self.txPower = -60
         self.txPowerValid = False
         self.iBeaconRange = -1.0
-        self.firstSeen = datetime.datetime.now()
-        self.lastSeen = datetime.datetime.now()
+        self.firstSeenEpoch = time.time()
+        self.lastSeenEpoch = self.firstSeenEpoch
 
-        self.gps = SparrowGPS()
+        self.gpsLatitude = 0.0
+        self.gpsLongitude = 0.0
+        self.gpsAltitude = 0.0
+        self.gpsSpeed = 0.0
+        self.gpsValid = False
         self.strongestRssi = self.rssi
-        self.strongestgps = SparrowGPS()
+        self.strongestLatitude = 0.0
+        self.strongestLongitude = 0.0
+        self.strongestAltitude = 0.0
+        self.strongestSpeed = 0.0
+        self.strongestValid = False
         
         self.foundInList = False
         
+    @property
+    def gps(self):
+        return SparrowGPSView(self, BluetoothDevice.GPS_FIELDS)
+        
+    @gps.setter
+    def gps(self, gpsData):
+        # Copies the values, it doesn't keep gpsData
+        self.gpsLatitude = gpsData.latitude
+        self.gpsLongitude = gpsData.longitude
+        self.gpsAltitude = gpsData.altitude
+        self.gpsSpeed = gpsData.speed
+        self.gpsValid = gpsData.isValid
+        
+    @property
+    def strongestgps(self):
+        return SparrowGPSView(self, BluetoothDevice.STRONGEST_GPS_FIELDS)
+        
+    @strongestgps.setter
+    def strongestgps(self, gpsData):
+        self.strongestLatitude = gpsData.latitude
+        self.strongestLongitude = gpsData.longitude
+        self.strongestAltitude = gpsData.altitude
+        self.strongestSpeed = gpsData.speed
+        self.strongestValid = gpsData.isValid
+        
+    @property
+    def firstSeen(self):
+        return datetime.datetime.fromtimestamp(self.firstSeenEpoch)
+        
+    @firstSeen.setter
+    def firstSeen(self, timestamp):
+        self.firstSeenEpoch = toEpoch(timestamp)
+        
+    @property
+    def lastSeen(self):
+        return datetime.datetime.fromtimestamp(self.lastSeenEpoch)
+        
+    @lastSeen.setter
+    def lastSeen(self, timestamp):
+        self.lastSeenEpoch = toEpoch(timestamp)
+        
+    def getFirstSeenString(self):
+        return formatEpoch(self.firstSeenEpoch)
+        
+    def getLastSeenString(self):
+        return formatEpoch(self.lastSeenEpoch)
+        
     def __str__(self):
         retVal = ""
         retVal += "UUID: " + self.uuid + '\n'
@@ -115,23 +187,9 @@ class BluetoothDevice(object):
             return not self.__eq__(other)
         
     def copy(self, other):
-        self.uuid=other.uuid
-        self.macAddress = other.macAddress
-        self.name=other.name
-        self.company=other.company
-        self.manufacturer=other.manufacturer
-        self.bluetoothDescription = other.bluetoothDescription
-        self.btType = other.btType
-        self.rssi=other.rssi
-        self.txPower = other.txPower
-        self.txPowerValid = other.txPowerValid
-        self.iBeaconRange = other.iBeaconRange
-        self.firstSeen = other.firstSeen
-        self.lastSeen = other.lastSeen
-
-        self.gps.copy(other.gps)
-        self.strongestRssi = other.strongestRssi
-        self.strongestgps.copy(other.strongestgps)
+        # Every field is immutable, so a field-by-field copy is a full copy
+        for curField in BluetoothDevice.__slots__:
+            setattr(self, curField, getattr(other, curField))
         
         self.foundInList = False
         
@@ -140,6 +198,9 @@ class BluetoothDevice(object):
         
         return key
         
+    def getSignature(self):
+        return tuple(getattr(self, curField) for curField in BluetoothDevice.SIGNATURE_FIELDS)
+        
     def calcRange(self):
         if not self.txPowerValid or self.txPower == 0:
             self.iBeaconRange = -1
@@ -239,17 +300,17 @@ class BluetoothDevice(object):
         self.firstSeen = parser.parse(dictjson['firstseen'])
         self.lastSeen = parser.parse(dictjson['lastseen'])
 
-        self.gps.latitude = float(dictjson['lat'])
-        self.gps.longitude = float(dictjson['lon'])
-        self.gps.altitude = float(dictjson['alt'])
-        self.gps.speed = float(dictjson['speed'])
-        self.gps.isValid = stringtobool(dictjson['gpsvalid'])
-        
-        self.strongestgps.latitude = float(dictjson['strongestlat'])
-        self.strongestgps.longitude = float(dictjson['strongestlon'])
-        self.strongestgps.altitude = float(dictjson['strongestalt'])
-        self.strongestgps.speed = float(dictjson['strongestspeed'])
-        self.strongestgps.isValid = stringtobool(dictjson['strongestgpsvalid'])
+        self.gpsLatitude = float(dictjson['lat'])
+        self.gpsLongitude = float(dictjson['lon'])
+        self.gpsAltitude = float(dictjson['alt'])
+        self.gpsSpeed = float(dictjson['speed'])
+        self.gpsValid = stringtobool(dictjson['gpsvalid'])
+        
+        self.strongestLatitude = float(dictjson['strongestlat'])
+        self.strongestLongitude = float(dictjson['strongestlon'])
+        self.strongestAltitude = float(dictjson['strongestalt'])
+        self.strongestSpeed = float(dictjson['strongestspeed'])
+        self.strongestValid = stringtobool(dictjson['strongestgpsvalid'])
             
     def toJsondict(self):
         dictjson = {}
@@ -270,17 +331,17 @@ class BluetoothDevice(object):
         dictjson['firstseen'] = str(self.firstSeen)
         dictjson['lastseen'] = str(self.lastSeen)
 
-        dictjson['lat'] = str(self.gps.latitude)
-        dictjson['lon'] = str(self.gps.longitude)
-        dictjson['alt'] = str(self.gps.altitude)
-        dictjson['speed'] = str(self.gps.speed)
-        dictjson['gpsvalid'] = str(self.gps.isValid)
-        
-        dictjson['strongestlat'] = str(self.strongestgps.latitude)
-        dictjson['strongestlon'] = str(self.strongestgps.longitude)
-        dictjson['strongestalt'] = str(self.strongestgps.altitude)
-        dictjson['strongestspeed'] = str(self.strongestgps.speed)
-        dictjson['strongestgpsvalid'] = str(self.strongestgps.isValid)
+        dictjson['lat'] = str(self.gpsLatitude)
+        dictjson['lon'] = str(self.gpsLongitude)
+        dictjson['alt'] = str(self.gpsAltitude)
+        dictjson['speed'] = str(self.gpsSpeed)
+        dictjson['gpsvalid'] = str(self.gpsValid)
+        
+        dictjson['strongestlat'] = str(self.strongestLatitude)
+        dictjson['strongestlon'] = str(self.strongestLongitude)
+        dictjson['strongestalt'] = str(self.strongestAltitude)
+        dictjson['strongestspeed'] = str(self.strongestSpeed)
+        dictjson['strongestgpsvalid'] = str(self.strongestValid)
 
         return dictjson
         
@@ -377,6 +438,7 @@ class BtmonThread(BaseThreadClass):
         
         curDevice = None
         # eventType = ""
+        lineCounter = LineCounter('btmon')
         
         while not self.signalStop:
             if not self.hcitoolRunning():
@@ -389,6 +451,7 @@ class BtmonThread(BaseThreadClass):
                 self.startBTMon()
                 
             curLine = self.btmonProc.stdout.readline().decode('ASCII').replace('\n', '')
+            parseStart = time.monotonic()
 
             # Address
             fieldValue = self.getFieldValue(p_address, curLine)
@@ -463,8 +526,8 @@ class BtmonThread(BaseThreadClass):
                         # We may not always get some fields
                         lastDevice = self.parentBluetooth.devices[curDevice.macAddress]
                         curDevice.firstSeen = lastDevice.firstSeen  # copy first seen timestamp
-                        curDevice.gps.copy(lastDevice.gps)
-                        curDevice.strongestgps.copy(lastDevice.strongestgps)
+                        curDevice.gps = lastDevice.gps
+                        curDevice.strongestgps = lastDevice.strongestgps
                         
                         if len(lastDevice.name) > 0 and len(curDevice.name) == 0:
                             curDevice.name = lastDevice.name
@@ -477,12 +540,16 @@ class BtmonThread(BaseThreadClass):
                     self.parentBluetooth.devices[curDevice.macAddress] = curDevice
                     self.parentBluetooth.deviceLock.release()
                 
+            lineCounter.addLine(time.monotonic() - parseStart)
+            
             # Just give the thread a chance to release resources
             iteration += 1
             if iteration > 50000:
                 iteration = 0
                 sleep(0.01)
 
+        lineCounter.flush()
+        
         try:
             self.hcitoolProc.kill()
         except:
@@ -515,9 +582,11 @@ class specanThread(BaseThreadClass):
         
         iteration = 0
         rssi_offset = -54   # Note: This is direct from the Ubertooth bluetooth module.  I thought the RSSI's looked really high.
+        lineCounter = LineCounter('ubertooth')
         
         while not specanProc.poll() and not self.signalStop:
             dataline = specanProc.stdout.readline().decode('ASCII').replace('\n', '')
+            parseStart = time.monotonic()
             dataline = dataline.replace(' ', '')
             data = dataline.split(',')
             if len(data) >= 3:
@@ -529,12 +598,16 @@ class specanThread(BaseThreadClass):
                 except:
                     pass
         
+            lineCounter.addLine(time.monotonic() - parseStart)
+            
             # Just give the thread a chance to release resources
             iteration += 1
             if iteration > 50000:
                 iteration = 0
                 sleep(0.01)
                 
+        lineCounter.flush()
+        
         try:
             specanProc.kill()
         except:
@@ -553,7 +626,7 @@ class SparrowBluetooth(object):
             self.spectrum[i] = -100
             
         self.spectrumLock = Lock()
-        self.deviceLock = Lock()
+        self.deviceLock = TimedLock('deviceLock')
     
         # This scan thread is for the spectrum
         self.spectrumScanThread = None
@@ -693,7 +766,9 @@ class SparrowBluetooth(object):
         # Because GPS comes from further up the stack, we maintain a local class list and have to
         # be sure to copy some fields like firstseen forward on updates
         if self.scanType == SparrowBluetooth.SCANTYPE_BLUEHYDRA:
+            readStart = time.monotonic()
             errcode, retList = SparrowBluetooth.getBlueHydraBluetoothDevices()        
+            blueHydraSeconds.observe(time.monotonic() - readStart)
             
             if errcode == 0:
                 self.deviceLock.acquire()
@@ -705,7 +780,7 @@ class SparrowBluetooth(object):
                         dev = self.devices[curDevice.macAddress]
                         curDevice.firstSeen = dev.firstSeen
                         curDevice.strongestRssi = dev.strongestRssi
-                        curDevice.strongestgps.copy(dev.strongestgps)
+                        curDevice.strongestgps = dev.strongestgps
                         self.devices[curDevice.macAddress] = curDevice
                 self.deviceLock.release()                            
         else:
@@ -0,0 +1,395 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# Recordings catalog.  What /system/getrecordings lists is kept in memory and in a sidecar index (.catalog.json in the
+# recordings directory) instead of being read off the disk for every request.  Entries are updated when something
+# changes a recording:  the recorder closing or rotating a segment, a segment being gzipped, a journal being
+# compacted, a delete.  Besides name, size and time each entry has what's in the file, so a listing can be filtered
+# by time or area without opening anything:
+#   format        wifi-csv, bluetooth-csv, sqlite or other
+#   compression   none or gzip
+#   rows          CSV rows, or observations for a database.  -1 if not known.
+#   bssids / devices   distinct wifi and bluetooth MACs
+#   firstseen / lastseen   epoch seconds, None if not known
+#   bounds        [minLat, minLon, maxLat, maxLon] of the valid gps positions, None if there weren't any
+#   recording     True for the recorder's open segment (the agent adds those, they aren't kept here)
+#
+# Files the agent didn't write itself (or ones from before the catalog) are picked up with just their size and time.
+# The directory is listed again whenever its mtime says something's been added or removed.
+
+import datetime
+import json
+import os
+from threading import Lock
+
+CATALOG_FILENAME = '.catalog.json'
+CATALOG_VERSION = 1
+
+FORMAT_WIFI_CSV = 'wifi-csv'
+FORMAT_BLUETOOTH_CSV = 'bluetooth-csv'
+FORMAT_SQLITE = 'sqlite'
+FORMAT_OTHER = 'other'
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gzip'
+
+def getFileFormat(filename):
+    # (format, compression) from a recording's name
+    if filename.endswith('.gz'):
+        compression = COMPRESSION_GZIP
+        filename = filename[:-len('.gz')]
+    else:
+        compression = COMPRESSION_NONE
+        
+    if filename.endswith('.sqlite3'):
+        fileFormat = FORMAT_SQLITE
+    elif filename.endswith('.csv') and ('_wifi_' in filename):
+        fileFormat = FORMAT_WIFI_CSV
+    elif filename.endswith('.csv') and ('_bt_' in filename):
+        fileFormat = FORMAT_BLUETOOTH_CSV
+    else:
+        fileFormat = FORMAT_OTHER
+        
+    return fileFormat, compression
+    
+class RecordingSummary(object):
+    # What's in a recording.  Built up a record at a time by whoever wrote it.
+    def __init__(self):
+        self.rows = 0
+        self.bssids = 0
+        self.devices = 0
+        self.firstSeen = None
+        self.lastSeen = None
+        self.bounds = None
+        
+    def addTime(self, epoch):
+        if (self.firstSeen is None) or (epoch < self.firstSeen):
+            self.firstSeen = epoch
+            
+        if (self.lastSeen is None) or (epoch > self.lastSeen):
+            self.lastSeen = epoch
+            
+    def addPosition(self, latitude, longitude):
+        if self.bounds is None:
+            self.bounds = [latitude, longitude, latitude, longitude]
+        else:
+            self.bounds = [min(self.bounds[0], latitude), min(self.bounds[1], longitude), max(self.bounds[2], latitude), max(self.bounds[3], longitude)]
+            
+    def addRecords(self, records):
+        # WirelessNetworks or BluetoothDevices, one per CSV row.  Both record where they were last and strongest heard.
+        bssids = set()
+        devices = set()
+        
+        for curRecord in records:
+            self.rows += 1
+            
+            if hasattr(curRecord, 'macAddress'):
+                devices.add(curRecord.macAddress)
+            else:
+                bssids.add(curRecord.macAddr)
+                
+            self.addTime(curRecord.firstSeenEpoch)
+            self.addTime(curRecord.lastSeenEpoch)
+            
+            if curRecord.gpsValid:
+                self.addPosition(curRecord.gpsLatitude, curRecord.gpsLongitude)
+                
+            if curRecord.strongestValid:
+                self.addPosition(curRecord.strongestLatitude, curRecord.strongestLongitude)
+                
+        self.bssids += len(bssids)
+        self.devices += len(devices)
+        
+class RecordingEntry(object):
+    def __init__(self):
+        self.filename = ""
+        self.size = 0
+        self.timestamp = None
+        self.fileFormat = FORMAT_OTHER
+        self.compression = COMPRESSION_NONE
+        self.rows = -1
+        self.bssids = -1
+        self.devices = -1
+        self.firstSeen = None
+        self.lastSeen = None
+        self.bounds = None
+        # Still being written
+        self.recording = False
+        
+    def setSummary(self, summary):
+        self.rows = summary.rows
+        self.bssids = summary.bssids
+        self.devices = summary.devices
+        self.firstSeen = summary.firstSeen
+        self.lastSeen = summary.lastSeen
+        self.bounds = summary.bounds
+        
+    def setFileStats(self, fullPath):
+        fileStats = os.stat(fullPath)
+        self.size = fileStats.st_size
+        self.timestamp = datetime.datetime.fromtimestamp(fileStats.st_mtime)
+        
+    def matches(self, startTime, endTime, bounds):
+        # Overlaps the time range and box.  An entry that doesn't know its times or area can't match a filter on them.
+        if (startTime is not None) and ((self.lastSeen is None) or (self.lastSeen < startTime)):
+            return False
+            
+        if (endTime is not None) and ((self.firstSeen is None) or (self.firstSeen > endTime)):
+            return False
+            
+        if bounds is not None:
+            if self.bounds is None:
+                return False
+                
+            if ((self.bounds[0] > bounds[2]) or (self.bounds[2] < bounds[0]) or 
+                (self.bounds[1] > bounds[3]) or (self.bounds[3] < bounds[1])):
+                return False
+                
+        return True
+        
+    def toJsondict(self):
+        # filename, size and timestamp are the same as FileSystemFile's so older clients still read it
+        jsondict = {}
+        jsondict['filename'] = self.filename
+        jsondict['size'] = self.size
+        jsondict['timestamp'] = str(self.timestamp)
+        jsondict['format'] = self.fileFormat
+        jsondict['compression'] = self.compression
+        jsondict['rows'] = self.rows
+        jsondict['bssids'] = self.bssids
+        jsondict['devices'] = self.devices
+        jsondict['firstseen'] = self.firstSeen
+        jsondict['lastseen'] = self.lastSeen
+        jsondict['bounds'] = self.bounds
+        jsondict['recording'] = self.recording
+        
+        return jsondict
+        
+    def fromJsondict(self, jsondict):
+        self.filename = jsondict['filename']
+        self.size = jsondict['size']
+        
+        if jsondict['timestamp'] == 'None':
+            self.timestamp = None
+        else:
+            self.timestamp = datetime.datetime.fromisoformat(jsondict['timestamp'])
+            
+        self.fileFormat = jsondict.get('format', FORMAT_OTHER)
+        self.compression = jsondict.get('compression', COMPRESSION_NONE)
+        self.rows = jsondict.get('rows', -1)
+        self.bssids = jsondict.get('bssids', -1)
+        self.devices = jsondict.get('devices', -1)
+        self.firstSeen = jsondict.get('firstseen')
+        self.lastSeen = jsondict.get('lastseen')
+        self.bounds = jsondict.get('bounds')
+        
+class RecordingCatalog(object):
+    # Safe to share between threads.  Every change is written straight to the index.
+    def __init__(self, recordingsDir, skipFunc=None):
+        # skipFunc(filename) is True for files in the directory that aren't recordings (temporaries, sidecars)
+        self.recordingsDir = recordingsDir
+        self.indexFile = recordingsDir + '/' + CATALOG_FILENAME
+        self.skipFunc = skipFunc
+        self.entries = {}
+        self.lock = Lock()
+        # The directory's mtime when it was last listed
+        self.dirMtime = None
+        
+        self.load()
+        
+    def load(self):
+        # Reads the index and squares it with what's actually in the directory
+        try:
+            with open(self.indexFile, 'r') as f:
+                indexdict = json.load(f)
+                
+            if indexdict.get('version') == CATALOG_VERSION:
+                for curEntrydict in indexdict['files']:
+                    curEntry = RecordingEntry()
+                    curEntry.fromJsondict(curEntrydict)
+                    self.entries[curEntry.filename] = curEntry
+        except:
+            pass
+            
+        self.lock.acquire()
+        self.scan()
+        self.save()
+        self.lock.release()
+        
+    def refresh(self):
+        # Lists the directory again if a file's been added, removed or renamed there since the last time, so files
+        # copied in by something other than the agent still show up.  Our own index writes count too, which costs
+        # one listing that finds nothing new.
+        try:
+            dirMtime = os.stat(self.recordingsDir).st_mtime_ns
+        except:
+            return
+            
+        self.lock.acquire()
+        
+        if (dirMtime != self.dirMtime) and self.scan():
+            self.save()
+            
+        self.lock.release()
+        
+    def scan(self):
+        # Called with the lock held.  Adds what's new in the directory, drops what's gone and returns True if
+        # anything changed.
+        changed = False
+        
+        try:
+            # Taken before the listing so a file added while it runs changes the mtime again
+            self.dirMtime = os.stat(self.recordingsDir).st_mtime_ns
+            filenames = set(os.listdir(self.recordingsDir))
+        except:
+            self.dirMtime = None
+            filenames = set()
+            
+        for curFilename in list(self.entries.keys()):
+            if curFilename not in filenames:
+                curEntry = self.entries.pop(curFilename)
+                changed = True
+                
+                # Gzipped before the compressor got to tell us (see renameFile).  It's the same recording.
+                compressedFilename = curFilename + '.gz'
+                if (compressedFilename in filenames) and (compressedFilename not in self.entries):
+                    try:
+                        self.renameEntry(curEntry, compressedFilename)
+                    except:
+                        pass
+                
+        for curFilename in filenames:
+            if (curFilename == CATALOG_FILENAME) or ((self.skipFunc is not None) and self.skipFunc(curFilename)):
+                continue
+                
+            fullPath = self.recordingsDir + '/' + curFilename
+            
+            if os.path.isdir(fullPath):
+                continue
+                
+            curEntry = self.entries.get(curFilename)
+            
+            try:
+                if curEntry is None:
+                    curEntry = self.newEntry(curFilename)
+                    self.entries[curFilename] = curEntry
+                    changed = True
+                elif curEntry.size != os.path.getsize(fullPath):
+                    # Changed behind our back, so what we knew about it is out of date
+                    self.entries[curFilename] = self.newEntry(curFilename)
+                    changed = True
+            except:
+                pass
+                
+        return changed
+        
+    def newEntry(self, filename):
+        curEntry = RecordingEntry()
+        curEntry.filename = filename
+        curEntry.fileFormat, curEntry.compression = getFileFormat(filename)
+        curEntry.setFileStats(self.recordingsDir + '/' + filename)
+        
+        return curEntry
+        
+    def renameEntry(self, curEntry, newFilename):
+        # Called with the lock held
+        curEntry.filename = newFilename
+        curEntry.fileFormat, curEntry.compression = getFileFormat(newFilename)
+        curEntry.setFileStats(self.recordingsDir + '/' + newFilename)
+        self.entries[newFilename] = curEntry
+        
+    def save(self):
+        # Called with the lock held.  Written to a temporary first so a crash can't leave half an index.
+        indexdict = {}
+        indexdict['version'] = CATALOG_VERSION
+        indexdict['files'] = [curEntry.toJsondict() for curEntry in self.entries.values()]
+        
+        tmpFile = self.indexFile + '.tmp'
+        
+        try:
+            with open(tmpFile, 'w') as f:
+                json.dump(indexdict, f)
+                
+            os.replace(tmpFile, self.indexFile)
+        except:
+            print('ERROR: Unable to write the recordings catalog ' + self.indexFile)
+            
+    def addFile(self, filename, summary=None):
+        # Adds or refreshes filename (a name in the recordings directory).  Ignored if it isn't there, which is the
+        # case for a recorder writing somewhere else.
+        self.lock.acquire()
+        
+        try:
+            curEntry = self.newEntry(filename)
+            
+            if summary is not None:
+                curEntry.setSummary(summary)
+                
+            self.entries[filename] = curEntry
+            self.save()
+        except:
+            pass
+        finally:
+            self.lock.release()
+            
+    def renameFile(self, filename, newFilename):
+        # Same recording under a new name, like filename.gz once it's compressed
+        self.lock.acquire()
+        
+        try:
+            curEntry = self.entries.pop(filename, None)
+            
+            if curEntry is None:
+                # A rescan may have seen the rename first and moved the entry already
+                curEntry = self.entries.get(newFilename)
+                
+            if curEntry is None:
+                self.entries[newFilename] = self.newEntry(newFilename)
+            else:
+                self.renameEntry(curEntry, newFilename)
+                
+            self.save()
+        except:
+            pass
+        finally:
+            self.lock.release()
+            
+    def removeFile(self, filename):
+        self.lock.acquire()
+        
+        if filename in self.entries:
+            del self.entries[filename]
+            self.save()
+            
+        self.lock.release()
+        
+    def getFiles(self, startTime=None, endTime=None, bounds=None):
+        # Entries as dicts, from memory.  bounds is [minLat, minLon, maxLat, maxLon].
+        self.refresh()
+        
+        self.lock.acquire()
+        
+        retVal = [curEntry.toJsondict() for curEntry in self.entries.values() if curEntry.matches(startTime, endTime, bounds)]
+        
+        self.lock.release()
+        
+        return retVal
+        
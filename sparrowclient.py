@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# Shared HTTP client for talking to agents.  Each agent gets its own requests Session, so its connections are
+# kept alive and reused between calls instead of a new TCP connection per request.  Timeouts come from
+# ENDPOINT_TIMEOUTS unless the caller passes one, and every call's latency is tracked per endpoint.
+
+import time
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+# Seconds.  Matched on the start of the path, first match wins.
+ENDPOINT_TIMEOUTS = [('/wireless/networks/', 20),
+                     ('/spectrum/scanstart', 10),
+                     ('/spectrum/scanstop', 10),
+                     ('/spectrum/scanstatus', 10),
+                     ('/system/getrecording/', 30)]
+DEFAULT_TIMEOUT = 6
+
+# Connections kept per agent.  The GUI can have a scan, GPS, spectrum and bluetooth poll going at once.
+POOL_SIZE = 8
+
+class EndpointStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.totalTime = 0.0
+        self.minTime = 0.0
+        self.maxTime = 0.0
+        self.lastTime = 0.0
+
+    def addCall(self, elapsed, failed):
+        if self.count == 0 or elapsed < self.minTime:
+            self.minTime = elapsed
+        if elapsed > self.maxTime:
+            self.maxTime = elapsed
+
+        self.count += 1
+        self.totalTime += elapsed
+        self.lastTime = elapsed
+
+        if failed:
+            self.errors += 1
+
+    def toJsondict(self):
+        dictjson = {}
+        dictjson['count'] = self.count
+        dictjson['errors'] = self.errors
+        if self.count > 0:
+            dictjson['mean'] = self.totalTime / self.count
+        else:
+            dictjson['mean'] = 0.0
+        dictjson['min'] = self.minTime
+        dictjson['max'] = self.maxTime
+        dictjson['last'] = self.lastTime
+
+        return dictjson
+
+class KeepAliveRetry(Retry):
+    # urllib3 counts a kept-alive connection the agent has since closed (RemoteDisconnected) as a read error, so
+    # reads have to be retried for that to be.  A read timeout is a slow scan though, and isn't retried.
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError):
+            raise error.with_traceback(_stacktrace)
+
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+class AgentClient(object):
+    def __init__(self):
+        self.sessions = {}
+        self.stats = {}
+        self.lock = Lock()
+
+    def getSession(self, netloc):
+        self.lock.acquire()
+
+        if netloc not in self.sessions:
+            session = requests.Session()
+            # One retry for a kept-alive connection the agent has since closed.  Only GETs (Retry's default
+            # allowed_methods) are reissued that way.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=KeepAliveRetry(total=1, read=1, redirect=0, status=0))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.sessions[netloc] = session
+
+        session = self.sessions[netloc]
+        self.lock.release()
+
+        return session
+
+    @staticmethod
+    def getEndpoint(path):
+        # Stats key: the first two parts of the path, so /wireless/networks/wlan0 and /wireless/networks/wlan1 are one
+        return '/'.join(path.split('/')[:3])
+
+    @staticmethod
+    def getTimeout(path):
+        for curPrefix, curTimeout in ENDPOINT_TIMEOUTS:
+            if path.startswith(curPrefix):
+                return curTimeout
+
+        return DEFAULT_TIMEOUT
+
+    def request(self, method, url, timeout=None, **kwargs):
+        # Same as requests.request but pooled, with the endpoint's timeout and the call timed.  Raises like requests does.
+        urlparts = urlsplit(url)
+
+        if timeout is None:
+            timeout = AgentClient.getTimeout(urlparts.path)
+
+        session = self.getSession(urlparts.netloc)
+
+        startTime = time.monotonic()
+        failed = True
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+            failed = response.status_code != 200
+            return response
+        finally:
+            self.recordCall(AgentClient.getEndpoint(urlparts.path), time.monotonic() - startTime, failed)
+
+    def get(self, url, timeout=None, **kwargs):
+        return self.request('GET', url, timeout, **kwargs)
+
+    def post(self, url, data=None, timeout=None, **kwargs):
+        return self.request('POST', url, timeout, data=data, **kwargs)
+
+    def recordCall(self, endpoint, elapsed, failed):
+        self.lock.acquire()
+
+        if endpoint not in self.stats:
+            self.stats[endpoint] = EndpointStats()
+
+        self.stats[endpoint].addCall(elapsed, failed)
+        self.lock.release()
+
+    def getLatencyStats(self):
+        # endpoint -> dict of count, errors, and mean/min/max/last in seconds
+        self.lock.acquire()
+
+        retVal = {}
+        for curEndpoint in self.stats.keys():
+            retVal[curEndpoint] = self.stats[curEndpoint].toJsondict()
+
+        self.lock.release()
+
+        return retVal
+
+    def resetLatencyStats(self):
+        self.lock.acquire()
+        self.stats = {}
+        self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+
+        for curSession in self.sessions.values():
+            curSession.close()
+
+        self.sessions = {}
+        self.lock.release()
+
+# The one client everything shares
+agentClient = AgentClient()
@@ -17,8 +17,11 @@
 # the Free Software Foundation, Inc., 51 Franklin Street,
 # Boston, MA 02110-1301, USA.
 # 
-from threading import Thread
+from threading import Thread, Lock
 from time import sleep
+import time
+import datetime
+from functools import lru_cache
 import socket
 import platform
 import subprocess
@@ -32,6 +35,22 @@ def stringtobool(instr):
     else:
         return False
         
+def toEpoch(timestamp):
+    # Timestamps on the scan records are float epoch seconds.  Accepts a datetime or a number.
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    else:
+        return float(timestamp)
+        
+@lru_cache(maxsize=4096)
+def formatEpochSeconds(seconds):
+    return time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(seconds))
+    
+def formatEpoch(epoch):
+    # Same text as datetime.strftime("%m/%d/%Y %H:%M:%S").  Table refreshes mostly redraw the same
+    # few seconds, so the strings are cached per second.
+    return formatEpochSeconds(int(epoch))
+    
 def portOpen(host, port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(1) 
@@ -117,6 +136,160 @@ class BaseThreadClass(Thread):
             sleep(0.1)
             i += 1
 
+# ------------------  Delta sync ----------------------------------
+class ChangeLog(object):
+    # Agent side of delta sync.  Keeps the latest copy of every record in a data set along with the sequence
+    # number of its last change, so a client that sends back the cursor from its last response only gets what
+    # was added, changed or expired since.  A record whose only change is lastSeen counts as changed again
+    # once lastSeen has moved lastSeenRefresh seconds from the copy the clients have, so they can still age it out.
+    # Sequence numbers start from the clock (ms), so a cursor from before an agent restart forces a full resync.
+    def __init__(self, maxAge=0, lastSeenRefresh=30.0, maxExpired=10000):
+        self.maxAge = maxAge
+        self.lastSeenRefresh = lastSeenRefresh
+        self.maxExpired = maxExpired
+        self.seq = int(time.time() * 1000)
+        # Cursors older than this can't be answered with a delta
+        self.minSeq = self.seq
+        # key -> [seq, signature, lastSeen sent, lastSeen, record].  Both dicts are kept in seq order.
+        self.entries = {}
+        self.expired = {}
+        self.lock = Lock()
+        
+    def update(self, key, record, signature, lastSeen):
+        # Returns True if the record counts as changed
+        self.lock.acquire()
+        
+        entry = self.entries.get(key)
+        
+        if (entry is not None) and (entry[1] == signature) and ((lastSeen - entry[2]) < self.lastSeenRefresh):
+            entry[3] = lastSeen
+            entry[4] = record
+            self.lock.release()
+            return False
+            
+        if entry is not None:
+            # Move it to the end so entries stays in seq order
+            del self.entries[key]
+            
+        self.seq += 1
+        self.entries[key] = [self.seq, signature, lastSeen, lastSeen, record]
+        self.expired.pop(key, None)
+        
+        self.lock.release()
+        return True
+        
+    def getRecord(self, key):
+        entry = self.entries.get(key)
+        
+        if entry is None:
+            return None
+        else:
+            return entry[4]
+            
+    def expire(self, keys):
+        self.lock.acquire()
+        
+        for curKey in keys:
+            if curKey in self.entries:
+                del self.entries[curKey]
+                self.seq += 1
+                self.expired[curKey] = self.seq
+                
+        while len(self.expired) > self.maxExpired:
+            oldestKey = next(iter(self.expired))
+            self.minSeq = max(self.minSeq, self.expired.pop(oldestKey))
+            
+        self.lock.release()
+        
+    def expireOld(self, now=None):
+        # Drops records not seen in maxAge seconds
+        if self.maxAge <= 0:
+            return
+            
+        if now is None:
+            now = time.time()
+            
+        self.lock.acquire()
+        oldKeys = [curKey for curKey, entry in self.entries.items() if entry[3] < (now - self.maxAge)]
+        self.lock.release()
+        
+        self.expire(oldKeys)
+        
+    def expireMissing(self, currentKeys):
+        # For data sets where the caller always has the full list: anything not in it is gone
+        self.lock.acquire()
+        missingKeys = [curKey for curKey in self.entries.keys() if curKey not in currentKeys]
+        self.lock.release()
+        
+        self.expire(missingKeys)
+        
+    def getChanges(self, since=None):
+        # Returns full, cursor, records and expired keys.  full means the client should replace what it has
+        # with records (no cursor, a cursor from another agent run, or one older than the expired keys we kept).
+        self.lock.acquire()
+        
+        try:
+            if (since is None) or (since < self.minSeq) or (since > self.seq):
+                return True, self.seq, [entry[4] for entry in self.entries.values()], []
+                
+            records = []
+            for entry in reversed(self.entries.values()):
+                if entry[0] <= since:
+                    break
+                records.append(entry[4])
+            records.reverse()
+            
+            expiredKeys = []
+            for curKey, curSeq in reversed(self.expired.items()):
+                if curSeq <= since:
+                    break
+                expiredKeys.append(curKey)
+            expiredKeys.reverse()
+            
+            return False, self.seq, records, expiredKeys
+        finally:
+            self.lock.release()
+            
+class DeltaState(object):
+    # Client side of delta sync.  Holds the records from the last full response with every delta since merged in,
+    # and the cursor to send with the next request.
+    def __init__(self):
+        self.records = {}
+        self.cursor = None
+        
+    def merge(self, records, expiredKeys, cursor, full):
+        # records is a dict of key -> record.  Returns the records that were added or changed.
+        if full:
+            self.records = dict(records)
+        else:
+            self.records.update(records)
+            
+            for curKey in expiredKeys:
+                self.records.pop(curKey, None)
+                
+        self.cursor = cursor
+        
+        return records
+        
+    def mergeResponse(self, records, response):
+        # response is the decoded response dict (or the delta dict from sparrowwire.decodeNetworks).
+        # Agents without delta sync answer every request in full and send no cursor.
+        if 'seq' not in response:
+            return self.merge(records, [], None, True)
+            
+        return self.merge(records, response['expired'], response['seq'], response['full'])
+        
+    def getSince(self):
+        # since value for the next request.  0 is older than any cursor, so it asks for everything.
+        if self.cursor is None:
+            return 0
+        else:
+            return self.cursor
+            
+    def reset(self):
+        self.records = {}
+        self.cursor = None
+        
 if __name__ == '__main__':
     pass
     if portOpen('127.0.0.1', 80):
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# Response compression for the agent.  The encoding is negotiated from Accept-Encoding (gzip, deflate or identity)
+# and the zlib level is set with setCompressLevel().  Responses written a piece at a time go through a
+# StreamCompressor, and bodies that many clients ask for (the same scan results for instance) can be kept already
+# encoded in an EncodedBodyCache so they're only serialized and compressed once.  CompressionStats keeps the bytes
+# in and out and the CPU time spent per endpoint so the level can be tuned for the hardware.
+
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+ENCODING_GZIP = 'gzip'
+ENCODING_DEFLATE = 'deflate'
+ENCODING_IDENTITY = 'identity'
+
+# Preferred first when the client weights them the same
+ENCODINGS = [ENCODING_GZIP, ENCODING_DEFLATE]
+
+# 0 turns compression off.  6 is zlib's default.
+compressLevel = 6
+
+def setCompressLevel(level):
+    global compressLevel
+    
+    try:
+        level = int(level)
+    except:
+        return False
+        
+    if (level < 0) or (level > 9):
+        return False
+        
+    compressLevel = level
+    
+    return True
+    
+def getCompressLevel():
+    return compressLevel
+    
+def negotiateEncoding(acceptEncoding):
+    # Returns the encoding to use for an Accept-Encoding header value (None if there wasn't one)
+    if (compressLevel == 0) or (not acceptEncoding):
+        return ENCODING_IDENTITY
+        
+    weights = {}
+    for curItem in acceptEncoding.split(','):
+        parts = curItem.strip().split(';')
+        name = parts[0].strip().lower()
+        weight = 1.0
+        for curParam in parts[1:]:
+            curParam = curParam.strip()
+            if curParam.startswith('q='):
+                try:
+                    weight = float(curParam[2:])
+                except:
+                    weight = 0.0
+                    
+        weights[name] = weight
+        
+    bestEncoding = ENCODING_IDENTITY
+    bestWeight = 0.0
+    for curEncoding in ENCODINGS:
+        curWeight = weights.get(curEncoding, weights.get('*', 0.0))
+        if curWeight > bestWeight:
+            bestEncoding = curEncoding
+            bestWeight = curWeight
+            
+    return bestEncoding
+    
+def getCompressor(encoding):
+    # zlib compressobj for gzip or deflate (zlib wrapped, which is what HTTP deflate means)
+    if encoding == ENCODING_GZIP:
+        return zlib.compressobj(compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        return zlib.compressobj(compressLevel, zlib.DEFLATED, zlib.MAX_WBITS)
+        
+def compressBytes(data, encoding):
+    if encoding == ENCODING_IDENTITY:
+        return data
+        
+    compressor = getCompressor(encoding)
+    
+    return compressor.compress(data) + compressor.flush()
+    
+class EndpointCompressionStats(object):
+    def __init__(self):
+        self.count = 0
+        self.cacheHits = 0
+        self.rawBytes = 0
+        self.encodedBytes = 0
+        self.cpuTime = 0.0
+        
+    def toJsondict(self):
+        dictjson = {}
+        dictjson['count'] = self.count
+        dictjson['cachehits'] = self.cacheHits
+        dictjson['rawbytes'] = self.rawBytes
+        dictjson['encodedbytes'] = self.encodedBytes
+        if self.encodedBytes > 0:
+            dictjson['ratio'] = self.rawBytes / self.encodedBytes
+        else:
+            dictjson['ratio'] = 1.0
+        # CPU seconds, and CPU milliseconds per raw KB
+        dictjson['cputime'] = self.cpuTime
+        if self.rawBytes > 0:
+            dictjson['cpumsperkb'] = self.cpuTime * 1000.0 / (self.rawBytes / 1024.0)
+        else:
+            dictjson['cpumsperkb'] = 0.0
+            
+        return dictjson
+        
+class CompressionStats(object):
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = Lock()
+        
+    def addResponse(self, endpoint, rawBytes, encodedBytes, cpuTime, cacheHit=False):
+        self.lock.acquire()
+        
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointCompressionStats()
+            
+        curStats = self.endpoints[endpoint]
+        curStats.count += 1
+        if cacheHit:
+            curStats.cacheHits += 1
+        else:
+            # Only what was actually compressed counts toward the ratio and cost
+            curStats.rawBytes += rawBytes
+            curStats.encodedBytes += encodedBytes
+            curStats.cpuTime += cpuTime
+            
+        self.lock.release()
+        
+    def getStats(self):
+        self.lock.acquire()
+        
+        retVal = {}
+        for curEndpoint in self.endpoints.keys():
+            retVal[curEndpoint] = self.endpoints[curEndpoint].toJsondict()
+            
+        self.lock.release()
+        
+        return retVal
+        
+class StreamCompressor(object):
+    # Stands in for a handler's wfile and compresses what's written to it.  Each write is sync-flushed so a streamed
+    # response (networks as iw reports them) reaches the client as it's written rather than when the compressor's
+    # buffer fills.  finish() writes out the end of the stream.
+    def __init__(self, rawfile, encoding, endpoint, stats):
+        self.rawfile = rawfile
+        self.encoding = encoding
+        self.endpoint = endpoint
+        self.stats = stats
+        self.compressor = getCompressor(encoding)
+        self.rawBytes = 0
+        self.encodedBytes = 0
+        self.cpuTime = 0.0
+        
+    def write(self, data):
+        startTime = time.thread_time()
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.cpuTime += time.thread_time() - startTime
+        
+        self.rawBytes += len(data)
+        if len(compressed) > 0:
+            self.encodedBytes += len(compressed)
+            self.rawfile.write(compressed)
+            
+        return len(data)
+        
+    def flush(self):
+        self.rawfile.flush()
+        
+    def finish(self):
+        startTime = time.thread_time()
+        compressed = self.compressor.flush()
+        self.cpuTime += time.thread_time() - startTime
+        
+        self.encodedBytes += len(compressed)
+        self.rawfile.write(compressed)
+        
+        if self.stats is not None:
+            self.stats.addResponse(self.endpoint, self.rawBytes, self.encodedBytes, self.cpuTime)
+            
+class EncodedBodyCache(object):
+    # Response bodies already serialized and compressed, by key.  Keys include the version of the data (a scan's
+    # finish time for instance) and the encoding, so an entry is never stale, it just stops being asked for.
+    # Least recently used entries go once there are more than maxEntries.
+    def __init__(self, maxEntries=32):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        
+    def get(self, key):
+        self.lock.acquire()
+        
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            
+        self.lock.release()
+        
+        return body
+        
+    def put(self, key, body):
+        self.lock.acquire()
+        
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            
+        self.lock.release()
+        
+    def getStats(self):
+        self.lock.acquire()
+        
+        retVal = {}
+        retVal['entries'] = len(self.entries)
+        retVal['bytes'] = sum(len(curBody) for curBody in self.entries.values())
+        retVal['hits'] = self.hits
+        retVal['misses'] = self.misses
+        
+        self.lock.release()
+        
+        return retVal
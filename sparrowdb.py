@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# SQLite persistence for surveys.  One row per network / bluetooth device (what a CSV export has) and one per sighting
+# in the observation tables, so a long survey can be queried by time, MAC or area without loading it all.
+#   - WAL journal with synchronous=NORMAL:  readers don't block the recorder and a commit is one sequential append
+#   - each scan is one transaction with executemany, which is what keeps the per-row cost down on an SD card
+#   - observations carry a coarse grid cell (GRID_SCALE cells per degree) so area queries use an index instead of
+#     comparing every row's lat/lon
+# Used by the agent's recorder (recordformat=sqlite) and the GUI's continuous save.
+
+import math
+import os
+import sqlite3
+from threading import Lock
+
+from sparrowcatalog import RecordingSummary
+
+DB_EXTENSION = '.sqlite3'
+
+# 100 cells per degree is about 1.1 km of latitude
+GRID_SCALE = 100
+GRID_COLUMNS = 360 * GRID_SCALE
+# A box spanning more grid rows than this is filtered on lat/lon alone
+MAX_GRID_ROWS = 200
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS networks (id INTEGER PRIMARY KEY, macaddr TEXT NOT NULL, ssid TEXT NOT NULL, channel INTEGER NOT NULL,
+            vendor TEXT, mode TEXT, security TEXT, privacy TEXT, cipher TEXT, frequency INTEGER, bandwidth INTEGER, secondarychannel INTEGER,
+            thirdchannel INTEGER, secondarychannellocation TEXT, firstseen REAL, lastseen REAL, signal INTEGER, strongestsignal INTEGER,
+            strongestlat REAL, strongestlon REAL, strongestalt REAL, strongestspeed REAL, strongestgpsvalid INTEGER, 
+            UNIQUE (macaddr, ssid, channel))''',
+    '''CREATE TABLE IF NOT EXISTS btdevices (id INTEGER PRIMARY KEY, macaddr TEXT NOT NULL UNIQUE, uuid TEXT, name TEXT, company TEXT, 
+            manufacturer TEXT, description TEXT, bttype INTEGER, txpower INTEGER, txpowervalid INTEGER, ibeaconrange REAL, firstseen REAL, 
+            lastseen REAL, rssi INTEGER, strongestrssi INTEGER, strongestlat REAL, strongestlon REAL, strongestalt REAL, strongestspeed REAL, 
+            strongestgpsvalid INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS wifiobservations (networkid INTEGER NOT NULL, time REAL NOT NULL, signal INTEGER, lat REAL, lon REAL, 
+            alt REAL, speed REAL, gpsvalid INTEGER, grid INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS btobservations (deviceid INTEGER NOT NULL, time REAL NOT NULL, rssi INTEGER, lat REAL, lon REAL, 
+            alt REAL, speed REAL, gpsvalid INTEGER, grid INTEGER)''',
+    'CREATE INDEX IF NOT EXISTS networks_mac ON networks (macaddr)',
+    'CREATE INDEX IF NOT EXISTS networks_lastseen ON networks (lastseen)',
+    'CREATE INDEX IF NOT EXISTS btdevices_lastseen ON btdevices (lastseen)',
+    'CREATE INDEX IF NOT EXISTS wifiobservations_time ON wifiobservations (time)',
+    'CREATE INDEX IF NOT EXISTS wifiobservations_network ON wifiobservations (networkid, time)',
+    'CREATE INDEX IF NOT EXISTS wifiobservations_grid ON wifiobservations (grid, time)',
+    'CREATE INDEX IF NOT EXISTS btobservations_time ON btobservations (time)',
+    'CREATE INDEX IF NOT EXISTS btobservations_device ON btobservations (deviceid, time)',
+    'CREATE INDEX IF NOT EXISTS btobservations_grid ON btobservations (grid, time)'
+]
+
+# INSERT OR IGNORE followed by an UPDATE rather than an upsert so older SQLite (before 3.24) works too.
+# firstseen is only set by the insert, and the strongest signal/gps only move when the new signal is at least as strong.
+NETWORK_INSERT = '''INSERT OR IGNORE INTO networks (macaddr, ssid, channel, firstseen, strongestsignal) VALUES (?, ?, ?, ?, -1000)'''
+NETWORK_UPDATE = '''UPDATE networks SET vendor=?, mode=?, security=?, privacy=?, cipher=?, frequency=?, bandwidth=?, secondarychannel=?, 
+            thirdchannel=?, secondarychannellocation=?, lastseen=?, signal=?, 
+            strongestlat = CASE WHEN ? >= strongestsignal THEN ? ELSE strongestlat END, 
+            strongestlon = CASE WHEN ? >= strongestsignal THEN ? ELSE strongestlon END, 
+            strongestalt = CASE WHEN ? >= strongestsignal THEN ? ELSE strongestalt END, 
+            strongestspeed = CASE WHEN ? >= strongestsignal THEN ? ELSE strongestspeed END, 
+            strongestgpsvalid = CASE WHEN ? >= strongestsignal THEN ? ELSE strongestgpsvalid END, 
+            strongestsignal = MAX(strongestsignal, ?) 
+            WHERE macaddr=? AND ssid=? AND channel=?'''
+WIFI_OBSERVATION_INSERT = 'INSERT INTO wifiobservations (networkid, time, signal, lat, lon, alt, speed, gpsvalid, grid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+DEVICE_INSERT = '''INSERT OR IGNORE INTO btdevices (macaddr, firstseen, strongestrssi) VALUES (?, ?, -1000)'''
+DEVICE_UPDATE = '''UPDATE btdevices SET uuid=?, name=?, company=?, manufacturer=?, description=?, bttype=?, txpower=?, txpowervalid=?, 
+            ibeaconrange=?, lastseen=?, rssi=?, 
+            strongestlat = CASE WHEN ? >= strongestrssi THEN ? ELSE strongestlat END, 
+            strongestlon = CASE WHEN ? >= strongestrssi THEN ? ELSE strongestlon END, 
+            strongestalt = CASE WHEN ? >= strongestrssi THEN ? ELSE strongestalt END, 
+            strongestspeed = CASE WHEN ? >= strongestrssi THEN ? ELSE strongestspeed END, 
+            strongestgpsvalid = CASE WHEN ? >= strongestrssi THEN ? ELSE strongestgpsvalid END, 
+            strongestrssi = MAX(strongestrssi, ?) 
+            WHERE macaddr=?'''
+BT_OBSERVATION_INSERT = 'INSERT INTO btobservations (deviceid, time, rssi, lat, lon, alt, speed, gpsvalid, grid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+def getGridCell(latitude, longitude):
+    return int(math.floor((latitude + 90.0) * GRID_SCALE)) * GRID_COLUMNS + int(math.floor((longitude + 180.0) * GRID_SCALE))
+    
+def getGridRanges(minLat, minLon, maxLat, maxLon):
+    # The grid cells covering a box as (first, last) per grid row, or None if the box is too tall to be worth it
+    firstRow = int(math.floor((minLat + 90.0) * GRID_SCALE))
+    lastRow = int(math.floor((maxLat + 90.0) * GRID_SCALE))
+    
+    if lastRow - firstRow + 1 > MAX_GRID_ROWS:
+        return None
+        
+    firstColumn = int(math.floor((minLon + 180.0) * GRID_SCALE))
+    lastColumn = int(math.floor((maxLon + 180.0) * GRID_SCALE))
+    
+    return [(curRow * GRID_COLUMNS + firstColumn, curRow * GRID_COLUMNS + lastColumn) for curRow in range(firstRow, lastRow + 1)]
+    
+class SQLiteRecorder(object):
+    # Safe to share between threads.  Writes are serialized on the recorder's lock.
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+        self.networkIds = {}  # (mac, ssid, channel) -> networks.id
+        self.deviceIds = {}  # mac -> btdevices.id
+        
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA temp_store=MEMORY')
+        
+        for curStatement in SCHEMA:
+            self.db.execute(curStatement)
+            
+        self.db.commit()
+        
+    def close(self):
+        self.lock.acquire()
+        
+        if self.db is not None:
+            try:
+                self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except:
+                pass
+                
+            self.db.close()
+            self.db = None
+            
+        self.lock.release()
+        
+    def getSize(self):
+        # Bytes on disk, counting the WAL
+        retVal = 0
+        
+        for curFile in [self.filename, self.filename + '-wal']:
+            try:
+                retVal += os.path.getsize(curFile)
+            except:
+                pass
+                
+        return retVal
+        
+    def checkpoint(self):
+        # Folds the WAL into the main file so a copy of just the .sqlite3 has everything
+        self.lock.acquire()
+        
+        if self.db is not None:
+            self.db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            
+        self.lock.release()
+        
+    def getGPSValues(self, latitude, longitude, valid):
+        if valid:
+            return latitude, longitude, getGridCell(latitude, longitude)
+        else:
+            return None, None, None
+            
+    def lookupIds(self, cursor, idCache, keys, query):
+        # Fills in ids for keys not already cached (new rows, or ones written in an earlier session)
+        for curKey in keys:
+            if curKey not in idCache:
+                cursor.execute(query, curKey)
+                row = cursor.fetchone()
+                if row is not None:
+                    idCache[curKey] = row[0]
+                    
+    def recordNetworks(self, networks, vendorLookup=None):
+        # networks is a list of WirelessNetwork from one scan.  The whole scan goes in as one transaction.
+        if len(networks) == 0:
+            return
+            
+        inserts = []
+        updates = []
+        keys = []
+        
+        for curNet in networks:
+            key = (curNet.macAddr, curNet.ssid, curNet.channel)
+            keys.append(key)
+            
+            if vendorLookup is not None:
+                vendor = vendorLookup(curNet.macAddr)
+            else:
+                vendor = None
+                
+            signal = curNet.signal
+            inserts.append((curNet.macAddr, curNet.ssid, curNet.channel, curNet.firstSeenEpoch))
+            updates.append((vendor, curNet.mode, curNet.security, curNet.privacy, curNet.cipher, curNet.frequency, curNet.bandwidth, 
+                                    curNet.secondaryChannel, curNet.thirdChannel, curNet.secondaryChannelLocation, curNet.lastSeenEpoch, signal, 
+                                    signal, curNet.strongestLatitude, signal, curNet.strongestLongitude, signal, curNet.strongestAltitude, 
+                                    signal, curNet.strongestSpeed, signal, int(curNet.strongestValid), signal) + key)
+                                    
+        self.lock.acquire()
+        
+        try:
+            cursor = self.db.cursor()
+            cursor.execute('BEGIN')
+            cursor.executemany(NETWORK_INSERT, inserts)
+            cursor.executemany(NETWORK_UPDATE, updates)
+            self.lookupIds(cursor, self.networkIds, keys, 'SELECT id FROM networks WHERE macaddr=? AND ssid=? AND channel=?')
+            
+            observations = []
+            for curNet, curKey in zip(networks, keys):
+                latitude, longitude, grid = self.getGPSValues(curNet.gpsLatitude, curNet.gpsLongitude, curNet.gpsValid)
+                observations.append((self.networkIds[curKey], curNet.lastSeenEpoch, curNet.signal, latitude, longitude, 
+                                                curNet.gpsAltitude, curNet.gpsSpeed, int(curNet.gpsValid), grid))
+                                                
+            cursor.executemany(WIFI_OBSERVATION_INSERT, observations)
+            cursor.execute('COMMIT')
+        except:
+            self.db.rollback()
+            raise
+        finally:
+            self.lock.release()
+            
+    def recordBluetoothDevices(self, devices):
+        # devices is a list of BluetoothDevice heard in one pass
+        if len(devices) == 0:
+            return
+            
+        inserts = []
+        updates = []
+        keys = []
+        
+        for curDevice in devices:
+            key = (curDevice.macAddress,)
+            keys.append(key)
+            
+            rssi = curDevice.rssi
+            inserts.append((curDevice.macAddress, curDevice.firstSeenEpoch))
+            updates.append((curDevice.uuid, curDevice.name, curDevice.company, curDevice.manufacturer, curDevice.bluetoothDescription, 
+                                    curDevice.btType, curDevice.txPower, int(curDevice.txPowerValid), curDevice.iBeaconRange, 
+                                    curDevice.lastSeenEpoch, rssi, rssi, curDevice.strongestLatitude, rssi, curDevice.strongestLongitude, 
+                                    rssi, curDevice.strongestAltitude, rssi, curDevice.strongestSpeed, rssi, int(curDevice.strongestValid), rssi) + key)
+                                    
+        self.lock.acquire()
+        
+        try:
+            cursor = self.db.cursor()
+            cursor.execute('BEGIN')
+            cursor.executemany(DEVICE_INSERT, inserts)
+            cursor.executemany(DEVICE_UPDATE, updates)
+            self.lookupIds(cursor, self.deviceIds, keys, 'SELECT id FROM btdevices WHERE macaddr=?')
+            
+            observations = []
+            for curDevice, curKey in zip(devices, keys):
+                latitude, longitude, grid = self.getGPSValues(curDevice.gpsLatitude, curDevice.gpsLongitude, curDevice.gpsValid)
+                observations.append((self.deviceIds[curKey], curDevice.lastSeenEpoch, curDevice.rssi, latitude, longitude, 
+                                                curDevice.gpsAltitude, curDevice.gpsSpeed, int(curDevice.gpsValid), grid))
+                                                
+            cursor.executemany(BT_OBSERVATION_INSERT, observations)
+            cursor.execute('COMMIT')
+        except:
+            self.db.rollback()
+            raise
+        finally:
+            self.lock.release()
+            
+    # ------------------  Queries ------------------------------
+    def getObservationFilter(self, startTime, endTime, bounds, macAddr, idColumn, parentTable):
+        # WHERE clause and parameters shared by the observation queries.  bounds is (minLat, minLon, maxLat, maxLon).
+        clauses = []
+        params = []
+        
+        if startTime is not None:
+            clauses.append('o.time >= ?')
+            params.append(startTime)
+            
+        if endTime is not None:
+            clauses.append('o.time <= ?')
+            params.append(endTime)
+            
+        if bounds is not None:
+            minLat, minLon, maxLat, maxLon = bounds
+            gridRanges = getGridRanges(minLat, minLon, maxLat, maxLon)
+            if gridRanges is not None:
+                clauses.append('(' + ' OR '.join(['o.grid BETWEEN ? AND ?'] * len(gridRanges)) + ')')
+                for curRange in gridRanges:
+                    params += list(curRange)
+                    
+            clauses.append('o.lat BETWEEN ? AND ? AND o.lon BETWEEN ? AND ?')
+            params += [minLat, maxLat, minLon, maxLon]
+            
+        if macAddr is not None:
+            clauses.append('o.' + idColumn + ' IN (SELECT id FROM ' + parentTable + ' WHERE macaddr=?)')
+            params.append(macAddr)
+            
+        if len(clauses) == 0:
+            return '', params
+            
+        return ' WHERE ' + ' AND '.join(clauses), params
+        
+    def query(self, statement, params):
+        self.lock.acquire()
+        try:
+            return self.db.execute(statement, params).fetchall()
+        finally:
+            self.lock.release()
+            
+    def getWifiObservations(self, startTime=None, endTime=None, bounds=None, macAddr=None):
+        # (macaddr, ssid, channel, time, signal, lat, lon, alt, speed, gpsvalid) for each matching sighting, in time order
+        whereClause, params = self.getObservationFilter(startTime, endTime, bounds, macAddr, 'networkid', 'networks')
+        
+        return self.query('SELECT n.macaddr, n.ssid, n.channel, o.time, o.signal, o.lat, o.lon, o.alt, o.speed, o.gpsvalid ' + 
+                                    'FROM wifiobservations o JOIN networks n ON n.id = o.networkid' + whereClause + ' ORDER BY o.time', params)
+                                    
+    def getBluetoothObservations(self, startTime=None, endTime=None, bounds=None, macAddr=None):
+        # (macaddr, name, time, rssi, lat, lon, alt, speed, gpsvalid) for each matching sighting, in time order
+        whereClause, params = self.getObservationFilter(startTime, endTime, bounds, macAddr, 'deviceid', 'btdevices')
+        
+        return self.query('SELECT d.macaddr, d.name, o.time, o.rssi, o.lat, o.lon, o.alt, o.speed, o.gpsvalid ' + 
+                                    'FROM btobservations o JOIN btdevices d ON d.id = o.deviceid' + whereClause + ' ORDER BY o.time', params)
+                                    
+    def getNetworkCount(self):
+        return self.query('SELECT COUNT(*) FROM networks', [])[0][0]
+        
+    def getBluetoothDeviceCount(self):
+        return self.query('SELECT COUNT(*) FROM btdevices', [])[0][0]
+        
+    def getSummary(self):
+        # What's in the database for the recordings catalog
+        summary = RecordingSummary()
+        summary.bssids = self.getNetworkCount()
+        summary.devices = self.getBluetoothDeviceCount()
+        
+        for curTable in ['wifiobservations', 'btobservations']:
+            rows, firstSeen, lastSeen = self.query('SELECT COUNT(*), MIN(time), MAX(time) FROM ' + curTable, [])[0]
+            summary.rows += rows
+            
+            if rows > 0:
+                summary.addTime(firstSeen)
+                summary.addTime(lastSeen)
+                
+            minLat, minLon, maxLat, maxLon = self.query('SELECT MIN(lat), MIN(lon), MAX(lat), MAX(lon) FROM ' + curTable + ' WHERE gpsvalid=1', [])[0]
+            
+            if minLat is not None:
+                summary.addPosition(minLat, minLon)
+                summary.addPosition(maxLat, maxLon)
+                
+        return summary
+        
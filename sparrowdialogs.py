@@ -20,6 +20,7 @@
 
 from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QApplication, QLabel, QComboBox, QLineEdit, QPushButton, QAbstractItemView
 from PyQt5.QtWidgets  import QFileDialog, QSpinBox, QDesktopWidget, QMessageBox, QTableWidget, QHeaderView,QTableWidgetItem,  QMenu, QAction
+from PyQt5.QtWidgets import QInputDialog, QProgressDialog
 from sparrowtablewidgets import DateTableWidgetItem, FloatTableWidgetItem, IntTableWidgetItem
 from PyQt5.QtCore import Qt,QTimer
 from PyQt5 import QtCore
@@ -28,13 +29,12 @@ from socket import *
 import datetime
 from threading import Thread, Lock
 from time import sleep
-import requests
 import json
 import re
-# import urllib
-from urllib.request import urlretrieve
 
+import gzip
 import os
+import shutil
 
 from sparrowmap import MapEngine
 from sparrowwifiagent import FileSystemFile
@@ -42,6 +42,8 @@ from sparrowbluetooth import SparrowBluetooth, BluetoothDevice
 from telemetry import BluetoothTelemetry
 from sparrowmap import MapMarker
 from wirelessengine import WirelessEngine
+from sparrowcommon import DeltaState
+from sparrowclient import agentClient
 
 # ------------------  Global File Dialogs ------------------------------
 def openFileDialog(fileSpec="CSV Files (*.csv);;All Files (*)"):    
@@ -68,7 +70,7 @@ def saveFileDialog(fileSpec="CSV Files (*.csv);;All Files (*)"):
 def makeGetRequest(url):
     try:
         # Not using a timeout can cause the request to hang indefinitely
-        response = requests.get(url, timeout=2)
+        response = agentClient.get(url, 2)
     except:
         return -1, ""
         
@@ -134,8 +136,13 @@ def stopRemoteBluetoothDiscoveryScan(agentIP, agentPort):
     else:
             return -2, 'Bad response from agent [' + str(statusCode) + ']'
 
-def getRemoteBluetoothDiscoveryStatus(agentIP, agentPort):
+def getRemoteBluetoothDiscoveryStatus(agentIP, agentPort, deltaState=None):
+    # With a DeltaState only devices added or changed since its cursor are returned and the state is updated
     url = "http://" + agentIP + ":" + str(agentPort) + "/bluetooth/discoverystatus"
+    
+    if deltaState is not None:
+        url += "?since=" + str(deltaState.getSince())
+        
     statusCode, responsestr = makeGetRequest(url)
     
     if statusCode == 200:
@@ -152,6 +159,10 @@ def getRemoteBluetoothDiscoveryStatus(agentIP, agentPort):
                     devices[newdevice.macAddress] = newdevice
                 except:
                     pass
+                    
+            if deltaState is not None:
+                devices = deltaState.mergeResponse(devices, responsedict)
+                
             return errcode, errmsg, devices
         except:
             return -1, 'Error parsing response', None
@@ -254,10 +265,183 @@ def stopRecord(agentIP, agentPort):
     else:
         return statusCode, 'Received error code: ' + str(statusCode)
         
+def startRemoteProfile(agentIP, agentPort, seconds, mode, token):
+    # Blocks until the agent finishes profiling.  Returns errcode, errmsg, the files it wrote to its recordings
+    # directory and its summary lines.
+    url = "http://" + agentIP + ":" + str(agentPort) + "/system/profile?seconds=" + str(seconds) + "&mode=" + mode
+    
+    try:
+        response = agentClient.get(url, seconds + 30, headers={'X-Sparrow-Token': token})
+    except:
+        return -1, 'Error requesting profile from agent.', [], []
+        
+    if response.status_code not in [200, 403]:
+        return response.status_code, 'Received error code: ' + str(response.status_code), [], []
+        
+    try:
+        responsedict = json.loads(response.text)
+        errcode = responsedict['errcode']
+        errmsg = responsedict['errmsg']
+    except:
+        return 1, "Error parsing response: " + response.text, [], []
+        
+    if errcode != 0:
+        return errcode, errmsg, [], []
+        
+    return 0, '', responsedict['files'], responsedict['summary'].get('top', [])
+    
+# Recording downloads are written this much at a time, and picked up again this many times if the connection drops
+DOWNLOAD_CHUNK_SIZE = 65536
+DOWNLOAD_RETRIES = 3
+# Where a download goes until it's complete.  One that's left behind is resumed next time.
+PARTIAL_EXTENSION = '.part'
+# The agent's ETag (or Last-Modified) for the file a .part came from, sent back as If-Range so a resume of a file
+# that's changed since gets the whole new file instead of its tail spliced on.
+VALIDATOR_EXTENSION = '.validator'
+
+def readValidator(validatorPath):
+    try:
+        with open(validatorPath, 'r') as f:
+            return f.read().strip()
+    except:
+        return ""
+        
+def removePartial(partPath):
+    for curPath in [partPath, partPath + VALIDATOR_EXTENSION]:
+        try:
+            os.remove(curPath)
+        except:
+            pass
+
+def getRangeTotal(contentRange):
+    # The full file size from a Content-Range header (bytes 0-99/1234 or bytes */1234), or -1
+    try:
+        return int(contentRange.split('/')[-1])
+    except:
+        return -1
+        
+def downloadRecording(url, fullPath, progressCallback=None):
+    # Streams a recording to fullPath.  It's written to fullPath.part first and if the connection drops (or a
+    # .part is already there) the rest is asked for with a Range request.  progressCallback(bytesDone, totalBytes)
+    # is called as it goes, with totalBytes -1 if it isn't known, and can return False to cancel.  The .part is kept
+    # on a cancel so the next copy resumes.  Returns errcode, errmsg.
+    partPath = fullPath + PARTIAL_EXTENSION
+    validatorPath = partPath + VALIDATOR_EXTENSION
+    errmsg = "Error downloading and saving file."
+    
+    for curTry in range(DOWNLOAD_RETRIES + 1):
+        if curTry > 0:
+            sleep(1)
+            
+        try:
+            offset = os.path.getsize(partPath)
+        except:
+            offset = 0
+            
+        headers = {}
+        if offset > 0:
+            validator = readValidator(validatorPath)
+            
+            if len(validator) == 0:
+                # Nothing to check the .part against so it can't be trusted
+                removePartial(partPath)
+                offset = 0
+            else:
+                headers['Range'] = 'bytes=' + str(offset) + '-'
+                headers['If-Range'] = validator
+                
+        try:
+            response = agentClient.get(url, headers=headers, stream=True)
+        except:
+            continue
+            
+        try:
+            if response.status_code == 416 and offset > 0:
+                # Nothing past what we have.  Either the .part is already the whole file or it's from something else.
+                if getRangeTotal(response.headers.get('Content-Range', '')) == offset:
+                    os.replace(partPath, fullPath)
+                    removePartial(partPath)
+                    return 0, ""
+                    
+                removePartial(partPath)
+                continue
+            elif response.status_code == 206:
+                mode = 'ab'
+                totalBytes = getRangeTotal(response.headers.get('Content-Range', ''))
+            elif response.status_code == 200:
+                # Whole file, whether or not we asked for a range
+                mode = 'wb'
+                offset = 0
+                try:
+                    totalBytes = int(response.headers['Content-Length'])
+                except:
+                    totalBytes = -1
+            else:
+                return response.status_code, 'Received error code: ' + str(response.status_code)
+                
+            bytesDone = offset
+            
+            try:
+                # Live recordings come without a validator and aren't resumed
+                validator = response.headers.get('ETag', response.headers.get('Last-Modified', ''))
+                if len(validator) > 0:
+                    with open(validatorPath, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validatorPath):
+                    os.remove(validatorPath)
+                    
+                with open(partPath, mode) as outfile:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        outfile.write(chunk)
+                        bytesDone += len(chunk)
+                        
+                        if (progressCallback is not None) and (not progressCallback(bytesDone, totalBytes)):
+                            return 2, "Download cancelled.  It will pick up where it left off next time."
+            except OSError as e:
+                # Local disk problem.  Trying again won't help.
+                return 1, "Unable to write " + partPath + ": " + str(e)
+            except:
+                # Connection dropped.  Go again for the rest.
+                continue
+                
+            if (totalBytes >= 0) and (bytesDone < totalBytes):
+                continue
+                
+            os.replace(partPath, fullPath)
+            removePartial(partPath)
+            return 0, ""
+        finally:
+            response.close()
+            
+    return 1, errmsg
+    
+def decompressRecording(fullPath):
+    # Agents send rotated segments as .gz.  This unzips one next to itself and removes the .gz.  Returns the new path.
+    outPath = fullPath[:-len('.gz')]
+    tmpPath = outPath + '.tmp'
+    
+    try:
+        with gzip.open(fullPath, 'rb') as infile:
+            with open(tmpPath, 'wb') as outfile:
+                shutil.copyfileobj(infile, outfile, 1048576)
+                
+        os.replace(tmpPath, outPath)
+    except:
+        try:
+            os.remove(tmpPath)
+        except:
+            pass
+            
+        raise
+        
+    os.remove(fullPath)
+    
+    return outPath
+    
 def makePostRequest(url, jsonstr):
         # use something like jsonstr = json.dumps(somestring) to get the right format
         try:
-            response = requests.post(url, data=jsonstr, timeout=2)
+            response = agentClient.post(url, jsonstr, 2)
         except:
             return -1, ""
         
@@ -409,7 +593,8 @@ class DBSettingsDialog(QDialog):
             self.dbinput.setText(fileName)
 
     def onDBChanged(self, index):
-        self.dbMode = index
+        # The combo is in the same order as the DBSettings modes
+        self.dbMode = index + DBSettings.SQLITE
         
         if index == 0:
             self.setPostgresVisible(False)
@@ -1118,6 +1303,8 @@ class BluetoothDialog(QDialog):
         self.usingRemoteAgent = useRemoteAgent
         self.remoteAgentIP = remoteAgentIP
         self.remoteAgentPort = remoteAgentPort
+        # Remote agents only send the devices that changed since the last poll
+        self.remoteDeltaState = DeltaState()
 
         self.updateWindowTitle()
 
@@ -1269,6 +1456,7 @@ class BluetoothDialog(QDialog):
         self.usingRemoteAgent = True
         self.remoteAgentIP = agentIP
         self.remoteAgentPort = agentPort
+        self.remoteDeltaState.reset()
 
         # Check if we're running local.  If so stop it
         if self.bluetooth.discoveryRunning():
@@ -1512,7 +1700,7 @@ class BluetoothDialog(QDialog):
                             else:
                                 self.bluetoothTable.item(curRow, 8).setText('Unknown')
                                 
-                            self.bluetoothTable.item(curRow, 9).setText(curDevice.lastSeen.strftime("%m/%d/%Y %H:%M:%S"))
+                            self.bluetoothTable.item(curRow, 9).setText(curDevice.getLastSeenString())
                             if (curDevice.gps.isValid):
                                 self.bluetoothTable.item(curRow,10).setText('Yes')
                             else:
@@ -1563,7 +1751,7 @@ class BluetoothDialog(QDialog):
                 else:
                     self.bluetoothTable.setItem(rowPosition, 8, FloatTableWidgetItem('Unknown'))
                     
-                self.bluetoothTable.setItem(rowPosition, 9, DateTableWidgetItem(curDevice.lastSeen.strftime("%m/%d/%Y %H:%M:%S")))
+                self.bluetoothTable.setItem(rowPosition, 9, DateTableWidgetItem(curDevice.getLastSeenString()))
                 if (curDevice.gps.isValid):
                     self.bluetoothTable.setItem(rowPosition,10, QTableWidgetItem('Yes'))
                 else:
@@ -1695,7 +1883,7 @@ class BluetoothDialog(QDialog):
                 
             outputFile.write(curData.uuid  + ',' + curData.macAddress + ',"' + curData.name + '","' + curData.company + '","' + curData.manufacturer)
             outputFile.write('","' + btType + '",' + str(curData.rssi) + ',' + str(curData.strongestRssi) + ',' + txPower + ',' + str(curData.iBeaconRange) + ',' +
-                                    curData.lastSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + 
+                                    curData.getLastSeenString() + ',' + 
                                     str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
                                     str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
             
@@ -1703,16 +1891,36 @@ class BluetoothDialog(QDialog):
         
         self.updateLock.release()
                         
+    def onStreamDevices(self, devices):
+        # Devices that changed, from the remote agent's live stream.  The agent has already GPS tagged them.
+        if (not self.usingRemoteAgent) or (not self.btnScan.isChecked()):
+            return
+            
+        # The stream has its own cursor on the agent so if it goes away polling starts over with everything
+        self.remoteDeltaState.reset()
+        
+        for curDevice in devices.values():
+            curDevice.manufacturer = self.mainWin.ouiLookup(curDevice.macAddress)
+            if curDevice.manufacturer is None:
+                curDevice.manufacturer = ''
+                
+        self.updateTable(devices)
+        
     def onBtTimer(self):
         if not self.mainWin:
             # We'll just take one shot coming in here for debug purposes.  Technically we don't need to come in here
             # if there's no main win
             return
 
+        if self.usingRemoteAgent and self.mainWin.bluetoothStreaming():
+            # Changes come in through onStreamDevices
+            self.btTimer.start(self.btTimerTimeout)
+            return
+            
         curGPS = self.mainWin.getCurrentGPS()
         
         if self.usingRemoteAgent:
-            errcode, errmsg, devices = getRemoteBluetoothDiscoveryStatus(self.remoteAgentIP, self.remoteAgentPort)
+            errcode, errmsg, devices = getRemoteBluetoothDiscoveryStatus(self.remoteAgentIP, self.remoteAgentPort, self.remoteDeltaState)
         else:
             errcode = 0
             self.bluetooth.updateDeviceList()
@@ -1736,10 +1944,10 @@ class BluetoothDialog(QDialog):
                     # This is a little bit of a hack for the BlueHydra side since it can take a while to see devices or have
                     # them show up in the db.  For LE discovery scans this will always be pretty quick.
                     if elapsedTime.total_seconds() < 120:
-                        curDevice.gps.copy(curGPS)
+                        curDevice.gps = curGPS
                         if curDevice.rssi >= curDevice.strongestRssi:
                             curDevice.strongestRssi = curDevice.rssi
-                            curDevice.strongestgps.copy(curGPS)
+                            curDevice.strongestgps = curGPS
                 
             self.updateTable(devices)
             
@@ -2163,11 +2371,14 @@ class AgentConfigDialog(QDialog):
 # ------------------  GPS Coordinate  ------------------------------
 class RemoteFilesDialog(QDialog):
     visibility = QtCore.pyqtSignal(bool)
+    # retVal, errmsg, files, summary from a profile run on its own thread
+    profileDone = QtCore.pyqtSignal(int, str, list, list)
     
     def __init__(self, mainWin, agentIP, agentPort, parent = None):
         super(RemoteFilesDialog, self).__init__(parent)
 
         self.visibility.connect(self.onVisibilityChanged)
+        self.profileDone.connect(self.onProfileDone)
         
         self.mainWin = mainWin
         
@@ -2189,6 +2400,10 @@ class RemoteFilesDialog(QDialog):
         self.btnDelete = QPushButton("&Delete", self)
         self.btnDelete.clicked.connect(self.onDeleteFiles)
         
+        self.btnProfile = QPushButton("&Profile", self)
+        self.btnProfile.setToolTip("Profile the agent.  The results are saved in the agent's recordings directory and listed here.")
+        self.btnProfile.clicked.connect(self.onProfileAgent)
+        
         self.fileTable = QTableWidget(self)
         self.fileTable.setColumnCount(3)
         self.fileTable.setShowGrid(True)
@@ -2231,6 +2446,7 @@ class RemoteFilesDialog(QDialog):
 
         self.btnCopy.setGeometry(size.width()-90, 80, 80, 30)
         self.btnDelete.setGeometry(size.width()-90, 130, 80, 30)
+        self.btnProfile.setGeometry(size.width()-90, 180, 80, 30)
 
     def setBlackoutColors(self):
         self.fileTable.setStyleSheet("background-color: black;gridline-color: white;color: white")
@@ -2318,19 +2534,50 @@ class RemoteFilesDialog(QDialog):
         recordingsDir = dirname + '/recordings'
         fullPath = recordingsDir + '/' + filename
         
-        if os.path.isfile(fullPath):
+        if filename.endswith('.gz'):
+            localPath = fullPath[:-len('.gz')]
+        else:
+            localPath = fullPath
+            
+        if os.path.isfile(localPath):
             reply = QMessageBox.question(self, 'Question',"Local file by that name already exists.  Overwrite?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
             if reply == QMessageBox.No:
-                return
+                return 0, ""
         
-        try:
-            # urllib.urlretrieve(url, fullPath)
-            urlretrieve(url, fullPath)
-            return 0, ""
-        except:
-            return 1, "Error downloading and saving file."
+        self.downloadProgress = QProgressDialog('Copying ' + filename, 'Cancel', 0, 100, self)
+        self.downloadProgress.setWindowTitle('Remote Files')
+        self.downloadProgress.setWindowModality(Qt.WindowModal)
+        self.downloadProgress.setMinimumDuration(500)
+        
+        retVal, errmsg = downloadRecording(url, fullPath, self.onDownloadProgress)
+        
+        self.downloadProgress.close()
+        self.downloadProgress = None
+        
+        if retVal != 0:
+            return retVal, errmsg
             
+        if filename.endswith('.gz'):
+            # A compressed segment.  Unzip it here so it can be imported like any other recording.
+            try:
+                decompressRecording(fullPath)
+            except:
+                return 1, "Downloaded " + filename + " but could not decompress it."
+                
+        return 0, ""
+            
+    def onDownloadProgress(self, bytesDone, totalBytes):
+        if totalBytes > 0:
+            self.downloadProgress.setValue(int(bytesDone * 100 / totalBytes))
+        else:
+            # Unknown size, just keep it moving
+            self.downloadProgress.setMaximum(0)
+            
+        QApplication.processEvents()
+        
+        return not self.downloadProgress.wasCanceled()
+        
     def onCopyFiles(self):
         filenames = self.getSelectedFilenames()
         
@@ -2342,6 +2589,10 @@ class RemoteFilesDialog(QDialog):
             
             if retVal != 0:
                 QMessageBox.question(self, 'Error',errmsg, QMessageBox.Ok)
+                
+                if retVal == 2:
+                    # Cancelled, so don't start on the rest
+                    break
 
         self.onRefreshFiles()
         
@@ -2358,6 +2609,43 @@ class RemoteFilesDialog(QDialog):
             
         self.onRefreshFiles()
         
+    def onProfileAgent(self):
+        token, ok = QInputDialog.getText(self, 'Profile Agent', "Agent's profile token:", QLineEdit.Password)
+        if not ok:
+            return
+            
+        seconds, ok = QInputDialog.getInt(self, 'Profile Agent', 'Seconds to profile:', 10, 1, 300)
+        if not ok:
+            return
+            
+        mode, ok = QInputDialog.getItem(self, 'Profile Agent', 'Mode:', ['sample', 'cprofile'], 0, False)
+        if not ok:
+            return
+            
+        # The agent doesn't answer until it's done profiling so the request goes on its own thread
+        self.btnProfile.setEnabled(False)
+        self.btnProfile.setText('Profiling...')
+        
+        profileThread = Thread(target=self.profileAgent, args=(seconds, mode, token))
+        profileThread.daemon = True
+        profileThread.start()
+        
+    def profileAgent(self, seconds, mode, token):
+        retVal, errmsg, files, summary = startRemoteProfile(self.remoteAgentIP, self.remoteAgentPort, seconds, mode, token)
+        self.profileDone.emit(retVal, errmsg, files, summary)
+        
+    def onProfileDone(self, retVal, errmsg, files, summary):
+        self.btnProfile.setText('&Profile')
+        self.btnProfile.setEnabled(True)
+        
+        if retVal != 0:
+            QMessageBox.question(self, 'Error',"Could not profile agent: " + errmsg, QMessageBox.Ok)
+            return
+            
+        QMessageBox.information(self, 'Profile Agent', 'Saved ' + ', '.join(files) + '\n\n' + '\n'.join(summary[:10]), QMessageBox.Ok)
+        
+        self.onRefreshFiles()
+        
     def populateTable(self, filelist):
         self.fileTable.setRowCount(0)
         
@@ -133,6 +133,41 @@ class SparrowGPS(object):
         self.speed = other.speed
         self.isValid = other.isValid
         
+def inlineGPSField(index):
+    # Property that reads/writes field fieldNames[index] on the view's record
+    def getField(self):
+        return getattr(self.record, self.fieldNames[index])
+        
+    def setField(self, value):
+        setattr(self.record, self.fieldNames[index], value)
+        
+    return property(getField, setField)
+    
+class SparrowGPSView(SparrowGPS):
+    # A SparrowGPS over GPS fields stored inline on a slotted record (see WirelessNetwork.gps).
+    # fieldNames are the record's latitude, longitude, altitude, speed and isValid field names.
+    # Reads and writes (including copy()) go straight through to the record.
+    __slots__ = ('record', 'fieldNames')
+    
+    latitude = inlineGPSField(0)
+    longitude = inlineGPSField(1)
+    altitude = inlineGPSField(2)
+    speed = inlineGPSField(3)
+    isValid = inlineGPSField(4)
+    
+    def __init__(self, record, fieldNames):
+        self.record = record
+        self.fieldNames = fieldNames
+        
+    def copy(self, other):
+        record = self.record
+        fieldNames = self.fieldNames
+        setattr(record, fieldNames[0], other.latitude)
+        setattr(record, fieldNames[1], other.longitude)
+        setattr(record, fieldNames[2], other.altitude)
+        setattr(record, fieldNames[3], other.speed)
+        setattr(record, fieldNames[4], other.isValid)
+        
 class GPSStatus(object):
     def __init__(self):
         super().__init__()
@@ -22,13 +22,14 @@ import os
 import subprocess
 # import sys
 import signal
-from time import sleep
+from time import sleep, monotonic
 import re
 from threading import Lock
 import datetime
 from dateutil import parser
 import json
 from sparrowcommon import BaseThreadClass
+from sparrowmetrics import LineCounter
 
 # ------------------  Ubertooth Specan scanning Thread ----------------------------------
 class HackrfSweepThread(BaseThreadClass):
@@ -88,9 +89,11 @@ class HackrfSweepThread(BaseThreadClass):
         #	fprintf(fd, "\n");
 
         iteration = 0
+        lineCounter = LineCounter('hackrf')
         
         while not hackrfsweepProc.poll() and not self.signalStop:
             dataline = hackrfsweepProc.stdout.readline().decode('ASCII').replace('\n', '')
+            parseStart = monotonic()
             
             dataline = dataline.replace(' ', '')
             data = dataline.split(',')
@@ -114,12 +117,16 @@ class HackrfSweepThread(BaseThreadClass):
                 except:
                     pass
                     
+            lineCounter.addLine(monotonic() - parseStart)
+            
             # Just give the thread a chance to release resources
             iteration += 1
             if iteration > 50000:
                 iteration = 0
                 sleep(0.01)
                 
+        lineCounter.flush()
+        
         try:
             os.kill(hackrfsweepProc.pid, signal.SIGINT)
             
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# Append-only observation journal for recordings.  Each scan adds one line with what that scan saw, so the cost of a
+# scan is the size of its results rather than everything recorded so far, and nothing already written is touched
+# again.  The file is flushed every append and fsynced every syncInterval seconds, so a crash or power cut loses at
+# most the last few seconds and a half-written last line is skipped on read.
+#
+# Layout (JSON lines):  the first line is {"class": <record class name>, "fields": [<slot names>]} and every line after
+# it a list of rows, one per record, with the values in that field order.  Records are WirelessNetwork or
+# BluetoothDevice as they stood when they were merged into the recorder's store, so replaying the lines through a
+# NetworkStore/BluetoothStore gives back the same merged list (see compactJournal in the agent).
+
+import json
+import os
+from time import monotonic
+
+JOURNAL_EXTENSION = '.journal'
+JOURNAL_SYNC_INTERVAL = 5.0  # seconds
+
+def getJournalFields(recordClass):
+    return [curField for curField in recordClass.__slots__ if curField != 'foundInList']
+    
+class ObservationJournal(object):
+    # The file isn't created until the first append, so a recording that never sees anything leaves nothing behind
+    def __init__(self, filename, recordClass, syncInterval=JOURNAL_SYNC_INTERVAL):
+        self.filename = filename
+        self.recordClass = recordClass
+        self.fields = getJournalFields(recordClass)
+        self.syncInterval = syncInterval
+        self.journalFile = None
+        self.lastSync = 0.0
+        self.unsynced = False
+        
+    def open(self):
+        newFile = (not os.path.isfile(self.filename)) or (os.path.getsize(self.filename) == 0)
+        
+        self.journalFile = open(self.filename, 'a')
+        
+        if newFile:
+            headerdict = {}
+            headerdict['class'] = self.recordClass.__name__
+            headerdict['fields'] = self.fields
+            self.journalFile.write(json.dumps(headerdict) + '\n')
+            
+        self.lastSync = monotonic()
+        
+    def append(self, records):
+        if len(records) == 0:
+            return
+            
+        if self.journalFile is None:
+            self.open()
+            
+        rows = []
+        for curRecord in records:
+            rows.append([getattr(curRecord, curField) for curField in self.fields])
+            
+        self.journalFile.write(json.dumps(rows) + '\n')
+        self.journalFile.flush()
+        self.unsynced = True
+        
+        if monotonic() - self.lastSync >= self.syncInterval:
+            self.sync()
+            
+    def sync(self):
+        if (self.journalFile is not None) and self.unsynced:
+            os.fsync(self.journalFile.fileno())
+            self.unsynced = False
+            
+        self.lastSync = monotonic()
+        
+    def getSize(self):
+        # Bytes written so far
+        if self.journalFile is None:
+            return 0
+            
+        return self.journalFile.tell()
+        
+    def close(self):
+        if self.journalFile is not None:
+            self.sync()
+            self.journalFile.close()
+            self.journalFile = None
+            
+    def remove(self):
+        self.close()
+        
+        try:
+            os.remove(self.filename)
+        except:
+            pass
+            
+def getJournalClassName(filename):
+    # The record class name from the header, or '' if the file can't be read
+    try:
+        with open(filename, 'r') as f:
+            return json.loads(f.readline())['class']
+    except:
+        return ''
+        
+def readJournal(filename, recordClass):
+    # Yields the records from each line in turn as a list.  Lines that don't parse (the tail of a crash) are skipped.
+    with open(filename, 'r') as f:
+        try:
+            headerdict = json.loads(f.readline())
+            fields = headerdict['fields']
+        except:
+            return
+            
+        knownFields = set(recordClass.__slots__)
+        
+        for curLine in f:
+            try:
+                rows = json.loads(curLine)
+            except:
+                continue
+                
+            records = []
+            for curRow in rows:
+                curRecord = recordClass()
+                for curField, curValue in zip(fields, curRow):
+                    if curField in knownFields:
+                        setattr(curRecord, curField, curValue)
+                        
+                records.append(curRecord)
+                
+            yield records
+            
@@ -0,0 +1,368 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# In-process metrics for the agent, served by /system/metrics as Prometheus text or JSON.  Everything registers in
+# the one MetricsRegistry (metrics) when its module loads:
+#   - Histogram: fixed buckets, observe() is a bisect and a few adds under the histogram's lock
+#   - Counter: a running total, incremented as things happen
+#   - Gauge: a function called when the metrics are read, so nothing is tracked between reads
+# Each can have labels.  Label values are passed as a tuple in the same order as labelNames.
+# TimedLock is a drop-in Lock that records how long callers waited for it when it was already held.
+
+import json
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+# Seconds.  From a lock wait on up to a full hunt sweep.
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+METRIC_COUNTER = 'counter'
+METRIC_GAUGE = 'gauge'
+METRIC_HISTOGRAM = 'histogram'
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    elif isinstance(value, int):
+        return str(value)
+    else:
+        return repr(float(value))
+        
+def formatLabels(labelNames, labelValues, extra=None):
+    labelList = []
+    for curName, curValue in zip(labelNames, labelValues):
+        curValue = str(curValue).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labelList.append(curName + '="' + curValue + '"')
+        
+    if extra is not None:
+        labelList.append(extra)
+        
+    if len(labelList) == 0:
+        return ''
+        
+    return '{' + ','.join(labelList) + '}'
+    
+# ------------------  Metric types  ------------------------------
+class Counter(object):
+    def __init__(self, name, helpText, labelNames=()):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = tuple(labelNames)
+        self.metricType = METRIC_COUNTER
+        self.series = {}  # label values -> total
+        self.lock = Lock()
+        
+    def inc(self, amount=1, labelValues=()):
+        self.lock.acquire()
+        self.series[labelValues] = self.series.get(labelValues, 0) + amount
+        self.lock.release()
+        
+    def getSeries(self):
+        self.lock.acquire()
+        retVal = dict(self.series)
+        self.lock.release()
+        
+        return retVal
+        
+    def toPrometheus(self):
+        lines = []
+        for curLabels, curValue in self.getSeries().items():
+            lines.append(self.name + formatLabels(self.labelNames, curLabels) + ' ' + formatValue(curValue))
+            
+        return lines
+        
+    def toJsondict(self):
+        seriesList = []
+        for curLabels, curValue in self.getSeries().items():
+            seriesList.append({'labels': dict(zip(self.labelNames, curLabels)), 'value': curValue})
+            
+        return seriesList
+        
+class Gauge(object):
+    # valueFunc returns the value, or a dict of label values -> value when there are labels
+    def __init__(self, name, helpText, valueFunc, labelNames=()):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = tuple(labelNames)
+        self.metricType = METRIC_GAUGE
+        self.valueFunc = valueFunc
+        
+    def getSeries(self):
+        try:
+            value = self.valueFunc()
+        except:
+            return {}
+            
+        if isinstance(value, dict):
+            return value
+        else:
+            return {(): value}
+            
+    def toPrometheus(self):
+        lines = []
+        for curLabels, curValue in self.getSeries().items():
+            lines.append(self.name + formatLabels(self.labelNames, curLabels) + ' ' + formatValue(curValue))
+            
+        return lines
+        
+    def toJsondict(self):
+        seriesList = []
+        for curLabels, curValue in self.getSeries().items():
+            seriesList.append({'labels': dict(zip(self.labelNames, curLabels)), 'value': curValue})
+            
+        return seriesList
+        
+class HistogramSeries(object):
+    def __init__(self, numBuckets):
+        # One past the buckets for +Inf.  Not cumulative, that's done when they're read.
+        self.bucketCounts = [0] * (numBuckets + 1)
+        self.count = 0
+        self.total = 0.0
+        
+class Histogram(object):
+    def __init__(self, name, helpText, labelNames=(), buckets=None):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = tuple(labelNames)
+        self.metricType = METRIC_HISTOGRAM
+        
+        if buckets is None:
+            self.buckets = list(LATENCY_BUCKETS)
+        else:
+            self.buckets = sorted(buckets)
+            
+        self.series = {}  # label values -> HistogramSeries
+        self.lock = Lock()
+        
+    def observe(self, value, labelValues=()):
+        bucketIndex = bisect_left(self.buckets, value)
+        
+        self.lock.acquire()
+        curSeries = self.series.get(labelValues)
+        if curSeries is None:
+            curSeries = HistogramSeries(len(self.buckets))
+            self.series[labelValues] = curSeries
+            
+        curSeries.bucketCounts[bucketIndex] += 1
+        curSeries.count += 1
+        curSeries.total += value
+        self.lock.release()
+        
+    def getSeries(self):
+        # label values -> (cumulative bucket counts, count, sum)
+        retVal = {}
+        
+        self.lock.acquire()
+        for curLabels, curSeries in self.series.items():
+            cumulative = []
+            runningCount = 0
+            for curCount in curSeries.bucketCounts:
+                runningCount += curCount
+                cumulative.append(runningCount)
+                
+            retVal[curLabels] = (cumulative, curSeries.count, curSeries.total)
+        self.lock.release()
+        
+        return retVal
+        
+    def toPrometheus(self):
+        lines = []
+        bounds = self.buckets + [float('inf')]
+        
+        for curLabels, (cumulative, count, total) in self.getSeries().items():
+            for curBound, curCount in zip(bounds, cumulative):
+                lines.append(self.name + '_bucket' + formatLabels(self.labelNames, curLabels, 'le="' + formatValue(curBound) + '"') + ' ' + str(curCount))
+                
+            lines.append(self.name + '_sum' + formatLabels(self.labelNames, curLabels) + ' ' + formatValue(total))
+            lines.append(self.name + '_count' + formatLabels(self.labelNames, curLabels) + ' ' + str(count))
+            
+        return lines
+        
+    def toJsondict(self):
+        seriesList = []
+        
+        for curLabels, (cumulative, count, total) in self.getSeries().items():
+            dictjson = {}
+            dictjson['labels'] = dict(zip(self.labelNames, curLabels))
+            dictjson['count'] = count
+            dictjson['sum'] = total
+            if count > 0:
+                dictjson['mean'] = total / count
+            else:
+                dictjson['mean'] = 0.0
+            # Upper bound -> count at or under it, like the Prometheus buckets.  The last one is +Inf.
+            dictjson['buckets'] = [[curBound, curCount] for curBound, curCount in zip(self.buckets + ['+Inf'], cumulative)]
+            seriesList.append(dictjson)
+            
+        return seriesList
+        
+# ------------------  Registry  ------------------------------
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = {}  # name -> metric, in the order they were added
+        self.lock = Lock()
+        
+    def register(self, metric):
+        # Returns the metric already registered under the name if there is one, so modules can be reloaded
+        self.lock.acquire()
+        if metric.name in self.metrics:
+            metric = self.metrics[metric.name]
+        else:
+            self.metrics[metric.name] = metric
+        self.lock.release()
+        
+        return metric
+        
+    def counter(self, name, helpText, labelNames=()):
+        return self.register(Counter(name, helpText, labelNames))
+        
+    def gauge(self, name, helpText, valueFunc, labelNames=()):
+        return self.register(Gauge(name, helpText, valueFunc, labelNames))
+        
+    def histogram(self, name, helpText, labelNames=(), buckets=None):
+        return self.register(Histogram(name, helpText, labelNames, buckets))
+        
+    def getMetrics(self):
+        self.lock.acquire()
+        retVal = list(self.metrics.values())
+        self.lock.release()
+        
+        return retVal
+        
+    def toPrometheus(self):
+        # Text exposition format 0.0.4
+        lines = []
+        
+        for curMetric in self.getMetrics():
+            lines.append('# HELP ' + curMetric.name + ' ' + curMetric.helpText.replace('\\', '\\\\').replace('\n', '\\n'))
+            lines.append('# TYPE ' + curMetric.name + ' ' + curMetric.metricType)
+            lines += curMetric.toPrometheus()
+            
+        return '\n'.join(lines) + '\n'
+        
+    def toJsondict(self):
+        dictjson = {}
+        
+        for curMetric in self.getMetrics():
+            metricdict = {}
+            metricdict['type'] = curMetric.metricType
+            metricdict['help'] = curMetric.helpText
+            metricdict['series'] = curMetric.toJsondict()
+            dictjson[curMetric.name] = metricdict
+            
+        return dictjson
+        
+    def toJson(self):
+        return json.dumps(self.toJsondict())
+        
+# The one registry everything shares
+metrics = MetricsRegistry()
+
+lockAcquires = metrics.counter('sparrow_lock_acquires_total', 'Times a TimedLock was acquired', ('lock',))
+lockContended = metrics.counter('sparrow_lock_contended_total', 'Acquires that had to wait because the lock was held', ('lock',))
+lockWait = metrics.histogram('sparrow_lock_wait_seconds', 'Time spent waiting for a lock that was held', ('lock',))
+
+parsedLines = metrics.counter('sparrow_parsed_lines_total', 'Lines read from tools streaming output (hackrf_sweep, ubertooth-specan, btmon)', ('source',))
+parseSeconds = metrics.counter('sparrow_parse_seconds_total', 'Time spent parsing those lines', ('source',))
+
+# ------------------  Line counter  ------------------------------
+class LineCounter(object):
+    # For a thread reading a tool's output a line at a time.  Tallies lines and parse time locally and adds them to
+    # the shared counters every flushLines lines, so a fast sweep doesn't take the counter lock per line.
+    def __init__(self, source, flushLines=500):
+        self.labelValues = (source,)
+        self.flushLines = flushLines
+        self.lines = 0
+        self.parseTime = 0.0
+        
+    def addLine(self, parseTime):
+        self.lines += 1
+        self.parseTime += parseTime
+        
+        if self.lines >= self.flushLines:
+            self.flush()
+            
+    def flush(self):
+        if self.lines > 0:
+            parsedLines.inc(self.lines, self.labelValues)
+            parseSeconds.inc(self.parseTime, self.labelValues)
+            
+        self.lines = 0
+        self.parseTime = 0.0
+        
+# ------------------  Timed lock  ------------------------------
+class TimedLock(object):
+    # Lock that records waits under lockName.  An uncontended acquire costs one extra try and a counter.
+    def __init__(self, lockName):
+        self.lock = Lock()
+        self.labelValues = (lockName,)
+        
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            lockAcquires.inc(1, self.labelValues)
+            return True
+            
+        if not blocking:
+            return False
+            
+        startTime = monotonic()
+        retVal = self.lock.acquire(True, timeout)
+        lockWait.observe(monotonic() - startTime, self.labelValues)
+        lockContended.inc(1, self.labelValues)
+        
+        if retVal:
+            lockAcquires.inc(1, self.labelValues)
+            
+        return retVal
+        
+    def release(self):
+        self.lock.release()
+        
+    def locked(self):
+        return self.lock.locked()
+        
+    def __enter__(self):
+        self.acquire()
+        return self
+        
+    def __exit__(self, excType, excValue, tb):
+        self.release()
+        
+# ------------------  Byte counting writer  ------------------------------
+class ByteCountingWriter(object):
+    # Wraps a wfile and counts what's written to it
+    def __init__(self, rawfile):
+        self.rawfile = rawfile
+        self.bytesWritten = 0
+        
+    def write(self, data):
+        retVal = self.rawfile.write(data)
+        self.bytesWritten += len(data)
+        return retVal
+        
+    def flush(self):
+        self.rawfile.flush()
+        
+    @property
+    def closed(self):
+        return getattr(self.rawfile, 'closed', False)
+        
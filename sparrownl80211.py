@@ -0,0 +1,724 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# Pure python nl80211 (generic netlink) scan backend.  This talks to the kernel directly
+# rather than forking iw and parsing its text output.  The decoder fills in WirelessNetwork
+# objects with the same values the iw text parser would produce for the same scan.
+#
+# Offline testing: python3 sparrownl80211.py --replay <capture file>
+# A capture file can be recorded from a live scan with: python3 sparrownl80211.py --interface wlan0 --capture <file>
+# Add --dump to capture the kernel's BSS cache instead (what hybrid scan mode reads between scans).
+
+import os
+import socket
+import struct
+import datetime
+import argparse
+from threading import Lock
+
+# wirelessengine imports this module, so only reference it at call time
+import wirelessengine
+
+# ------------------  Netlink / nl80211 definitions ------------------------------
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLA_TYPE_MASK = 0x3FFF
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_SCAN = 32
+NL80211_CMD_TRIGGER_SCAN = 33
+NL80211_CMD_NEW_SCAN_RESULTS = 34
+NL80211_CMD_SCAN_ABORTED = 35
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_SCAN_FREQUENCIES = 44
+NL80211_ATTR_SCAN_SSIDS = 45
+NL80211_ATTR_BSS = 47
+
+NL80211_IFTYPE_MONITOR = 6
+
+NL80211_BSS_BSSID = 1
+NL80211_BSS_FREQUENCY = 2
+NL80211_BSS_CAPABILITY = 5
+NL80211_BSS_INFORMATION_ELEMENTS = 6
+NL80211_BSS_SIGNAL_MBM = 7
+NL80211_BSS_SEEN_MS_AGO = 10
+NL80211_BSS_BEACON_IES = 11
+
+# Information element IDs
+IE_SSID = 0
+IE_DS_PARAMETER = 3
+IE_RSN = 48
+IE_HT_OPERATION = 61
+IE_VHT_OPERATION = 192
+IE_VENDOR = 221
+
+NL80211_CAPTURE_HEADER = '# sparrow-wifi nl80211 capture'
+
+# Names as iw prints them so the decoded values match what the iw text parser stores
+cipherNames = {}
+cipherNames[b'\x00\x0f\xac'] = {0: 'Use group cipher suite', 1: 'WEP-40', 2: 'TKIP', 4: 'CCMP', 5: 'WEP-104', 6: 'AES-128-CMAC',
+                                                7: 'NO-GROUP', 8: 'GCMP', 9: 'GCMP-256', 10: 'CCMP-256', 11: 'BIP-GMAC-128', 12: 'BIP-GMAC-256', 13: 'BIP-CMAC-256'}
+cipherNames[b'\x00\x50\xf2'] = {0: 'Use group cipher suite', 1: 'WEP-40', 2: 'TKIP', 4: 'CCMP', 5: 'WEP-104'}
+
+authNames = {}
+authNames[b'\x00\x0f\xac'] = {1: 'IEEE 802.1X', 2: 'PSK', 3: 'FT/IEEE 802.1X', 4: 'FT/PSK', 5: 'IEEE 802.1X/SHA-256', 6: 'PSK/SHA-256', 7: 'TDLS/TPK',
+                                            8: 'SAE', 9: 'FT/SAE', 11: 'IEEE 802.1X/SUITE-B', 12: 'IEEE 802.1X/SUITE-B-192', 13: 'FT/IEEE 802.1X/SHA-384',
+                                            14: 'FILS/SHA-256', 15: 'FILS/SHA-384', 16: 'FT/FILS/SHA-256', 17: 'FT/FILS/SHA-384', 18: 'OWE'}
+authNames[b'\x00\x50\xf2'] = {1: 'IEEE 802.1X', 2: 'PSK'}
+authNames[b'\x50\x6f\x9a'] = {1: 'OSEN', 2: 'DPP'}
+
+htSecondaryOffset = ['no', 'above', '[reserved!]', 'below']
+
+# VHT operation channel width -> bandwidth the iw text parser ends up with
+# (0 is printed as '20 or 40 MHz' and 3 as '80+80 MHz')
+vhtChannelWidths = {0: 40, 1: 80, 2: 160, 3: 80}
+
+# Family and scan multicast group IDs don't change while the system is up
+nl80211FamilyId = None
+nl80211ScanGroupId = None
+nl80211FamilyLock = Lock()
+
+class NL80211Error(Exception):
+    # Raised when nl80211 can't be used at all (no netlink, no nl80211 family).  Callers fall back to iw.
+    pass
+
+# ------------------  Attribute helpers ------------------------------
+def nlaAlign(length):
+    return (length + 3) & ~3
+
+def packAttr(attrType, data):
+    attrLen = 4 + len(data)
+    return struct.pack('=HH', attrLen, attrType) + data + b'\x00' * (nlaAlign(attrLen) - attrLen)
+
+def packU32Attr(attrType, value):
+    return packAttr(attrType, struct.pack('=I', value))
+
+def parseAttrs(data):
+    # Returns a dict of attribute type -> payload.  Repeated types keep the last one, as libnl does.
+    retVal = {}
+
+    for attrType, payload in iterAttrs(data):
+        retVal[attrType] = payload
+
+    return retVal
+
+def iterAttrs(data):
+    pos = 0
+    dataLen = len(data)
+
+    while pos + 4 <= dataLen:
+        attrLen, attrType = struct.unpack_from('=HH', data, pos)
+
+        if attrLen < 4 or pos + attrLen > dataLen:
+            break
+
+        yield attrType & NLA_TYPE_MASK, data[pos+4:pos+attrLen]
+        pos += nlaAlign(attrLen)
+
+def getU16(data):
+    return struct.unpack_from('=H', data)[0]
+
+def getU32(data):
+    return struct.unpack_from('=I', data)[0]
+
+def getS32(data):
+    return struct.unpack_from('=i', data)[0]
+
+def iterMessages(buf):
+    # Splits a receive buffer into (type, flags, seq, payload) tuples
+    pos = 0
+    bufLen = len(buf)
+
+    while pos + 16 <= bufLen:
+        msgLen, msgType, msgFlags, msgSeq, msgPid = struct.unpack_from('=IHHII', buf, pos)
+
+        if msgLen < 16 or pos + msgLen > bufLen:
+            break
+
+        yield msgType, msgFlags, msgSeq, buf[pos:pos+msgLen]
+        pos += nlaAlign(msgLen)
+
+# ------------------  Information element decoder ------------------------------
+def escapeSSID(ssid):
+    # Same escaping iw uses when it prints an SSID
+    retVal = ''
+    ssidLen = len(ssid)
+
+    for i in range(0, ssidLen):
+        curByte = ssid[i]
+
+        if curByte > 0x20 and curByte < 0x7f and curByte != 0x5c:
+            retVal += chr(curByte)
+        elif curByte == 0x20 and i != 0 and i != ssidLen - 1:
+            retVal += ' '
+        else:
+            retVal += '\\x%.2x' % curByte
+
+    return retVal
+
+def getSuiteName(names, suite):
+    suiteTable = names.get(suite[:3])
+
+    if suiteTable is not None:
+        suiteName = suiteTable.get(suite[3])
+        if suiteName is not None:
+            return suiteName
+
+    return '%.2x-%.2x-%.2x:%d' % (suite[0], suite[1], suite[2], suite[3])
+
+def decodeRSN(curNetwork, data, defaultCipher, defaultAuth):
+    # RSN and WPA share a layout after the version field.  Missing trailing fields mean the defaults.
+    data = data[2:]
+
+    if len(data) < 4:
+        curNetwork.privacy = defaultCipher
+        curNetwork.cipher = defaultCipher
+        return
+
+    data = data[4:]
+
+    if len(data) < 2:
+        curNetwork.privacy = defaultCipher
+        curNetwork.cipher = defaultCipher
+        return
+
+    count = getU16(data)
+    if 2 + count * 4 > len(data):
+        return
+
+    if count > 0:
+        ciphers = []
+        for i in range(0, count):
+            ciphers.append(getSuiteName(cipherNames, data[2+i*4:6+i*4]))
+
+        curNetwork.privacy = '/'.join(ciphers).replace(' ', '/')
+        curNetwork.cipher = curNetwork.privacy
+
+    data = data[2+count*4:]
+
+    if len(data) < 2:
+        curNetwork.security = defaultAuth
+        return
+
+    count = getU16(data)
+    if 2 + count * 4 > len(data):
+        return
+
+    if count > 0:
+        suites = []
+        for i in range(0, count):
+            suites.append(getSuiteName(authNames, data[2+i*4:6+i*4]))
+
+        curNetwork.security = ' '.join(suites)
+
+def decodeIEs(curNetwork, ieData):
+    # Walks the information elements in order.  Later elements override earlier ones the same way
+    # later lines do in the iw output (e.g. HT operation primary channel over DS parameter set).
+    pos = 0
+    ieLen = len(ieData)
+
+    while pos + 2 <= ieLen:
+        eid = ieData[pos]
+        elen = ieData[pos+1]
+
+        if pos + 2 + elen > ieLen:
+            break
+
+        data = ieData[pos+2:pos+2+elen]
+        pos += 2 + elen
+
+        if eid == IE_SSID:
+            if elen > 32:
+                # iw prints the raw bytes for oversized SSIDs and the parser picks that up as the name
+                ssid = '<invalid: %d bytes:' % elen + ''.join(' %.02x' % curByte for curByte in data) + '>'
+            else:
+                ssid = escapeSSID(data)
+
+            if len(ssid) > 0:
+                curNetwork.ssid = wirelessengine.WirelessEngine.convertUnknownToString(ssid)
+        elif eid == IE_DS_PARAMETER:
+            if elen == 1:
+                curNetwork.channel = data[0]
+        elif eid == IE_HT_OPERATION:
+            if elen == 22:
+                curNetwork.channel = data[0]
+                curNetwork.secondaryChannelLocation = htSecondaryOffset[data[1] & 0x03]
+                if curNetwork.secondaryChannelLocation == 'above':
+                    curNetwork.secondaryChannel = curNetwork.channel + 4
+                elif curNetwork.secondaryChannelLocation == 'below':
+                    curNetwork.secondaryChannel = curNetwork.channel - 4
+        elif eid == IE_VHT_OPERATION:
+            if elen >= 5:
+                if data[0] in vhtChannelWidths:
+                    curNetwork.bandwidth = vhtChannelWidths[data[0]]
+
+                curNetwork.thirdChannel = data[1]
+        elif eid == IE_RSN:
+            if elen >= 2:
+                decodeRSN(curNetwork, data, 'CCMP', 'IEEE 802.1X')
+        elif eid == IE_VENDOR:
+            # Microsoft OUI type 1 is the original WPA element
+            if elen >= 6 and data[:4] == b'\x00\x50\xf2\x01':
+                decodeRSN(curNetwork, data[4:], 'TKIP', 'IEEE 802.1X')
+
+def decodeCapability(curNetwork, capability):
+    # iw prints the capability flags in bit order (ESS IBSS CfPollable CfPollReq Privacy ...), and the
+    # text parser looks for 'ESS Privacy' / 'IBSS Privacy', so privacy only counts if nothing is printed in between.
+    if capability & 0x0001:
+        curNetwork.mode = "AP"
+        if (capability & 0x001F) == 0x0011:
+            curNetwork.security = "WEP"
+            curNetwork.privacy = "WEP"
+    elif capability & 0x0002:
+        curNetwork.mode = "Ad Hoc"
+        curNetwork.security = "[Ad-Hoc] Open"
+        if (capability & 0x001E) == 0x0012:
+            curNetwork.security = "[Ad-Hoc] WEP"
+            curNetwork.privacy = "WEP"
+
+def decodeBSS(bssData, now=None):
+    # Decodes a nested NL80211_ATTR_BSS into a WirelessNetwork.  Returns None if there's no BSSID.
+    bss = parseAttrs(bssData)
+
+    if NL80211_BSS_BSSID not in bss:
+        return None
+
+    if now is None:
+        now = datetime.datetime.now()
+
+    curNetwork = wirelessengine.WirelessNetwork()
+    curNetwork.lastSeen = now
+    curNetwork.firstSeen = now
+    curNetwork.macAddr = ':'.join('%02x' % curByte for curByte in bss[NL80211_BSS_BSSID][:6])
+
+    if NL80211_BSS_FREQUENCY in bss:
+        curNetwork.frequency = getU32(bss[NL80211_BSS_FREQUENCY])
+
+    if NL80211_BSS_CAPABILITY in bss:
+        decodeCapability(curNetwork, getU16(bss[NL80211_BSS_CAPABILITY]))
+
+    if NL80211_BSS_SIGNAL_MBM in bss:
+        # mBm -> dBm, truncated toward zero the way iw prints it
+        curNetwork.signal = int(getS32(bss[NL80211_BSS_SIGNAL_MBM]) / 100)
+        curNetwork.strongestsignal = curNetwork.signal
+
+    if NL80211_BSS_SEEN_MS_AGO in bss:
+        wirelessengine.WirelessEngine.setLastSeenAge(curNetwork, getU32(bss[NL80211_BSS_SEEN_MS_AGO]))
+
+    if NL80211_BSS_INFORMATION_ELEMENTS in bss:
+        decodeIEs(curNetwork, bss[NL80211_BSS_INFORMATION_ELEMENTS])
+    elif NL80211_BSS_BEACON_IES in bss:
+        decodeIEs(curNetwork, bss[NL80211_BSS_BEACON_IES])
+
+    return curNetwork
+
+def decodeScanMessage(msg, now=None):
+    # msg is a full netlink message (header included) from a GET_SCAN dump.  Returns a WirelessNetwork or None.
+    if len(msg) < 20:
+        return None
+
+    cmd = msg[16]
+
+    if cmd != NL80211_CMD_NEW_SCAN_RESULTS:
+        return None
+
+    attrs = parseAttrs(msg[20:])
+
+    if NL80211_ATTR_BSS not in attrs:
+        return None
+
+    return decodeBSS(attrs[NL80211_ATTR_BSS], now)
+
+def decodeScanMessages(messages, now=None):
+    # Same return format as WirelessEngine.parseIWoutput
+    retVal = {}
+
+    if now is None:
+        now = datetime.datetime.now()
+
+    for curMsg in messages:
+        if len(curMsg) < 20:
+            continue
+
+        msgType = struct.unpack_from('=H', curMsg, 4)[0]
+
+        if msgType in [NLMSG_NOOP, NLMSG_ERROR, NLMSG_DONE, GENL_ID_CTRL]:
+            continue
+
+        try:
+            curNetwork = decodeScanMessage(curMsg, now)
+        except:
+            # Truncated or corrupt message
+            curNetwork = None
+
+        # Same incomplete-data check as the iw parser
+        if curNetwork is not None and curNetwork.channel > 0:
+            retVal[curNetwork.getKey()] = curNetwork
+
+    return retVal
+
+# ------------------  Capture files ------------------------------
+def saveCapture(filename, messages):
+    try:
+        with open(filename, 'w') as f:
+            f.write(NL80211_CAPTURE_HEADER + '\n')
+            for curMsg in messages:
+                f.write(curMsg.hex() + '\n')
+
+        return True
+    except:
+        return False
+
+def loadCapture(filename):
+    # One raw netlink message per line as hex.  Lines starting with # are comments.
+    messages = []
+
+    with open(filename, 'r') as f:
+        for curLine in f:
+            curLine = curLine.strip()
+            if len(curLine) == 0 or curLine.startswith('#'):
+                continue
+
+            messages.append(bytes.fromhex(curLine))
+
+    return messages
+
+def replayCapture(filename):
+    return decodeScanMessages(loadCapture(filename))
+
+# ------------------  Netlink socket ------------------------------
+class NL80211Socket(object):
+    def __init__(self, timeout=30.0):
+        # Raw received messages are appended here when it's a list (see --capture)
+        self.capture = None
+        self.seq = 0
+
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+            self.sock.bind((0, 0))
+            self.sock.settimeout(timeout)
+        except Exception as e:
+            raise NL80211Error('Unable to open a generic netlink socket: ' + str(e))
+
+        self.familyId, self.scanGroupId = self.resolveFamily()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
+
+    def send(self, msgType, flags, cmd, attrData=b''):
+        self.seq += 1
+        payload = struct.pack('=BBH', cmd, 1, 0) + attrData
+        self.sock.send(struct.pack('=IHHII', 16 + len(payload), msgType, flags, self.seq, 0) + payload)
+        return self.seq
+
+    def recvMessages(self):
+        buf = self.sock.recv(131072)
+
+        for msgType, msgFlags, msgSeq, msg in iterMessages(buf):
+            if self.capture is not None:
+                self.capture.append(msg)
+
+            yield msgType, msgFlags, msgSeq, msg
+
+    def request(self, cmd, attrData=b'', dump=False):
+        # Sends a request and returns (error, [messages]).  error is 0 or a negative errno as the kernel reports it.
+        flags = NLM_F_REQUEST | NLM_F_ACK
+        if dump:
+            flags |= NLM_F_DUMP
+
+        seq = self.send(self.familyId, flags, cmd, attrData)
+        messages = []
+
+        while True:
+            for msgType, msgFlags, msgSeq, msg in self.recvMessages():
+                if msgSeq != seq:
+                    # Multicast events (seq 0) and stale replies
+                    continue
+
+                if msgType == NLMSG_ERROR:
+                    return getS32(msg[16:20]), messages
+                elif msgType == NLMSG_DONE:
+                    return 0, messages
+                elif msgType == self.familyId:
+                    messages.append(msg)
+                    if not (msgFlags & NLM_F_MULTI) and not dump:
+                        return 0, messages
+
+    def resolveFamily(self):
+        global nl80211FamilyId
+        global nl80211ScanGroupId
+
+        nl80211FamilyLock.acquire()
+
+        try:
+            if nl80211FamilyId is None:
+                seq = self.send(GENL_ID_CTRL, NLM_F_REQUEST, CTRL_CMD_GETFAMILY, packAttr(CTRL_ATTR_FAMILY_NAME, b'nl80211\x00'))
+                familyAttrs = None
+
+                while familyAttrs is None:
+                    for msgType, msgFlags, msgSeq, msg in self.recvMessages():
+                        if msgSeq != seq:
+                            continue
+
+                        if msgType == NLMSG_ERROR:
+                            raise NL80211Error('nl80211 is not available (' + str(getS32(msg[16:20])) + ')')
+
+                        familyAttrs = parseAttrs(msg[20:])
+
+                scanGroupId = None
+                if CTRL_ATTR_MCAST_GROUPS in familyAttrs:
+                    for grpType, grpData in iterAttrs(familyAttrs[CTRL_ATTR_MCAST_GROUPS]):
+                        grpAttrs = parseAttrs(grpData)
+                        if grpAttrs.get(CTRL_ATTR_MCAST_GRP_NAME, b'').rstrip(b'\x00') == b'scan':
+                            scanGroupId = getU32(grpAttrs[CTRL_ATTR_MCAST_GRP_ID])
+
+                nl80211FamilyId = getU16(familyAttrs[CTRL_ATTR_FAMILY_ID])
+                nl80211ScanGroupId = scanGroupId
+        except NL80211Error:
+            raise
+        except Exception as e:
+            raise NL80211Error('Unable to resolve the nl80211 family: ' + str(e))
+        finally:
+            nl80211FamilyLock.release()
+
+        return nl80211FamilyId, nl80211ScanGroupId
+
+    def joinScanGroup(self):
+        if self.scanGroupId is None:
+            raise NL80211Error('nl80211 scan multicast group not found')
+
+        self.sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, self.scanGroupId)
+
+    def waitForScan(self, ifIndex):
+        # Returns True when the scan finished, False if it was aborted
+        while True:
+            for msgType, msgFlags, msgSeq, msg in self.recvMessages():
+                if msgType != self.familyId or len(msg) < 20:
+                    continue
+
+                cmd = msg[16]
+                if cmd not in [NL80211_CMD_NEW_SCAN_RESULTS, NL80211_CMD_SCAN_ABORTED]:
+                    continue
+
+                attrs = parseAttrs(msg[20:])
+                if NL80211_ATTR_IFINDEX in attrs and getU32(attrs[NL80211_ATTR_IFINDEX]) != ifIndex:
+                    continue
+
+                return cmd == NL80211_CMD_NEW_SCAN_RESULTS
+
+# ------------------  Scanner ------------------------------
+class NL80211Scanner(object):
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        # Set to a list to record every message received (see saveCapture)
+        self.capture = None
+
+    def available():
+        # True if this system has a usable nl80211 family
+        try:
+            nlSocket = NL80211Socket()
+            nlSocket.close()
+            return True
+        except:
+            return False
+
+    def getErrString(err):
+        # Same text iw prints so WirelessEngine.getScanErrString treats both backends the same way
+        try:
+            errText = os.strerror(-err)
+        except:
+            errText = 'Unknown error'
+
+        return 'command failed: ' + errText + ' (' + str(err) + ')'
+
+    def openSocket(self):
+        nlSocket = NL80211Socket(self.timeout)
+        nlSocket.capture = self.capture
+        return nlSocket
+
+    def scan(self, interfaceName, frequency=0):
+        # Returns retCode, errString, networks dict like WirelessEngine.scanForNetworks.
+        # frequency can be a single frequency or a list to scan in one request (0 scans everything).
+        # retCode uses iw's exit codes (256 - errno) and errString is the message iw would print,
+        # so WirelessEngine.getScanErrString handles busy/down/permission the same way for both backends.
+        # Raises NL80211Error if nl80211 itself can't be used.
+        try:
+            ifIndex = socket.if_nametoindex(interfaceName)
+        except OSError:
+            # ENODEV, as iw would report
+            return 237, NL80211Scanner.getErrString(-19), {}
+
+        nlSocket = self.openSocket()
+
+        try:
+            nlSocket.joinScanGroup()
+
+            attrData = packU32Attr(NL80211_ATTR_IFINDEX, ifIndex)
+            # A single wildcard SSID makes this an active scan like 'iw scan'
+            attrData += packAttr(NL80211_ATTR_SCAN_SSIDS, packAttr(1, b''))
+            frequencyList = wirelessengine.WirelessEngine.getFrequencyList(frequency)
+            if len(frequencyList) > 0:
+                freqData = b''
+                for i in range(0, len(frequencyList)):
+                    freqData += packU32Attr(i + 1, frequencyList[i])
+
+                attrData += packAttr(NL80211_ATTR_SCAN_FREQUENCIES, freqData)
+
+            err, messages = nlSocket.request(NL80211_CMD_TRIGGER_SCAN, attrData)
+
+            if err != 0:
+                return err & 0xFF, NL80211Scanner.getErrString(err), {}
+
+            if not nlSocket.waitForScan(ifIndex):
+                return wirelessengine.WirelessNetwork.ERR_DEVICEBUSY, 'scan aborted!', {}
+
+            return self.getScanResults(nlSocket, ifIndex)
+        except socket.timeout:
+            return 146, NL80211Scanner.getErrString(-110), {}
+        finally:
+            nlSocket.close()
+
+    def dump(self, interfaceName):
+        # Reads the kernel's BSS cache without triggering a scan (same as 'iw dev <interface> scan dump')
+        try:
+            ifIndex = socket.if_nametoindex(interfaceName)
+        except OSError:
+            return 237, NL80211Scanner.getErrString(-19), {}
+
+        nlSocket = self.openSocket()
+
+        try:
+            return self.getScanResults(nlSocket, ifIndex)
+        except socket.timeout:
+            return 146, NL80211Scanner.getErrString(-110), {}
+        finally:
+            nlSocket.close()
+
+    def getScanResults(self, nlSocket, ifIndex):
+        err, messages = nlSocket.request(NL80211_CMD_GET_SCAN, packU32Attr(NL80211_ATTR_IFINDEX, ifIndex), dump=True)
+
+        if err != 0:
+            return err & 0xFF, NL80211Scanner.getErrString(err), {}
+
+        return 0, "", decodeScanMessages(messages)
+
+    def getInterfaceList(self):
+        # Returns a list of (name, iftype, mac) for every wireless interface
+        nlSocket = self.openSocket()
+
+        try:
+            err, messages = nlSocket.request(NL80211_CMD_GET_INTERFACE, dump=True)
+        finally:
+            nlSocket.close()
+
+        retVal = []
+
+        for curMsg in messages:
+            attrs = parseAttrs(curMsg[20:])
+            if NL80211_ATTR_IFNAME not in attrs:
+                continue
+
+            ifName = attrs[NL80211_ATTR_IFNAME].rstrip(b'\x00').decode('ASCII')
+            ifType = getU32(attrs[NL80211_ATTR_IFTYPE]) if NL80211_ATTR_IFTYPE in attrs else 0
+            macAddr = ''
+            if NL80211_ATTR_MAC in attrs:
+                macAddr = ':'.join('%02x' % curByte for curByte in attrs[NL80211_ATTR_MAC][:6])
+
+            retVal.append((ifName, ifType, macAddr))
+
+        return retVal
+
+    def getInterfaces(self):
+        return [curIf[0] for curIf in self.getInterfaceList()]
+
+    def getMonitoringModeInterfaces(self):
+        return [curIf[0] for curIf in self.getInterfaceList() if curIf[1] == NL80211_IFTYPE_MONITOR]
+
+    def getMacAddress(self, interface):
+        for curIf in self.getInterfaceList():
+            if curIf[0] == interface:
+                return curIf[2]
+
+        return ""
+
+# ----------------- Main -----------------------------
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Sparrow-wifi nl80211 scan backend')
+    argparser.add_argument('--interface', help='Wireless interface to scan (requires root)', default='', required=False)
+    argparser.add_argument('--capture', help='Save the raw netlink messages from the scan to this file', default='', required=False)
+    argparser.add_argument('--dump', help="Read the kernel's BSS cache rather than triggering a scan", action='store_true', default=False, required=False)
+    argparser.add_argument('--replay', help='Decode a capture file instead of scanning', action='append', default=[], required=False)
+    args = argparser.parse_args()
+
+    if len(args.replay) > 0:
+        for curFile in args.replay:
+            wirelessNetworks = replayCapture(curFile)
+            print(curFile + ': ' + str(len(wirelessNetworks)) + ' networks')
+            for curKey in wirelessNetworks.keys():
+                print(wirelessNetworks[curKey])
+    elif len(args.interface) > 0:
+        scanner = NL80211Scanner()
+        if len(args.capture) > 0:
+            scanner.capture = []
+
+        if args.dump:
+            retCode, errString, wirelessNetworks = scanner.dump(args.interface)
+        else:
+            retCode, errString, wirelessNetworks = scanner.scan(args.interface)
+
+        if retCode != 0:
+            print('ERROR [' + str(retCode) + ']: ' + wirelessengine.WirelessEngine.getScanErrString(retCode, errString))
+        else:
+            for curKey in wirelessNetworks.keys():
+                print(wirelessNetworks[curKey])
+
+        if len(args.capture) > 0:
+            if saveCapture(args.capture, scanner.capture):
+                print('Saved ' + str(len(scanner.capture)) + ' messages to ' + args.capture)
+            else:
+                print('ERROR: Unable to write ' + args.capture)
+    else:
+        argparser.print_help()
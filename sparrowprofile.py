@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# On-demand CPU profiling of a running agent (/system/profile).  Nothing is installed until a profile is asked for, and
+# everything is removed when it's done, so there's no cost the rest of the time.  Two modes:
+#   - sample: a statistical profiler.  Every SAMPLE_INTERVAL seconds the stack of every thread is read with
+#     sys._current_frames() and counted.  Works on any python and sees threads that were already running.
+#     Written as collapsed stacks (thread;outer;...;inner count), the input flamegraph.pl and speedscope take.
+#   - cprofile: cProfile, written as a .prof for pstats/snakeviz plus a text report.  cProfile only follows every
+#     thread from python 3.12 on, so older versions get an error pointing at sample mode.
+# Only one profile runs at a time.
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+from socket import gethostname
+from time import sleep, monotonic
+
+PROFILE_SAMPLE = 'sample'
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_MODES = [PROFILE_SAMPLE, PROFILE_CPROFILE]
+
+MAX_PROFILE_SECONDS = 300
+SAMPLE_INTERVAL = 0.01  # seconds
+SUMMARY_LINES = 25
+
+profileLock = threading.Lock()
+
+def getThreadLabel(curThread):
+    # Groups a pool's threads under one name:  the class for Thread subclasses (BtmonThread, HackrfSweepThread, ...), 
+    # otherwise the name with its number taken out ('Thread (process_request_thread)', 'agentworker')
+    if curThread.__class__ is not threading.Thread:
+        return curThread.__class__.__name__
+        
+    return re.sub('[-_][0-9]+', '', curThread.name)
+    
+def getProfileFilename(mode, extension):
+    now = datetime.datetime.now()
+    return gethostname() + '_profile_' + mode + '_' + now.strftime("%Y-%m-%d_%H_%M_%S") + '.' + extension
+    
+def sampleStacks(seconds, interval=SAMPLE_INTERVAL):
+    # Returns collapsed stack -> samples for every thread but this one
+    stackCounts = {}
+    ownIdent = threading.get_ident()
+    endTime = monotonic() + seconds
+    
+    while monotonic() < endTime:
+        threadLabels = {}
+        for curThread in threading.enumerate():
+            threadLabels[curThread.ident] = getThreadLabel(curThread)
+            
+        for curIdent, curFrame in sys._current_frames().items():
+            if curIdent == ownIdent:
+                continue
+                
+            stack = []
+            while curFrame is not None:
+                curCode = curFrame.f_code
+                stack.append(curCode.co_name + ' (' + os.path.basename(curCode.co_filename) + ':' + str(curCode.co_firstlineno) + ')')
+                curFrame = curFrame.f_back
+                
+            stack.append(threadLabels.get(curIdent, 'thread'))
+            stack.reverse()
+            
+            curKey = ';'.join(stack)
+            stackCounts[curKey] = stackCounts.get(curKey, 0) + 1
+            
+        sleep(interval)
+        
+    return stackCounts
+    
+def summarizeStacks(stackCounts):
+    # Samples per thread, and the functions most often on top of a stack (where the time was actually spent)
+    totalSamples = sum(stackCounts.values())
+    threadSamples = {}
+    selfSamples = {}
+    
+    for curStack, curCount in stackCounts.items():
+        frames = curStack.split(';')
+        threadSamples[frames[0]] = threadSamples.get(frames[0], 0) + curCount
+        if len(frames) > 1:
+            selfSamples[frames[-1]] = selfSamples.get(frames[-1], 0) + curCount
+            
+    summary = []
+    for curFunction, curCount in sorted(selfSamples.items(), key=lambda item: item[1], reverse=True)[:SUMMARY_LINES]:
+        summary.append('%6.2f%% %6d  %s' % (100.0 * curCount / max(totalSamples, 1), curCount, curFunction))
+        
+    return totalSamples, threadSamples, summary
+    
+def profileProcess(seconds, mode, outputDir):
+    # Profiles the whole process for seconds and writes the results to outputDir.  Blocks until it's done.
+    # Returns errcode, errmsg, list of the files written, and a dict with the summary.
+    if mode not in PROFILE_MODES:
+        return 1, 'Unknown profile mode ' + str(mode) + '.  Use ' + ' or '.join(PROFILE_MODES) + '.', [], {}
+        
+    if (seconds <= 0) or (seconds > MAX_PROFILE_SECONDS):
+        return 1, 'Profile time has to be 1 to ' + str(MAX_PROFILE_SECONDS) + ' seconds.', [], {}
+        
+    if (mode == PROFILE_CPROFILE) and (sys.version_info < (3, 12)):
+        return 1, 'cprofile mode needs python 3.12 or later to follow all threads.  Use sample mode.', [], {}
+        
+    if not profileLock.acquire(False):
+        return 2, 'A profile is already running.', [], {}
+        
+    try:
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+            
+        if mode == PROFILE_SAMPLE:
+            stackCounts = sampleStacks(seconds)
+            totalSamples, threadSamples, summary = summarizeStacks(stackCounts)
+            
+            filename = getProfileFilename(mode, 'txt')
+            with open(outputDir + '/' + filename, 'w') as f:
+                for curStack, curCount in sorted(stackCounts.items(), key=lambda item: item[1], reverse=True):
+                    f.write(curStack + ' ' + str(curCount) + '\n')
+                    
+            summarydict = {}
+            summarydict['samples'] = totalSamples
+            summarydict['interval'] = SAMPLE_INTERVAL
+            summarydict['threads'] = threadSamples
+            summarydict['top'] = summary
+            
+            return 0, '', [filename], summarydict
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                sleep(seconds)
+            finally:
+                profiler.disable()
+                
+            statsFilename = getProfileFilename(mode, 'prof')
+            profiler.dump_stats(outputDir + '/' + statsFilename)
+            
+            report = io.StringIO()
+            stats = pstats.Stats(profiler, stream=report)
+            stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+            
+            reportFilename = getProfileFilename(mode, 'txt')
+            with open(outputDir + '/' + reportFilename, 'w') as f:
+                f.write(report.getvalue())
+                
+            summarydict = {}
+            summarydict['top'] = report.getvalue().splitlines()
+            
+            return 0, '', [statsFilename, reportFilename], summarydict
+    except Exception as e:
+        return 3, 'Profile failed: ' + str(e), [], {}
+    finally:
+        profileLock.release()
+        
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# Route table for the agent's URL handlers.  Exact paths are a dict lookup and prefixes are walked in a character
+# trie, so dispatch and the allow-list check are one lookup however many routes there are:  a path that doesn't
+# match a route isn't allowed.  Parameter patterns are compiled once when the route is added, and each route keeps
+# its call count and latency.
+
+import re
+import time
+from threading import Lock
+
+# Interface names, and comma-separated lists of them
+INTERFACE_PATTERN = '^([0-9a-zA-Z]+)'
+INTERFACE_LIST_PATTERN = '^([0-9a-zA-Z,]+)'
+
+class Route(object):
+    def __init__(self, path, handler, prefix=False, sendsHeaders=False, paramPattern=None):
+        # handler is called with the request handler.  sendsHeaders routes send their own status line and headers,
+        # the rest get a 200 application/json sent for them.
+        self.path = path
+        self.handler = handler
+        self.prefix = prefix
+        self.sendsHeaders = sendsHeaders
+        
+        if paramPattern is not None:
+            self.paramPattern = re.compile(paramPattern)
+        else:
+            self.paramPattern = None
+            
+        self.count = 0
+        self.totalTime = 0.0
+        self.minTime = 0.0
+        self.maxTime = 0.0
+        
+    def getParam(self, path):
+        # First group of paramPattern matched against what follows the route's path, or "" if there isn't one.
+        # A route path that doesn't end in a / still needs one before the parameter.
+        remainder = path[len(self.path):]
+        
+        if not self.path.endswith('/'):
+            if not remainder.startswith('/'):
+                return ""
+            remainder = remainder[1:]
+            
+        try:
+            return self.paramPattern.search(remainder).group(1)
+        except:
+            return ""
+            
+    def addCall(self, elapsed):
+        if self.count == 0 or elapsed < self.minTime:
+            self.minTime = elapsed
+        if elapsed > self.maxTime:
+            self.maxTime = elapsed
+            
+        self.count += 1
+        self.totalTime += elapsed
+        
+    def toJsondict(self):
+        dictjson = {}
+        dictjson['count'] = self.count
+        dictjson['total'] = self.totalTime
+        if self.count > 0:
+            dictjson['mean'] = self.totalTime / self.count
+        else:
+            dictjson['mean'] = 0.0
+        dictjson['min'] = self.minTime
+        dictjson['max'] = self.maxTime
+        
+        return dictjson
+        
+class Router(object):
+    def __init__(self):
+        self.exactRoutes = {}
+        # Nested dicts keyed by character.  The None key holds the route whose prefix ends at that node.
+        self.prefixTrie = {}
+        self.lock = Lock()
+        
+    def addRoute(self, path, handler, prefix=False, sendsHeaders=False, paramPattern=None):
+        route = Route(path, handler, prefix, sendsHeaders, paramPattern)
+        
+        if prefix:
+            curNode = self.prefixTrie
+            for curChar in path:
+                curNode = curNode.setdefault(curChar, {})
+            curNode[None] = route
+        else:
+            self.exactRoutes[path] = route
+            
+        return route
+        
+    def match(self, path):
+        # Returns the Route for path or None if it isn't allowed.  Exact routes ignore any query string and
+        # win over prefixes, and the longest prefix wins.
+        route = self.exactRoutes.get(path.split('?', 1)[0])
+        if route is not None:
+            return route
+            
+        curNode = self.prefixTrie
+        for curChar in path:
+            curNode = curNode.get(curChar)
+            if curNode is None:
+                break
+                
+            if None in curNode:
+                route = curNode[None]
+                
+        return route
+        
+    def dispatch(self, route, requestHandler):
+        # Runs the route's handler and records how long it took
+        startTime = time.monotonic()
+        try:
+            route.handler(requestHandler)
+        finally:
+            elapsed = time.monotonic() - startTime
+            self.lock.acquire()
+            route.addCall(elapsed)
+            self.lock.release()
+            
+    def getRoutes(self):
+        routes = list(self.exactRoutes.values())
+        
+        pendingNodes = [self.prefixTrie]
+        while len(pendingNodes) > 0:
+            curNode = pendingNodes.pop()
+            for curKey, curValue in curNode.items():
+                if curKey is None:
+                    routes.append(curValue)
+                else:
+                    pendingNodes.append(curValue)
+                    
+        return routes
+        
+    def getStats(self):
+        # route path -> dict of count, and total/mean/min/max in seconds
+        self.lock.acquire()
+        
+        retVal = {}
+        for curRoute in self.getRoutes():
+            retVal[curRoute.path] = curRoute.toJsondict()
+            
+        self.lock.release()
+        
+        return retVal
+        
+    def resetStats(self):
+        self.lock.acquire()
+        
+        for curRoute in self.getRoutes():
+            curRoute.count = 0
+            curRoute.totalTime = 0.0
+            curRoute.minTime = 0.0
+            curRoute.maxTime = 0.0
+            
+        self.lock.release()
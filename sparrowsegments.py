@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+# Recording segments.  With rotation on, the recorder closes its files every so many MB or minutes and starts new
+# ones, and a SegmentCompressor gzips the closed files in the background.  The compressor thread runs at the lowest
+# CPU priority so it only gets time the scanner and web server aren't using.  The .gz files are served as they are.
+#
+# getDiskState is the recorder's guard against filling the card:  it thins out what it writes once free space gets
+# within twice minFreeBytes, and stops writing below minFreeBytes until space is freed.
+
+import gzip
+import os
+import queue
+import threading
+import traceback
+from threading import Thread
+
+COMPRESSED_EXTENSION = '.gz'
+# Written here first, so a half-compressed file never shows up as a segment
+COMPRESS_TMP_EXTENSION = '.gz.tmp'
+COMPRESS_LEVEL = 6
+COMPRESS_CHUNK = 1048576
+
+DISK_OK = 0
+DISK_THIN = 1
+DISK_STOP = 2
+
+def getFreeBytes(path):
+    # Space an unprivileged process can use, or -1 if it can't be read
+    try:
+        stats = os.statvfs(path)
+        return stats.f_bavail * stats.f_frsize
+    except:
+        return -1
+        
+def getDiskState(path, minFreeBytes):
+    if minFreeBytes <= 0:
+        return DISK_OK
+        
+    freeBytes = getFreeBytes(path)
+    
+    if freeBytes < 0:
+        return DISK_OK
+    elif freeBytes < minFreeBytes:
+        return DISK_STOP
+    elif freeBytes < 2 * minFreeBytes:
+        return DISK_THIN
+    else:
+        return DISK_OK
+        
+def compressFile(filename, compressLevel=COMPRESS_LEVEL):
+    # Replaces filename with filename.gz (keeping its modified time).  Returns the new name, or '' if filename
+    # went away (deleted or sent) before it was done.
+    tmpFilename = filename + COMPRESS_TMP_EXTENSION
+    
+    try:
+        with open(filename, 'rb') as infile:
+            with gzip.open(tmpFilename, 'wb', compressLevel) as outfile:
+                while True:
+                    chunk = infile.read(COMPRESS_CHUNK)
+                    if not chunk:
+                        break
+                        
+                    outfile.write(chunk)
+                    
+        fileStats = os.stat(filename)
+        os.utime(tmpFilename, (fileStats.st_atime, fileStats.st_mtime))
+        os.replace(tmpFilename, filename + COMPRESSED_EXTENSION)
+        os.remove(filename)
+    except FileNotFoundError:
+        try:
+            os.remove(tmpFilename)
+        except:
+            pass
+            
+        return ''
+    except:
+        try:
+            os.remove(tmpFilename)
+        except:
+            pass
+            
+        raise
+        
+    return filename + COMPRESSED_EXTENSION
+    
+class SegmentCompressor(Thread):
+    def __init__(self, compressLevel=COMPRESS_LEVEL, onCompressed=None):
+        # onCompressed(filename, compressedFilename) is called on this thread after each file is done
+        super(SegmentCompressor, self).__init__()
+        self.compressLevel = compressLevel
+        self.onCompressed = onCompressed
+        self.pendingFiles = queue.Queue()
+        self.threadRunning = False
+        self.daemon = True
+        
+    def addFile(self, filename):
+        self.pendingFiles.put(filename)
+        
+    def stop(self):
+        self.pendingFiles.put(None)
+        
+    def setLowPriority(self):
+        # On Linux the nice value is per thread, so this only slows down the compressor
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except:
+            pass
+            
+    def run(self):
+        self.threadRunning = True
+        self.setLowPriority()
+        
+        while True:
+            curFile = self.pendingFiles.get()
+            
+            if curFile is None:
+                break
+                
+            try:
+                compressedFile = compressFile(curFile, self.compressLevel)
+                
+                if (len(compressedFile) > 0) and (self.onCompressed is not None):
+                    self.onCompressed(curFile, compressedFile)
+            except:
+                print('ERROR: Unable to compress ' + curFile + ':')
+                traceback.print_exc()
+                
+        self.threadRunning = False
+        
@@ -0,0 +1,502 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# Columnar in-memory stores for long surveys.  Instead of a dict of WirelessNetwork / BluetoothDevice objects,
+# each field is a numpy array indexed by row and a whole scan is merged in with a handful of vectorized operations.
+#
+# Layout notes:
+# - MAC addresses are 48-bit ints.  The key column holds mac << 8 | (channel & 0xFF) so one uint64 both stores the MAC
+#   and locates the row.  Anything that isn't a 6-byte MAC gets an id above 2**48 instead.
+# - Latitude/longitude are int32 degrees * 1e7 (about 1 cm), altitude/speed are float32 and read back rounded to 3 places.
+# - Strings (SSIDs, names) and rarely-changing attribute groups (security, cipher, bandwidth, ...) are stored once
+#   in a table and referenced by id.
+# - The key index is a sorted copy of the keys with their rows, plus a small sorted run of recent inserts that's
+#   folded in once it grows past PENDING_LIMIT, so an upsert doesn't copy the whole index.
+
+from threading import Lock
+
+import numpy as np
+
+from wirelessengine import WirelessEngine, WirelessNetwork
+from sparrowbluetooth import BluetoothDevice
+from sparrowmap import MapMarker
+
+# ------------------  Global definitions ------------------------------
+MAC_OTHER_BASE = 1 << 48
+DEG_SCALE = 10000000.0
+
+FLAG_GPSVALID = 1
+FLAG_STRONGESTVALID = 2
+FLAG_MACUPPER = 4
+
+# ------------------  String table ------------------------------
+class StringTable(object):
+    # Each distinct value is stored once and referenced by id.  Id 0 is always ''.
+    def __init__(self):
+        self.values = ['']
+        self.ids = {'': 0}
+
+    def getId(self, value):
+        valueId = self.ids.get(value)
+
+        if valueId is None:
+            valueId = len(self.values)
+            self.ids[value] = valueId
+            self.values.append(value)
+
+        return valueId
+
+    def __len__(self):
+        return len(self.values)
+
+# ------------------  Column store base ------------------------------
+class ColumnStore(object):
+    # Subclasses define COLUMNS, MATCH_COLUMNS (columns besides key that have to be equal for two records to be the same),
+    # KEEP_COLUMNS (left alone when an existing row is updated), recordToValues() and valuesToRecord().
+    PENDING_LIMIT = 8192
+    GROWTH = 1.25
+
+    GPS_COLUMNS = [('latitude', np.int32), ('longitude', np.int32), ('altitude', np.float32), ('speed', np.float32),
+                            ('strongestLatitude', np.int32), ('strongestLongitude', np.int32), ('strongestAltitude', np.float32), ('strongestSpeed', np.float32),
+                            ('firstSeen', np.float64), ('lastSeen', np.float64), ('flags', np.uint8)]
+
+    STRONGEST_COLUMNS = ['strongestLatitude', 'strongestLongitude', 'strongestAltitude', 'strongestSpeed']
+
+    def __init__(self, capacity=1024):
+        self.numRows = 0
+        self.capacity = max(int(capacity), 16)
+        self.columns = {}
+        for curName, curType in self.COLUMNS + ColumnStore.GPS_COLUMNS:
+            self.columns[curName] = np.zeros(self.capacity, dtype=curType)
+
+        self.strings = StringTable()
+        self.profiles = StringTable()
+        self.otherMacs = StringTable()
+
+        # Key index: the main run covers rows added before the last fold, the pending run the ones since.  Both are in key order.
+        self.sortedKeys = np.zeros(0, dtype=np.uint64)
+        self.sortedRows = np.zeros(0, dtype=np.int32)
+        self.pendingRows = np.zeros(0, dtype=np.int32)
+        self.pendingKeys = np.zeros(0, dtype=np.uint64)
+
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.numRows
+
+    def getMacId(self, macAddr):
+        # 'aa:bb:cc:dd:ee:ff' -> 48-bit int.  Anything else gets its own id above 2**48.
+        if len(macAddr) == 17:
+            try:
+                return int(macAddr.replace(':', ''), 16)
+            except ValueError:
+                pass
+
+        return MAC_OTHER_BASE + self.otherMacs.getId(macAddr)
+
+    def getMacString(self, macId, upperCase):
+        if macId >= MAC_OTHER_BASE:
+            return self.otherMacs.values[macId - MAC_OTHER_BASE]
+
+        macStr = '%012x' % macId
+        macStr = ':'.join(macStr[i:i+2] for i in range(0, 12, 2))
+
+        if upperCase:
+            return macStr.upper()
+        else:
+            return macStr
+
+    def getColumn(self, columnName):
+        # A read-only view of the first numRows entries
+        retVal = self.columns[columnName][:self.numRows]
+        retVal = retVal.view()
+        retVal.flags.writeable = False
+        return retVal
+
+    def getMemoryUsage(self):
+        # Bytes held by the columns and the index.  The string tables are Python objects and aren't counted.
+        retVal = 0
+        for curName in self.columns.keys():
+            retVal += self.columns[curName].nbytes
+
+        retVal += self.sortedKeys.nbytes + self.sortedRows.nbytes + self.pendingRows.nbytes + self.pendingKeys.nbytes
+
+        return retVal
+
+    # ------------------  Batches ------------------------------
+    def makeBatch(self, records):
+        # Converts WirelessNetwork/BluetoothDevice objects (a list or a dict) to a column batch for upsertBatch.
+        # If the same record shows up more than once the last one wins.
+        if isinstance(records, dict):
+            records = records.values()
+
+        columnNames = [curName for curName, curType in self.COLUMNS] + [curName for curName, curType in ColumnStore.GPS_COLUMNS]
+        columnTypes = [curType for curName, curType in self.COLUMNS] + [curType for curName, curType in ColumnStore.GPS_COLUMNS]
+        matchIndexes = [0] + [columnNames.index(curName) for curName in self.MATCH_COLUMNS]
+
+        valueRows = {}
+        for curRecord in records:
+            curValues = self.recordToValues(curRecord)
+            valueRows[tuple(curValues[i] for i in matchIndexes)] = curValues
+
+        batch = {}
+        if len(valueRows) > 0:
+            valueColumns = list(zip(*valueRows.values()))
+        else:
+            valueColumns = [[] for curName in columnNames]
+
+        for i in range(0, len(columnNames)):
+            batch[columnNames[i]] = np.array(valueColumns[i], dtype=columnTypes[i])
+
+        return batch
+
+    def upsert(self, records):
+        # Merges a scan's worth of WirelessNetwork/BluetoothDevice objects.  Returns the number of new rows.
+        return self.upsertBatch(self.makeBatch(records))
+
+    def upsertBatch(self, batch):
+        # batch is a dict of column name -> numpy array (see makeBatch), one entry per record with no repeated keys.
+        # Existing rows are updated in place, new ones are appended.  Returns the number of new rows.
+        batchSize = len(batch['key'])
+        if batchSize == 0:
+            return 0
+
+        self.lock.acquire()
+
+        try:
+            rows = self.findRows(batch)
+            found = rows >= 0
+
+            if found.all():
+                self.updateRows(rows, batch)
+                return 0
+
+            if found.any():
+                self.updateRows(rows[found], self.selectBatch(batch, found))
+
+            newRecords = ~found
+            self.appendRows(self.selectBatch(batch, newRecords))
+
+            return int(np.count_nonzero(newRecords))
+        finally:
+            self.lock.release()
+
+    def selectBatch(self, batch, mask):
+        retVal = {}
+        for curName in batch.keys():
+            retVal[curName] = batch[curName][mask]
+
+        return retVal
+
+    # ------------------  Index ------------------------------
+    def findRows(self, batch):
+        # Returns the row for each batch entry, or -1
+        batchKeys = batch['key']
+        rows = np.full(len(batchKeys), -1, dtype=np.int64)
+
+        # searchsorted is quite a bit quicker when the values being looked up are in order too
+        order = np.argsort(batchKeys)
+        sortedKeys = batchKeys[order]
+
+        if len(self.sortedRows) > 0:
+            self.matchRun(batch, rows, order, sortedKeys, self.sortedKeys, self.sortedRows)
+
+        if len(self.pendingRows) > 0:
+            self.matchRun(batch, rows, order, sortedKeys, self.pendingKeys, self.pendingRows)
+
+        return rows
+
+    def matchRun(self, batch, rows, order, sortedKeys, runKeys, runRows):
+        positions = np.searchsorted(runKeys, sortedKeys)
+
+        lastPosition = len(runRows) - 1
+        positions = np.minimum(positions, lastPosition)
+        candidates = runRows[positions]
+        keyMatched = runKeys[positions] == sortedKeys
+
+        # The usual case: one row with this key.  It's the same record if the match columns agree too.
+        matched = keyMatched.copy()
+        for curName in self.MATCH_COLUMNS:
+            matched &= self.columns[curName][candidates] == batch[curName][order]
+
+        found = matched & (rows[order] < 0)
+        rows[order[found]] = candidates[found]
+
+        if len(self.MATCH_COLUMNS) == 0:
+            return
+
+        # Same MAC and channel byte but a different SSID, so there may be more rows with this key.  Rare, so check them one at a time.
+        for i in np.nonzero(keyMatched & (~matched))[0].tolist():
+            batchIndex = order[i]
+            curPos = positions[i] + 1
+            while (rows[batchIndex] < 0) and (curPos <= lastPosition) and (runKeys[curPos] == sortedKeys[i]):
+                curRow = runRows[curPos]
+                if all(self.columns[curName][curRow] == batch[curName][batchIndex] for curName in self.MATCH_COLUMNS):
+                    rows[batchIndex] = curRow
+
+                curPos += 1
+
+    def appendRows(self, batch):
+        numNew = len(batch['key'])
+
+        if self.numRows + numNew > self.capacity:
+            newCapacity = max(int(self.capacity * ColumnStore.GROWTH), self.numRows + numNew)
+            for curName in self.columns.keys():
+                newColumn = np.zeros(newCapacity, dtype=self.columns[curName].dtype)
+                newColumn[:self.numRows] = self.columns[curName][:self.numRows]
+                self.columns[curName] = newColumn
+
+            self.capacity = newCapacity
+
+        startRow = self.numRows
+        for curName in batch.keys():
+            self.columns[curName][startRow:startRow + numNew] = batch[curName]
+
+        self.numRows += numNew
+
+        # Merge the new keys into the pending run
+        newRows = np.arange(startRow, startRow + numNew, dtype=np.int32)
+        order = np.argsort(batch['key'], kind='stable')
+        newKeys = batch['key'][order]
+        newRows = newRows[order]
+
+        positions = np.searchsorted(self.pendingKeys, newKeys, side='right')
+        self.pendingKeys = np.insert(self.pendingKeys, positions, newKeys)
+        self.pendingRows = np.insert(self.pendingRows, positions, newRows)
+
+        if len(self.pendingRows) > ColumnStore.PENDING_LIMIT:
+            self.foldPending()
+
+    def foldPending(self):
+        # Moves the pending run into the main sorted index
+        positions = np.searchsorted(self.sortedKeys, self.pendingKeys, side='right')
+        self.sortedKeys = np.insert(self.sortedKeys, positions, self.pendingKeys)
+        self.sortedRows = np.insert(self.sortedRows, positions, self.pendingRows)
+
+        self.pendingRows = np.zeros(0, dtype=np.int32)
+        self.pendingKeys = np.zeros(0, dtype=np.uint64)
+
+    def updateRows(self, rows, batch):
+        # The newest values win, except firstSeen (and anything else in KEEP_COLUMNS) carries forward
+        # and the strongest signal/GPS only change if the new signal is at least as strong.
+        newStrongest = self.columns[self.STRONGEST_SIGNAL][rows] <= batch[self.SIGNAL]
+        strongestRows = rows[newStrongest]
+
+        for curName in batch.keys():
+            if curName in self.KEEP_COLUMNS:
+                continue
+
+            if (curName == self.STRONGEST_SIGNAL) or (curName in ColumnStore.STRONGEST_COLUMNS):
+                self.columns[curName][strongestRows] = batch[curName][newStrongest]
+            elif curName == 'flags':
+                strongestFlags = np.where(newStrongest, batch['flags'], self.columns['flags'][rows]) & FLAG_STRONGESTVALID
+                self.columns['flags'][rows] = (batch['flags'] & ~np.uint8(FLAG_STRONGESTVALID)) | strongestFlags
+            else:
+                self.columns[curName][rows] = batch[curName]
+
+    # ------------------  Shared conversions ------------------------------
+    def gpsToValues(self, curRecord, upperCase):
+        flags = 0
+        if curRecord.gpsValid:
+            flags |= FLAG_GPSVALID
+        if curRecord.strongestValid:
+            flags |= FLAG_STRONGESTVALID
+        if upperCase:
+            flags |= FLAG_MACUPPER
+
+        return (int(round(curRecord.gpsLatitude * DEG_SCALE)), int(round(curRecord.gpsLongitude * DEG_SCALE)), curRecord.gpsAltitude, curRecord.gpsSpeed,
+                    int(round(curRecord.strongestLatitude * DEG_SCALE)), int(round(curRecord.strongestLongitude * DEG_SCALE)), curRecord.strongestAltitude, curRecord.strongestSpeed,
+                    curRecord.firstSeenEpoch, curRecord.lastSeenEpoch, flags)
+
+    def valuesToGPS(self, curRecord, columnValues, i):
+        flags = columnValues['flags'][i]
+        curRecord.gpsLatitude = columnValues['latitude'][i] / DEG_SCALE
+        curRecord.gpsLongitude = columnValues['longitude'][i] / DEG_SCALE
+        curRecord.gpsAltitude = round(columnValues['altitude'][i], 3)
+        curRecord.gpsSpeed = round(columnValues['speed'][i], 3)
+        curRecord.gpsValid = (flags & FLAG_GPSVALID) != 0
+        curRecord.strongestLatitude = columnValues['strongestLatitude'][i] / DEG_SCALE
+        curRecord.strongestLongitude = columnValues['strongestLongitude'][i] / DEG_SCALE
+        curRecord.strongestAltitude = round(columnValues['strongestAltitude'][i], 3)
+        curRecord.strongestSpeed = round(columnValues['strongestSpeed'][i], 3)
+        curRecord.strongestValid = (flags & FLAG_STRONGESTVALID) != 0
+        curRecord.firstSeenEpoch = columnValues['firstSeen'][i]
+        curRecord.lastSeenEpoch = columnValues['lastSeen'][i]
+
+    def getColumnValues(self, startRow, endRow):
+        # Plain Python lists are much faster to pull single values out of than numpy arrays
+        retVal = {}
+        for curName in self.columns.keys():
+            retVal[curName] = self.columns[curName][startRow:endRow].tolist()
+
+        return retVal
+
+    def getRecord(self, row):
+        self.lock.acquire()
+        columnValues = self.getColumnValues(row, row + 1)
+        self.lock.release()
+
+        return self.valuesToRecord(columnValues, 0)
+
+    def iterRecords(self, chunkSize=4096):
+        # Yields a WirelessNetwork/BluetoothDevice for every row, in the order they were first stored.
+        # Rows are copied out a chunk at a time so upserts can carry on in between.
+        startRow = 0
+
+        while startRow < self.numRows:
+            self.lock.acquire()
+            endRow = min(startRow + chunkSize, self.numRows)
+            columnValues = self.getColumnValues(startRow, endRow)
+            self.lock.release()
+
+            for i in range(0, endRow - startRow):
+                yield self.valuesToRecord(columnValues, i)
+
+            startRow = endRow
+
+# ------------------  Wireless network store ------------------------------
+class NetworkStore(ColumnStore):
+    # Rows are matched the same way as WirelessNetwork.getKey(): MAC, SSID and channel
+    COLUMNS = [('key', np.uint64), ('ssid', np.uint32), ('profile', np.uint32), ('channel', np.int16), ('frequency', np.uint16),
+                        ('signal', np.int16), ('strongestSignal', np.int16)]
+    MATCH_COLUMNS = ['ssid', 'channel']
+    KEEP_COLUMNS = ['firstSeen']
+    SIGNAL = 'signal'
+    STRONGEST_SIGNAL = 'strongestSignal'
+
+    def recordToValues(self, curNet):
+        upperCase = curNet.macAddr != curNet.macAddr.lower()
+        profile = (curNet.mode, curNet.security, curNet.privacy, curNet.cipher, curNet.bandwidth, curNet.secondaryChannel,
+                        curNet.thirdChannel, curNet.secondaryChannelLocation)
+
+        return (self.getMacId(curNet.macAddr) << 8 | (curNet.channel & 0xFF), self.strings.getId(curNet.ssid), self.profiles.getId(profile),
+                    curNet.channel, curNet.frequency, curNet.signal, curNet.strongestsignal) + self.gpsToValues(curNet, upperCase)
+
+    def valuesToRecord(self, columnValues, i):
+        curNet = WirelessNetwork()
+        curNet.macAddr = self.getMacString(columnValues['key'][i] >> 8, (columnValues['flags'][i] & FLAG_MACUPPER) != 0)
+        curNet.ssid = self.strings.values[columnValues['ssid'][i]]
+        curNet.mode, curNet.security, curNet.privacy, curNet.cipher, curNet.bandwidth, curNet.secondaryChannel, curNet.thirdChannel, curNet.secondaryChannelLocation = self.profiles.values[columnValues['profile'][i]]
+        curNet.channel = columnValues['channel'][i]
+        curNet.frequency = columnValues['frequency'][i]
+        curNet.signal = columnValues['signal'][i]
+        curNet.strongestsignal = columnValues['strongestSignal'][i]
+        self.valuesToGPS(curNet, columnValues, i)
+
+        return curNet
+
+    def findNetwork(self, curNet):
+        # Returns the stored copy of a network (matched like getKey()) or None
+        batch = self.makeBatch([curNet])
+
+        self.lock.acquire()
+        rows = self.findRows(batch)
+        self.lock.release()
+
+        if rows[0] < 0:
+            return None
+
+        return self.getRecord(int(rows[0]))
+
+    def iterNetworks(self):
+        return self.iterRecords()
+
+    def getMapMarkers(self, plotStrongest=False, maxLabelLength=15):
+        # One MapMarker per distinct location with every SSID seen there as a label.  The bar count is the weakest
+        # signal at that spot (same scale as WirelessEngine.getSignalQualityFromDB0To5).
+        self.lock.acquire()
+
+        if plotStrongest:
+            signal = self.columns['strongestSignal'][:self.numRows].astype(np.int32)
+            latitudes = self.columns['strongestLatitude'][:self.numRows].astype(np.int64)
+            longitudes = self.columns['strongestLongitude'][:self.numRows].astype(np.int64)
+            gpsValid = (self.columns['flags'][:self.numRows] & FLAG_STRONGESTVALID) != 0
+        else:
+            signal = self.columns['signal'][:self.numRows].astype(np.int32)
+            latitudes = self.columns['latitude'][:self.numRows].astype(np.int64)
+            longitudes = self.columns['longitude'][:self.numRows].astype(np.int64)
+            gpsValid = (self.columns['flags'][:self.numRows] & FLAG_GPSVALID) != 0
+
+        ssidIds = self.columns['ssid'][:self.numRows].tolist()
+
+        self.lock.release()
+
+        latitudes[~gpsValid] = 0
+        longitudes[~gpsValid] = 0
+        barCounts = (4 * np.clip(2 * (signal + 100), 0, 100)) // 100
+
+        # Group rows by location, keeping the order locations were first stored in
+        locations = (latitudes << 32) | (longitudes & 0xFFFFFFFF)
+        uniqueLocations, firstRows, groups = np.unique(locations, return_index=True, return_inverse=True)
+        minBars = np.full(len(uniqueLocations), 4, dtype=barCounts.dtype)
+        np.minimum.at(minBars, groups, barCounts)
+
+        markerList = []
+        for curGroup in range(0, len(uniqueLocations)):
+            curRow = firstRows[curGroup]
+            newMarker = MapMarker()
+            newMarker.gpsValid = bool(gpsValid[curRow])
+            newMarker.latitude = float(latitudes[curRow]) / DEG_SCALE
+            newMarker.longitude = float(longitudes[curRow]) / DEG_SCALE
+            newMarker.barCount = int(minBars[curGroup])
+            markerList.append(newMarker)
+
+        labels = {}
+        for curId in set(ssidIds):
+            labels[curId] = WirelessEngine.convertUnknownToString(self.strings.values[curId])[:maxLabelLength]
+
+        for curGroup, curId in zip(groups.tolist(), ssidIds):
+            markerList[curGroup].addLabel(labels[curId])
+
+        return [markerList[curGroup] for curGroup in np.argsort(firstRows, kind='stable').tolist()]
+
+# ------------------  Bluetooth device store ------------------------------
+class BluetoothStore(ColumnStore):
+    # Rows are matched the same way as BluetoothDevice.getKey(): the MAC address
+    COLUMNS = [('key', np.uint64), ('name', np.uint32), ('profile', np.uint32), ('rssi', np.int16), ('strongestRssi', np.int16),
+                        ('txPower', np.int16), ('iBeaconRange', np.float64)]
+    MATCH_COLUMNS = []
+    KEEP_COLUMNS = ['firstSeen']
+    SIGNAL = 'rssi'
+    STRONGEST_SIGNAL = 'strongestRssi'
+
+    def recordToValues(self, curDevice):
+        upperCase = curDevice.macAddress != curDevice.macAddress.lower()
+        profile = (curDevice.uuid, curDevice.company, curDevice.manufacturer, curDevice.bluetoothDescription, curDevice.btType, curDevice.txPowerValid)
+
+        return (self.getMacId(curDevice.macAddress) << 8, self.strings.getId(curDevice.name), self.profiles.getId(profile),
+                    curDevice.rssi, curDevice.strongestRssi, curDevice.txPower, curDevice.iBeaconRange) + self.gpsToValues(curDevice, upperCase)
+
+    def valuesToRecord(self, columnValues, i):
+        curDevice = BluetoothDevice()
+        curDevice.macAddress = self.getMacString(columnValues['key'][i] >> 8, (columnValues['flags'][i] & FLAG_MACUPPER) != 0)
+        curDevice.name = self.strings.values[columnValues['name'][i]]
+        curDevice.uuid, curDevice.company, curDevice.manufacturer, curDevice.bluetoothDescription, curDevice.btType, curDevice.txPowerValid = self.profiles.values[columnValues['profile'][i]]
+        curDevice.rssi = columnValues['rssi'][i]
+        curDevice.strongestRssi = columnValues['strongestRssi'][i]
+        curDevice.txPower = columnValues['txPower'][i]
+        curDevice.iBeaconRange = columnValues['iBeaconRange'][i]
+        self.valuesToGPS(curDevice, columnValues, i)
+
+        return curDevice
+
+    def iterDevices(self):
+        return self.iterRecords()
+
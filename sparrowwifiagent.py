@@ -24,6 +24,12 @@ import json
 import re
 import argparse
 import configparser
+import queue
+import asyncio
+import time
+import traceback
+import threading
+import hmac
 # import subprocess
 
 from socket import *
@@ -31,9 +37,11 @@ from time import sleep
 from threading import Thread, Lock
 from dateutil import parser
 from http import server as HTTPServer
+from email.utils import formatdate
 from socketserver import ThreadingMixIn
+from sparrowasync import AsyncHTTPServer, LoopQueue
 
-from wirelessengine import WirelessEngine
+from wirelessengine import WirelessEngine, WirelessNetwork, ScanCache, JsonNetworkEncoder, NdjsonNetworkEncoder, DeltaNetworkEncoder, SCANBACKEND_IW, SCANMODE_TRIGGER
 from sparrowgps import GPSEngine, GPSStatus
 try:
     from sparrowdrone import SparrowDroneMavlink
@@ -43,8 +51,18 @@ except:
     
 from sparrowrpi import SparrowRPi
 from sparrowbluetooth import SparrowBluetooth, BluetoothDevice
+from sparrowstore import NetworkStore, BluetoothStore
+from sparrowwire import BinaryNetworkEncoder, acceptsBinary
 from sparrowhackrf import SparrowHackrf
-from sparrowcommon import gzipCompress
+from sparrowcommon import ChangeLog
+from sparrowcompress import CompressionStats, EncodedBodyCache, StreamCompressor, negotiateEncoding, compressBytes, setCompressLevel, getCompressLevel, ENCODING_IDENTITY
+from sparrowrouter import Router, INTERFACE_PATTERN, INTERFACE_LIST_PATTERN
+from sparrowmetrics import metrics, TimedLock, ByteCountingWriter
+from sparrowprofile import profileProcess, PROFILE_SAMPLE
+from sparrowjournal import ObservationJournal, readJournal, getJournalClassName, JOURNAL_EXTENSION
+from sparrowdb import SQLiteRecorder, DB_EXTENSION
+from sparrowcatalog import CATALOG_FILENAME, RecordingCatalog, RecordingSummary, RecordingEntry, getFileFormat
+from sparrowsegments import SegmentCompressor, getDiskState, DISK_OK, DISK_THIN, DISK_STOP, COMPRESS_TMP_EXTENSION
 
 try:
     from manuf import manuf
@@ -70,6 +88,77 @@ hackrf = SparrowHackrf()
 # Lock list is a dictionary of thread locks for scanning interfaces
 lockList = {}
 
+# Change logs for since=<cursor> (delta) requests.  One per interface list for wifi, one for bluetooth.
+# Wifi networks not heard from in DELTA_MAXAGE seconds are reported as expired.
+DELTA_MAXAGE = 180.0
+wifiChangeLogs = {}
+btChangeLog = ChangeLog()
+changeLogLock = Lock()
+
+# Compression stats per endpoint (/system/compressionstats), and response bodies already encoded so clients
+# polling the same data only cost one serialization and compression.  compresslevel sets the zlib level.
+compressionStats = CompressionStats()
+responseCache = EncodedBodyCache()
+
+# Agent side of /system/metrics.  Scan, parse and lock timings register from the modules doing the work.
+httpBytesSent = metrics.counter('sparrow_http_bytes_sent_total', 'Bytes written to clients, headers included', ('route',))
+httpRequests = metrics.counter('sparrow_http_requests_total', 'Requests answered', ('route',))
+
+def getThreadCounts():
+    retVal = {}
+    for curThread in threading.enumerate():
+        curKey = (curThread.__class__.__name__,)
+        retVal[curKey] = retVal.get(curKey, 0) + 1
+        
+    return retVal
+    
+metrics.gauge('sparrow_threads', 'Running threads by class', getThreadCounts, ('class',))
+
+# Interfaces with a BackgroundScanThread (--backgroundscan).  /wireless/networks for them answers from the thread's
+# latest snapshot instead of scanning.  backgroundScanWatchdog restarts any that die.
+backgroundScanThreads = {}
+backgroundScanWatchdog = None
+
+# /wireless/networks requests for the same interface and frequencies share a scan.  scancachettl sets how long a
+# finished scan is reused.
+scanCache = ScanCache()
+
+# Live stream (/wireless/stream/<iface>) clients.  One LiveScanThread per interface and channel list scans back to back
+# while anyone is listening, and liveStatusThread pushes GPS fixes and bluetooth changes.  Each client has its own queue
+# of NDJSON lines; a client that falls STREAM_QUEUE_LIMIT lines behind loses its oldest lines rather than holding up the
+# others, so the newest (like a scan's end marker) always gets through.
+# Clients get a keepalive line after STREAM_KEEPALIVE idle seconds so dead connections are noticed on both ends.
+STREAM_KEEPALIVE = 2.0
+STREAM_QUEUE_LIMIT = 5000
+liveScanThreads = {}
+liveStatusThread = None
+liveStreamLock = Lock()
+liveStreamsStopping = False
+
+# asyncio server mode (--servermode asyncio) answers these on the event loop since they only read state.  The rest
+# go to its worker pool.
+ASYNC_INLINE_URLS = ['/gps/status', '/spectrum/scanstatus', '/spectrum/hackrfstatus', '/bluetooth/scanstatus', '/system/metrics']
+
+# URL parameter parsers, compiled once rather than on each request
+SINCE_PATTERN = re.compile('[?&]since=([0-9]+)', re.IGNORECASE)
+FREQUENCIES_PATTERN = re.compile('.*Frequencies=(.*)', re.IGNORECASE)
+STREAM_INTERFACE_PATTERN = re.compile(INTERFACE_LIST_PATTERN)
+STREAM_FREQUENCIES_PATTERN = re.compile('[?&]frequencies=([0-9,]*)', re.IGNORECASE)
+STREAM_BLUETOOTH_PATTERN = re.compile('[?&]bluetooth=(1|true)', re.IGNORECASE)
+PROFILE_SECONDS_PATTERN = re.compile('[?&]seconds=([0-9]+)', re.IGNORECASE)
+PROFILE_MODE_PATTERN = re.compile('[?&]mode=([a-z]+)', re.IGNORECASE)
+RECORDINGS_START_PATTERN = re.compile('[?&]start=([0-9.]+)', re.IGNORECASE)
+RECORDINGS_END_PATTERN = re.compile('[?&]end=([0-9.]+)', re.IGNORECASE)
+RECORDINGS_BBOX_PATTERN = re.compile('[?&]bbox=([-0-9.]+),([-0-9.]+),([-0-9.]+),([-0-9.]+)', re.IGNORECASE)
+# A single byte range.  Anything else in a Range header gets the whole file.
+RANGE_PATTERN = re.compile('^bytes=([0-9]*)-([0-9]*)$', re.IGNORECASE)
+# Recording downloads without sendfile (asyncio server) are read and written this much at a time
+FILE_CHUNK_SIZE = 65536
+
+# /system/profile is off unless profiletoken is set.  Clients send it in the X-Sparrow-Token header.
+PROFILE_TOKEN_HEADER = 'X-Sparrow-Token'
+profileToken = ''
+
 allowedIPs = []
 useRPILeds = False
 
@@ -79,7 +168,187 @@ runningcfg = None
 recordThread = None
 announceThread = None
 
+# How the recorder (--recordinterface / startrecord) writes: csv files, or one sqlite database per recording
+RECORD_FORMAT_CSV = 'csv'
+RECORD_FORMAT_SQLITE = 'sqlite'
+recordFormat = RECORD_FORMAT_CSV
+# SQLite keeps these next to a database while it's open
+DB_SIDECAR_EXTENSIONS = ['-wal', '-shm']
+
+# Recording segments.  0 turns that kind of rotation off.  Closed segments are gzipped by segmentCompressor.
+recordSegmentBytes = 0
+recordSegmentSeconds = 0
+segmentCompressor = None
+# What's in the recordings directory (see sparrowcatalog).  Built by initRecordingCatalog at startup.
+recordingCatalog = None
+catalogLock = Lock()
+# Disk guard.  The recorder thins out what it writes below twice this much free space and stops below it.
+recordMinFreeBytes = 100 * 1048576
+DISK_CHECK_INTERVAL = 10.0  # seconds
+# While thinning, every Nth scan is written
+THIN_SCAN_INTERVAL = 4
+
 # ------   Global functions ------------
+def getWifiChangeLog(interfaceName):
+    changeLogLock.acquire()
+    
+    if interfaceName not in wifiChangeLogs:
+        wifiChangeLogs[interfaceName] = ChangeLog(DELTA_MAXAGE)
+        
+    curChangeLog = wifiChangeLogs[interfaceName]
+    changeLogLock.release()
+    
+    return curChangeLog
+    
+def getSinceCursor(path):
+    # The since=<cursor> parameter from a delta request, or None
+    try:
+        return int(SINCE_PATTERN.search(path).group(1))
+    except:
+        return None
+        
+def getCurrentGPS():
+    # GPSStatus from whichever GPS source the agent is using, or None if it isn't synchronized
+    if useMavlink:
+        gpsCoord = GPSStatus()
+        gpsCoord.gpsInstalled = True
+        gpsCoord.gpsRunning = True
+        gpsCoord.isValid = mavlinkGPSThread.synchronized
+        gpsCoord.latitude = mavlinkGPSThread.latitude
+        gpsCoord.longitude = mavlinkGPSThread.longitude
+        gpsCoord.altitude = mavlinkGPSThread.altitude
+        gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
+        return gpsCoord
+    elif gpsEngine.gpsValid():
+        return gpsEngine.lastCoord
+    else:
+        return None
+        
+class StreamQueue(queue.Queue):
+    # Threaded server client queue.  When it's full the oldest line makes way for the new one.
+    def put_nowait(self, item):
+        while True:
+            try:
+                super().put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                except queue.Empty:
+                    pass
+                    
+def getStreamSubscribers(subscribers):
+    # Copy of a subscriber set (or dict's keys) the threads can walk while clients come and go
+    liveStreamLock.acquire()
+    retVal = list(subscribers)
+    liveStreamLock.release()
+    
+    return retVal
+    
+def publishStreamLine(subscribers, line):
+    for curQueue in getStreamSubscribers(subscribers):
+        curQueue.put_nowait(line)
+        
+def subscribeLiveStream(clientQueue, interfaceName, huntChannelList, wantBluetooth):
+    global liveStatusThread
+    
+    liveStreamLock.acquire()
+    
+    streamKey = (interfaceName, tuple(huntChannelList))
+    if streamKey not in liveScanThreads:
+        liveScanThreads[streamKey] = LiveScanThread(interfaceName, huntChannelList)
+        liveScanThreads[streamKey].start()
+    liveScanThreads[streamKey].subscribers.add(clientQueue)
+    
+    if liveStatusThread is None:
+        liveStatusThread = LiveStatusThread()
+        liveStatusThread.start()
+    liveStatusThread.gpsSubscribers[clientQueue] = None
+    if wantBluetooth:
+        liveStatusThread.btSubscribers[clientQueue] = None
+        
+    liveStreamLock.release()
+    
+def unsubscribeLiveStream(clientQueue):
+    # The threads notice on their next pass when they've got nobody left and stop
+    liveStreamLock.acquire()
+    
+    for curThread in liveScanThreads.values():
+        curThread.subscribers.discard(clientQueue)
+        
+    if liveStatusThread is not None:
+        liveStatusThread.gpsSubscribers.pop(clientQueue, None)
+        liveStatusThread.btSubscribers.pop(clientQueue, None)
+        
+    liveStreamLock.release()
+    
+def parseLiveStreamPath(path):
+    # Returns the interface (list), hunt frequencies and whether bluetooth was asked for
+    inputstr = path.replace('/wireless/stream/', '')
+    try:
+        fieldValue = STREAM_INTERFACE_PATTERN.search(inputstr).group(1)
+    except:
+        fieldValue = ""
+        
+    huntChannelList = []
+    try:
+        for curItem in STREAM_FREQUENCIES_PATTERN.search(inputstr).group(1).split(','):
+            if len(curItem) > 0:
+                huntChannelList.append(int(curItem))
+    except:
+        pass
+        
+    wantBluetooth = STREAM_BLUETOOTH_PATTERN.search(inputstr) is not None
+    
+    return fieldValue, huntChannelList, wantBluetooth
+    
+async def sendLiveStreamAsync(request, reader, writer):
+    # asyncio server version of SparrowWiFiAgentRequestHandler.sendLiveStream.  Runs on the event loop so open
+    # streams don't each hold a worker thread.
+    if (len(allowedIPs) > 0) and (request.clientAddress[0] not in allowedIPs):
+        writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-type: text/html\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        return
+        
+    fieldValue, huntChannelList, wantBluetooth = parseLiveStreamPath(request.path)
+    
+    writer.write(('HTTP/1.1 200 OK\r\nContent-type: ' + NdjsonNetworkEncoder.contentType + '\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n').encode('ascii'))
+    
+    if len(fieldValue) == 0:
+        writer.write(NdjsonNetworkEncoder().end(5, "Error parsing interface.  Identified interface: " + fieldValue, {}))
+        await writer.drain()
+        return
+        
+    clientQueue = LoopQueue(asyncio.get_running_loop(), STREAM_QUEUE_LIMIT)
+    subscribeLiveStream(clientQueue, fieldValue, huntChannelList, wantBluetooth)
+    
+    try:
+        while not liveStreamsStopping:
+            line = await clientQueue.get(STREAM_KEEPALIVE)
+            if line is None:
+                line = b'{"type": "keepalive"}\n'
+                
+            lines = [line]
+            while len(lines) < 256:
+                line = clientQueue.get_nowait()
+                if line is None:
+                    break
+                lines.append(line)
+                
+            writer.write(b''.join(lines))
+            await writer.drain()
+    except:
+        # Client went away
+        pass
+    finally:
+        unsubscribeLiveStream(clientQueue)
+        
+def stopLiveStreams():
+    global liveStreamsStopping
+    
+    # Stream handlers check this between lines, so server_close isn't left waiting on them
+    liveStreamsStopping = True
+    
 def stringtobool(instr):
     if (instr == 'True' or instr == 'true'):
         return True
@@ -102,8 +371,34 @@ def deleteRecordingFiles(filelist):
         dirname, filename = os.path.split(curFilename)
         if len(filename) > 0:
             fullpath = recordingsDir + '/' + filename
+            if os.path.isfile(fullpath + JOURNAL_EXTENSION):
+                try:
+                    os.remove(fullpath + JOURNAL_EXTENSION)
+                except:
+                    pass
+                    
+                if not os.path.isfile(fullpath):
+                    continue
+                    
+            if filename.endswith(DB_EXTENSION):
+                if recordThread and recordThread.threadRunning and (recordThread.recorder is not None) and (os.path.basename(recordThread.dbfilename) == filename):
+                    # Still being written
+                    if len(retVal) == 0:
+                        retVal = filename
+                    else:
+                        retVal += ',' + filename
+                        
+                    continue
+                    
+                for curExtension in DB_SIDECAR_EXTENSIONS:
+                    try:
+                        os.remove(fullpath + curExtension)
+                    except:
+                        pass
+                    
             try:
                 os.remove(fullpath)
+                getRecordingCatalog().removeFile(filename)
             except:
                 if len(retVal) == 0:
                     retVal = filename
@@ -112,32 +407,231 @@ def deleteRecordingFiles(filelist):
                     
     return retVal
 
-def getRecordingFiles():
-    dirname, filename = os.path.split(os.path.abspath(__file__))
-    recordingsDir = dirname + '/recordings'
-    if  not os.path.exists(recordingsDir):
-        os.makedirs(recordingsDir)
+def isRecordingFile(filename):
+    # False for what lives alongside the recordings:  the catalog's index, journals, SQLite's sidecars and the
+    # temporaries things are written to before they're renamed into place
+    if filename == CATALOG_FILENAME:
+        return False
+        
+    if filename.endswith(JOURNAL_EXTENSION) or filename.endswith(tuple(DB_SIDECAR_EXTENSIONS)):
+        return False
+        
+    if filename.endswith(COMPRESS_TMP_EXTENSION) or ('.tmp' in filename):
+        return False
+        
+    return True
     
-    retVal = []
+def getRecordingCatalog():
+    global recordingCatalog
     
-    try:
-        for filename in os.listdir(recordingsDir):
-            fullPath = recordingsDir + '/' + filename
+    catalogLock.acquire()
+    
+    if recordingCatalog is None:
+        dirname, filename = os.path.split(os.path.abspath(__file__))
+        recordingsDir = dirname + '/recordings'
+        if  not os.path.exists(recordingsDir):
+            os.makedirs(recordingsDir)
             
-            if not os.path.isdir(fullPath):
-                curFile = FileSystemFile()
-                curFile.filename = filename
-                curFile.size = os.path.getsize(fullPath)
-                try:
-                    curFile.timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(fullPath))
-                except:
-                    curFile.timestamp = None
-                    
-                retVal.append(curFile.toJsondict())
+        recordingCatalog = RecordingCatalog(recordingsDir, lambda filename: not isRecordingFile(filename))
+        
+    catalogLock.release()
+    
+    return recordingCatalog
+    
+def initRecordingCatalog():
+    # Run at startup before the recorder starts.  Recovering a journal goes through compactRecording, which would wait
+    # on the recorder's segmentLock, so it can't happen from the recorder (it catalogs segments with that lock held).
+    catalog = getRecordingCatalog()
+    recoverJournals(catalog.recordingsDir)
+    
+def recoverJournals(recordingsDir):
+    # A journal nothing's writing to is a recording that was cut off.  Its CSV is built now so it's catalogued.
+    for curFilename in os.listdir(recordingsDir):
+        if curFilename.endswith(JOURNAL_EXTENSION):
+            csvFilename = curFilename[:-len(JOURNAL_EXTENSION)]
+            
+            if isLiveRecording(csvFilename):
+                continue
+                
+            try:
+                compactRecording(csvFilename)
+            except:
+                print('ERROR: Unable to recover ' + curFilename)
+                
+def isLiveRecording(filename):
+    if recordThread and recordThread.threadRunning:
+        return filename in recordThread.getLiveFiles()
+    else:
+        return False
+        
+def getRecordingFiles(startTime=None, endTime=None, bounds=None):
+    # From the catalog, plus whatever the recorder has open.  Those are listed under the name they'll be downloaded
+    # as (a CSV is built from its journal when it's asked for).
+    catalog = getRecordingCatalog()
+    
+    if recordThread and recordThread.threadRunning:
+        liveEntries = recordThread.getLiveEntries(catalog.recordingsDir)
+    else:
+        liveEntries = []
+        
+    liveNames = [curEntry.filename for curEntry in liveEntries]
+    retVal = [curFile for curFile in catalog.getFiles(startTime, endTime, bounds) if curFile['filename'] not in liveNames]
+    
+    for curEntry in liveEntries:
+        if curEntry.matches(startTime, endTime, bounds):
+            retVal.append(curEntry.toJsondict())
+            
+    return retVal
+
+def getByteRange(rangeHeader, fileSize):
+    # (first byte, last byte, partial) for a download, or None if the range can't be satisfied
+    if rangeHeader is None:
+        return 0, fileSize - 1, False
+        
+    rangeMatch = RANGE_PATTERN.match(rangeHeader.strip())
+    if (rangeMatch is None) or ((len(rangeMatch.group(1)) == 0) and (len(rangeMatch.group(2)) == 0)):
+        return 0, fileSize - 1, False
+        
+    if len(rangeMatch.group(1)) == 0:
+        # bytes=-N is the last N bytes
+        suffixLength = int(rangeMatch.group(2))
+        if suffixLength == 0:
+            return None
+            
+        return max(fileSize - suffixLength, 0), fileSize - 1, True
+        
+    first = int(rangeMatch.group(1))
+    if len(rangeMatch.group(2)) > 0:
+        last = min(int(rangeMatch.group(2)), fileSize - 1)
+    else:
+        last = fileSize - 1
+        
+    if (first >= fileSize) or (last < first):
+        return None
+        
+    return first, last, True
+    
+def getFileValidators(fileStat):
+    # (ETag, Last-Modified) for a download.  The ETag is size and mtime so a resume can tell the file's been replaced.
+    etag = '"' + format(fileStat.st_size, 'x') + '-' + format(fileStat.st_mtime_ns, 'x') + '"'
+    lastModified = formatdate(fileStat.st_mtime, usegmt=True)
+    
+    return etag, lastModified
+    
+def onSegmentCompressed(filename, compressedFilename):
+    getRecordingCatalog().renameFile(os.path.basename(filename), os.path.basename(compressedFilename))
+    
+def getSegmentCompressor():
+    global segmentCompressor
+    
+    if segmentCompressor is None:
+        segmentCompressor = SegmentCompressor(onCompressed=onSegmentCompressed)
+        segmentCompressor.start()
+        
+    return segmentCompressor
+    
+def compactRecording(filename):
+    # Builds filename (a recordings CSV) from its journal if there is one.  A running recorder writes it from what
+    # it has in memory.  Otherwise the journal is replayed, and since the CSV then has everything the journal is removed.
+    dirname, runfilename = os.path.split(os.path.abspath(__file__))
+    fullPath = dirname + '/recordings/' + filename
+    journalFile = fullPath + JOURNAL_EXTENSION
+    
+    if recordThread and recordThread.threadRunning:
+        if recordThread.exportSegment(filename):
+            return
+            
+    if not os.path.isfile(journalFile):
+        return
+        
+    className = getJournalClassName(journalFile)
+    
+    if className == WirelessNetwork.__name__:
+        store = NetworkStore()
+        for curRecords in readJournal(journalFile, WirelessNetwork):
+            store.upsert(curRecords)
+            
+        ouiLookupEngine = getOUIDB()
+        writeNetworksCSV(fullPath, store.iterNetworks(), lambda macAddr: lookupVendor(ouiLookupEngine, macAddr))
+        records = store.iterNetworks()
+    elif className == BluetoothDevice.__name__:
+        store = BluetoothStore()
+        for curRecords in readJournal(journalFile, BluetoothDevice):
+            store.upsert(curRecords)
+            
+        writeBluetoothCSV(fullPath, store.iterDevices())
+        records = store.iterDevices()
+    else:
+        return
+        
+    try:
+        os.remove(journalFile)
     except:
         pass
         
-    return retVal
+    summary = RecordingSummary()
+    summary.addRecords(records)
+    getRecordingCatalog().addFile(filename, summary)
+        
+def writeNetworksCSV(filename, networks, vendorLookup):
+    # Written to a temp file and renamed into place so a download never sees half a file.  The recorder and a
+    # download can both be writing one, so the temp file is per thread.
+    tmpFilename = filename + '.tmp' + str(threading.get_ident())
+    
+    try:
+        outputFile = open(tmpFilename, 'w')
+    except:
+        print('ERROR: Unable to write to wifi file ' + filename)
+        return
+
+    outputFile.write('macAddr,vendor,SSID,Security,Privacy,Channel,Frequency,Signal Strength,Strongest Signal Strength,Bandwidth,Last Seen,First Seen,GPS Valid,Latitude,Longitude,Altitude,Speed,Strongest GPS Valid,Strongest Latitude,Strongest Longitude,Strongest Altitude,Strongest Speed\n')
+    
+    for curData in networks:
+        vendor = vendorLookup(curData.macAddr)
+        
+        if vendor is None:
+            vendor = ''
+        
+        outputFile.write(curData.macAddr  + ',' + vendor + ',"' + curData.ssid + '",' + curData.security + ',' + curData.privacy)
+        outputFile.write(',' + curData.getChannelString() + ',' + str(curData.frequency) + ',' + str(curData.signal) + ',' + str(curData.strongestsignal) + ',' + str(curData.bandwidth) + ',' +
+                                curData.getLastSeenString() + ',' + curData.getFirstSeenString() + ',' + 
+                                str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
+                                str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
+
+    outputFile.close()
+    os.replace(tmpFilename, filename)
+    
+def writeBluetoothCSV(filename, devices):
+    tmpFilename = filename + '.tmp' + str(threading.get_ident())
+    
+    try:
+        btOutputFile = open(tmpFilename, 'w')
+    except:
+        print('ERROR: Unable to write to bluetooth file ' + filename)
+        return
+
+    btOutputFile.write('uuid,Address,Name,Company,Manufacturer,Type,RSSI,TX Power,Strongest RSSI,Est Range (m),Last Seen,GPS Valid,Latitude,Longitude,Altitude,Speed,Strongest GPS Valid,Strongest Latitude,Strongest Longitude,Strongest Altitude,Strongest Speed\n')
+
+    for curData in devices:
+        btType = ""
+        if curData.btType == BluetoothDevice.BT_LE:
+            btType = "BTLE"
+        else:
+            btType = "Classic"
+            
+        if curData.txPowerValid:
+            txPower = str(curData.txPower)
+        else:
+            txPower = 'Unknown'
+            
+        btOutputFile.write(curData.uuid  + ',' + curData.macAddress + ',"' + curData.name + '","' + curData.company + '","' + curData.manufacturer)
+        btOutputFile.write('","' + btType + '",' + str(curData.rssi) + ',' + str(curData.strongestRssi) + ',' + txPower + ',' + str(curData.iBeaconRange) + ',' +
+                                curData.getLastSeenString() + ',' + 
+                                str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
+                                str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
+
+    btOutputFile.close()
+    os.replace(tmpFilename, filename)
 
 def restartAgent():
     global bluetooth
@@ -333,6 +827,18 @@ def getOUIDB():
         
     return ouidb
 
+def lookupVendor(ouiLookupEngine, macAddr):
+    clientVendor = ""
+    
+    if hasOUILookup:
+        try:
+            if ouiLookupEngine:
+                clientVendor = ouiLookupEngine.get_manuf(macAddr)
+        except:
+            clientVendor = ""
+        
+    return clientVendor
+
 # ------------------  File  ------------------------------
 class FileSystemFile(object):
     def __init__(self):
@@ -511,8 +1017,6 @@ class AutoAgentScanThread(Thread):
         self.signalStop = False
         self.scanDelay = 0.5  # seconds
         self.threadRunning = False
-        self.discoveredNetworks = {}
-        self.discoveredBluetoothDevices = {}
         self.daemon = True
         
         try:
@@ -526,25 +1030,194 @@ class AutoAgentScanThread(Thread):
         self.ouiLookupEngine = getOUIDB()
         
         if interface not in lockList.keys():
-            lockList[interface] = Lock()
+            lockList[interface] = TimedLock('lockList')
             
         if  not os.path.exists('./recordings'):
             os.makedirs('./recordings')
             
+        # Held while a segment is closed and the next one started, so a download doesn't export half of each
+        self.segmentLock = Lock()
+        self.segmentStart = 0.0
+        self.scanCount = 0
+        self.diskState = DISK_OK
+        self.lastDiskCheck = 0.0
+        
+        self.startSegment()
+        
+    def getSegmentFilename(self, now, recordType, extension):
+        filename = './recordings/' + self.hostname  + '_' + recordType + '_' + str(now.year) + "-" + TwoDigits(str(now.month)) + "-" + TwoDigits(str(now.day))
+        filename += "_" + TwoDigits(str(now.hour)) + "_" + TwoDigits(str(now.minute)) + "_" + TwoDigits(str(now.second)) + extension
+        
+        return filename
+        
+    def startSegment(self):
         now = datetime.datetime.now()
         
-        self.filename = './recordings/' + self.hostname  + '_wifi_' + str(now.year) + "-" + TwoDigits(str(now.month)) + "-" + TwoDigits(str(now.day))
-        self.filename += "_" + TwoDigits(str(now.hour)) + "_" + TwoDigits(str(now.minute)) + "_" + TwoDigits(str(now.second)) + ".csv"
-
-        self.btfilename = './recordings/' + self.hostname  + '_bt_' + str(now.year) + "-" + TwoDigits(str(now.month)) + "-" + TwoDigits(str(now.day))
-        self.btfilename += "_" + TwoDigits(str(now.hour)) + "_" + TwoDigits(str(now.minute)) + "_" + TwoDigits(str(now.second)) + ".csv"
-
-        if hasBluetooth:
-            print('Capturing on ' + interface + ' and writing wifi to ' + self.filename)
-            print('and writing bluetooth to ' + self.btfilename)
+        self.filename = self.getSegmentFilename(now, 'wifi', '.csv')
+        self.btfilename = self.getSegmentFilename(now, 'bt', '.csv')
+        self.dbfilename = self.getSegmentFilename(now, 'survey', DB_EXTENSION)
+        
+        # A segment only has what was heard while it was open
+        self.discoveredNetworks = NetworkStore()
+        self.discoveredBluetoothDevices = BluetoothStore()
+        self.segmentStart = time.monotonic()
+        self.segmentStartEpoch = time.time()
+        
+        # Each scan is appended to a journal.  The CSVs are only written when asked for (see compactRecording) and at the end.
+        self.journal = ObservationJournal(self.filename + JOURNAL_EXTENSION, WirelessNetwork)
+        self.btJournal = ObservationJournal(self.btfilename + JOURNAL_EXTENSION, BluetoothDevice)
+        self.btJournaled = False
+        
+        if recordFormat == RECORD_FORMAT_SQLITE:
+            # Or each scan is a transaction in the survey database and there are no CSVs
+            self.recorder = SQLiteRecorder(self.dbfilename)
+            print('Capturing on ' + self.interface + ' and writing to ' + self.dbfilename)
+        else:
+            self.recorder = None
+            
+            if hasBluetooth:
+                print('Capturing on ' + self.interface + ' and writing wifi to ' + self.filename)
+                print('and writing bluetooth to ' + self.btfilename)
+            else:
+                print('Capturing on ' + self.interface + ' and writing wifi to ' + self.filename)
+                
+    def getSegmentFiles(self):
+        # What the current segment leaves behind once it's closed
+        if self.recorder is not None:
+            return [self.dbfilename]
+            
+        retVal = []
+        
+        if self.journal.journalFile is not None:
+            retVal.append(self.filename)
+            
+        if self.btJournal.journalFile is not None:
+            retVal.append(self.btfilename)
+            
+        return retVal
+        
+    def getLiveFiles(self):
+        # Names the open segment is listed under
+        return [os.path.basename(curFile) for curFile in self.getSegmentFiles()]
+        
+    def getLiveEntries(self, recordingsDir):
+        # Catalog entries for the open segment if it's being written to recordingsDir.  Sizes are what's on disk so far.
+        retVal = []
+        
+        for curFilename in self.getLiveFiles():
+            if self.recorder is not None:
+                diskFiles = [curFilename, curFilename + '-wal']
+            else:
+                diskFiles = [curFilename + JOURNAL_EXTENSION]
+                
+            curEntry = RecordingEntry()
+            curEntry.filename = curFilename
+            curEntry.fileFormat, curEntry.compression = getFileFormat(curFilename)
+            curEntry.firstSeen = self.segmentStartEpoch
+            curEntry.lastSeen = time.time()
+            curEntry.recording = True
+            curEntry.size = 0
+            
+            try:
+                curEntry.setFileStats(recordingsDir + '/' + diskFiles[0])
+                
+                for curDiskFile in diskFiles[1:]:
+                    if os.path.isfile(recordingsDir + '/' + curDiskFile):
+                        curEntry.size += os.path.getsize(recordingsDir + '/' + curDiskFile)
+            except:
+                continue
+                
+            retVal.append(curEntry)
+            
+        return retVal
+        
+    def getSegmentSize(self):
+        if self.recorder is not None:
+            return self.recorder.getSize()
         else:
-            print('Capturing on ' + interface + ' and writing wifi to ' + self.filename)
+            return self.journal.getSize() + self.btJournal.getSize()
+            
+    def isSegmentFull(self):
+        if (recordSegmentSeconds > 0) and (time.monotonic() - self.segmentStart >= recordSegmentSeconds):
+            return True
+            
+        if (recordSegmentBytes > 0) and (self.getSegmentSize() >= recordSegmentBytes):
+            return True
+            
+        return False
+        
+    def closeSegment(self):
+        closedFiles = self.getSegmentFiles()
+        self.compact()
+        
+        if (recordSegmentBytes > 0) or (recordSegmentSeconds > 0):
+            for curFile in closedFiles:
+                if os.path.isfile(curFile):
+                    getSegmentCompressor().addFile(curFile)
+                    
+    def rotateSegment(self):
+        self.segmentLock.acquire()
+        
+        try:
+            self.closeSegment()
+            self.startSegment()
+        finally:
+            self.segmentLock.release()
+            
+    def exportSegment(self, filename):
+        # Brings the file a download asked for up to date if it's this recording's open segment.  Returns False if it isn't.
+        self.segmentLock.acquire()
+        
+        try:
+            if self.recorder is not None:
+                if os.path.basename(self.dbfilename) == filename:
+                    # Fold the WAL in so the file sent is complete
+                    self.recorder.checkpoint()
+                    return True
+            elif os.path.basename(self.filename) == filename:
+                self.exportNetworks()
+                return True
+            elif os.path.basename(self.btfilename) == filename:
+                self.exportBluetoothDevices()
+                return True
+        finally:
+            self.segmentLock.release()
+            
+        return False
+        
+    def shouldWrite(self):
+        # The disk guard.  Checks free space every DISK_CHECK_INTERVAL seconds and says whether this scan gets written.
+        self.scanCount += 1
+        
+        if time.monotonic() - self.lastDiskCheck >= DISK_CHECK_INTERVAL:
+            self.lastDiskCheck = time.monotonic()
+            newState = getDiskState('./recordings', recordMinFreeBytes)
+            
+            if newState != self.diskState:
+                if newState == DISK_STOP:
+                    print('WARNING: Less than ' + str(int(recordMinFreeBytes / 1048576)) + ' MB free.  Recording paused until space is freed.')
+                elif newState == DISK_THIN:
+                    print('WARNING: Disk space is getting low.  Only recording every ' + str(THIN_SCAN_INTERVAL) + ' scans.')
+                else:
+                    print('Disk space is OK.  Recording every scan.')
+                    
+                self.diskState = newState
                 
+        if self.diskState == DISK_STOP:
+            return False
+        elif self.diskState == DISK_THIN:
+            return (self.scanCount % THIN_SCAN_INTERVAL) == 0
+        else:
+            return True
+            
+    def mergeNetworks(self, scanNetworks, gpsCoord):
+        # The store carries firstSeen forward and keeps the strongest signal/gps, everything else is updated.
+        for curNet in scanNetworks:
+            curNet.gps = gpsCoord
+            curNet.strongestgps = gpsCoord
+            
+        self.discoveredNetworks.upsert(scanNetworks)
+            
     def run(self):
         global lockList
         global hasBluetooth
@@ -552,7 +1225,7 @@ class AutoAgentScanThread(Thread):
         self.threadRunning = True
         
         if self.interface not in lockList.keys():
-            lockList[self.interface] = Lock()
+            lockList[self.interface] = TimedLock('lockList')
         
         curLock = lockList[self.interface]
         
@@ -563,68 +1236,62 @@ class AutoAgentScanThread(Thread):
         lastState = -1
         
         while (not self.signalStop):
-            # Scan all / normal mode
+            if useMavlink:
+                gpsCoord = GPSStatus()
+                gpsCoord.gpsInstalled = True
+                gpsCoord.gpsRunning = True
+                gpsCoord.isValid = mavlinkGPSThread.synchronized
+                gpsCoord.latitude = mavlinkGPSThread.latitude
+                gpsCoord.longitude = mavlinkGPSThread.longitude
+                gpsCoord.altitude = mavlinkGPSThread.altitude
+                gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
+            elif gpsEngine.gpsValid():
+                gpsCoord = gpsEngine.lastCoord
+                if useRPILeds  and (lastState !=SparrowRPi.LIGHT_STATE_ON):
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
+                    lastState = SparrowRPi.LIGHT_STATE_ON
+            else:
+                gpsCoord = GPSStatus()
+                if useRPILeds and (lastState !=SparrowRPi.LIGHT_STATE_HEARTBEAT) :
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+                    lastState = SparrowRPi.LIGHT_STATE_HEARTBEAT
+                    
+            # Scan all / normal mode.  Networks are parsed as iw prints them and merged as one batch at the end of the scan.
+            scanStream = WirelessEngine.scanForNetworksStreaming(self.interface)
+            scanNetworks = []
+            
             if (curLock):
                 curLock.acquire()
-            retCode, errString, wirelessNetworks = WirelessEngine.scanForNetworks(self.interface)
-            if (curLock):
-                curLock.release()
                 
-            if (retCode == 0):
-                if useMavlink:
-                    gpsCoord = GPSStatus()
-                    gpsCoord.gpsInstalled = True
-                    gpsCoord.gpsRunning = True
-                    gpsCoord.isValid = mavlinkGPSThread.synchronized
-                    gpsCoord.latitude = mavlinkGPSThread.latitude
-                    gpsCoord.longitude = mavlinkGPSThread.longitude
-                    gpsCoord.altitude = mavlinkGPSThread.altitude
-                    gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
-                elif gpsEngine.gpsValid():
-                    gpsCoord = gpsEngine.lastCoord
-                    if useRPILeds  and (lastState !=SparrowRPi.LIGHT_STATE_ON):
-                        SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
-                        lastState = SparrowRPi.LIGHT_STATE_ON
-                else:
-                    gpsCoord = GPSStatus()
-                    if useRPILeds and (lastState !=SparrowRPi.LIGHT_STATE_HEARTBEAT) :
-                        SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
-                        lastState = SparrowRPi.LIGHT_STATE_HEARTBEAT
-                    
-                # self.statusBar().showMessage('Scan complete.  Found ' + str(len(wirelessNetworks)) + ' networks')
-                if wirelessNetworks and (len(wirelessNetworks) > 0) and (not self.signalStop):
-                    for netKey in wirelessNetworks.keys():
-                        curNet = wirelessNetworks[netKey]
-                        curNet.gps.copy(gpsCoord)
-                        curNet.strongestgps.copy(gpsCoord)
-                        
-                        curKey = curNet.getKey()
-                        if curKey not in self.discoveredNetworks.keys():
-                            self.discoveredNetworks[curKey] = curNet
-                        else:
-                            # Network exists, need to update it.
-                            pastNet = self.discoveredNetworks[curKey]
-                            # Need to save strongest gps and first seen.  Everything else can be updated.
-                            # Carry forward firstSeen
-                            curNet.firstSeen = pastNet.firstSeen # This is one field to carry forward
-                            
-                            # Check strongest signal
-                            if pastNet.strongestsignal > curNet.signal:
-                                curNet.strongestsignal = pastNet.strongestsignal
-                                curNet.strongestgps.latitude = pastNet.strongestgps.latitude
-                                curNet.strongestgps.longitude = pastNet.strongestgps.longitude
-                                curNet.strongestgps.altitude = pastNet.strongestgps.altitude
-                                curNet.strongestgps.speed = pastNet.strongestgps.speed
-                                curNet.strongestgps.isValid = pastNet.strongestgps.isValid
-                                
-                            self.discoveredNetworks[curKey] = curNet
-                            
-                    if not self.signalStop:
-                        self.exportNetworks()
-        
-                    # Now if we have bluetooth running export these:
-                    if hasBluetooth and bluetooth.discoveryRunning():
-                        bluetooth.deviceLock.acquire()
+            try:
+                for curNet in scanStream:
+                    if self.signalStop:
+                        break
+                        
+                    scanNetworks.append(curNet)
+            finally:
+                if (curLock):
+                    curLock.release()
+                
+            writeScan = self.shouldWrite()
+            
+            if writeScan:
+                self.mergeNetworks(scanNetworks, gpsCoord)
+                
+            if (scanStream.retCode == 0):
+                # self.statusBar().showMessage('Scan complete.  Found ' + str(scanStream.numNetworks) + ' networks')
+                if (scanStream.numNetworks > 0) and (not self.signalStop) and writeScan:
+                    if self.recorder is not None:
+                        self.recorder.recordNetworks(scanNetworks, self.ouiLookup)
+                    else:
+                        self.journal.append(scanNetworks)
+        
+                    # Now if we have bluetooth running export these:
+                    if hasBluetooth and bluetooth.discoveryRunning():
+                        # Copies taken under the lock, since discovery keeps updating the devices while they're written
+                        btObservations = []
+                        
+                        bluetooth.deviceLock.acquire()
                         
                         # Update GPS
                         now = datetime.datetime.now()
@@ -636,89 +1303,256 @@ class AutoAgentScanThread(Thread):
                             # This is a little bit of a hack for the BlueHydra side since it can take a while to see devices or have
                             # them show up in the db.  For LE discovery scans this will always be pretty quick.
                             if elapsedTime.total_seconds() < 120:
-                                curDevice.gps.copy(gpsCoord)
+                                curDevice.gps = gpsCoord
                                 if curDevice.rssi >= curDevice.strongestRssi:
                                     curDevice.strongestRssi = curDevice.rssi
-                                    curDevice.strongestgps.copy(gpsCoord)
-                        # export
-                        self.exportBluetoothDevices(bluetooth.devices)
+                                    curDevice.strongestgps = gpsCoord
+                                    
+                            if (elapsedTime.total_seconds() < 120) or (not self.btJournaled):
+                                # Just heard, or already known when the recording started
+                                storedDevice = BluetoothDevice()
+                                storedDevice.copy(curDevice)
+                                btObservations.append(storedDevice)
+                                
+                        self.discoveredBluetoothDevices.upsert(bluetooth.devices)
                         bluetooth.deviceLock.release()
+                        
+                        # Only what was just heard goes to the journal
+                        if self.recorder is not None:
+                            self.recorder.recordBluetoothDevices(btObservations)
+                        else:
+                            self.btJournal.append(btObservations)
+                            
+                        self.btJournaled = True
                     
+            if (not self.signalStop) and self.isSegmentFull():
+                self.rotateSegment()
+                
             sleep(self.scanDelay)
               
         if hasBluetooth:
             # Start normal discovery
             bluetooth.stopDiscovery()
             
+        self.segmentLock.acquire()
+        self.closeSegment()
+        self.segmentLock.release()
+        
         self.threadRunning = False
         
     def ouiLookup(self, macAddr):
-        clientVendor = ""
+        return lookupVendor(self.ouiLookupEngine, macAddr)
+
+    def exportBluetoothDevices(self):
+        writeBluetoothCSV(self.btfilename, self.discoveredBluetoothDevices.iterDevices())
         
-        if hasOUILookup:
-            try:
-                if self.ouiLookupEngine:
-                    clientVendor = self.ouiLookupEngine.get_manuf(macAddr)
-            except:
-                clientVendor = ""
+    def exportNetworks(self):
+        writeNetworksCSV(self.filename, self.discoveredNetworks.iterNetworks(), self.ouiLookup)
+        
+    def compact(self):
+        # Writes the final CSVs from memory.  The journals aren't needed after that.  Each finished file goes in
+        # the catalog with a summary of what's in it.
+        if self.recorder is not None:
+            summary = self.recorder.getSummary()
+            self.recorder.close()
+            getRecordingCatalog().addFile(os.path.basename(self.dbfilename), summary)
             
-        return clientVendor
-
-    def exportBluetoothDevices(self, devices):
+        if self.journal.journalFile is not None:
+            self.exportNetworks()
+            self.journal.remove()
+            
+            summary = RecordingSummary()
+            summary.addRecords(self.discoveredNetworks.iterNetworks())
+            getRecordingCatalog().addFile(os.path.basename(self.filename), summary)
+            
+        if self.btJournal.journalFile is not None:
+            self.exportBluetoothDevices()
+            self.btJournal.remove()
+            
+            summary = RecordingSummary()
+            summary.addRecords(self.discoveredBluetoothDevices.iterDevices())
+            getRecordingCatalog().addFile(os.path.basename(self.btfilename), summary)
+        
+# ------------------  Background scan thread  ------------------------------
+class BackgroundScanSnapshot(object):
+    # What a background scanner has heard.  Replaced whole after each scan, never changed, so handlers can
+    # read one without a lock.
+    def __init__(self, networks=None, retCode=0, errString="", scanTime=0.0):
+        if networks is None:
+            self.networks = []
+        else:
+            self.networks = networks
+            
+        self.retCode = retCode
+        self.errString = errString
+        # time.time() the last scan finished, 0 before the first one
+        self.scanTime = scanTime
+        
+class BackgroundScanThread(Thread):
+    # Scans an interface back to back whether or not anyone's asking (--backgroundscan), so /wireless/networks
+    # for it just sends the latest snapshot.  Like AutoAgentScanThread each scan is merged into a NetworkStore,
+    # which carries firstSeen forward and keeps the strongest signal and gps.  The snapshot is the merged networks
+    # heard in the last maxAge seconds.
+    def __init__(self, interface, maxAge):
+        global lockList
+        
+        super(BackgroundScanThread, self).__init__()
+        self.interface = interface
+        self.maxAge = maxAge
+        self.signalStop = False
+        self.scanDelay = 0.1  # seconds between scans so the radio isn't pinned
+        self.threadRunning = False
+        self.discoveredNetworks = NetworkStore()
+        self.snapshot = BackgroundScanSnapshot()
+        self.failures = 0
+        self.daemon = True
+        
+        if interface not in lockList.keys():
+            lockList[interface] = TimedLock('lockList')
+            
+    def scan(self):
+        gpsCoord = getCurrentGPS()
+        if gpsCoord is None:
+            gpsCoord = GPSStatus()
+            
+        scanStream = WirelessEngine.scanForNetworksStreaming(self.interface)
+        scanNetworks = []
+        
+        curLock = lockList[self.interface]
+        curLock.acquire()
+        
         try:
-            btOutputFile = open(self.btfilename, 'w')
-        except:
-            print('ERROR: Unable to write to bluetooth file ' + self.filename)
-            return
-
-        btOutputFile.write('uuid,Address,Name,Company,Manufacturer,Type,RSSI,TX Power,Strongest RSSI,Est Range (m),Last Seen,GPS Valid,Latitude,Longitude,Altitude,Speed,Strongest GPS Valid,Strongest Latitude,Strongest Longitude,Strongest Altitude,Strongest Speed\n')
-
-        for curKey in devices.keys():
-            curData = devices[curKey]
+            for curNet in scanStream:
+                if self.signalStop:
+                    return
+                    
+                scanNetworks.append(curNet)
+        finally:
+            curLock.release()
             
-            btType = ""
-            if curData.btType == BluetoothDevice.BT_LE:
-                btType = "BTLE"
-            else:
-                btType = "Classic"
+        if scanStream.retCode == 0:
+            for curNet in scanNetworks:
+                curNet.gps = gpsCoord
+                curNet.strongestgps = gpsCoord
                 
-            if curData.txPowerValid:
-                txPower = str(curData.txPower)
-            else:
-                txPower = 'Unknown'
+            self.discoveredNetworks.upsert(scanNetworks)
+            
+        oldestSeen = time.time() - self.maxAge
+        networks = [curNet for curNet in self.discoveredNetworks.iterNetworks() if curNet.lastSeenEpoch >= oldestSeen]
+        
+        if scanStream.retCode == 0:
+            scanTime = time.time()
+        else:
+            # Nothing new was heard, so the data is as old as the last scan that worked
+            scanTime = self.snapshot.scanTime
+            
+        self.snapshot = BackgroundScanSnapshot(networks, scanStream.retCode, scanStream.errString, scanTime)
+        
+    def run(self):
+        self.threadRunning = True
+        
+        while (not self.signalStop):
+            try:
+                self.scan()
+                self.failures = 0
+                sleep(self.scanDelay)
+            except:
+                # Keep scanning, backing off if it keeps failing
+                self.failures += 1
+                print('ERROR: Background scan on ' + self.interface + ' failed:')
+                traceback.print_exc()
+                sleep(min(2 ** self.failures, 30))
                 
-            btOutputFile.write(curData.uuid  + ',' + curData.macAddress + ',"' + curData.name + '","' + curData.company + '","' + curData.manufacturer)
-            btOutputFile.write('","' + btType + '",' + str(curData.rssi) + ',' + str(curData.strongestRssi) + ',' + txPower + ',' + str(curData.iBeaconRange) + ',' +
-                                    curData.lastSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + 
-                                    str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
-                                    str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
-
-        btOutputFile.close()
+        self.threadRunning = False
         
-    def exportNetworks(self):
-        try:
-            self.outputFile = open(self.filename, 'w')
-        except:
-            print('ERROR: Unable to write to wifi file ' + self.filename)
-            return
-
-        self.outputFile.write('macAddr,vendor,SSID,Security,Privacy,Channel,Frequency,Signal Strength,Strongest Signal Strength,Bandwidth,Last Seen,First Seen,GPS Valid,Latitude,Longitude,Altitude,Speed,Strongest GPS Valid,Strongest Latitude,Strongest Longitude,Strongest Altitude,Strongest Speed\n')
+class BackgroundScanWatchdog(Thread):
+    # BackgroundScanThread.run catches everything, but if one does die its snapshot would be served forever.
+    # Restarts it with what it had heard.
+    def __init__(self):
+        super(BackgroundScanWatchdog, self).__init__()
+        self.signalStop = False
+        self.checkDelay = 5.0  # seconds
+        self.threadRunning = False
+        self.daemon = True
+        
+    def run(self):
+        self.threadRunning = True
+        
+        while (not self.signalStop):
+            sleep(self.checkDelay)
+            
+            for curInterface in list(backgroundScanThreads.keys()):
+                curThread = backgroundScanThreads[curInterface]
+                
+                if (not curThread.is_alive()) and (not curThread.signalStop) and (not self.signalStop):
+                    print('ERROR: Background scan thread on ' + curInterface + ' stopped.  Restarting it.')
+                    newThread = BackgroundScanThread(curInterface, curThread.maxAge)
+                    newThread.discoveredNetworks = curThread.discoveredNetworks
+                    newThread.snapshot = curThread.snapshot
+                    backgroundScanThreads[curInterface] = newThread
+                    newThread.start()
+                    
+        self.threadRunning = False
         
-        for netKey in self.discoveredNetworks.keys():
-            curData = self.discoveredNetworks[netKey]
-            vendor = self.ouiLookup(curData.macAddr)
+def startBackgroundScans(interfaceList, maxAge):
+    global backgroundScanWatchdog
+    
+    interfaces = WirelessEngine.getInterfaces()
+    
+    for curInterface in interfaceList:
+        if curInterface in backgroundScanThreads:
+            continue
             
-            if vendor is None:
-                vendor = ''
+        if curInterface in interfaces:
+            backgroundScanThreads[curInterface] = BackgroundScanThread(curInterface, maxAge)
+            backgroundScanThreads[curInterface].start()
+            print('Background scanning on ' + curInterface)
+        else:
+            print('ERROR: Background scan was requested on ' + curInterface + ' but that interface was not found.')
             
-            self.outputFile.write(curData.macAddr  + ',' + vendor + ',"' + curData.ssid + '",' + curData.security + ',' + curData.privacy)
-            self.outputFile.write(',' + curData.getChannelString() + ',' + str(curData.frequency) + ',' + str(curData.signal) + ',' + str(curData.strongestsignal) + ',' + str(curData.bandwidth) + ',' +
-                                    curData.lastSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + curData.firstSeen.strftime("%m/%d/%Y %H:%M:%S") + ',' + 
-                                    str(curData.gps.isValid) + ',' + str(curData.gps.latitude) + ',' + str(curData.gps.longitude) + ',' + str(curData.gps.altitude) + ',' + str(curData.gps.speed) + ',' + 
-                                    str(curData.strongestgps.isValid) + ',' + str(curData.strongestgps.latitude) + ',' + str(curData.strongestgps.longitude) + ',' + str(curData.strongestgps.altitude) + ',' + str(curData.strongestgps.speed) + '\n')
-
-        self.outputFile.close()
+    if (len(backgroundScanThreads) > 0) and (backgroundScanWatchdog is None):
+        backgroundScanWatchdog = BackgroundScanWatchdog()
+        backgroundScanWatchdog.start()
         
+def stopBackgroundScans():
+    if backgroundScanWatchdog is not None:
+        backgroundScanWatchdog.signalStop = True
+        
+    for curThread in backgroundScanThreads.values():
+        curThread.signalStop = True
+        
+def getBackgroundSnapshot(interfaceName):
+    # The latest BackgroundScanSnapshot for an interface, or a comma-separated list of them merged (strongest
+    # reading wins), or None if any of them isn't background scanned
+    snapshots = []
+    
+    for curInterface in interfaceName.split(','):
+        curThread = backgroundScanThreads.get(curInterface)
+        if curThread is None:
+            return None
+            
+        snapshots.append(curThread.snapshot)
+        
+    if len(snapshots) == 1:
+        return snapshots[0]
+        
+    wirelessNetworks = {}
+    retCode = 0
+    errString = ""
+    
+    for curSnapshot in snapshots:
+        if (curSnapshot.retCode != 0) and (retCode == 0):
+            retCode = curSnapshot.retCode
+            errString = curSnapshot.errString
+            
+        for curNet in curSnapshot.networks:
+            curKey = curNet.getKey()
+            if (curKey not in wirelessNetworks) or (curNet.signal > wirelessNetworks[curKey].signal):
+                wirelessNetworks[curKey] = curNet
+                
+    # The merge is as old as its oldest scan
+    return BackgroundScanSnapshot(list(wirelessNetworks.values()), retCode, errString, min(curSnapshot.scanTime for curSnapshot in snapshots))
+    
 # ------------------  Announce thread  ------------------------------
 class AnnounceThread(Thread):
     def __init__(self, port):
@@ -791,10 +1625,180 @@ class MavlinkGPSThread(Thread):
                     
         self.threadRunning = False
 
+# ------------------  Live stream threads  ------------------------------
+class LiveScanThread(Thread):
+    def __init__(self, interfaceName, huntChannelList):
+        super(LiveScanThread, self).__init__()
+        self.signalStop = False
+        self.scanDelay = 0.1  # seconds between scans so the radio isn't pinned
+        self.threadRunning = False
+        self.interfaceName = interfaceName
+        self.huntChannelList = huntChannelList
+        self.streamKey = (interfaceName, tuple(huntChannelList))
+        # Client queues.  Changed under liveStreamLock.
+        self.subscribers = set()
+        self.daemon = True
+        
+    def run(self):
+        global lockList
+        
+        self.threadRunning = True
+        
+        while (not self.signalStop):
+            liveStreamLock.acquire()
+            if len(self.subscribers) == 0:
+                # Nobody listening.  Remove ourselves under the lock so a new client starts a new thread.
+                if liveScanThreads.get(self.streamKey) is self:
+                    del liveScanThreads[self.streamKey]
+                liveStreamLock.release()
+                break
+            liveStreamLock.release()
+            
+            if ',' in self.interfaceName:
+                # Each radio takes its own lock as it scans
+                curLock = None
+            else:
+                if self.interfaceName not in lockList.keys():
+                    lockList[self.interfaceName] = TimedLock('lockList')
+                    
+                curLock = lockList[self.interfaceName]
+                
+            if (curLock):
+                curLock.acquire()
+                
+            try:
+                # Networks go out to the clients as iw reports them
+                for chunk in WirelessEngine.getNetworksAsStream(self.interfaceName, getCurrentGPS(), self.huntChannelList, lockList, NdjsonNetworkEncoder()):
+                    if len(chunk) > 0:
+                        publishStreamLine(self.subscribers, chunk)
+            except:
+                pass
+            finally:
+                if (curLock):
+                    curLock.release()
+                    
+            sleep(self.scanDelay)
+            
+        self.threadRunning = False
+        
+class LiveStatusThread(Thread):
+    def __init__(self):
+        super(LiveStatusThread, self).__init__()
+        self.signalStop = False
+        self.checkDelay = 0.25  # seconds
+        self.threadRunning = False
+        # Client queue -> last GPS dict sent, and client queue -> bluetooth cursor.  Changed under liveStreamLock.
+        self.gpsSubscribers = {}
+        self.btSubscribers = {}
+        self.btChangeLog = ChangeLog()
+        self.daemon = True
+        
+    def setSubscriberState(self, subscribers, clientQueue, state):
+        # Only if the client hasn't left in the meantime
+        liveStreamLock.acquire()
+        if clientQueue in subscribers:
+            subscribers[clientQueue] = state
+        liveStreamLock.release()
+        
+    def sendGPS(self):
+        gpsCoord = getCurrentGPS()
+        
+        gpsdict = {}
+        if gpsCoord is not None:
+            gpsdict['isValid'] = gpsCoord.isValid
+            gpsdict['latitude'] = gpsCoord.latitude
+            gpsdict['longitude'] = gpsCoord.longitude
+            gpsdict['altitude'] = gpsCoord.altitude
+            gpsdict['speed'] = gpsCoord.speed
+        else:
+            gpsdict['isValid'] = False
+            
+        line = None
+        for curQueue in getStreamSubscribers(self.gpsSubscribers):
+            if self.gpsSubscribers.get(curQueue) != gpsdict:
+                if line is None:
+                    line = (json.dumps({'type': 'gps', 'gps': gpsdict}) + '\n').encode('UTF-8')
+                publishStreamLine([curQueue], line)
+                self.setSubscriberState(self.gpsSubscribers, curQueue, gpsdict)
+                
+        return gpsCoord
+        
+    def sendBluetooth(self, gpsCoord):
+        if (not hasBluetooth) or (not bluetooth.discoveryRunning()):
+            return
+            
+        bluetooth.updateDeviceList()
+        
+        bluetooth.deviceLock.acquire()
+        now = datetime.datetime.now()
+        for curKey in bluetooth.devices.keys():
+            curDevice = bluetooth.devices[curKey]
+            
+            # Same GPS tagging as /bluetooth/discoverystatus
+            if (gpsCoord is not None) and ((now - curDevice.lastSeen).total_seconds() < 120):
+                curDevice.gps = gpsCoord
+                if curDevice.rssi >= curDevice.strongestRssi:
+                    curDevice.strongestRssi = curDevice.rssi
+                    curDevice.strongestgps = gpsCoord
+                    
+            storedDevice = BluetoothDevice()
+            storedDevice.copy(curDevice)
+            self.btChangeLog.update(curKey, storedDevice, storedDevice.getSignature(), storedDevice.lastSeenEpoch)
+            
+        self.btChangeLog.expireMissing(bluetooth.devices)
+        bluetooth.deviceLock.release()
+        
+        # Clients that joined at different times are at different cursors.  Most share one, so build each line once.
+        lines = {}
+        for curQueue in getStreamSubscribers(self.btSubscribers):
+            since = self.btSubscribers.get(curQueue)
+            
+            if since not in lines:
+                full, cursor, changedDevices, expiredKeys = self.btChangeLog.getChanges(since)
+                if full or (len(changedDevices) > 0) or (len(expiredKeys) > 0):
+                    responsedict = {'type': 'bluetooth', 'full': full, 'expired': expiredKeys}
+                    responsedict['devices'] = [curDevice.toJsondict() for curDevice in changedDevices]
+                    lines[since] = (cursor, (json.dumps(responsedict) + '\n').encode('UTF-8'))
+                else:
+                    lines[since] = (cursor, None)
+                    
+            cursor, line = lines[since]
+            if line is not None:
+                publishStreamLine([curQueue], line)
+            self.setSubscriberState(self.btSubscribers, curQueue, cursor)
+            
+    def run(self):
+        global liveStatusThread
+        
+        self.threadRunning = True
+        
+        while (not self.signalStop):
+            liveStreamLock.acquire()
+            if (len(self.gpsSubscribers) == 0) and (len(self.btSubscribers) == 0):
+                if liveStatusThread is self:
+                    liveStatusThread = None
+                liveStreamLock.release()
+                break
+            liveStreamLock.release()
+            
+            try:
+                gpsCoord = self.sendGPS()
+                
+                if len(self.btSubscribers) > 0:
+                    self.sendBluetooth(gpsCoord)
+            except:
+                pass
+                
+            sleep(self.checkDelay)
+            
+        self.threadRunning = False
+
 class SparrowWiFiAgent(object):
     # See https://docs.python.org/3/library/http.server.html
     # For HTTP Server info
-    def run(self, port):
+    def run(self, port, serverMode='threaded', serverWorkers=4):
+        # serverMode 'threaded' is a thread per request.  'asyncio' serves connections on an event loop and runs
+        # the slow requests on serverWorkers threads (see sparrowasync.py).
         global useRPILeds
         global hackrf
         global bluetooth
@@ -802,7 +1806,20 @@ class SparrowWiFiAgent(object):
         
         server_address = ('', port)
         try:           # httpd = HTTPServer.HTTPServer(server_address, SparrowWiFiAgentRequestHandler)
-            httpd = MultithreadHTTPServer(server_address, SparrowWiFiAgentRequestHandler)
+            if serverMode == 'asyncio':
+                httpd = AsyncHTTPServer(SparrowWiFiAgentRequestHandler, port, ASYNC_INLINE_URLS, [('/wireless/stream/', sendLiveStreamAsync)], 
+                                                    serverWorkers, serverWorkers*4)
+                metrics.gauge('sparrow_http_busy_rejections', 'Requests turned away with a 503 because the worker queue was full', lambda: httpd.rejected)
+                metrics.gauge('sparrow_http_queue_depth', 'Requests waiting for a worker', httpd.getQueueDepth)
+                # asyncio doesn't bind until it starts, so check the port here to fail the same way
+                testSocket = socket(AF_INET, SOCK_STREAM)
+                testSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+                try:
+                    testSocket.bind(server_address)
+                finally:
+                    testSocket.close()
+            else:
+                httpd = MultithreadHTTPServer(server_address, SparrowWiFiAgentRequestHandler)
         except OSError as e:
             curTime = datetime.datetime.now()
             print('[' +curTime.strftime("%m/%d/%Y %H:%M:%S") + "] Unable to bind to port " + str(port) +  ". " + e.strerror)
@@ -813,7 +1830,7 @@ class SparrowWiFiAgent(object):
             
     
         curTime = datetime.datetime.now()
-        print('[' +curTime.strftime("%m/%d/%Y %H:%M:%S") + "] Starting Sparrow-wifi agent on port " + str(port))
+        print('[' +curTime.strftime("%m/%d/%Y %H:%M:%S") + "] Starting Sparrow-wifi agent on port " + str(port) + " (" + serverMode + " server)")
 
         if useRPILeds:
             SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
@@ -823,7 +1840,10 @@ class SparrowWiFiAgent(object):
         except KeyboardInterrupt:
             pass
     
-        httpd.server_close()
+        stopLiveStreams()
+        stopBackgroundScans()
+        if serverMode != 'asyncio':
+            httpd.server_close()
         
         if useRPILeds:
             SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_OFF)
@@ -844,9 +1864,167 @@ class SparrowWiFiAgent(object):
 class MultithreadHTTPServer(ThreadingMixIn, HTTPServer.HTTPServer):
     pass
 
+class ChunkedWriter(object):
+    # Stands in for the handler's wfile on keep-alive responses.  The handlers write their responses a piece at a
+    # time without knowing the length up front, so each write goes out as an HTTP/1.1 chunk.
+    def __init__(self, rawfile):
+        self.rawfile = rawfile
+        
+    def write(self, data):
+        # A zero-length chunk would end the response
+        if len(data) > 0:
+            self.rawfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+            
+        return len(data)
+        
+    def flush(self):
+        self.rawfile.flush()
+        
+    def finish(self):
+        self.rawfile.write(b'0\r\n\r\n')
+        self.rawfile.flush()
+        
 # ---------------  HTTP Request Handler --------------------
 # Sample handler: https://wiki.python.org/moin/BaseHttpServer
 class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive so clients don't pay a TCP handshake on every poll.  Responses without a Content-Length are
+    # chunked (see end_headers), and idle connections are dropped after timeout seconds.
+    protocol_version = 'HTTP/1.1'
+    timeout = 60
+    # Responses go out in several small writes.  With Nagle on, each kept-alive request stalls on the client's delayed ACK.
+    disable_nagle_algorithm = True
+    
+    def handle_one_request(s):
+        s.chunkedWriter = None
+        s.compressWriter = None
+        s.hasContentLength = False
+        s.hasContentEncoding = False
+        s.contentType = ''
+        s.route = None
+        # Under the chunked and compress writers, so it's what actually goes out
+        byteCounter = ByteCountingWriter(s.wfile)
+        s.wfile = byteCounter
+        
+        super().handle_one_request()
+        
+        if s.compressWriter is not None:
+            s.wfile = s.compressWriter.rawfile
+            try:
+                s.compressWriter.finish()
+            except:
+                s.close_connection = True
+                
+            s.compressWriter = None
+            
+        if s.chunkedWriter is not None:
+            s.wfile = s.chunkedWriter.rawfile
+            try:
+                s.chunkedWriter.finish()
+            except:
+                s.close_connection = True
+                
+            s.chunkedWriter = None
+            
+        s.wfile = byteCounter.rawfile
+        
+        if byteCounter.bytesWritten > 0:
+            # Unmatched paths all count as one so a scan for URLs can't add endless series
+            if s.route is not None:
+                labelValues = (s.route.path,)
+            else:
+                labelValues = ('other',)
+                
+            httpRequests.inc(1, labelValues)
+            httpBytesSent.inc(byteCounter.bytesWritten, labelValues)
+            
+    def send_header(s, keyword, value):
+        if keyword.lower() == 'content-length':
+            s.hasContentLength = True
+        elif keyword.lower() == 'content-encoding':
+            s.hasContentEncoding = True
+        elif keyword.lower() == 'content-type':
+            s.contentType = value
+            
+        super().send_header(keyword, value)
+        
+    def end_headers(s):
+        # JSON written a piece at a time is compressed on the way out if the client takes it.  Responses with a
+        # Content-Length went through sendBody, which does its own.
+        if ((s.compressWriter is None) and s.contentType.startswith('application/json') and (not s.hasContentEncoding) and 
+            (not s.hasContentLength) and (s.command != 'HEAD')):
+            encoding = negotiateEncoding(s.headers.get('Accept-Encoding'))
+        else:
+            encoding = ENCODING_IDENTITY
+            
+        if encoding != ENCODING_IDENTITY:
+            super().send_header('Content-Encoding', encoding)
+            super().send_header('Vary', 'Accept-Encoding')
+            
+        # HTTP/1.0 clients and responses ending in a close are delimited by the close like before
+        if ((s.request_version == 'HTTP/1.1') and (s.command != 'HEAD') and (not s.close_connection) and 
+            (not s.hasContentLength) and (s.chunkedWriter is None)):
+            super().send_header('Transfer-Encoding', 'chunked')
+            super().end_headers()
+            s.chunkedWriter = ChunkedWriter(s.wfile)
+            s.wfile = s.chunkedWriter
+        else:
+            super().end_headers()
+            
+        if encoding != ENCODING_IDENTITY:
+            s.compressWriter = StreamCompressor(s.wfile, encoding, s.getEndpoint(), compressionStats)
+            s.wfile = s.compressWriter
+            
+    def getEndpoint(s):
+        # Name responses are counted under in the stats:  the route, or the path without parameters
+        if s.route is not None:
+            return s.route.path
+        else:
+            return s.path.split('?')[0]
+            
+    def sendBody(s, contentType, rawBody, extraHeaders=None, cacheKey=None):
+        # Sends a whole 200 response with a Content-Length, compressed if it's JSON and the client takes it.  With a
+        # cacheKey (which has to change whenever the data does) the encoded body is kept in responseCache, and rawBody
+        # can be a function that builds the body so it's only called on a miss.
+        if contentType.startswith('application/json'):
+            encoding = negotiateEncoding(s.headers.get('Accept-Encoding'))
+        else:
+            encoding = ENCODING_IDENTITY
+            
+        body = None
+        if cacheKey is not None:
+            cacheKey = (cacheKey, contentType, encoding)
+            body = responseCache.get(cacheKey)
+            
+        if body is not None:
+            compressionStats.addResponse(s.getEndpoint(), 0, 0, 0.0, True)
+        else:
+            if callable(rawBody):
+                rawBody = rawBody()
+                
+            if encoding != ENCODING_IDENTITY:
+                startTime = time.thread_time()
+                body = compressBytes(rawBody, encoding)
+                compressionStats.addResponse(s.getEndpoint(), len(rawBody), len(body), time.thread_time() - startTime)
+            else:
+                body = rawBody
+                
+            if cacheKey is not None:
+                responseCache.put(cacheKey, body)
+                
+        s.send_response(200)
+        s.send_header("Content-type", contentType)
+        if encoding != ENCODING_IDENTITY:
+            s.send_header("Content-Encoding", encoding)
+            s.send_header("Vary", "Accept-Encoding")
+        if extraHeaders is not None:
+            for curKey, curValue in extraHeaders:
+                s.send_header(curKey, curValue)
+        s.send_header("Content-Length", str(len(body)))
+        s.end_headers()
+        
+        s.wfile.write(body)
+        
+
     def do_HEAD(s):
         s.send_response(200)
         s.send_header("Content-type", "text/html")
@@ -856,6 +2034,9 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
         global runningcfg
         global falconWiFiRemoteAgent
         
+        # Some of the error paths below don't read the posted data, which would be taken as the next request
+        s.close_connection = True
+        
         if len(s.client_address) == 0:
             # This should have the connecting client IP.  If this isn't at least 1, something is wrong
             return
@@ -1286,56 +2467,56 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
         
         return False
         
-    def isValidGetURL(s):
-        # Full urls
-        allowedfullurls = ['/wireless/interfaces', 
-                                    '/wireless/moninterfaces', 
-                                    '/falcon/getscanresults',
-                                    '/falcon/getalldeauths', 
-                                    '/system/getrecordings',
-                                    '/bluetooth/present', 
-                                   '/bluetooth/scanstart', 
-                                  '/bluetooth/scanstop',  
-                                  '/bluetooth/scanstatus',  
-                                  '/bluetooth/running', 
-                                  '/bluetooth/beaconstart', 
-                                  '/bluetooth/beaconstop', 
-                                  '/bluetooth/discoverystartp', 
-                                  '/bluetooth/discoverystarta', 
-                                  '/bluetooth/discoverystop', 
-                                  '/bluetooth/discoverystatus', 
-                                  '/spectrum/scanstart24', 
-                                  '/spectrum/scanstart5', 
-                                  '/spectrum/scanstop', 
-                                  '/spectrum/scanstatus', 
-                                  '/spectrum/hackrfstatus', 
-                                    '/gps/status']
-                                    
-        # partials that have more in the URL
-        allowedstarturls=['/wireless/networks/', 
-                                    '/falcon/startmonmode/', 
-                                    '/falcon/stopmonmode/', 
-                                    '/falcon/scanrunning/', 
-                                    '/falcon/startscan/', 
-                                    '/falcon/stopscan/', 
-                                    '/falcon/stopalldeauths', 
-                                    '/falcon/crackstatuswpapsk', 
-                                    '/falcon/crackstatuswep', 
-                                    '/falcon/stopcrack', 
-                                    '/system/config', 
-                                    '/system/startrecord', 
-                                    '/system/stoprecord', 
-                                    '/system/getrecording']
+    def sendLiveStream(s):
+        # /wireless/stream/<interface>[?frequencies=<list>][&bluetooth=1]
+        # Long-lived NDJSON response.  network lines come as the agent's scanner hears them with a scan line closing
+        # out each scan (see NdjsonNetworkEncoder), gps lines when the fix changes, and with bluetooth=1 bluetooth
+        # lines with the devices that changed (full=true on the first).  Runs until the client disconnects.
+        fieldValue, huntChannelList, wantBluetooth = parseLiveStreamPath(s.path)
         
-        if s.path in allowedfullurls:
-            return True
-        else:
-            for curURL in allowedstarturls:
-                if s.path.startswith(curURL):
-                    return True
+        try:
+            s.send_response(200)
+            s.send_header("Content-type", NdjsonNetworkEncoder.contentType)
+            s.send_header("Cache-Control", "no-cache")
+            s.send_header("Connection", "close")
+            s.end_headers()
+        except:
+            return
+            
+        s.close_connection = True
         
-        return False
+        if len(fieldValue) == 0:
+            try:
+                s.wfile.write(NdjsonNetworkEncoder().end(5, "Error parsing interface.  Identified interface: " + fieldValue, {}))
+            except:
+                pass
+            return
+            
+        clientQueue = StreamQueue(STREAM_QUEUE_LIMIT)
+        subscribeLiveStream(clientQueue, fieldValue, huntChannelList, wantBluetooth)
         
+        try:
+            while not liveStreamsStopping:
+                try:
+                    lines = [clientQueue.get(timeout=STREAM_KEEPALIVE)]
+                except queue.Empty:
+                    lines = [b'{"type": "keepalive"}\n']
+                    
+                # Whatever else has queued up goes out in the same write
+                while len(lines) < 256:
+                    try:
+                        lines.append(clientQueue.get_nowait())
+                    except queue.Empty:
+                        break
+                        
+                s.wfile.write(b''.join(lines))
+                s.wfile.flush()
+        except:
+            # Client went away
+            pass
+        finally:
+            unsubscribeLiveStream(clientQueue)
+            
     def sendFile(s, passedfilename):
         # Directory traversal safety check
         dirname, runfilename = os.path.split(os.path.abspath(__file__))
@@ -1344,7 +2525,11 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
 
         fullPath = recordingsDir + '/' + filename
         
-        if not os.path.isfile(fullPath):
+        # The catalog's index, journals and the like aren't recordings and aren't served
+        if isRecordingFile(filename):
+            compactRecording(filename)
+            
+        if (not isRecordingFile(filename)) or (not os.path.isfile(fullPath)):
             s.send_response(400)
             s.send_header("Content-type", "application/json")
             s.end_headers()
@@ -1368,85 +2553,414 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
             s.wfile.write(jsonstr.encode("UTF-8"))
             return
             
+        fileStat = os.fstat(f.fileno())
+        fileSize = fileStat.st_size
+        etag, lastModified = getFileValidators(fileStat)
+        
+        # A file that's still being recorded changes under the client so it's only ever sent whole.  A resume
+        # (If-Range) for a file that's changed since gets the whole new file too.
+        liveFile = isLiveRecording(filename)
+        rangeHeader = s.headers.get('Range')
+        ifRange = s.headers.get('If-Range')
+        
+        if liveFile or ((ifRange is not None) and (ifRange.strip() not in [etag, lastModified])):
+            rangeHeader = None
+            
+        byteRange = getByteRange(rangeHeader, fileSize)
+        
+        if byteRange is None:
+            f.close()
+            s.send_response(416)
+            s.send_header("Content-Range", "bytes */" + str(fileSize))
+            s.send_header("Content-Length", "0")
+            s.end_headers()
+            return
+            
+        first, last, partial = byteRange
+        
         fileExtension = filename.split(".")[-1]
         
         if fileExtension in ['txt', 'csv', 'json', 'xml']:
             contentType = 'text/plain'
         elif fileExtension == 'html':
             contentType = 'text/html'
+        elif fileExtension == 'gz':
+            # Compressed segment.  Sent as is, the client unzips it.
+            contentType = 'application/gzip'
         else:
             contentType = 'application/octet-stream'
             
-        s.send_response(200)
+        if partial:
+            s.send_response(206)
+            s.send_header("Content-Range", "bytes " + str(first) + "-" + str(last) + "/" + str(fileSize))
+        else:
+            s.send_response(200)
+            
         #s.send_header("Content-type", "text/html")
         s.send_header("Content-type", contentType)
+        s.send_header("Content-Length", str(last - first + 1))
+        if not liveFile:
+            s.send_header("Accept-Ranges", "bytes")
+            s.send_header("ETag", etag)
+            s.send_header("Last-Modified", lastModified)
         s.end_headers()
 
         try:
-            s.wfile.write(f.read())
+            s.sendFileRange(f, first, last - first + 1)
         except:
-            pass
+            # Client went away.  It can pick up where it left off with a Range request.
+            s.close_connection = True
             
         f.close()
         
         return
         
-    def do_GET(s):
-        global gpsEngine
-        global useMavlink
-        global mavlinkGPSThread
-        global lockList
-        global allowedIPs
-        global runningcfg
-        global falconWiFiRemoteAgent
-        global hasBluetooth
-        global hasUbertooth
-        global bluetooth
+    def sendFileRange(s, f, offset, count):
+        # The threaded server has the client's socket, so the kernel copies the file straight to it (sendfile) without
+        # it passing through here.  The asyncio server's wfile has no socket and gets it in chunks.
+        if count <= 0:
+            return
+            
+        s.wfile.flush()
         
-        # For RPi LED's, using it during each get request wasn't completely working.  Short transactions like
-        # status and interface list were so quick the light would get "confused" and stay off.  So
-        # the LED is only used for long calls like scan
+        if isinstance(s.request, socket):
+            sent = s.request.sendfile(f, offset, count)
+            
+            if isinstance(s.wfile, ByteCountingWriter):
+                s.wfile.bytesWritten += sent
+                
+            if sent < count:
+                raise ConnectionError('Client disconnected')
+        else:
+            f.seek(offset)
+            remaining = count
+            
+            while remaining > 0:
+                chunk = f.read(min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError('File truncated while sending')
+                    
+                s.wfile.write(chunk)
+                remaining -= len(chunk)
         
-        if len(s.client_address) == 0:
-            # This should have the connecting client IP.  If this isn't at least 1, something is wrong
+    def handleInterfaces(s):
+        wirelessInterfaces = WirelessEngine.getInterfaces()
+        jsondict={}
+        jsondict['interfaces']=wirelessInterfaces
+        jsonstr = json.dumps(jsondict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleNetworks(s):
+        # THIS IS THE NORMAL SCAN
+        if acceptsBinary(s.headers['Accept']):
+            encoder = BinaryNetworkEncoder()
+        else:
+            encoder = JsonNetworkEncoder()
+            
+        inputstr = s.path.replace('/wireless/networks/', '')
+        # Sanitized by the route's parameter pattern.  A comma-separated list scans with several radios at once
+        fieldValue = s.route.getParam(s.path)
+
+        if len(fieldValue) == 0:
+            if useRPILeds:
+                # Green will heartbeat when servicing requests. Turn back solid here
+                SparrowRPi.greenLED(LIGHT_STATE_ON)
+                
+            try:
+                s.send_response(200)
+                s.send_header("Content-type", encoder.contentType)
+                s.end_headers()
+            except:
+                pass
+                
+            errmsg = "Error parsing interface.  Identified interface: " + fieldValue
+            if encoder.contentType == JsonNetworkEncoder.contentType:
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = errmsg
+                responsebytes = json.dumps(responsedict).encode("UTF-8")
+            else:
+                responsebytes = encoder.begin() + encoder.end(5, errmsg, {'latitude': 0.0, 'longitude': 0.0, 'altitude': 0.0, 'speed': 0.0})
+            try:
+                s.wfile.write(responsebytes)
+            except:
+                pass
             return
+        
+        if '?' in inputstr:
+            splitlist = inputstr.split('?')
+            curInterface = splitlist[0]
+        else:
+            curInterface = inputstr
             
         try:
-            # If the pipe gets broken mid-stream it'll throw an exception
-            if len(allowedIPs) > 0:
-                if s.client_address[0] not in allowedIPs:
-                    try:
-                        s.send_response(403)
-                        s.send_header("Content-type", "text/html")
-                        s.end_headers()
-                        s.wfile.write("<html><body><p>Connections not authorized from your IP address</p>".encode("utf-8"))
-                        s.wfile.write("</body></html>".encode("UTF-8"))
-                    except:
-                        pass
-                    if useRPILeds:
-                    # Green will heartbeat when servicing requests. Turn back solid here
-                        SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
-                    return
+            channelStr = FREQUENCIES_PATTERN.search(inputstr).group(1).split('&')[0]
+        except:
+            channelStr = ""
 
-            if not s.isValidGetURL():
+        huntChannelList = []
+        
+        if ',' in channelStr:
+            tmpList = channelStr.split(',')
+        else:
+            tmpList = []
+        
+        if len(tmpList) > 0:
+            for curItem in tmpList:
                 try:
-                    s.send_response(404)
-                    s.send_header("Content-type", "text/html")
-                    s.end_headers()
-                    s.wfile.write("<html><body><p>Bad Request</p>".encode("utf-8"))
-                    s.wfile.write("</body></html>".encode("UTF-8"))
+                    if len(curItem) > 0:
+                        huntChannelList.append(int(curItem))
+                        # Get results for the specified interface
+                        # Need to iterate through the channels and aggregate the results
                 except:
                     pass
+
+        if useRPILeds:
+            # Green will heartbeat when servicing requests
+            SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_OFF)
+            sleep(0.1)
+            
+        if ',' in fieldValue:
+            # Each radio takes its own lock as it scans
+            curLock = None
+        else:
+            if curInterface not in lockList.keys():
+                lockList[curInterface] = TimedLock('lockList')
+            
+            curLock = lockList[curInterface]
+        
+        since = getSinceCursor(inputstr)
+        if since is not None:
+            encoder = DeltaNetworkEncoder(encoder, getWifiChangeLog(fieldValue), since)
+            
+        if useMavlink:
+            gpsCoord = GPSStatus()
+            gpsCoord.gpsInstalled = True
+            gpsCoord.gpsRunning = True
+            gpsCoord.isValid = mavlinkGPSThread.synchronized
+            gpsCoord.latitude = mavlinkGPSThread.latitude
+            gpsCoord.longitude = mavlinkGPSThread.longitude
+            gpsCoord.altitude = mavlinkGPSThread.altitude
+            gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
+        elif gpsEngine.gpsValid():
+            gpsCoord = gpsEngine.lastCoord
+            if useRPILeds:
+                SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
+        else:
+            gpsCoord = None
+            if useRPILeds:
+                SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+            
+        snapshot = getBackgroundSnapshot(fieldValue)
+        if snapshot is not None:
+            # Background scanned.  Send what it has, for just the hunt frequencies if there are any.
+            if len(huntChannelList) > 0:
+                networks = [curNet for curNet in snapshot.networks if curNet.frequency in huntChannelList]
+            else:
+                networks = snapshot.networks
+                
+            if snapshot.scanTime > 0.0:
+                ageHeader = ('Age', str(int(max(time.time() - snapshot.scanTime, 0.0))))
+            else:
+                ageHeader = ('Age', '0')
+                
+            if since is None:
+                # Everyone polling this snapshot gets the same body, so it's only encoded once
+                cacheKey = ('/wireless/networks/', fieldValue, tuple(huntChannelList), snapshot.scanTime)
+            else:
+                cacheKey = None
+                
+            try:
+                s.sendBody(encoder.contentType, lambda: b''.join(WirelessEngine.getNetworkListAsStream(networks, snapshot, gpsCoord, encoder)), 
+                              [ageHeader], cacheKey)
+            except:
+                pass
+                
+            return
+            
+        # Join a scan of the same interface and frequencies that's already running (or finished within the
+        # scan cache TTL) rather than queuing on the interface lock for another one
+        flight, isLeader = scanCache.joinScan(fieldValue, huntChannelList)
+        
+        try:
+            s.sendScanFlight(flight, isLeader, encoder, since, gpsCoord, lockList, curLock)
+        finally:
+            if not isLeader:
+                scanCache.leaveScan(flight)
+                
+    def sendScanFlight(s, flight, isLeader, encoder, since, gpsCoord, lockList, curLock):
+        if (not isLeader) and flight.done and (since is None):
+            # A cached scan.  Encode it once for everyone who asks.
+            cacheKey = ('/wireless/networks/', ScanCache.getKey(flight.interfaceName, flight.huntChannelList), flight.finishTime)
+            try:
+                s.sendBody(encoder.contentType, lambda: b''.join(scanCache.getNetworksAsStream(flight, False, gpsCoord, lockList, encoder)), 
+                              [('Age', str(int(flight.getAge())))], cacheKey)
+            except:
+                pass
+                
+            return
+            
+        try:
+            s.send_response(200)
+            s.send_header("Content-type", encoder.contentType)
+            # Seconds since the scan finished.  0 for a scan that's still running.
+            s.send_header("Age", str(int(flight.getAge())))
+            s.end_headers()
+        except:
+            pass
+            
+        try:
+            # Write each network out as iw reports it rather than waiting on the whole scan
+            for chunk in scanCache.getNetworksAsStream(flight, isLeader, gpsCoord, lockList, encoder, curLock):
+                s.wfile.write(chunk)
+        except (ConnectionError, TimeoutError):
+            # Client went away part way through
+            s.close_connection = True
+        except Exception as e:
+            # The response is cut short, so the client can only tell from the connection closing
+            print('ERROR: ' + s.path + ' failed part way through: ' + str(e))
+            s.close_connection = True
+        
+    def handleGPSStatus(s):
+        jsondict={}
+        
+        if not useMavlink:
+            jsondict['gpsinstalled'] = str(GPSEngine.GPSDInstalled())
+            jsondict['gpsrunning'] = str(GPSEngine.GPSDRunning())
+            jsondict['gpssynch'] = str(gpsEngine.gpsValid())
+            if gpsEngine.gpsValid():
+                gpsPos = {}
+                gpsPos['latitude'] = gpsEngine.lastCoord.latitude
+                gpsPos['longitude'] = gpsEngine.lastCoord.longitude
+                gpsPos['altitude'] = gpsEngine.lastCoord.altitude
+                gpsPos['speed'] = gpsEngine.lastCoord.speed
+                jsondict['gpspos'] = gpsPos
                 if useRPILeds:
-                    # Green will heartbeat when servicing requests. Turn back solid here
-                    SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
-                return
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
+            else:
+                if useRPILeds:
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+        else:
+            jsondict['gpsinstalled'] = 'True'
+            jsondict['gpsrunning'] = 'True'
+            jsondict['gpssynch'] = str(mavlinkGPSThread.synchronized)
+            gpsPos = {}
+            gpsPos['latitude'] = mavlinkGPSThread.latitude
+            gpsPos['longitude'] = mavlinkGPSThread.longitude
+            gpsPos['altitude'] = mavlinkGPSThread.altitude
+            gpsPos['speed'] = mavlinkGPSThread.vehicle.getAirSpeed()
+            jsondict['gpspos'] = gpsPos
+            
+        jsonstr = json.dumps(jsondict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleMonitorInterfaces(s):
+        wirelessInterfaces = WirelessEngine.getMonitoringModeInterfaces()
+        jsondict={}
+        jsondict['interfaces']=wirelessInterfaces
+        jsonstr = json.dumps(jsondict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleRecordingList(s):
+        # Optional filters:  start=<epoch>, end=<epoch>, bbox=<minLat>,<minLon>,<maxLat>,<maxLon>
+        try:
+            startTime = float(RECORDINGS_START_PATTERN.search(s.path).group(1))
+        except:
+            startTime = None
+            
+        try:
+            endTime = float(RECORDINGS_END_PATTERN.search(s.path).group(1))
+        except:
+            endTime = None
+            
+        try:
+            bounds = [float(curValue) for curValue in RECORDINGS_BBOX_PATTERN.search(s.path).groups()]
+        except:
+            bounds = None
+            
+        filelist = getRecordingFiles(startTime, endTime, bounds)
+        
+        responsedict = {}
+        responsedict['files'] = filelist
+        
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleRecordingFile(s):
+        filename = s.path.replace('/system/getrecording/', '')
+        s.sendFile(filename)
+        
+    def handleBluetoothPresent(s):
+        responsedict = {}
+        responsedict['errcode'] = 0
+        responsedict['errmsg'] = ''
+        responsedict['hasbluetooth'] = hasBluetooth
+        if hasBluetooth:
+            responsedict['scanrunning'] = bluetooth.scanRunnning()
+        else:
+            responsedict['scanrunning'] = False
                 
-            """Respond to a GET request."""
-            if (not s.path.startswith('/system/getrecording/') and (not s.path == ('/bluetooth/scanstatus')) and 
-                (not s.path == ('/spectrum/scanstatus'))):
-                # In getrecording we may adjust the content type header based on file extension
-                # Spectrum we'll gzip
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleBluetoothBeacon(s):
+        if not hasBluetooth:
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Bluetooth not supported on this agent'
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            function=s.path.replace('/bluetooth/beacon', '')
+            function = function.replace('/', '')
+            
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+            
+            if function=='start':
+                if bluetooth.discoveryRunning():
+                    bluetooth.stopDiscovery()
+
+                retVal = bluetooth.startBeacon()
+                
+                if not retVal:
+                    responsedict['errcode'] = 1
+                    responsedict['errmsg'] = 'Unable to start beacon.'
+            elif function == 'stop':
+                bluetooth.stopBeacon()
+            else:
+                responsedict['errcode'] = 1
+                responsedict['errmsg'] = 'Unknown command'
+                
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleBluetoothScan(s):
+        if not hasBluetooth:
+            if s.path == '/bluetooth/scanstatus':
+                # status skips the usual header above since it sends its own with a Content-Length
                 try:
                     s.send_response(200)
                     s.send_header("Content-type", "application/json")
@@ -1454,88 +2968,88 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
                 except:
                     pass
                     
-            # NOTE: In python 3, string is a bit different.  Examples write strings directly for Python2,
-            # In python3 you have to convert it to UTF-8 bytes
-            # s.wfile.write("<html><head><title>Sparrow-wifi agent</title></head><body>".encode("utf-8"))
-
-            if s.path == '/wireless/interfaces':
-                wirelessInterfaces = WirelessEngine.getInterfaces()
-                jsondict={}
-                jsondict['interfaces']=wirelessInterfaces
-                jsonstr = json.dumps(jsondict)
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Bluetooth not supported on this agent'
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            function=s.path.replace('/bluetooth/scan', '')
+            function = function.replace('/', '')
+            
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+            
+            if function=='start':
+                bluetooth.startScanning()
+                jsonstr = json.dumps(responsedict)
                 try:
                     s.wfile.write(jsonstr.encode("UTF-8"))
                 except:
                     pass
-            elif '/wireless/networks/' in s.path:
-                # THIS IS THE NORMAL SCAN
-                inputstr = s.path.replace('/wireless/networks/', '')
-                # Sanitize command-line input here:
-                p = re.compile('^([0-9a-zA-Z]+)')
+            elif function == 'stop':
+                bluetooth.stopScanning()
+                jsonstr = json.dumps(responsedict)
                 try:
-                    fieldValue = p.search(inputstr).group(1)
+                    s.wfile.write(jsonstr.encode("UTF-8"))
                 except:
-                    fieldValue = ""
-
-                if len(fieldValue) == 0:
-                    if useRPILeds:
-                        # Green will heartbeat when servicing requests. Turn back solid here
-                        SparrowRPi.greenLED(LIGHT_STATE_ON)
-                        
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                    return
-                
-                if '?' in inputstr:
-                    splitlist = inputstr.split('?')
-                    curInterface = splitlist[0]
-                else:
-                    curInterface = inputstr
-                    
-                p = re.compile('.*Frequencies=(.*)', re.IGNORECASE)
+                    pass
+            elif function == 'status':
+                channelData = bluetooth.spectrumToChannels()
+                responsedict['channeldata'] = channelData
+                jsonstr = json.dumps(responsedict)
                 try:
-                    channelStr = p.search(inputstr).group(1)
+                    s.sendBody("application/json", jsonstr.encode("UTF-8"))
                 except:
-                    channelStr = ""
-
-                huntChannelList = []
+                    pass
+            else:
+                responsedict['errcode'] = 1
+                responsedict['errmsg'] = 'Unknown command'
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
                 
-                if ',' in channelStr:
-                    tmpList = channelStr.split(',')
+        
+    def handleBluetoothDiscovery(s):
+        if not hasBluetooth:
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Bluetooth not supported on this agent'
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            function=s.path.split('?')[0].replace('/bluetooth/discovery', '')
+            function = function.replace('/', '')
+            
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+            
+            if function=='startp':
+                # Promiscuous with ubertooth
+                if hasUbertooth:
+                    bluetooth.startDiscovery(True)
                 else:
-                    tmpList = []
-                
-                if len(tmpList) > 0:
-                    for curItem in tmpList:
-                        try:
-                            if len(curItem) > 0:
-                                huntChannelList.append(int(curItem))
-                                # Get results for the specified interface
-                                # Need to iterate through the channels and aggregate the results
-                        except:
-                            pass
-
-                if useRPILeds:
-                    # Green will heartbeat when servicing requests
-                    SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_OFF)
-                    sleep(0.1)
-                    
-                if curInterface not in lockList.keys():
-                    lockList[curInterface] = Lock()
-                
-                curLock = lockList[curInterface]
-                
-                if (curLock):
-                    curLock.acquire()
-                    
+                    responsedict['errcode'] = 2
+                    responsedict['errmsg'] = 'Ubertooth not supported on this agent'
+            elif function == 'starta':
+                # Normal with Bluetooth
+                bluetooth.startDiscovery(False)
+            elif function == 'stop':
+                bluetooth.stopDiscovery()
+            elif function == 'status':
+                    # have to get the GPS:
+                gpsCoord = GPSStatus()
                 if useMavlink:
-                    gpsCoord = GPSStatus()
                     gpsCoord.gpsInstalled = True
                     gpsCoord.gpsRunning = True
                     gpsCoord.isValid = mavlinkGPSThread.synchronized
@@ -1543,919 +3057,822 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
                     gpsCoord.longitude = mavlinkGPSThread.longitude
                     gpsCoord.altitude = mavlinkGPSThread.altitude
                     gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
-                    retCode, errString, jsonstr=WirelessEngine.getNetworksAsJson(fieldValue, gpsCoord, huntChannelList)
                 elif gpsEngine.gpsValid():
-                    retCode, errString, jsonstr=WirelessEngine.getNetworksAsJson(fieldValue, gpsEngine.lastCoord, huntChannelList)
-                    if useRPILeds:
-                        SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
-                else:
-                    retCode, errString, jsonstr=WirelessEngine.getNetworksAsJson(fieldValue, None, huntChannelList)
-                    if useRPILeds:
-                        SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+                    gpsCoord.copy(gpsEngine.lastCoord)
                     
-                if (curLock):
-                    curLock.release()
-            
-                s.wfile.write(jsonstr.encode("UTF-8"))
-            elif s.path == '/gps/status':
-                jsondict={}
-                
-                if not useMavlink:
-                    jsondict['gpsinstalled'] = str(GPSEngine.GPSDInstalled())
-                    jsondict['gpsrunning'] = str(GPSEngine.GPSDRunning())
-                    jsondict['gpssynch'] = str(gpsEngine.gpsValid())
-                    if gpsEngine.gpsValid():
-                        gpsPos = {}
-                        gpsPos['latitude'] = gpsEngine.lastCoord.latitude
-                        gpsPos['longitude'] = gpsEngine.lastCoord.longitude
-                        gpsPos['altitude'] = gpsEngine.lastCoord.altitude
-                        gpsPos['speed'] = gpsEngine.lastCoord.speed
-                        jsondict['gpspos'] = gpsPos
-                        if useRPILeds:
-                            SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
+                # errcode, devices = bluetooth.getDiscoveredDevices()
+                bluetooth.updateDeviceList()
+                since = getSinceCursor(s.path)
+                
+                bluetooth.deviceLock.acquire()
+                devdict = []
+                now = datetime.datetime.now()
+                for curKey in bluetooth.devices.keys():
+                    curDevice = bluetooth.devices[curKey]
+                    elapsedTime =  now - curDevice.lastSeen
+                    
+                    # This is a little bit of a hack for the BlueHydra side since it can take a while to see devices or have
+                    # them show up in the db.  For LE discovery scans this will always be pretty quick.
+                    if elapsedTime.total_seconds() < 120:
+                        curDevice.gps = gpsCoord
+                        if curDevice.rssi >= curDevice.strongestRssi:
+                            curDevice.strongestRssi = curDevice.rssi
+                            curDevice.strongestgps = gpsCoord
+                        
+                    if since is None:
+                        entryDict = curDevice.toJsondict()
+                        devdict.append(entryDict)
                     else:
-                        if useRPILeds:
-                            SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
-                else:
-                    jsondict['gpsinstalled'] = 'True'
-                    jsondict['gpsrunning'] = 'True'
-                    jsondict['gpssynch'] = str(mavlinkGPSThread.synchronized)
-                    gpsPos = {}
-                    gpsPos['latitude'] = mavlinkGPSThread.latitude
-                    gpsPos['longitude'] = mavlinkGPSThread.longitude
-                    gpsPos['altitude'] = mavlinkGPSThread.altitude
-                    gpsPos['speed'] = mavlinkGPSThread.vehicle.getAirSpeed()
-                    jsondict['gpspos'] = gpsPos
+                        # Stored as a copy since the bluetooth thread keeps updating the device
+                        storedDevice = BluetoothDevice()
+                        storedDevice.copy(curDevice)
+                        btChangeLog.update(curKey, storedDevice, storedDevice.getSignature(), storedDevice.lastSeenEpoch)
                     
-                jsonstr = json.dumps(jsondict)
-                try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
-                except:
-                    pass
-            elif s.path == '/wireless/moninterfaces':
-                wirelessInterfaces = WirelessEngine.getMonitoringModeInterfaces()
-                jsondict={}
-                jsondict['interfaces']=wirelessInterfaces
-                jsonstr = json.dumps(jsondict)
-                try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
-                except:
-                    pass
-            elif s.path == '/system/getrecordings':
-                filelist = getRecordingFiles()
+                if since is not None:
+                    btChangeLog.expireMissing(bluetooth.devices)
+                    full, cursor, changedDevices, expiredKeys = btChangeLog.getChanges(since)
+                    devdict = [curDevice.toJsondict() for curDevice in changedDevices]
+                    responsedict['seq'] = cursor
+                    responsedict['full'] = full
+                    responsedict['expired'] = expiredKeys
+                    
+                bluetooth.deviceLock.release()
+                responsedict['devices'] = devdict
+            else:
+                responsedict['errcode'] = 1
+                responsedict['errmsg'] = 'Unknown command'
                 
-                responsedict = {}
-                responsedict['files'] = filelist
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleBluetoothRunning(s):
+        if not hasBluetooth:
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Bluetooth not supported on this agent'
+            responsedict['hasbluetooth'] = hasBluetooth
+            responsedict['hasubertooth'] = hasUbertooth
+            responsedict['spectrumscanrunning'] = False
+            responsedict['discoveryscanrunning'] = False
+            responsedict['beaconrunning'] = False
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+
+            responsedict['hasbluetooth'] = hasBluetooth
+            responsedict['hasubertooth'] = hasUbertooth
+            responsedict['spectrumscanrunning'] = bluetooth.scanRunning()
+            responsedict['discoveryscanrunning'] = bluetooth.discoveryRunning()
+            responsedict['beaconrunning'] = bluetooth.beaconRunning()
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleHackrfStatus(s):
+        responsedict = {}
+        responsedict['errcode'] = 0
+        responsedict['errmsg'] = ''
+        responsedict['hashackrf'] = hackrf.hasHackrf
+        responsedict['scan24running'] = hackrf.scanRunning24()
+        responsedict['scan5running'] = hackrf.scanRunning5()
                 
-                jsonstr = json.dumps(responsedict)
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleSpectrumScan(s):
+        if not hackrf.hasHackrf:
+            if s.path == '/spectrum/scanstatus':
+                # status skips the usual header above since it sends its own with a Content-Length
                 try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
+                    s.send_response(200)
+                    s.send_header("Content-type", "application/json")
+                    s.end_headers()
                 except:
                     pass
-            elif s.path.startswith('/system/getrecording/'):
-                filename = s.path.replace('/system/getrecording/', '')
-                s.sendFile(filename)
-            elif s.path == '/bluetooth/present':
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    responsedict['hasbluetooth'] = hasBluetooth
-                    if hasBluetooth:
-                        responsedict['scanrunning'] = bluetooth.scanRunnning()
-                    else:
-                        responsedict['scanrunning'] = False
-                        
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path.startswith('/bluetooth/beacon'):
-                if not hasBluetooth:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'Bluetooth not supported on this agent'
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    function=s.path.replace('/bluetooth/beacon', '')
-                    function = function.replace('/', '')
-                    
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    
-                    if function=='start':
-                        if bluetooth.discoveryRunning():
-                            bluetooth.stopDiscovery()
-
-                        retVal = bluetooth.startBeacon()
-                        
-                        if not retVal:
-                            responsedict['errcode'] = 1
-                            responsedict['errmsg'] = 'Unable to start beacon.'
-                    elif function == 'stop':
-                        bluetooth.stopBeacon()
-                    else:
-                        responsedict['errcode'] = 1
-                        responsedict['errmsg'] = 'Unknown command'
-                        
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path.startswith('/bluetooth/scan'):
-                if not hasBluetooth:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'Bluetooth not supported on this agent'
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    function=s.path.replace('/bluetooth/scan', '')
-                    function = function.replace('/', '')
-                    
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    
-                    if function=='start':
-                        bluetooth.startScanning()
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                    elif function == 'stop':
-                        bluetooth.stopScanning()
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                    elif function == 'status':
-                        channelData = bluetooth.spectrumToChannels()
-                        responsedict['channeldata'] = channelData
-                        try:
-                            s.send_response(200)
-                            s.send_header("Content-type", "application/json")
-                            s.send_header("Content-Encoding", "gzip")
-                            s.end_headers()
-                        except:
-                            pass
-                        jsonstr = json.dumps(responsedict)
-                        gzipBytes = gzipCompress(jsonstr)
-                        # s.wfile.write(jsonstr.encode("UTF-8"))
-                        try:
-                            s.wfile.write(gzipBytes)
-                        except:
-                            pass
-                    else:
-                        responsedict['errcode'] = 1
-                        responsedict['errmsg'] = 'Unknown command'
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        
-            elif s.path.startswith('/bluetooth/discovery'):
-                if not hasBluetooth:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'Bluetooth not supported on this agent'
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    function=s.path.replace('/bluetooth/discovery', '')
-                    function = function.replace('/', '')
-                    
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    
-                    if function=='startp':
-                        # Promiscuous with ubertooth
-                        if hasUbertooth:
-                            bluetooth.startDiscovery(True)
-                        else:
-                            responsedict['errcode'] = 2
-                            responsedict['errmsg'] = 'Ubertooth not supported on this agent'
-                    elif function == 'starta':
-                        # Normal with Bluetooth
-                        bluetooth.startDiscovery(False)
-                    elif function == 'stop':
-                        bluetooth.stopDiscovery()
-                    elif function == 'status':
-                            # have to get the GPS:
-                        gpsCoord = GPSStatus()
-                        if useMavlink:
-                            gpsCoord.gpsInstalled = True
-                            gpsCoord.gpsRunning = True
-                            gpsCoord.isValid = mavlinkGPSThread.synchronized
-                            gpsCoord.latitude = mavlinkGPSThread.latitude
-                            gpsCoord.longitude = mavlinkGPSThread.longitude
-                            gpsCoord.altitude = mavlinkGPSThread.altitude
-                            gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
-                        elif gpsEngine.gpsValid():
-                            gpsCoord.copy(gpsEngine.lastCoord)
-                            
-                        # errcode, devices = bluetooth.getDiscoveredDevices()
-                        bluetooth.updateDeviceList()
-                        
-                        bluetooth.deviceLock.acquire()
-                        devdict = []
-                        now = datetime.datetime.now()
-                        for curKey in bluetooth.devices.keys():
-                            curDevice = bluetooth.devices[curKey]
-                            elapsedTime =  now - curDevice.lastSeen
-                            
-                            # This is a little bit of a hack for the BlueHydra side since it can take a while to see devices or have
-                            # them show up in the db.  For LE discovery scans this will always be pretty quick.
-                            if elapsedTime.total_seconds() < 120:
-                                curDevice.gps.copy(gpsCoord)
-                                if curDevice.rssi >= curDevice.strongestRssi:
-                                    curDevice.strongestRssi = curDevice.rssi
-                                    curDevice.strongestgps.copy(gpsCoord)
-                                
-                            entryDict = curDevice.toJsondict()
-                            devdict.append(entryDict)
-                            
-                        bluetooth.deviceLock.release()
-                        responsedict['devices'] = devdict
-                    else:
-                        responsedict['errcode'] = 1
-                        responsedict['errmsg'] = 'Unknown command'
-                        
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path == '/bluetooth/running':
-                if not hasBluetooth:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'Bluetooth not supported on this agent'
-                    responsedict['hasbluetooth'] = hasBluetooth
-                    responsedict['hasubertooth'] = hasUbertooth
-                    responsedict['spectrumscanrunning'] = False
-                    responsedict['discoveryscanrunning'] = False
-                    responsedict['beaconrunning'] = False
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-
-                    responsedict['hasbluetooth'] = hasBluetooth
-                    responsedict['hasubertooth'] = hasUbertooth
-                    responsedict['spectrumscanrunning'] = bluetooth.scanRunning()
-                    responsedict['discoveryscanrunning'] = bluetooth.discoveryRunning()
-                    responsedict['beaconrunning'] = bluetooth.beaconRunning()
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path == '/spectrum/hackrfstatus':
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    responsedict['hashackrf'] = hackrf.hasHackrf
-                    responsedict['scan24running'] = hackrf.scanRunning24()
-                    responsedict['scan5running'] = hackrf.scanRunning5()
-                        
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path.startswith('/spectrum/scan'):
-                if not hackrf.hasHackrf:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'HackRF is not supported on this agent'
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'HackRF is not supported on this agent'
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            function=s.path.replace('/spectrum/scan', '')
+            function = function.replace('/', '')
+            
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+            
+            if function=='start24':
+                hackrf.startScanning24()
+                jsonstr = json.dumps(responsedict)
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            elif function == 'start5':
+                hackrf.startScanning5()
+                jsonstr = json.dumps(responsedict)
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            elif function == 'stop':
+                hackrf.stopScanning()
+                jsonstr = json.dumps(responsedict)
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            elif function == 'status':
+                if hackrf.scanRunning24():
+                    channelData = hackrf.spectrum24ToChannels()
+                    responsedict['scanrunning'] = hackrf.scanRunning24()
+                elif hackrf.scanRunning5():
+                    channelData = hackrf.spectrum5ToChannels()
+                    responsedict['scanrunning'] = hackrf.scanRunning24()
                 else:
-                    function=s.path.replace('/spectrum/scan', '')
-                    function = function.replace('/', '')
-                    
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
+                    channelData = {}  # Shouldn't be here but just in case.
+                    responsedict['scanrunning'] = False
                     
-                    if function=='start24':
-                        hackrf.startScanning24()
-                        jsonstr = json.dumps(responsedict)
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    elif function == 'start5':
-                        hackrf.startScanning5()
-                        jsonstr = json.dumps(responsedict)
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    elif function == 'stop':
-                        hackrf.stopScanning()
-                        jsonstr = json.dumps(responsedict)
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    elif function == 'status':
-                        if hackrf.scanRunning24():
-                            channelData = hackrf.spectrum24ToChannels()
-                            responsedict['scanrunning'] = hackrf.scanRunning24()
-                        elif hackrf.scanRunning5():
-                            channelData = hackrf.spectrum5ToChannels()
-                            responsedict['scanrunning'] = hackrf.scanRunning24()
-                        else:
-                            channelData = {}  # Shouldn't be here but just in case.
-                            responsedict['scanrunning'] = False
-                            
-                        responsedict['channeldata'] = channelData
+                responsedict['channeldata'] = channelData
 
-                        try:
-                            s.send_response(200)
-                            s.send_header("Content-type", "application/json")
-                            s.send_header("Content-Encoding", "gzip")
-                            s.end_headers()
-                            jsonstr = json.dumps(responsedict)
-                            gzipBytes = gzipCompress(jsonstr)
-                            # s.wfile.write(jsonstr.encode("UTF-8"))
-                            s.wfile.write(gzipBytes)
-                        except:
-                            pass
-                    else:
-                        responsedict['errcode'] = 1
-                        responsedict['errmsg'] = 'Unknown command'
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-            elif s.path == '/system/config':
-                cfgSettings = AgentConfigSettings()
-                cfgSettings.fromConfigFile('sparrowwifiagent.cfg')
-                responsedict = {}
-                responsedict['startup'] = cfgSettings.toJsondict()
-                
-                if recordThread:
-                    runningcfg.recordRunning = True
-                    runningcfg.recordInterface = recordThread.interface
-                    
-                responsedict['running'] = runningcfg.toJsondict()
-                
-                jsonstr = json.dumps(responsedict)
                 try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
-                except:
-                    pass
-            elif s.path.startswith('/system/startrecord'):
-                recordinterface = s.path.replace('/system/startrecord/', '')
-                
-                # Check that the specified interface is valid:
-                interfaces = WirelessEngine.getInterfaces()
-                
-                if recordinterface in interfaces:
-                    startRecord(recordinterface)
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ''
-                    jsonstr = json.dumps(responsedict)
-                else:
-                    responsedict = {}
-                    responsedict['errcode'] = 1
-                    responsedict['errmsg'] = 'The requested interface was not found on the system.'
                     jsonstr = json.dumps(responsedict)
-                    
-                try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
+                    s.sendBody("application/json", jsonstr.encode("UTF-8"))
                 except:
                     pass
-            elif s.path == '/system/stoprecord':
-                stopRecord()
-                responsedict = {}
-                responsedict['errcode'] = 0
-                responsedict['errmsg'] = ''
+            else:
+                responsedict['errcode'] = 1
+                responsedict['errmsg'] = 'Unknown command'
                 jsonstr = json.dumps(responsedict)
                 try:
                     s.wfile.write(jsonstr.encode("UTF-8"))
                 except:
                     pass
-            elif '/falcon/startmonmode' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/startmonmode/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                        
-                    retVal, errMsg = falconWiFiRemoteAgent.startMonitoringInterface(fieldValue)
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/stopmonmode' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/stopmonmode/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                        
-                    retVal, errMsg = falconWiFiRemoteAgent.stopMonitoringInterface(fieldValue)
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/scanrunning' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/scanrunning/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                        
-                    scanrunning = falconWiFiRemoteAgent.isScanRunning(fieldValue)
-                    
-                    if scanrunning:
-                        retVal = 0
-                        errMsg = "scan for " + fieldValue + " is running"
-                    else:
-                        retVal = 1
-                        errMsg = "scan for " + fieldValue + " is not running"
-                        
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/startscan' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/startscan/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                        
-                    scanProc = falconWiFiRemoteAgent.startCapture(fieldValue)
-                    
-                    if scanProc is not None:
-                        retVal = 0
-                        errMsg = ""
-                    else:
-                        retVal = -1
-                        errMsg = "Unable to start scanning process."
-                        
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/stopscan' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/stopscan/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                        
-                    retVal = falconWiFiRemoteAgent.stopCapture(fieldValue)
-                    
-                    if retVal == 0:
-                        errMsg = ""
-                    else:
-                        errMsg = "Unable to stop scanning process."
-                        
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/stopcrack' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/stopcrack/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        curInterface = p.search(inputstr).group(1)
-                    except:
-                        curInterface = ""
-                        
-                    if len(curInterface) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
-                    
-                    try:
-                        if curInterface in falconWiFiRemoteAgent.WEPCrackList:
-                            falconWiFiRemoteAgent.WEPCrackList[curInterface].stopCrack()
-                            falconWiFiRemoteAgent.WEPCrackList[curInterface].cleanupTempFiles()
-                            del falconWiFiRemoteAgent.WEPCrackList[curInterface]
-                            
-                        if curInterface in falconWiFiRemoteAgent.WPAPSKCrackList:
-                            falconWiFiRemoteAgent.WPAPSKCrackList[curInterface].stopCrack()
-                            falconWiFiRemoteAgent.WPAPSKCrackList[curInterface].cleanupTempFiles()
-                            del falconWiFiRemoteAgent.WPAPSKCrackList[curInterface]
-                    except:
-                        pass
-                        
-                    retVal = 0
-                    errMsg = ""
+        
+    def handleConfig(s):
+        cfgSettings = AgentConfigSettings()
+        cfgSettings.fromConfigFile('sparrowwifiagent.cfg')
+        responsedict = {}
+        responsedict['startup'] = cfgSettings.toJsondict()
+        
+        if recordThread:
+            runningcfg.recordRunning = True
+            runningcfg.recordInterface = recordThread.interface
+            
+        responsedict['running'] = runningcfg.toJsondict()
+        
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleStartRecord(s):
+        recordinterface = s.path.replace('/system/startrecord/', '')
+        
+        # Check that the specified interface is valid:
+        interfaces = WirelessEngine.getInterfaces()
+        
+        if recordinterface in interfaces:
+            startRecord(recordinterface)
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ''
+            jsonstr = json.dumps(responsedict)
+        else:
+            responsedict = {}
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'The requested interface was not found on the system.'
+            jsonstr = json.dumps(responsedict)
+            
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleStopRecord(s):
+        stopRecord()
+        responsedict = {}
+        responsedict['errcode'] = 0
+        responsedict['errmsg'] = ''
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+        
+    def handleCompressionStats(s):
+        # Per endpoint:  responses, cache hits, bytes before and after compression, and CPU time spent compressing
+        responsedict = {}
+        responsedict['errcode'] = 0
+        responsedict['errmsg'] = ''
+        responsedict['level'] = getCompressLevel()
+        responsedict['endpoints'] = compressionStats.getStats()
+        responsedict['cache'] = responseCache.getStats()
+        
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+            
+    def handleMetrics(s):
+        # Prometheus text format, or JSON with ?format=json or an Accept header asking for it
+        if ('format=json' in s.path) or s.headers.get('Accept', '').startswith('application/json'):
+            s.sendBody('application/json', metrics.toJson().encode('UTF-8'))
+        else:
+            s.sendBody('text/plain; version=0.0.4; charset=utf-8', metrics.toPrometheus().encode('UTF-8'))
+            
+    def handleProfile(s):
+        # /system/profile?seconds=N&mode=sample|cprofile profiles the whole agent for N seconds (see sparrowprofile.py) 
+        # and answers once it's done.  The results go in the recordings directory for /system/getrecording/.
+        responsedict = {}
+        responsedict['errcode'] = 0
+        responsedict['errmsg'] = ''
+        statusCode = 200
+        
+        if len(profileToken) == 0:
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Profiling is not enabled on this agent.  Set profiletoken to turn it on.'
+        elif not hmac.compare_digest(s.headers.get(PROFILE_TOKEN_HEADER, '').encode('UTF-8'), profileToken.encode('UTF-8')):
+            statusCode = 403
+            responsedict['errcode'] = 1
+            responsedict['errmsg'] = 'Not authorized to profile this agent.'
+        else:
+            matchObj = PROFILE_SECONDS_PATTERN.search(s.path)
+            if matchObj:
+                seconds = int(matchObj.group(1))
+            else:
+                seconds = 10
+                
+            matchObj = PROFILE_MODE_PATTERN.search(s.path)
+            if matchObj:
+                mode = matchObj.group(1).lower()
+            else:
+                mode = PROFILE_SAMPLE
+                
+            dirname, runfilename = os.path.split(os.path.abspath(__file__))
+            errcode, errmsg, files, summary = profileProcess(seconds, mode, dirname + '/recordings')
+            
+            for curFile in files:
+                getRecordingCatalog().addFile(curFile)
+            
+            responsedict['errcode'] = errcode
+            responsedict['errmsg'] = errmsg
+            responsedict['mode'] = mode
+            responsedict['seconds'] = seconds
+            responsedict['files'] = files
+            responsedict['summary'] = summary
+            
+        jsonstr = json.dumps(responsedict)
+        try:
+            s.send_response(statusCode)
+            s.send_header("Content-type", "application/json")
+            s.end_headers()
+            s.wfile.write(jsonstr.encode("UTF-8"))
+        except:
+            pass
+            
+    def handleFalconStartMonMode(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    responsedict = {}
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+                
+            retVal, errMsg = falconWiFiRemoteAgent.startMonitoringInterface(fieldValue)
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconStopMonMode(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/crackstatus' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+                
+            retVal, errMsg = falconWiFiRemoteAgent.stopMonitoringInterface(fieldValue)
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconScanRunning(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    if 'crackstatuswep' in s.path:
-                        type='wep'
-                    else:
-                        type = 'wpapsk'
-                        
-                    inputstr = s.path.replace('/falcon/crackstatus'+type+'/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        curInterface = p.search(inputstr).group(1)
-                    except:
-                        curInterface = ""
-                        
-                    if len(curInterface) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
-                            
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + curInterface
-                        jsonstr = json.dumps(responsedict)
-                        try:
-                            s.wfile.write(jsonstr.encode("UTF-8"))
-                        except:
-                            pass
-                        return
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+                
+            scanrunning = falconWiFiRemoteAgent.isScanRunning(fieldValue)
+            
+            if scanrunning:
+                retVal = 0
+                errMsg = "scan for " + fieldValue + " is running"
+            else:
+                retVal = 1
+                errMsg = "scan for " + fieldValue + " is not running"
+                
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconStartScan(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    responsedict = {}
-                    retVal = -1
-                    errMsg = "Unable to find running crack."
-                                    
-                    try:
-                        if type == 'wep':
-                            if curInterface in falconWiFiRemoteAgent.WEPCrackList:
-                                wepCrack = falconWiFiRemoteAgent.WEPCrackList[curInterface]
-                                retVal = 0
-                                errMsg = ""
-                                responsedict['isrunning'] = wepCrack.isRunning()
-                                responsedict['ivcount'] = wepCrack.getIVCount()
-                                responsedict['ssid'] = wepCrack.SSID
-                                responsedict['crackedpasswords'] = wepCrack.getCrackedPasswords()
-                        else:
-                            if curInterface in falconWiFiRemoteAgent.WPAPSKCrackList:
-                                wpaPSKCrack = falconWiFiRemoteAgent.WPAPSKCrackList[curInterface]
-                                retVal = 0
-                                errMsg = ""
-                                responsedict['isrunning'] = wpaPSKCrack.isRunning()
-                                hasHandshake = wpaPSKCrack.hasHandshake()
-                                responsedict['hashandshake'] = hasHandshake
-                                
-                                if hasHandshake:
-                                    # For WPAPSK, lets copy the capture file to our recording directory for recovery
-                                    dirname, filename = os.path.split(os.path.abspath(__file__))
-                                    fullpath, filename=wpaPSKCrack.copyCaptureFile(dirname + '/recordings')
-                                    responsedict['capturefile'] = filename
-                                else:
-                                    responsedict['capturefile'] = ""
-                    except:
-                        pass
-                        
-                    responsedict['errcode'] = retVal
-                    responsedict['errmsg'] = errMsg
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+                
+            scanProc = falconWiFiRemoteAgent.startCapture(fieldValue)
+            
+            if scanProc is not None:
+                retVal = 0
+                errMsg = ""
+            else:
+                retVal = -1
+                errMsg = "Unable to start scanning process."
+                
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconStopScan(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif s.path == '/falcon/getscanresults':
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+                
+            retVal = falconWiFiRemoteAgent.stopCapture(fieldValue)
+            
+            if retVal == 0:
+                errMsg = ""
+            else:
+                errMsg = "Unable to stop scanning process."
+                
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconStopCrack(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            curInterface = s.route.getParam(s.path)
+                
+            if len(curInterface) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    if useMavlink:
-                        gpsCoord = GPSStatus()
-                        gpsCoord.gpsInstalled = True
-                        gpsCoord.gpsRunning = True
-                        gpsCoord.isValid = mavlinkGPSThread.synchronized
-                        gpsCoord.latitude = mavlinkGPSThread.latitude
-                        gpsCoord.longitude = mavlinkGPSThread.longitude
-                        gpsCoord.altitude = mavlinkGPSThread.altitude
-                        gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
-                        retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(gpsCoord)
-                    elif gpsEngine.gpsValid():
-                        retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(gpsEngine.lastCoord)
-                        if useRPILeds:
-                            SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
-                    else:
-                        retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(None)
-                        if useRPILeds:
-                            # This just signals that the GPS isn't synced
-                            SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + curInterface
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+            
+            try:
+                if curInterface in falconWiFiRemoteAgent.WEPCrackList:
+                    falconWiFiRemoteAgent.WEPCrackList[curInterface].stopCrack()
+                    falconWiFiRemoteAgent.WEPCrackList[curInterface].cleanupTempFiles()
+                    del falconWiFiRemoteAgent.WEPCrackList[curInterface]
                     
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/stopalldeauths' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
+                if curInterface in falconWiFiRemoteAgent.WPAPSKCrackList:
+                    falconWiFiRemoteAgent.WPAPSKCrackList[curInterface].stopCrack()
+                    falconWiFiRemoteAgent.WPAPSKCrackList[curInterface].cleanupTempFiles()
+                    del falconWiFiRemoteAgent.WPAPSKCrackList[curInterface]
+            except:
+                pass
+                
+            retVal = 0
+            errMsg = ""
+            
+            responsedict = {}
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconCrackStatus(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            if 'crackstatuswep' in s.path:
+                type='wep'
+            else:
+                type = 'wpapsk'
+                
+            # Sanitized by the route's parameter pattern
+            curInterface = s.route.getParam(s.path)
+                
+            if len(curInterface) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-                else:
-                    inputstr = s.path.replace('/falcon/stopalldeauths/', '')
-                    # Sanitize command-line input here:
-                    p = re.compile('^([0-9a-zA-Z]+)')
-                    try:
-                        fieldValue = p.search(inputstr).group(1)
-                    except:
-                        fieldValue = ""
-                        
-                    if len(fieldValue) == 0:
-                        if useRPILeds:
-                            # Green will heartbeat when servicing requests. Turn back solid here
-                            SparrowRPi.greenLED(LIGHT_STATE_ON)
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + curInterface
+                jsonstr = json.dumps(responsedict)
+                try:
+                    s.wfile.write(jsonstr.encode("UTF-8"))
+                except:
+                    pass
+                return
+            
+            responsedict = {}
+            retVal = -1
+            errMsg = "Unable to find running crack."
                             
-                        responsedict = {}
-                        responsedict['errcode'] = 5
-                        responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
-                        jsonstr = json.dumps(responsedict)
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                        return
-                        
-                    falconWiFiRemoteAgent.stopAllDeauths(fieldValue)
-                    responsedict = {}
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ""
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
-            elif '/falcon/getalldeauths' in s.path:
-                if not hasFalcon:
-                    responsedict = {}
-                    responsedict['errcode'] = 5
-                    responsedict['errmsg'] = "Unknown request: " + s.path
-                    
-                    jsonstr = json.dumps(responsedict)
-                    try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
-                    except:
-                        pass
+            try:
+                if type == 'wep':
+                    if curInterface in falconWiFiRemoteAgent.WEPCrackList:
+                        wepCrack = falconWiFiRemoteAgent.WEPCrackList[curInterface]
+                        retVal = 0
+                        errMsg = ""
+                        responsedict['isrunning'] = wepCrack.isRunning()
+                        responsedict['ivcount'] = wepCrack.getIVCount()
+                        responsedict['ssid'] = wepCrack.SSID
+                        responsedict['crackedpasswords'] = wepCrack.getCrackedPasswords()
                 else:
-                    responsedict = falconWiFiRemoteAgent.getAllDeauthsAsJsonDict()
-                    # Add in successful response
-                    responsedict['errcode'] = 0
-                    responsedict['errmsg'] = ""
+                    if curInterface in falconWiFiRemoteAgent.WPAPSKCrackList:
+                        wpaPSKCrack = falconWiFiRemoteAgent.WPAPSKCrackList[curInterface]
+                        retVal = 0
+                        errMsg = ""
+                        responsedict['isrunning'] = wpaPSKCrack.isRunning()
+                        hasHandshake = wpaPSKCrack.hasHandshake()
+                        responsedict['hashandshake'] = hasHandshake
+                        
+                        if hasHandshake:
+                            # For WPAPSK, lets copy the capture file to our recording directory for recovery
+                            dirname, filename = os.path.split(os.path.abspath(__file__))
+                            fullpath, filename=wpaPSKCrack.copyCaptureFile(dirname + '/recordings')
+                            responsedict['capturefile'] = filename
+                        else:
+                            responsedict['capturefile'] = ""
+            except:
+                pass
+                
+            responsedict['errcode'] = retVal
+            responsedict['errmsg'] = errMsg
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconScanResults(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            if useMavlink:
+                gpsCoord = GPSStatus()
+                gpsCoord.gpsInstalled = True
+                gpsCoord.gpsRunning = True
+                gpsCoord.isValid = mavlinkGPSThread.synchronized
+                gpsCoord.latitude = mavlinkGPSThread.latitude
+                gpsCoord.longitude = mavlinkGPSThread.longitude
+                gpsCoord.altitude = mavlinkGPSThread.altitude
+                gpsCoord.speed = mavlinkGPSThread.vehicle.getAirSpeed()
+                retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(gpsCoord)
+            elif gpsEngine.gpsValid():
+                retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(gpsEngine.lastCoord)
+                if useRPILeds:
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_ON)
+            else:
+                retCode, errString, jsonstr=falconWiFiRemoteAgent.getNetworksAsJson(None)
+                if useRPILeds:
+                    # This just signals that the GPS isn't synced
+                    SparrowRPi.redLED(SparrowRPi.LIGHT_STATE_HEARTBEAT)
+            
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconStopAllDeauths(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            # Sanitized by the route's parameter pattern
+            fieldValue = s.route.getParam(s.path)
+                
+            if len(fieldValue) == 0:
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(LIGHT_STATE_ON)
                     
-                    jsonstr = json.dumps(responsedict)
+                responsedict = {}
+                responsedict['errcode'] = 5
+                responsedict['errmsg'] = "Error parsing interface.  Identified interface: " + fieldValue
+                jsonstr = json.dumps(responsedict)
+                s.wfile.write(jsonstr.encode("UTF-8"))
+                return
+                
+            falconWiFiRemoteAgent.stopAllDeauths(fieldValue)
+            responsedict = {}
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ""
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def handleFalconGetAllDeauths(s):
+        if not hasFalcon:
+            responsedict = {}
+            responsedict['errcode'] = 5
+            responsedict['errmsg'] = "Unknown request: " + s.path
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        else:
+            responsedict = falconWiFiRemoteAgent.getAllDeauthsAsJsonDict()
+            # Add in successful response
+            responsedict['errcode'] = 0
+            responsedict['errmsg'] = ""
+            
+            jsonstr = json.dumps(responsedict)
+            try:
+                s.wfile.write(jsonstr.encode("UTF-8"))
+            except:
+                pass
+        
+    def do_GET(s):
+        global gpsEngine
+        global useMavlink
+        global mavlinkGPSThread
+        global lockList
+        global allowedIPs
+        global runningcfg
+        global falconWiFiRemoteAgent
+        global hasBluetooth
+        global hasUbertooth
+        global bluetooth
+        
+        # For RPi LED's, using it during each get request wasn't completely working.  Short transactions like
+        # status and interface list were so quick the light would get "confused" and stay off.  So
+        # the LED is only used for long calls like scan
+        
+        if len(s.client_address) == 0:
+            # This should have the connecting client IP.  If this isn't at least 1, something is wrong
+            return
+            
+        try:
+            # If the pipe gets broken mid-stream it'll throw an exception
+            if len(allowedIPs) > 0:
+                if s.client_address[0] not in allowedIPs:
                     try:
-                        s.wfile.write(jsonstr.encode("UTF-8"))
+                        s.send_response(403)
+                        s.send_header("Content-type", "text/html")
+                        s.end_headers()
+                        s.wfile.write("<html><body><p>Connections not authorized from your IP address</p>".encode("utf-8"))
+                        s.wfile.write("</body></html>".encode("UTF-8"))
                     except:
                         pass
-            else:
-                # Catch-all.  Should never be here
-                responsedict = {}
-                responsedict['errcode'] = 5
-                responsedict['errmsg'] = "Unknown request: " + s.path
+                    if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                        SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
+                    return
+
+            # One lookup both finds the handler and checks the URL is allowed
+            route = getRouter.match(s.path)
+            s.route = route
+            if route is None:
+                try:
+                    s.send_response(404)
+                    s.send_header("Content-type", "text/html")
+                    s.end_headers()
+                    s.wfile.write("<html><body><p>Bad Request</p>".encode("utf-8"))
+                    s.wfile.write("</body></html>".encode("UTF-8"))
+                except:
+                    pass
+                if useRPILeds:
+                    # Green will heartbeat when servicing requests. Turn back solid here
+                    SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
+                return
                 
-                jsonstr = json.dumps(responsedict)
+            """Respond to a GET request."""
+            if not route.sendsHeaders:
+                # Routes that send their own headers:  getrecording may adjust the content type based on file
+                # extension, spectrum we'll gzip, networks can go back in the compact binary format if the client
+                # asks for it, and the live stream is NDJSON
                 try:
-                    s.wfile.write(jsonstr.encode("UTF-8"))
+                    s.send_response(200)
+                    s.send_header("Content-type", "application/json")
+                    s.end_headers()
                 except:
                     pass
+                    
+            # NOTE: In python 3, string is a bit different.  Examples write strings directly for Python2,
+            # In python3 you have to convert it to UTF-8 bytes
+            # s.wfile.write("<html><head><title>Sparrow-wifi agent</title></head><body>".encode("utf-8"))
+
+            getRouter.dispatch(route, s)
         except:
             pass
             
@@ -2463,6 +3880,57 @@ class SparrowWiFiAgentRequestHandler(HTTPServer.BaseHTTPRequestHandler):
             # Green will heartbeat when servicing requests. Turn back solid here
             SparrowRPi.greenLED(SparrowRPi.LIGHT_STATE_ON)
 
+# ----------------- GET routes -----------------------------
+# Anything not listed here gets a 404.  Prefix routes take the rest of the URL, and paramPattern routes have their
+# interface sanitized by it for s.route.getParam().
+getRouter = Router()
+
+getRouter.addRoute('/wireless/interfaces', SparrowWiFiAgentRequestHandler.handleInterfaces)
+getRouter.addRoute('/wireless/moninterfaces', SparrowWiFiAgentRequestHandler.handleMonitorInterfaces)
+getRouter.addRoute('/wireless/networks/', SparrowWiFiAgentRequestHandler.handleNetworks, prefix=True, sendsHeaders=True, paramPattern=INTERFACE_LIST_PATTERN)
+getRouter.addRoute('/wireless/stream/', SparrowWiFiAgentRequestHandler.sendLiveStream, prefix=True, sendsHeaders=True)
+
+getRouter.addRoute('/gps/status', SparrowWiFiAgentRequestHandler.handleGPSStatus)
+
+getRouter.addRoute('/system/config', SparrowWiFiAgentRequestHandler.handleConfig)
+getRouter.addRoute('/system/startrecord', SparrowWiFiAgentRequestHandler.handleStartRecord, prefix=True)
+getRouter.addRoute('/system/stoprecord', SparrowWiFiAgentRequestHandler.handleStopRecord)
+getRouter.addRoute('/system/getrecordings', SparrowWiFiAgentRequestHandler.handleRecordingList)
+getRouter.addRoute('/system/compressionstats', SparrowWiFiAgentRequestHandler.handleCompressionStats)
+getRouter.addRoute('/system/metrics', SparrowWiFiAgentRequestHandler.handleMetrics, sendsHeaders=True)
+getRouter.addRoute('/system/profile', SparrowWiFiAgentRequestHandler.handleProfile, sendsHeaders=True)
+getRouter.addRoute('/system/getrecording/', SparrowWiFiAgentRequestHandler.handleRecordingFile, prefix=True, sendsHeaders=True)
+
+getRouter.addRoute('/bluetooth/present', SparrowWiFiAgentRequestHandler.handleBluetoothPresent)
+getRouter.addRoute('/bluetooth/running', SparrowWiFiAgentRequestHandler.handleBluetoothRunning)
+getRouter.addRoute('/bluetooth/scanstart', SparrowWiFiAgentRequestHandler.handleBluetoothScan)
+getRouter.addRoute('/bluetooth/scanstop', SparrowWiFiAgentRequestHandler.handleBluetoothScan)
+getRouter.addRoute('/bluetooth/scanstatus', SparrowWiFiAgentRequestHandler.handleBluetoothScan, sendsHeaders=True)
+getRouter.addRoute('/bluetooth/beaconstart', SparrowWiFiAgentRequestHandler.handleBluetoothBeacon)
+getRouter.addRoute('/bluetooth/beaconstop', SparrowWiFiAgentRequestHandler.handleBluetoothBeacon)
+getRouter.addRoute('/bluetooth/discoverystartp', SparrowWiFiAgentRequestHandler.handleBluetoothDiscovery)
+getRouter.addRoute('/bluetooth/discoverystarta', SparrowWiFiAgentRequestHandler.handleBluetoothDiscovery)
+getRouter.addRoute('/bluetooth/discoverystop', SparrowWiFiAgentRequestHandler.handleBluetoothDiscovery)
+getRouter.addRoute('/bluetooth/discoverystatus', SparrowWiFiAgentRequestHandler.handleBluetoothDiscovery)
+
+getRouter.addRoute('/spectrum/hackrfstatus', SparrowWiFiAgentRequestHandler.handleHackrfStatus)
+getRouter.addRoute('/spectrum/scanstart24', SparrowWiFiAgentRequestHandler.handleSpectrumScan)
+getRouter.addRoute('/spectrum/scanstart5', SparrowWiFiAgentRequestHandler.handleSpectrumScan)
+getRouter.addRoute('/spectrum/scanstop', SparrowWiFiAgentRequestHandler.handleSpectrumScan)
+getRouter.addRoute('/spectrum/scanstatus', SparrowWiFiAgentRequestHandler.handleSpectrumScan, sendsHeaders=True)
+
+getRouter.addRoute('/falcon/startmonmode/', SparrowWiFiAgentRequestHandler.handleFalconStartMonMode, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/stopmonmode/', SparrowWiFiAgentRequestHandler.handleFalconStopMonMode, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/scanrunning/', SparrowWiFiAgentRequestHandler.handleFalconScanRunning, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/startscan/', SparrowWiFiAgentRequestHandler.handleFalconStartScan, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/stopscan/', SparrowWiFiAgentRequestHandler.handleFalconStopScan, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/getscanresults', SparrowWiFiAgentRequestHandler.handleFalconScanResults)
+getRouter.addRoute('/falcon/stopcrack', SparrowWiFiAgentRequestHandler.handleFalconStopCrack, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/crackstatuswpapsk', SparrowWiFiAgentRequestHandler.handleFalconCrackStatus, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/crackstatuswep', SparrowWiFiAgentRequestHandler.handleFalconCrackStatus, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/stopalldeauths', SparrowWiFiAgentRequestHandler.handleFalconStopAllDeauths, prefix=True, paramPattern=INTERFACE_PATTERN)
+getRouter.addRoute('/falcon/getalldeauths', SparrowWiFiAgentRequestHandler.handleFalconGetAllDeauths)
+
 # ----------------- Bluetooth check -----------------------------
 def checkForBluetooth():
     global hasBluetooth
@@ -2501,9 +3969,25 @@ if __name__ == '__main__':
     argparser.add_argument('--sendannounce', help="Send a UDP broadcast packet on the specified port to announce presence", action='store_true', default=False, required=False)
     argparser.add_argument('--userpileds', help="Use RPi LEDs to signal state.  Red=GPS [off=None,blinking=Unsynchronized,solid=synchronized], Green=Agent Running [On=Running, blinking=servicing HTTP request]", action='store_true', default=False, required=False)
     argparser.add_argument('--recordinterface', help="Automatically start recording locally with the given wireless interface (headless mode) in a recordings directory", default='', required=False)
+    argparser.add_argument('--recordsegmentsize', help="Start a new recording segment once the current one reaches this many MB.  Closed segments are gzipped in the background.  Default is 0 (off)", default=0, required=False)
+    argparser.add_argument('--recordsegmentminutes', help="Start a new recording segment every this many minutes.  Closed segments are gzipped in the background.  Default is 0 (off)", default=0, required=False)
+    argparser.add_argument('--recordminfree', help="MB of disk to leave free.  Recording is thinned out below twice this and paused below it.  0 turns the check off.  Default is 100", default=100, required=False)
+    argparser.add_argument('--recordformat', help="'csv' (default) records to wifi and bluetooth CSV files.  'sqlite' records every observation to one SQLite database per recording", default='csv', required=False)
     argparser.add_argument('--ignorecfg', help="Don't load any config files (useful for overriding and/or testing)", action='store_true', default=False, required=False)
     argparser.add_argument('--cfgfile', help="Use the specified config file rather than the default sparrowwifiagent.cfg file", default='', required=False)
     argparser.add_argument('--delaystart', help="Wait <delaystart> seconds before initializing", default=0, required=False)
+    argparser.add_argument('--scanmode', help="'trigger' (default) runs a full scan on every request.  'hybrid' only triggers a full scan every --scantrigger seconds and returns the kernel's scan cache in between", default='trigger', required=False)
+    argparser.add_argument('--scantrigger', help="In hybrid scan mode, seconds between full scans.  Default is 10", default=10.0, required=False)
+    argparser.add_argument('--scanmaxage', help="In hybrid scan mode, drop cached networks not heard for this many seconds.  Default is 30", default=30.0, required=False)
+    argparser.add_argument('--scanbatch', help="Number of hunt frequencies to scan per iw call.  1 scans one at a time, 0 scans the whole list at once.  Default is 8", default=8, required=False)
+    argparser.add_argument('--backgroundscan', help="Comma-separated list of interfaces to scan continuously in the background.  /wireless/networks for them answers right away with the latest merged results", default='', required=False)
+    argparser.add_argument('--backgroundmaxage', help="Seconds a background scanned network is still reported after it was last heard.  Default is 30", default=30, required=False)
+    argparser.add_argument('--compresslevel', help="zlib level (1-9) for JSON responses to clients that accept gzip or deflate.  0 turns compression off.  Default is 6", default=6, required=False)
+    argparser.add_argument('--profiletoken', help="Turns on /system/profile for clients that send this value in the X-Sparrow-Token header.  Off by default", default='', required=False)
+    argparser.add_argument('--scancachettl', help="Seconds a finished scan is handed to other /wireless/networks requests for the same interface and frequencies.  Requests always join a scan that's still running.  Default is 0", default=0, required=False)
+    argparser.add_argument('--servermode', help="'threaded' (default) handles each request on its own thread.  'asyncio' serves connections on an event loop with slow requests (scans, bluetooth, file downloads) on a fixed pool of --serverworkers threads", default='threaded', required=False)
+    argparser.add_argument('--serverworkers', help="In asyncio server mode, number of worker threads for slow requests.  Default is 4", default=4, required=False)
+    argparser.add_argument('--scanbackend', help="How to run wifi scans.  'iw' (default) runs the iw command, 'nl80211' talks to the kernel directly over netlink and falls back to iw if it isn't available", default='iw', required=False)
     args = argparser.parse_args()
 
     if os.geteuid() != 0:
@@ -2621,6 +4105,172 @@ if __name__ == '__main__':
     
     runningcfg.recordInterface = recordinterface
     
+    if 'scanbackend' not in settings.keys():
+        scanbackend = args.scanbackend
+    else:
+        scanbackend = settings['scanbackend']
+        
+    if scanbackend != SCANBACKEND_IW:
+        if WirelessEngine.setScanBackend(scanbackend):
+            print('Using the ' + scanbackend + ' scan backend.')
+        else:
+            print('WARNING: The ' + scanbackend + ' scan backend is not available.  Using iw.')
+            
+    if 'scanmode' not in settings.keys():
+        scanmode = args.scanmode
+    else:
+        scanmode = settings['scanmode']
+        
+    if 'scantrigger' not in settings.keys():
+        scantrigger = args.scantrigger
+    else:
+        scantrigger = settings['scantrigger']
+        
+    if 'scanmaxage' not in settings.keys():
+        scanmaxage = args.scanmaxage
+    else:
+        scanmaxage = settings['scanmaxage']
+        
+    if scanmode != SCANMODE_TRIGGER:
+        try:
+            validMode = WirelessEngine.setScanMode(scanmode, float(scantrigger), float(scanmaxage))
+        except:
+            validMode = False
+            
+        if validMode:
+            print('Using ' + scanmode + ' scan mode.  Full scans every ' + str(scantrigger) + ' seconds.')
+        else:
+            print('WARNING: Unknown scan mode ' + scanmode + '.  Using trigger.')
+            
+    if 'scanbatch' not in settings.keys():
+        scanbatch = args.scanbatch
+    else:
+        scanbatch = settings['scanbatch']
+        
+    if not WirelessEngine.setScanBatchSize(scanbatch):
+        print('WARNING: Invalid scan batch size ' + str(scanbatch) + '.  Using the default.')
+        
+    if 'backgroundscan' not in settings.keys():
+        backgroundscan = args.backgroundscan
+    else:
+        backgroundscan = settings['backgroundscan']
+        
+    backgroundInterfaces = []
+    for curInterface in backgroundscan.split(','):
+        curInterface = curInterface.strip()
+        if len(curInterface) > 0:
+            backgroundInterfaces.append(curInterface)
+            
+    if 'backgroundmaxage' not in settings.keys():
+        backgroundmaxage = args.backgroundmaxage
+    else:
+        backgroundmaxage = settings['backgroundmaxage']
+        
+    try:
+        backgroundmaxage = float(backgroundmaxage)
+        if backgroundmaxage <= 0.0:
+            raise ValueError('backgroundmaxage must be positive')
+    except:
+        print('WARNING: Invalid background max age ' + str(backgroundmaxage) + '.  Using 30.')
+        backgroundmaxage = 30.0
+        
+    if 'compresslevel' not in settings.keys():
+        compresslevel = args.compresslevel
+    else:
+        compresslevel = settings['compresslevel']
+        
+    if not setCompressLevel(compresslevel):
+        print('WARNING: Invalid compression level ' + str(compresslevel) + '.  Using 6.')
+        
+    if 'profiletoken' not in settings.keys():
+        profileToken = args.profiletoken
+    else:
+        profileToken = settings['profiletoken']
+        
+    if 'recordformat' not in settings.keys():
+        recordFormat = args.recordformat
+    else:
+        recordFormat = settings['recordformat']
+        
+    recordFormat = recordFormat.lower()
+    if recordFormat not in [RECORD_FORMAT_CSV, RECORD_FORMAT_SQLITE]:
+        print('WARNING: Invalid record format ' + recordFormat + '.  Using csv.')
+        recordFormat = RECORD_FORMAT_CSV
+        
+    if 'recordsegmentsize' not in settings.keys():
+        recordsegmentsize = args.recordsegmentsize
+    else:
+        recordsegmentsize = settings['recordsegmentsize']
+        
+    try:
+        recordSegmentBytes = int(float(recordsegmentsize) * 1048576)
+        if recordSegmentBytes < 0:
+            raise ValueError('recordsegmentsize cannot be negative')
+    except:
+        print('WARNING: Invalid record segment size ' + str(recordsegmentsize) + '.  Not rotating by size.')
+        recordSegmentBytes = 0
+        
+    if 'recordsegmentminutes' not in settings.keys():
+        recordsegmentminutes = args.recordsegmentminutes
+    else:
+        recordsegmentminutes = settings['recordsegmentminutes']
+        
+    try:
+        recordSegmentSeconds = float(recordsegmentminutes) * 60.0
+        if recordSegmentSeconds < 0.0:
+            raise ValueError('recordsegmentminutes cannot be negative')
+    except:
+        print('WARNING: Invalid record segment interval ' + str(recordsegmentminutes) + '.  Not rotating by time.')
+        recordSegmentSeconds = 0
+        
+    if 'recordminfree' not in settings.keys():
+        recordminfree = args.recordminfree
+    else:
+        recordminfree = settings['recordminfree']
+        
+    try:
+        recordMinFreeBytes = int(float(recordminfree) * 1048576)
+        if recordMinFreeBytes < 0:
+            raise ValueError('recordminfree cannot be negative')
+    except:
+        print('WARNING: Invalid record minimum free space ' + str(recordminfree) + '.  Using 100 MB.')
+        recordMinFreeBytes = 100 * 1048576
+        
+    if 'scancachettl' not in settings.keys():
+        scancachettl = args.scancachettl
+    else:
+        scancachettl = settings['scancachettl']
+        
+    try:
+        scancachettl = float(scancachettl)
+        if scancachettl < 0.0:
+            raise ValueError('scancachettl cannot be negative')
+        scanCache.ttl = scancachettl
+    except:
+        print('WARNING: Invalid scan cache TTL ' + str(scancachettl) + '.  Using 0.')
+        
+    if 'servermode' not in settings.keys():
+        servermode = args.servermode
+    else:
+        servermode = settings['servermode']
+        
+    if servermode not in ['threaded', 'asyncio']:
+        print('WARNING: Unknown server mode ' + servermode + '.  Using threaded.')
+        servermode = 'threaded'
+        
+    if 'serverworkers' not in settings.keys():
+        serverworkers = args.serverworkers
+    else:
+        serverworkers = settings['serverworkers']
+        
+    try:
+        serverworkers = int(serverworkers)
+        if serverworkers < 1:
+            raise ValueError('serverworkers must be at least 1')
+    except:
+        print('WARNING: Invalid server worker count ' + str(serverworkers) + '.  Using 4.')
+        serverworkers = 4
+        
     # Now start logic
     
     if runningcfg.useRPiLEDs:
@@ -2710,12 +4360,17 @@ if __name__ == '__main__':
     if runningcfg.announce:
         startAnnounceThread()
 
+    initRecordingCatalog()
+    
     if len(runningcfg.recordInterface) > 0:
         startRecord(runningcfg.recordInterface)
 
+    if len(backgroundInterfaces) > 0:
+        startBackgroundScans(backgroundInterfaces, backgroundmaxage)
+
     # -------------- Run HTTP Server / Main Loop-------------- 
     server = SparrowWiFiAgent()
-    server.run(runningcfg.port)
+    server.run(runningcfg.port, servermode, serverworkers)
 
     # -------------- This is the shutdown process -------------- 
     if mavlinkGPSThread:
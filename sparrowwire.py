@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 ghostop14
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+# Compact binary encoding for /wireless/networks responses.  A client asks for it by sending
+#   Accept: application/x-sparrow-networks; version=1
+# and agents that don't know it just answer with JSON as before, so the client looks at Content-Type to decide how to decode.
+#
+# Layout (little endian): 'SPWN', version byte, then a sequence of blocks each starting with a tag byte.
+#   BLOCK_STRING   H length + utf-8.  Strings are numbered in the order they're sent, starting at 0.
+#   BLOCK_PROFILE  5 string ids: mode, security, privacy, cipher, secondaryChannelLocation.  Numbered like strings.
+#   BLOCK_NETWORK  see NETWORK_FORMAT.  Followed by 4 doubles of gps (lat, lon, alt, speed) if FLAG_GPS is set,
+#                  then 4 more for the strongest gps if FLAG_STRONGEST is set (otherwise it's the same as gps).
+#   BLOCK_DELTA    Only in answer to a since=<cursor> request: q cursor, B full, I number of expired keys, then that many string ids.
+#   BLOCK_END      errCode, errString id and the agent's gps.  Always last.
+# Strings and profiles are sent the first time a network uses them so the encoder can stream as the scan runs.
+
+import struct
+
+from wirelessengine import WirelessNetwork
+
+# ------------------  Global definitions ------------------------------
+WIRE_VERSION = 1
+WIRE_MAGIC = b'SPWN'
+CONTENT_TYPE_BINARY = 'application/x-sparrow-networks'
+ACCEPT_BINARY = CONTENT_TYPE_BINARY + '; version=' + str(WIRE_VERSION)
+
+BLOCK_STRING = 1
+BLOCK_PROFILE = 2
+BLOCK_NETWORK = 3
+BLOCK_END = 4
+BLOCK_DELTA = 5
+
+FLAG_GPSVALID = 0x01
+FLAG_STRONGESTVALID = 0x02
+FLAG_GPS = 0x04
+FLAG_STRONGEST = 0x08
+FLAG_MACUPPER = 0x10
+FLAG_MACSTRING = 0x20
+
+HEADER_FORMAT = struct.Struct('<4sB')
+STRING_FORMAT = struct.Struct('<BH')
+PROFILE_FORMAT = struct.Struct('<BIIIII')
+# tag, mac, flags, ssid id, profile id, frequency, channel, secondary channel, third channel, bandwidth, signal, strongest signal, first seen, last seen
+NETWORK_FORMAT = struct.Struct('<B6sBIIHhhhHhhdd')
+GPS_FORMAT = struct.Struct('<dddd')
+END_FORMAT = struct.Struct('<BiIdddd')
+DELTA_FORMAT = struct.Struct('<BqBI')
+
+# ------------------  Helpers ------------------------------
+def acceptsBinary(acceptHeader):
+    # True if an Accept header asks for this version of the binary format
+    if not acceptHeader:
+        return False
+
+    for curType in acceptHeader.split(','):
+        params = [curParam.strip() for curParam in curType.split(';')]
+        if params[0] != CONTENT_TYPE_BINARY:
+            continue
+
+        version = str(WIRE_VERSION)
+        for curParam in params[1:]:
+            if curParam.startswith('version='):
+                version = curParam[8:]
+
+        if version == str(WIRE_VERSION):
+            return True
+
+    return False
+
+# ------------------  Encoder ------------------------------
+class BinaryNetworkEncoder(object):
+    # Same interface as wirelessengine.JsonNetworkEncoder.  Keeps the string table for one response.
+    contentType = CONTENT_TYPE_BINARY
+
+    def __init__(self):
+        self.strings = {}
+        self.profiles = {}
+
+    def getStringId(self, value, pending):
+        stringId = self.strings.get(value)
+
+        if stringId is None:
+            stringId = len(self.strings)
+            self.strings[value] = stringId
+            encodedValue = value.encode('UTF-8')[:0xFFFF]
+            pending.append(STRING_FORMAT.pack(BLOCK_STRING, len(encodedValue)))
+            pending.append(encodedValue)
+
+        return stringId
+
+    def begin(self):
+        return HEADER_FORMAT.pack(WIRE_MAGIC, WIRE_VERSION)
+
+    def encodeNetwork(self, curNet):
+        pending = []
+
+        profile = (curNet.mode, curNet.security, curNet.privacy, curNet.cipher, curNet.secondaryChannelLocation)
+        profileId = self.profiles.get(profile)
+        if profileId is None:
+            profileIds = [self.getStringId(curValue, pending) for curValue in profile]
+            profileId = len(self.profiles)
+            self.profiles[profile] = profileId
+            pending.append(PROFILE_FORMAT.pack(BLOCK_PROFILE, *profileIds))
+
+        ssidId = self.getStringId(curNet.ssid, pending)
+
+        flags = 0
+        macAddr = curNet.macAddr
+        try:
+            if len(macAddr) != 17:
+                raise ValueError
+            macBytes = bytes.fromhex(macAddr.replace(':', ''))
+            if macAddr != macAddr.lower():
+                flags |= FLAG_MACUPPER
+        except ValueError:
+            # Not a plain MAC.  Send it as a string and put the id where the MAC goes.
+            macBytes = struct.pack('<IH', self.getStringId(macAddr, pending), 0)
+            flags |= FLAG_MACSTRING
+
+        gps = (curNet.gpsLatitude, curNet.gpsLongitude, curNet.gpsAltitude, curNet.gpsSpeed)
+        strongestgps = (curNet.strongestLatitude, curNet.strongestLongitude, curNet.strongestAltitude, curNet.strongestSpeed)
+
+        if curNet.gpsValid:
+            flags |= FLAG_GPSVALID
+        if curNet.strongestValid:
+            flags |= FLAG_STRONGESTVALID
+        if curNet.gpsValid or gps != (0.0, 0.0, 0.0, 0.0):
+            flags |= FLAG_GPS
+        if (strongestgps != gps) or (curNet.strongestValid != curNet.gpsValid):
+            flags |= FLAG_STRONGEST
+
+        pending.append(NETWORK_FORMAT.pack(BLOCK_NETWORK, macBytes, flags, ssidId, profileId, curNet.frequency, curNet.channel, curNet.secondaryChannel,
+                                                    curNet.thirdChannel, curNet.bandwidth, curNet.signal, curNet.strongestsignal, curNet.firstSeenEpoch, curNet.lastSeenEpoch))
+
+        if flags & FLAG_GPS:
+            pending.append(GPS_FORMAT.pack(*gps))
+        if flags & FLAG_STRONGEST:
+            pending.append(GPS_FORMAT.pack(*strongestgps))
+
+        return b''.join(pending)
+
+    def end(self, retCode, errString, gpsdict, delta=None):
+        # delta is the seq/full/expired dict from wirelessengine.DeltaNetworkEncoder
+        pending = []
+
+        if delta is not None:
+            expiredIds = [self.getStringId(curKey, pending) for curKey in delta['expired']]
+            pending.append(DELTA_FORMAT.pack(BLOCK_DELTA, delta['seq'], delta['full'], len(expiredIds)))
+            pending.append(struct.pack('<%dI' % len(expiredIds), *expiredIds))
+    
+        errStringId = self.getStringId(errString, pending)
+        pending.append(END_FORMAT.pack(BLOCK_END, retCode, errStringId, gpsdict['latitude'], gpsdict['longitude'], gpsdict['altitude'], gpsdict['speed']))
+
+        return b''.join(pending)
+
+    def encode(self, wirelessNetworks, retCode, errString, gpsdict):
+        # Whole response at once.  wirelessNetworks can be a dict or a list.
+        if isinstance(wirelessNetworks, dict):
+            wirelessNetworks = wirelessNetworks.values()
+
+        return self.begin() + b''.join([self.encodeNetwork(curNet) for curNet in wirelessNetworks]) + self.end(retCode, errString, gpsdict)
+
+# ------------------  Decoder ------------------------------
+def decodeNetworks(data, delta=None):
+    # Returns errCode, errString, gps dict and a dict of WirelessNetworks keyed on getKey() like requestRemoteNetworks.
+    # If the response answers a since=<cursor> request and delta is a dict, the cursor, full flag and expired keys are put in it.
+    # Raises ValueError if the data isn't a complete response in a version we know.
+    if len(data) < HEADER_FORMAT.size:
+        raise ValueError('Truncated response')
+
+    magic, version = HEADER_FORMAT.unpack_from(data, 0)
+    if magic != WIRE_MAGIC:
+        raise ValueError('Not a sparrow networks response')
+    if version != WIRE_VERSION:
+        raise ValueError('Unsupported wire format version ' + str(version))
+
+    strings = []
+    profiles = []
+    wirelessNetworks = {}
+
+    unpackNetwork = NETWORK_FORMAT.unpack_from
+    unpackGPS = GPS_FORMAT.unpack_from
+    networkSize = NETWORK_FORMAT.size
+    gpsSize = GPS_FORMAT.size
+
+    offset = HEADER_FORMAT.size
+    dataLen = len(data)
+
+    try:
+        while offset < dataLen:
+            tag = data[offset]
+
+            if tag == BLOCK_NETWORK:
+                (tag, macBytes, flags, ssidId, profileId, frequency, channel, secondaryChannel, thirdChannel, bandwidth, signal,
+                    strongestsignal, firstSeen, lastSeen) = unpackNetwork(data, offset)
+                offset += networkSize
+
+                curNet = WirelessNetwork()
+                if flags & FLAG_MACSTRING:
+                    curNet.macAddr = strings[struct.unpack_from('<I', macBytes)[0]]
+                else:
+                    macAddr = macBytes.hex(':')
+                    if flags & FLAG_MACUPPER:
+                        macAddr = macAddr.upper()
+                    curNet.macAddr = macAddr
+
+                curNet.ssid = strings[ssidId]
+                curNet.mode, curNet.security, curNet.privacy, curNet.cipher, curNet.secondaryChannelLocation = profiles[profileId]
+                curNet.frequency = frequency
+                curNet.channel = channel
+                curNet.secondaryChannel = secondaryChannel
+                curNet.thirdChannel = thirdChannel
+                curNet.bandwidth = bandwidth
+                curNet.signal = signal
+                curNet.strongestsignal = strongestsignal
+                curNet.firstSeenEpoch = firstSeen
+                curNet.lastSeenEpoch = lastSeen
+                curNet.gpsValid = (flags & FLAG_GPSVALID) != 0
+                curNet.strongestValid = (flags & FLAG_STRONGESTVALID) != 0
+
+                if flags & FLAG_GPS:
+                    curNet.gpsLatitude, curNet.gpsLongitude, curNet.gpsAltitude, curNet.gpsSpeed = unpackGPS(data, offset)
+                    offset += gpsSize
+
+                if flags & FLAG_STRONGEST:
+                    curNet.strongestLatitude, curNet.strongestLongitude, curNet.strongestAltitude, curNet.strongestSpeed = unpackGPS(data, offset)
+                    offset += gpsSize
+                else:
+                    curNet.strongestLatitude = curNet.gpsLatitude
+                    curNet.strongestLongitude = curNet.gpsLongitude
+                    curNet.strongestAltitude = curNet.gpsAltitude
+                    curNet.strongestSpeed = curNet.gpsSpeed
+
+                wirelessNetworks[curNet.getKey()] = curNet
+            elif tag == BLOCK_STRING:
+                tag, stringLen = STRING_FORMAT.unpack_from(data, offset)
+                offset += STRING_FORMAT.size
+                if offset + stringLen > dataLen:
+                    raise ValueError('Truncated response')
+                strings.append(bytes(data[offset:offset + stringLen]).decode('UTF-8'))
+                offset += stringLen
+            elif tag == BLOCK_PROFILE:
+                profileIds = PROFILE_FORMAT.unpack_from(data, offset)[1:]
+                offset += PROFILE_FORMAT.size
+                profiles.append(tuple(strings[curId] for curId in profileIds))
+            elif tag == BLOCK_DELTA:
+                tag, seq, full, numExpired = DELTA_FORMAT.unpack_from(data, offset)
+                offset += DELTA_FORMAT.size
+                expiredIds = struct.unpack_from('<%dI' % numExpired, data, offset)
+                offset += 4 * numExpired
+                if delta is not None:
+                    delta['seq'] = seq
+                    delta['full'] = (full != 0)
+                    delta['expired'] = [strings[curId] for curId in expiredIds]
+            elif tag == BLOCK_END:
+                tag, errCode, errStringId, latitude, longitude, altitude, speed = END_FORMAT.unpack_from(data, offset)
+                gpsdict = {'latitude': latitude, 'longitude': longitude, 'altitude': altitude, 'speed': speed}
+                return errCode, strings[errStringId], gpsdict, wirelessNetworks
+            else:
+                raise ValueError('Unknown block type ' + str(tag))
+    except (struct.error, IndexError):
+        raise ValueError('Corrupt response')
+
+    raise ValueError('Truncated response')
@@ -510,7 +510,7 @@ class TelemetryDialog(QDialog):
         
         self.locationTable.setItem(rowPosition, 1, newSSID)
         self.locationTable.setItem(rowPosition, 2,  IntTableWidgetItem(str(curNet.signal)))
-        self.locationTable.setItem(rowPosition, 3, DateTableWidgetItem(curNet.lastSeen.strftime("%m/%d/%Y %H:%M:%S")))
+        self.locationTable.setItem(rowPosition, 3, DateTableWidgetItem(curNet.getLastSeenString()))
         if curNet.gps.isValid:
             self.locationTable.setItem(rowPosition, 4, QTableWidgetItem('Yes'))
         else:
@@ -720,7 +720,7 @@ class BluetoothTelemetry(TelemetryDialog):
         else:
             self.locationTable.setItem(rowPosition, 4,  IntTableWidgetItem(str('Unknown')))
             
-        self.locationTable.setItem(rowPosition, 5, DateTableWidgetItem(curDevice.lastSeen.strftime("%m/%d/%Y %H:%M:%S")))
+        self.locationTable.setItem(rowPosition, 5, DateTableWidgetItem(curDevice.getLastSeenString()))
         if curDevice.gps.isValid:
             self.locationTable.setItem(rowPosition, 6, QTableWidgetItem('Yes'))
         else:
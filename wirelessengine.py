@@ -25,9 +25,18 @@ import datetime
 from dateutil import parser
 import json
 import copy
-from time import sleep
-from sparrowgps import SparrowGPS
-from sparrowcommon import stringtobool
+from time import sleep, monotonic, time
+from threading import Lock, Thread, Condition
+import queue
+from sparrowgps import SparrowGPS, SparrowGPSView
+from sparrowcommon import stringtobool, toEpoch, formatEpoch
+from sparrowmetrics import metrics, TimedLock
+
+try:
+    import sparrownl80211
+    hasNL80211 = True
+except:
+    hasNL80211 = False
 
 # ------------------  Global channel to frequency definitions ------------------------------
 channelToFreq = {}
@@ -104,6 +113,92 @@ channelToFreq['189'] = '4945'
 channelToFreq['192'] = '4960'
 channelToFreq['196'] = '4980'
    
+# ------------------  iw output parser definitions ------------------------------
+# Two parser engines are available for iw scan output.  'dispatch' classifies each line
+# once by its leading token and runs a single extractor.  'regex' is the original
+# parser that runs the full regex chain on every line and is kept as the reference.
+IWPARSER_DISPATCH = 'dispatch'
+IWPARSER_REGEX = 'regex'
+
+iwParserMode = IWPARSER_DISPATCH
+
+# Reference regexes, compiled once
+p_bss = re.compile('^BSS (.*?)\(')
+p_ssid = re.compile('^.+?SSID: +(.*)')
+p_ess = re.compile('^	capability:.*(ESS)')
+p_ess_privacy = re.compile('^	capability:.*(ESS Privacy)')
+p_ibss = re.compile('^	capability:.*(IBSS)')
+p_ibss_privacy = re.compile('^	capability:.*(IBSS Privacy)')
+p_auth_suites = re.compile('.*?Authentication suites: *(.*)')
+p_pw_ciphers = re.compile('.*?Pairwise ciphers: *(.*)')
+p_param_channel = re.compile('^.*?DS Parameter set: channel +([0-9]+).*')
+p_primary_channel = re.compile('^.*?primary channel: +([0-9]+).*')
+p_freq = re.compile('^.*?freq:.*?([0-9]+).*')
+p_signal = re.compile('^.*?signal:.*?([\-0-9]+).*?dBm')
+p_ht = re.compile('.*?HT20/HT40.*')
+p_bw = re.compile('.*?\\* channel width:.*?([0-9]+) MHz.*')
+p_secondary = re.compile('^.*?secondary channel offset: *([^ \\t]+).*')
+p_thirdfreq = re.compile('^.*?center freq segment 1: *([^ \\t]+).*')
+p_lastseen = re.compile('^	last seen: *([0-9]+) ms ago')
+
+# Dispatch parser helpers.  Every field the reference chain can pick up needs one of these
+# substrings on the line, so lines the dispatcher can't classify are only handed to the
+# reference chain if the guard matches.
+p_dispatch_guard = re.compile('SSID: |capability:|Authentication suites:|Pairwise ciphers:|DS Parameter set: channel|primary channel:|' + 
+                                            'freq:|signal:|\\* channel width:|secondary channel offset:|center freq segment 1:|last seen:')
+p_dispatch_digits = re.compile('[0-9]+')
+p_dispatch_signal = re.compile('[\-0-9]+')
+p_dispatch_bw = re.compile('([0-9]+) MHz')
+p_dispatch_lastseen = re.compile(' *([0-9]+) ms ago')
+
+# Field names as they appear in front of the colon.  If a line with a single colon has a
+# name ending in one of these (but isn't one of the dispatch keys) it goes to the reference chain.
+iwTriggerNames = ('SSID', 'capability', 'Authentication suites', 'Pairwise ciphers', 'DS Parameter set', 'primary channel', 
+                            'freq', 'signal', 'channel width', 'secondary channel offset', 'center freq segment 1')
+
+# ------------------  Scan backend definitions ------------------------------
+# 'iw' forks iw and parses its text output.  'nl80211' talks to the kernel directly over generic
+# netlink (see sparrownl80211.py).  If nl80211 can't be used on this system, scans fall back to iw.
+SCANBACKEND_IW = 'iw'
+SCANBACKEND_NL80211 = 'nl80211'
+
+scanBackend = SCANBACKEND_IW
+
+# ------------------  Scan mode definitions ------------------------------
+# 'trigger' runs a full active scan every time.  'hybrid' only triggers a full scan every
+# hybridTriggerInterval seconds per interface/frequency.  In between it reads the kernel's BSS
+# cache ('iw dev <interface> scan dump'), which is fast and doesn't tie up the radio.
+# In hybrid mode anything last heard more than hybridMaxAge seconds ago is dropped.
+SCANMODE_TRIGGER = 'trigger'
+SCANMODE_HYBRID = 'hybrid'
+
+scanMode = SCANMODE_TRIGGER
+hybridTriggerInterval = 10.0  # seconds
+hybridMaxAge = 30.0  # seconds
+hybridLastTrigger = {}
+hybridLock = Lock()
+
+# ------------------  Scan batch definitions ------------------------------
+# Hunt lists are scanned scanBatchSize frequencies at a time ('iw dev <interface> scan freq f1 f2 ...')
+# instead of one iw call per frequency.  1 goes back to one frequency per scan, 0 puts the whole list in one scan.
+# scanTimings keeps the radio time per frequency from the last scan that covered it so the batch size can be tuned.
+scanBatchSize = 8
+scanTimings = {}  # (interface, frequency) -> seconds
+scanTimingLock = Lock()
+
+# ------------------  Multi-radio channel plan definitions ------------------------------
+# With no hunt list, several radios split the 2.4 and 5 GHz channels between them.  The 4.9 GHz public safety
+# channels in channelToFreq (and the odd 5080) aren't scanned unless they're asked for in a hunt list.
+# Each radio only gets frequencies its phy reports as enabled ('iw phy <phy> info'), cached per interface.
+PLAN_BANDS = [(2412, 2484), (5150, 5895)]  # MHz, inclusive
+supportedFrequencies = {}  # interface -> list of frequencies, empty if it couldn't be read
+
+# ------------------  Metrics ------------------------------
+# phase is subprocess (waiting on iw), parse (turning its output into networks) or nl80211 (the whole netlink scan)
+scanSeconds = metrics.histogram('sparrow_scan_seconds', 'Wireless scan time by phase', ('phase',))
+serializeSeconds = metrics.histogram('sparrow_serialize_seconds', 'Time spent encoding network lists for a response', ('call',))
+busyRetries = metrics.counter('sparrow_scan_busy_retries_total', 'Scans run again because the interface reported busy', ('call',))
+
 # ------------------  WirelessNetwork class ------------------------------------
 class WirelessClient(object):
     def __init__(self):
@@ -254,6 +349,20 @@ class WirelessNetwork(object):
     ERR_DEVICEBUSY = 240
     ERR_OPNOTPERMITTED = 255
     
+    # Long surveys hold tens of thousands of these, so they're slotted.  The GPS fields are stored inline
+    # (gps and strongestgps are SparrowGPS views onto them) and firstSeen/lastSeen are kept as float
+    # epoch seconds, converted to datetime only when read.  Use getLastSeenString() for display.
+    __slots__ = ('macAddr', 'ssid', 'mode', 'security', 'privacy', 'cipher', 'channel', 'frequency', 'signal', 'bandwidth', 
+                        'secondaryChannel', 'thirdChannel', 'secondaryChannelLocation', 'firstSeenEpoch', 'lastSeenEpoch', 
+                        'gpsLatitude', 'gpsLongitude', 'gpsAltitude', 'gpsSpeed', 'gpsValid', 'strongestsignal', 
+                        'strongestLatitude', 'strongestLongitude', 'strongestAltitude', 'strongestSpeed', 'strongestValid', 'foundInList')
+                        
+    GPS_FIELDS = ('gpsLatitude', 'gpsLongitude', 'gpsAltitude', 'gpsSpeed', 'gpsValid')
+    STRONGEST_GPS_FIELDS = ('strongestLatitude', 'strongestLongitude', 'strongestAltitude', 'strongestSpeed', 'strongestValid')
+    # Everything a delta sync compares (see sparrowcommon.ChangeLog).  lastSeen is handled separately and
+    # firstSeen is carried forward by whoever keeps the list, so neither counts as a change.
+    SIGNATURE_FIELDS = tuple(curField for curField in __slots__ if curField not in ('firstSeenEpoch', 'lastSeenEpoch', 'foundInList'))
+    
     def __init__(self):
         self.macAddr = ""
         self.ssid = ""
@@ -268,17 +377,70 @@ class WirelessNetwork(object):
         self.secondaryChannel = 0  # used for 40+ MHz
         self.thirdChannel = 0  # used for 80+ MHz channels
         self.secondaryChannelLocation = ''  # above/below
-        now=datetime.datetime.now()
-        self.firstSeen = now
-        self.lastSeen = now
-        self.gps = SparrowGPS()
+        now = time()
+        self.firstSeenEpoch = now
+        self.lastSeenEpoch = now
+        self.gpsLatitude = 0.0
+        self.gpsLongitude = 0.0
+        self.gpsAltitude = 0.0
+        self.gpsSpeed = 0.0
+        self.gpsValid = False
         self.strongestsignal = self.signal
-        self.strongestgps = SparrowGPS()
+        self.strongestLatitude = 0.0
+        self.strongestLongitude = 0.0
+        self.strongestAltitude = 0.0
+        self.strongestSpeed = 0.0
+        self.strongestValid = False
         
         # Used for tracking in network table
         self.foundInList = False
         
-        super().__init__()
+    @property
+    def gps(self):
+        return SparrowGPSView(self, WirelessNetwork.GPS_FIELDS)
+        
+    @gps.setter
+    def gps(self, gpsData):
+        # Copies the values, it doesn't keep gpsData
+        self.gpsLatitude = gpsData.latitude
+        self.gpsLongitude = gpsData.longitude
+        self.gpsAltitude = gpsData.altitude
+        self.gpsSpeed = gpsData.speed
+        self.gpsValid = gpsData.isValid
+        
+    @property
+    def strongestgps(self):
+        return SparrowGPSView(self, WirelessNetwork.STRONGEST_GPS_FIELDS)
+        
+    @strongestgps.setter
+    def strongestgps(self, gpsData):
+        self.strongestLatitude = gpsData.latitude
+        self.strongestLongitude = gpsData.longitude
+        self.strongestAltitude = gpsData.altitude
+        self.strongestSpeed = gpsData.speed
+        self.strongestValid = gpsData.isValid
+        
+    @property
+    def firstSeen(self):
+        return datetime.datetime.fromtimestamp(self.firstSeenEpoch)
+        
+    @firstSeen.setter
+    def firstSeen(self, timestamp):
+        self.firstSeenEpoch = toEpoch(timestamp)
+        
+    @property
+    def lastSeen(self):
+        return datetime.datetime.fromtimestamp(self.lastSeenEpoch)
+        
+    @lastSeen.setter
+    def lastSeen(self, timestamp):
+        self.lastSeenEpoch = toEpoch(timestamp)
+        
+    def getFirstSeenString(self):
+        return formatEpoch(self.firstSeenEpoch)
+        
+    def getLastSeenString(self):
+        return formatEpoch(self.lastSeenEpoch)
 
     def __str__(self):
         retVal = ""
@@ -307,7 +469,13 @@ class WirelessNetwork(object):
         return retVal
 
     def copy(self):
-        return copy.deepcopy(self)
+        # Every field is immutable, so a field-by-field copy is a full copy
+        retVal = WirelessNetwork.__new__(WirelessNetwork)
+        
+        for curField in WirelessNetwork.__slots__:
+            setattr(retVal, curField, getattr(self, curField))
+            
+        return retVal
         
     def __eq__(self, obj):
         # This is equivance....   ==
@@ -357,17 +525,17 @@ class WirelessNetwork(object):
         self.bandwidth = int(dictjson['bandwidth'])
         self.firstSeen = parser.parse(dictjson['firstseen'])
         self.lastSeen = parser.parse(dictjson['lastseen'])
-        self.gps.latitude = float(dictjson['lat'])
-        self.gps.longitude = float(dictjson['lon'])
-        self.gps.altitude = float(dictjson['alt'])
-        self.gps.speed = float(dictjson['speed'])
-        self.gps.isValid = stringtobool(dictjson['gpsvalid'])
+        self.gpsLatitude = float(dictjson['lat'])
+        self.gpsLongitude = float(dictjson['lon'])
+        self.gpsAltitude = float(dictjson['alt'])
+        self.gpsSpeed = float(dictjson['speed'])
+        self.gpsValid = stringtobool(dictjson['gpsvalid'])
         
-        self.strongestgps.latitude = float(dictjson['strongestlat'])
-        self.strongestgps.longitude = float(dictjson['strongestlon'])
-        self.strongestgps.altitude = float(dictjson['strongestalt'])
-        self.strongestgps.speed = float(dictjson['strongestspeed'])
-        self.strongestgps.isValid = stringtobool(dictjson['strongestgpsvalid'])
+        self.strongestLatitude = float(dictjson['strongestlat'])
+        self.strongestLongitude = float(dictjson['strongestlon'])
+        self.strongestAltitude = float(dictjson['strongestalt'])
+        self.strongestSpeed = float(dictjson['strongestspeed'])
+        self.strongestValid = stringtobool(dictjson['strongestgpsvalid'])
             
     def fromJson(self, jsonstr):
         dictjson = json.loads(jsonstr)
@@ -392,17 +560,17 @@ class WirelessNetwork(object):
         dictjson['bandwidth'] = self.bandwidth
         dictjson['firstseen'] = str(self.firstSeen)
         dictjson['lastseen'] = str(self.lastSeen)
-        dictjson['lat'] = str(self.gps.latitude)
-        dictjson['lon'] = str(self.gps.longitude)
-        dictjson['alt'] = str(self.gps.altitude)
-        dictjson['speed'] = str(self.gps.speed)
-        dictjson['gpsvalid'] = str(self.gps.isValid)
+        dictjson['lat'] = str(self.gpsLatitude)
+        dictjson['lon'] = str(self.gpsLongitude)
+        dictjson['alt'] = str(self.gpsAltitude)
+        dictjson['speed'] = str(self.gpsSpeed)
+        dictjson['gpsvalid'] = str(self.gpsValid)
         
-        dictjson['strongestlat'] = str(self.strongestgps.latitude)
-        dictjson['strongestlon'] = str(self.strongestgps.longitude)
-        dictjson['strongestalt'] = str(self.strongestgps.altitude)
-        dictjson['strongestspeed'] = str(self.strongestgps.speed)
-        dictjson['strongestgpsvalid'] = str(self.strongestgps.isValid)
+        dictjson['strongestlat'] = str(self.strongestLatitude)
+        dictjson['strongestlon'] = str(self.strongestLongitude)
+        dictjson['strongestalt'] = str(self.strongestAltitude)
+        dictjson['strongestspeed'] = str(self.strongestSpeed)
+        dictjson['strongestgpsvalid'] = str(self.strongestValid)
         
         return dictjson
         
@@ -421,256 +589,1521 @@ class WirelessNetwork(object):
     def getKey(self):
         return self.macAddr + self.ssid+str(self.channel)
         
-class WirelessEngine(object):
+    def getSignature(self):
+        return tuple(getattr(self, curField) for curField in WirelessNetwork.SIGNATURE_FIELDS)
+        
+class JsonNetworkEncoder(object):
+    # Builds a /wireless/networks response a network at a time.  The networks come first since errCode and
+    # errString aren't known until the scan finishes.  sparrowwire.BinaryNetworkEncoder has the same interface.
+    contentType = 'application/json'
+    
     def __init__(self):
-        super().__init__()
-
-    def getMacAddress(interface):
-        macaddr = ""
+        self.firstNet = True
         
-        try:
-            f = open('/sys/class/net/'+interface+'/address', 'r')
-            macaddr = f.readline().strip()
-            f.close()
-        except:
-            pass
-            
-        return macaddr
+    def begin(self):
+        return b'{"networks": ['
         
-    def getFrequencyForChannel(channelNumber):
-        channelStr = str(channelNumber)
-        if channelStr in channelToFreq:
-            return channelToFreq[channelStr]
+    def encodeNetwork(self, curNet):
+        if self.firstNet:
+            self.firstNet = False
+            return json.dumps(curNet.toJsondict()).encode('UTF-8')
         else:
-            return None
+            return (', ' + json.dumps(curNet.toJsondict())).encode('UTF-8')
             
-    def getSignalQualityFromDB0To5(dBm):
-        # Based on same scale tha Microsoft uses.
-        # See https://stackoverflow.com/questions/15797920/how-to-convert-wifi-signal-strength-from-quality-percent-to-rssi-dbm
-        if (dBm <= -100):
-            quality = 0
-        elif dBm >= -50:
-            quality = 100
+    def end(self, retCode, errString, gpsdict, delta=None):
+        # delta is the seq/full/expired dict from DeltaNetworkEncoder
+        if delta is not None:
+            deltastr = ', "seq": ' + json.dumps(delta['seq']) + ', "full": ' + json.dumps(delta['full']) + ', "expired": ' + json.dumps(delta['expired'])
         else:
-            quality = 2 * (dBm + 100)      
-        
-        return int(4*quality/100)
-
-    def getSignalQualityFromDB(dBm):
-        # Based on same scale tha Microsoft uses.
-        # See https://stackoverflow.com/questions/15797920/how-to-convert-wifi-signal-strength-from-quality-percent-to-rssi-dbm
-        if (dBm <= -100):
-            quality = 0
-        elif dBm >= -50:
-            quality = 100
-        else:
-            quality = 2 * (dBm + 100)      
-        
-        return quality
-
-    def convertUnknownToString(ssid):
-        if '\\x00' not in ssid:
-            return ssid
+            deltastr = ''
             
-        retVal = ssid.replace('\\x00', '')
-        numblanks = ssid.count('\\x00')
+        return ('], "errCode": ' + json.dumps(retCode) + ', "errString": ' + json.dumps(errString) + ', "gps": ' + json.dumps(gpsdict) + deltastr + '}').encode('UTF-8')
         
-        if len(retVal) == 0:
-            if numblanks > 0:
-                return '<Unknown (' + str(numblanks )+ ')>'
-            else:
-                return '<Unknown>'
-        else:
-            return ssid
+class NdjsonNetworkEncoder(object):
+    # Live stream version of JsonNetworkEncoder: one JSON object per line.  Each network is its own
+    # {"type": "network"} line as soon as iw reports it, and a {"type": "scan"} line with errCode, errString
+    # and gps closes out the scan.
+    contentType = 'application/x-ndjson'
+    
+    def begin(self):
+        return b''
         
-    def getInterfaces(printResults=False):
-        result = subprocess.run(['iwconfig'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
-        wirelessResult = result.stdout.decode('ASCII')
-        p = re.compile('^(.*?) IEEE', re.MULTILINE)
-        tmpInterfaces = p.findall(wirelessResult)
+    def encodeNetwork(self, curNet):
+        return (json.dumps({'type': 'network', 'network': curNet.toJsondict()}) + '\n').encode('UTF-8')
         
-        retVal = []
+    def end(self, retCode, errString, gpsdict, delta=None):
+        return (json.dumps({'type': 'scan', 'errCode': retCode, 'errString': errString, 'gps': gpsdict}) + '\n').encode('UTF-8')
         
-        if (len(tmpInterfaces) > 0):
-            for curInterface in tmpInterfaces:
-                tmpStr=curInterface.replace(' ','')
-                retVal.append(tmpStr)
-                # debug
-                if (printResults):
-                    print(tmpStr)
-        else:
-            # debug
-            if (printResults):
-                print("Error: No wireless interfaces found.")
-
-        return retVal
-
-    def getMonitoringModeInterfaces(printResults=False):
-        # Note: for standard scans with iw, this isn't required.  Just root access.
-        # This is only required for some of the more advanced pen testing capabilities
-        result = subprocess.run(['iwconfig'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
-        wirelessResult = result.stdout.decode('ASCII')
-        p = re.compile('^(.*?) IEEE.*?Mode:Monitor', re.MULTILINE)
-        tmpInterfaces = p.findall(wirelessResult)
+class DeltaNetworkEncoder(object):
+    # Wraps a JsonNetworkEncoder or BinaryNetworkEncoder for since=<cursor> requests.  Networks from the scan go
+    # through the data set's ChangeLog and only the ones that changed are sent, along with anything else that
+    # changed since the cursor (another client's scan for instance).  The response ends with the new cursor and
+    # the keys of networks that expired.
+    def __init__(self, encoder, changeLog, since):
+        self.encoder = encoder
+        self.contentType = encoder.contentType
+        self.changeLog = changeLog
+        self.since = since
+        self.sentKeys = set()
         
-        retVal = []
+    def begin(self):
+        return self.encoder.begin()
         
-        if (len(tmpInterfaces) > 0):
-            for curInterface in tmpInterfaces:
-                tmpStr=curInterface.replace(' ','')
-                retVal.append(tmpStr)
-                # debug
-                if (printResults):
-                    print(tmpStr)
-        else:
-            # debug
-            if (printResults):
-                print("Error: No monitoring mode wireless interfaces found.")
-
-        return retVal
-
-    def getNetworksAsJson(interfaceName, gpsData, huntChannelList=None):
-        # This is only used by the remote agent to get and return networks
-        if (huntChannelList is None) or (len(huntChannelList) == 0):
-            # This code handles the thought that "what if we query for networks and the interface
-            # reports busy (it does happen if we query too fast.)
-            retries = 0
-            retCode = WirelessNetwork.ERR_DEVICEBUSY
+    def encodeNetwork(self, curNet):
+        curKey = curNet.getKey()
+        
+        # Carry forward firstSeen like the agent's recorder does
+        pastNet = self.changeLog.getRecord(curKey)
+        if pastNet is not None:
+            curNet.firstSeenEpoch = pastNet.firstSeenEpoch
             
-            while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
-                # Handle retries in case we get a busy response
-                retCode, errString, wirelessNetworks = WirelessEngine.scanForNetworks(interfaceName)
-                retries += 1
-                if retCode == WirelessNetwork.ERR_DEVICEBUSY:
-                    sleep(0.4)
+        if self.changeLog.update(curKey, curNet, curNet.getSignature(), curNet.lastSeenEpoch):
+            self.sentKeys.add(curKey)
+            return self.encoder.encodeNetwork(curNet)
         else:
-            wirelessNetworks = {}
-            for curFrequency in huntChannelList:
-                # Handle if the device reports busy with some retries
-                retries = 0
-                retCode = WirelessNetwork.ERR_DEVICEBUSY
-                while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
-                    # Handle retries in case we get a busy response
-                    retCode, errString, tmpWirelessNetworks = WirelessEngine.scanForNetworks(interfaceName,curFrequency )
-                    retries += 1
-                    if retCode == WirelessNetwork.ERR_DEVICEBUSY:
-                        sleep(0.2)
-                
-                for curKey in tmpWirelessNetworks.keys():
-                    curNet = tmpWirelessNetworks[curKey]
-                    wirelessNetworks[curNet.getKey()] = tmpWirelessNetworks[curNet.getKey()]
-            
-        retVal = {}
-        retVal['errCode'] = retCode
-        retVal['errString'] = errString
-        
-        netList = []
-        
-        for curKey in wirelessNetworks.keys():
-            curNet = wirelessNetworks[curKey]
-            if gpsData is not None:
-                curNet.gps.copy(gpsData)
-            netList.append(curNet.toJsondict())
+            return b''
             
-        gpsdict = {}
-        
-        gpsloc = SparrowGPS()
-        if (gpsData is not None):
-            gpsloc.copy(gpsData)
-        
-        gpsdict['latitude'] = gpsloc.latitude
-        gpsdict['longitude'] = gpsloc.longitude
-        gpsdict['altitude'] = gpsloc.altitude
-        gpsdict['speed'] = gpsloc.speed
-        retVal['gps'] = gpsdict
+    def end(self, retCode, errString, gpsdict):
+        self.changeLog.expireOld()
+        full, cursor, changedNetworks, expiredKeys = self.changeLog.getChanges(self.since)
         
-        retVal['networks'] = netList
+        pending = []
+        for curNet in changedNetworks:
+            if curNet.getKey() not in self.sentKeys:
+                pending.append(self.encoder.encodeNetwork(curNet))
+                
+        delta = {'seq': cursor, 'full': full, 'expired': expiredKeys}
+        pending.append(self.encoder.end(retCode, errString, gpsdict, delta))
         
-        jsonstr = json.dumps(retVal)
+        return b''.join(pending)
         
-        return retCode, errString, jsonstr
+class WirelessScanStream(object):
+    # Runs 'iw dev <interface> scan' (or 'scan dump' in hybrid mode) and parses stdout as it arrives.  Iterating
+    # yields each WirelessNetwork as its BSS block completes.  retCode, errString and scanTime are set once iteration is done.
+    # frequency can be a single frequency or a list of them to scan in one pass.
+    def __init__(self, interfaceName, frequency=0):
+        self.interfaceName = interfaceName
+        self.frequency = frequency
+        self.retCode = 0
+        self.errString = ""
+        self.numNetworks = 0
+        self.scanTime = 0.0  # seconds
+        self.preamble = []
         
-    def scanForNetworks(interfaceName, frequency=0, printResults=False):
+    def __iter__(self):
+        self.retCode = 0
+        self.errString = ""
+        self.numNetworks = 0
+        self.scanTime = 0.0
         
-        if frequency == 0:
-            result = subprocess.run(['iw', 'dev', interfaceName, 'scan'], stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        if scanMode == SCANMODE_HYBRID:
+            dumpCache = not WirelessEngine.isTriggerDue(self.interfaceName, self.frequency)
+            
+            if not dumpCache:
+                for curNetwork in self.runScan(False):
+                    yield curNetwork
+                    
+                if self.retCode == 0:
+                    WirelessEngine.setTriggerDone(self.interfaceName, self.frequency)
+                    return
+                elif self.retCode != WirelessNetwork.ERR_DEVICEBUSY:
+                    return
+                    
+                # Busy usually means a scan is already running.  The cache is still good.
+                self.retCode = 0
+                self.errString = ""
+                
+            for curNetwork in self.runScan(True):
+                yield curNetwork
         else:
-            result = subprocess.run(['iw', 'dev', interfaceName, 'scan', 'freq', str(frequency)], stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-
-        retCode = result.returncode
-        errString = ""
-        wirelessResult = result.stdout.decode('ASCII')
-        
-        # debug
-        if (printResults):
-            print('Return Code ' + str(retCode))
-            print(wirelessResult)
-        
-        wirelessNetworks = {}
+            for curNetwork in self.runScan(False):
+                yield curNetwork
+            
+    def runScan(self, dumpCache):
+        self.preamble = []
+        startTime = datetime.datetime.now()
         
-        if (retCode == 0):
-            wirelessNetworks = WirelessEngine.parseIWoutput(wirelessResult)
+        params = WirelessEngine.getScanParams(self.interfaceName, self.frequency, dumpCache)
+            
+        if scanMode == SCANMODE_HYBRID:
+            oldestSeen = datetime.datetime.now() - datetime.timedelta(seconds=hybridMaxAge)
         else:
-            # errCodes:
-            # 156 = Network is down (i.e. switch may be turned off)
-            # 240  = command failed: Device or resource busy (-16)
-            errString = wirelessResult.replace("\n", "")
-            if (retCode == WirelessNetwork.ERR_NETDOWN):
-                errString = 'Interface appears down'
-            elif (retCode == WirelessNetwork.ERR_DEVICEBUSY):
-                errString = 'Device is busy'
-            elif (retCode == WirelessNetwork.ERR_OPNOTPERMITTED):
-                errString = errString + '. Did you run as root?'
+            oldestSeen = None
             
-        return retCode, errString, wirelessNetworks
+        if scanBackend == SCANBACKEND_NL80211:
+            # nl80211 only returns results once the scan is complete, so there's nothing to stream
+            try:
+                if dumpCache:
+                    self.retCode, self.errString, wirelessNetworks = sparrownl80211.NL80211Scanner().dump(self.interfaceName)
+                else:
+                    self.retCode, self.errString, wirelessNetworks = sparrownl80211.NL80211Scanner().scan(self.interfaceName, self.frequency)
+            except sparrownl80211.NL80211Error:
+                wirelessNetworks = None
+                
+            if wirelessNetworks is not None:
+                self.scanTime = (datetime.datetime.now() - startTime).total_seconds()
+                scanSeconds.observe(self.scanTime, ('nl80211',))
+                
+                if self.retCode != 0:
+                    self.errString = WirelessEngine.getScanErrString(self.retCode, self.errString)
+                elif not dumpCache:
+                    WirelessEngine.recordScanTime(self.interfaceName, self.frequency, self.scanTime)
+                    
+                for curKey in wirelessNetworks.keys():
+                    curNetwork = wirelessNetworks[curKey]
+                    if WirelessEngine.isCachedNetworkCurrent(curNetwork, self.frequency, oldestSeen):
+                        self.numNetworks += 1
+                        yield curNetwork
+                    
+                return
+                
+        proc = subprocess.Popen(params, stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
         
-    def getFieldValue(p, curLine):
-        matchobj = p.search(curLine)
+        # Time inside the parser, less the part of it spent waiting on iw in readLines.  What the caller does
+        # with each network isn't counted.
+        self.readTime = 0.0
+        parseTime = 0.0
         
-        if not matchobj:
-            return ""
-            
         try:
-            retVal = matchobj.group(1)
-        except:
-            retVal = ""
+            networks = WirelessEngine.iterIWoutput(self.readLines(proc))
+            while True:
+                parseStart = monotonic()
+                curNetwork = next(networks, None)
+                parseTime += monotonic() - parseStart
+                
+                if curNetwork is None:
+                    break
+                    
+                if WirelessEngine.isCachedNetworkCurrent(curNetwork, self.frequency, oldestSeen):
+                    self.numNetworks += 1
+                    yield curNetwork
+                
+            proc.wait()
             
-        return retVal
+            scanSeconds.observe(self.readTime, ('subprocess',))
+            scanSeconds.observe(max(parseTime - self.readTime, 0.0), ('parse',))
+        finally:
+            if proc.poll() is None:
+                # Caller stopped iterating early
+                proc.kill()
+                proc.wait()
+                
+            proc.stdout.close()
+            
+        self.retCode = proc.returncode
+        self.scanTime = (datetime.datetime.now() - startTime).total_seconds()
         
-    def parseIWoutput(iwOutput):
-        
-        # Define search regexes once:
-        p_bss = re.compile('^BSS (.*?)\(')
-        p_ssid = re.compile('^.+?SSID: +(.*)')
-        p_ess = re.compile('^	capability:.*(ESS)')
-        p_ess_privacy = re.compile('^	capability:.*(ESS Privacy)')
-        p_ibss = re.compile('^	capability:.*(IBSS)')
-        p_ibss_privacy = re.compile('^	capability:.*(IBSS Privacy)')
-        p_auth_suites = re.compile('.*?Authentication suites: *(.*)')
-        p_pw_ciphers = re.compile('.*?Pairwise ciphers: *(.*)')
-        p_param_channel = re.compile('^.*?DS Parameter set: channel +([0-9]+).*')
-        p_primary_channel = re.compile('^.*?primary channel: +([0-9]+).*')
-        p_freq = re.compile('^.*?freq:.*?([0-9]+).*')
-        p_signal = re.compile('^.*?signal:.*?([\-0-9]+).*?dBm')
-        p_ht = re.compile('.*?HT20/HT40.*')
-        p_bw = re.compile('.*?\\* channel width:.*?([0-9]+) MHz.*')
-        p_secondary = re.compile('^.*?secondary channel offset: *([^ \\t]+).*')
-        p_thirdfreq = re.compile('^.*?center freq segment 1: *([^ \\t]+).*')
-        
-        # start
-        retVal = {}
-        curNetwork = None
-        now=datetime.datetime.now()
+        if self.retCode != 0:
+            self.errString = WirelessEngine.getScanErrString(self.retCode, ''.join(self.preamble))
+        elif not dumpCache:
+            WirelessEngine.recordScanTime(self.interfaceName, self.frequency, self.scanTime)
+            
+    def readLines(self, proc):
+        # On errors iw only prints a message, so keep what comes before the first BSS header for errString
+        inPreamble = True
         
-        # This now supports direct from STDOUT via scanForNetworks,
-        # and input from a file as f.readlines() which returns a list
-        if type(iwOutput) == str:
-            inputLines = iwOutput.splitlines()
-        else:
-            inputLines = iwOutput
+        lines = iter(proc.stdout)
+        while True:
+            readStart = monotonic()
+            rawLine = next(lines, None)
+            self.readTime += monotonic() - readStart
             
-        for curLine in inputLines:
-            fieldValue = WirelessEngine.getFieldValue(p_bss, curLine)
+            if rawLine is None:
+                break
+                
+            for curLine in rawLine.decode('ASCII').splitlines():
+                if inPreamble:
+                    if curLine.startswith('BSS '):
+                        inPreamble = False
+                    elif len(self.preamble) < 20:
+                        self.preamble.append(curLine)
+                    
+                yield curLine
+                
+# ------------------  Multi-radio scanner ------------------------------
+class MultiRadioScanner(object):
+    # Sweeps a channel plan with several interfaces at once.  Each radio gets an interleaved share of the
+    # frequencies (so 2.4 and 5 GHz are spread across them) and results are merged by getKey().
+    # Pass the agent's lockList so each radio's scans are serialized with anything else using that interface.
+    # With no plan, one interface does a normal full scan and several split up every channel in channelToFreq.
+    def __init__(self, interfaceList, huntChannelList=None, lockList=None):
+        self.interfaceList = []
+        for curInterface in interfaceList:
+            if (len(curInterface) > 0) and (curInterface not in self.interfaceList):
+                self.interfaceList.append(curInterface)
+                
+        self.huntChannelList = huntChannelList
+        self.lockList = lockList
+        self.retCode = 0
+        self.errString = ""
+        self.numNetworks = 0
+        self.radioErrors = {}  # interface -> (retCode, errString) of its last failed scan
+        self.radioTimes = {}  # interface -> seconds to sweep its share of the plan
+        self.signalStop = False
+        
+    def getChannelPlan(self):
+        if (self.huntChannelList is not None) and (len(self.huntChannelList) > 0):
+            return sorted(set(int(curFrequency) for curFrequency in self.huntChannelList))
+        elif len(self.interfaceList) > 1:
+            channelPlan = set()
+            for curFrequency in channelToFreq.values():
+                curFrequency = int(curFrequency)
+                for lowFrequency, highFrequency in PLAN_BANDS:
+                    if lowFrequency <= curFrequency <= highFrequency:
+                        channelPlan.add(curFrequency)
+                        
+            return sorted(channelPlan)
+        else:
+            return [0]
+            
+    def partitionChannels(self):
+        # Each frequency goes to whichever radio that can tune it has the fewest so far, taking them in order so
+        # the bands are interleaved across radios.  A radio whose frequencies couldn't be read is assumed to take
+        # anything.  Frequencies no radio supports are dropped.
+        channelPlan = self.getChannelPlan()
+        retVal = {}
+        
+        if channelPlan == [0]:
+            for curInterface in self.interfaceList:
+                retVal[curInterface] = [0]
+                
+            return retVal
+            
+        radioFrequencies = {}
+        for curInterface in self.interfaceList:
+            radioFrequencies[curInterface] = WirelessEngine.getSupportedFrequencies(curInterface)
+            
+        radioChannels = {}
+        for curInterface in self.interfaceList:
+            radioChannels[curInterface] = []
+            
+        for curFrequency in channelPlan:
+            candidates = [curInterface for curInterface in self.interfaceList if (len(radioFrequencies[curInterface]) == 0) or (curFrequency in radioFrequencies[curInterface])]
+            
+            if len(candidates) > 0:
+                # min() keeps the first of equals, so with no limits this is the same round-robin as before
+                curInterface = min(candidates, key=lambda curInterface: len(radioChannels[curInterface]))
+                radioChannels[curInterface].append(curFrequency)
+                
+        for curInterface in self.interfaceList:
+            if len(radioChannels[curInterface]) > 0:
+                retVal[curInterface] = radioChannels[curInterface]
+                
+        return retVal
+        
+    def sweepBatch(self, interfaceName, curBatch, curLock, resultQueue):
+        # Handle if the device reports busy with some retries
+        retries = 0
+        retCode = WirelessNetwork.ERR_DEVICEBUSY
+        errString = ""
+        while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3) and (not self.signalStop):
+            scanStream = WirelessEngine.scanForNetworksStreaming(interfaceName, curBatch)
+            
+            if curLock:
+                curLock.acquire()
+                
+            try:
+                for curNet in scanStream:
+                    resultQueue.put(curNet)
+            finally:
+                if curLock:
+                    curLock.release()
+                    
+            retCode = scanStream.retCode
+            errString = scanStream.errString
+            retries += 1
+            if retCode == WirelessNetwork.ERR_DEVICEBUSY:
+                busyRetries.inc(1, ('radioSweep',))
+                sleep(0.2)
+                
+        return retCode, errString
+        
+    def radioSweep(self, interfaceName, frequencyList, resultQueue):
+        startTime = datetime.datetime.now()
+        
+        try:
+            if self.lockList is not None:
+                if interfaceName not in self.lockList.keys():
+                    self.lockList[interfaceName] = TimedLock('lockList')
+                    
+                curLock = self.lockList[interfaceName]
+            else:
+                curLock = None
+                
+            # A plan of [0] is a full scan
+            for curBatch in WirelessEngine.getFrequencyBatches([curFrequency for curFrequency in frequencyList if curFrequency != 0]):
+                if self.signalStop:
+                    break
+                    
+                retCode, errString = self.sweepBatch(interfaceName, curBatch, curLock, resultQueue)
+                
+                if (retCode != 0) and (retCode != WirelessNetwork.ERR_DEVICEBUSY) and (len(curBatch) > 1):
+                    # One frequency the driver rejects fails the whole 'iw scan freq' call, so try them one at a
+                    # time and only report the ones that fail on their own.
+                    retCode = 0
+                    for curFrequency in curBatch:
+                        if self.signalStop:
+                            break
+                            
+                        freqRetCode, freqErrString = self.sweepBatch(interfaceName, [curFrequency], curLock, resultQueue)
+                        if freqRetCode != 0:
+                            retCode = freqRetCode
+                            errString = str(curFrequency) + ' MHz: ' + freqErrString
+                            
+                if retCode != 0:
+                    self.radioErrors[interfaceName] = (retCode, errString)
+        except Exception as e:
+            self.radioErrors[interfaceName] = (-1, str(e))
+        finally:
+            self.radioTimes[interfaceName] = (datetime.datetime.now() - startTime).total_seconds()
+            # Tell the collector this radio is done
+            resultQueue.put(None)
+            
+    def iterResults(self):
+        # Yields every network from every radio as it's reported, duplicates included
+        self.retCode = 0
+        self.errString = ""
+        self.numNetworks = 0
+        self.radioErrors = {}
+        self.radioTimes = {}
+        self.signalStop = False
+        
+        radioPlan = self.partitionChannels()
+        resultQueue = queue.Queue()
+        
+        for curInterface in radioPlan.keys():
+            radioThread = Thread(target=self.radioSweep, args=(curInterface, radioPlan[curInterface], resultQueue))
+            radioThread.daemon = True
+            radioThread.start()
+            
+        numRunning = len(radioPlan)
+        
+        try:
+            while numRunning > 0:
+                curNet = resultQueue.get()
+                if curNet is None:
+                    numRunning -= 1
+                else:
+                    self.numNetworks += 1
+                    yield curNet
+        finally:
+            # Stops the radios after their current scan if the caller quit early
+            self.signalStop = True
+            
+        if (len(radioPlan) == 0) or (len(self.radioErrors) == len(radioPlan) and self.numNetworks == 0):
+            # Nothing worked
+            if len(self.radioErrors) > 0:
+                self.retCode = list(self.radioErrors.values())[0][0]
+            else:
+                self.retCode = WirelessNetwork.ERR_OPNOTSUPPORTED
+                self.errString = 'No interfaces specified'
+                
+        if len(self.radioErrors) > 0:
+            self.errString = '; '.join(curInterface + ': ' + self.radioErrors[curInterface][1] for curInterface in self.radioErrors.keys())
+            
+    def __iter__(self):
+        # Each network once, as soon as the first radio reports it
+        sentKeys = set()
+        
+        for curNet in self.iterResults():
+            curKey = curNet.getKey()
+            if curKey not in sentKeys:
+                sentKeys.add(curKey)
+                yield curNet
+                
+    def scan(self):
+        # Returns retCode, errString, wirelessNetworks like WirelessEngine.scanForNetworks.
+        # If more than one radio hears a network, the strongest reading is kept.
+        wirelessNetworks = {}
+        
+        for curNet in self.iterResults():
+            curKey = curNet.getKey()
+            if (curKey not in wirelessNetworks.keys()) or (curNet.signal > wirelessNetworks[curKey].signal):
+                wirelessNetworks[curKey] = curNet
+                
+        return self.retCode, self.errString, wirelessNetworks
+        
+# ------------------  Adaptive channel scheduler ------------------------------
+class ChannelScheduler(object):
+    # Decides which hunt frequencies to scan next.  Each channel's cost (seconds of scan time) and yield
+    # (new or changed BSS per second of scan time) are measured, and scan time is handed out in proportion
+    # to 1 + yield with stride scheduling, so busy channels come around more often and quiet ones less.
+    # A channel not visited for maxIdle seconds goes to the front so nothing starves.
+    # getCycleDelay() holds a fixed cyclePeriod per scan instead of sleeping a constant amount after it.
+    # With adaptive=False it visits the channels round-robin but keeps the same statistics for comparison.
+    def __init__(self, channelList, cyclePeriod=1.0, batchSize=None, adaptive=True):
+        self.channelList = []
+        for curFrequency in channelList:
+            if int(curFrequency) not in self.channelList:
+                self.channelList.append(int(curFrequency))
+                
+        self.cyclePeriod = cyclePeriod  # seconds
+        self.minDelay = 0.1  # seconds.  Always leave the radio this long between scans
+        self.batchSize = batchSize  # None uses scanBatchSize
+        self.adaptive = adaptive
+        self.maxIdle = 20.0  # seconds
+        self.yieldAlpha = 0.3  # EWMA weight of the newest scan
+        self.signalChange = 10  # dBm.  A signal move this big counts as a changed BSS
+        self.maxDecisions = 100
+        self.clock = monotonic
+        
+        self.stats = {}
+        for curFrequency in self.channelList:
+            self.stats[curFrequency] = {'scans': 0, 'failures': 0, 'airtime': 0.0, 'cost': 0.0, 'yieldrate': 0.0, 'pass': 0.0, 'new': 0, 'changed': 0, 'lastvisit': None}
+            
+        self.seenNetworks = {}  # key -> (frequency, signature, signal)
+        self.decisions = []
+        self.nextIndex = 0
+        self.nextDeadline = None
+        self.lock = Lock()
+        
+    def getBatchSize(self):
+        if self.batchSize is None:
+            batchSize = scanBatchSize
+        else:
+            batchSize = self.batchSize
+            
+        if (batchSize <= 0) or (batchSize > len(self.channelList)):
+            return len(self.channelList)
+        else:
+            return batchSize
+            
+    def getWeight(self, frequency):
+        return 1.0 + self.stats[frequency]['yieldrate']
+        
+    def nextBatch(self):
+        # Returns the list of frequencies to hand to the next scan
+        if len(self.channelList) == 0:
+            return [0]
+            
+        self.lock.acquire()
+        
+        now = self.clock()
+        batchSize = self.getBatchSize()
+        
+        if not self.adaptive:
+            retVal = []
+            for i in range(0, batchSize):
+                retVal.append(self.channelList[(self.nextIndex + i) % len(self.channelList)])
+                
+            self.nextIndex = (self.nextIndex + batchSize) % len(self.channelList)
+            reason = 'round-robin'
+        else:
+            # Unvisited and idle-too-long channels first, then lowest pass
+            idle = []
+            for curFrequency in self.channelList:
+                lastVisit = self.stats[curFrequency]['lastvisit']
+                if (lastVisit is None) or (now - lastVisit >= self.maxIdle):
+                    idle.append(curFrequency)
+                    
+            ranked = sorted(self.channelList, key=lambda curFrequency: (curFrequency not in idle, self.stats[curFrequency]['pass']))
+            retVal = ranked[:batchSize]
+            
+            if len(idle) > 0:
+                reason = 'idle'
+            else:
+                reason = 'pass'
+                
+        self.decisions.append({'time': now, 'frequencies': list(retVal), 'reason': reason})
+        if len(self.decisions) > self.maxDecisions:
+            self.decisions.pop(0)
+            
+        self.lock.release()
+        
+        return retVal
+        
+    def getSignature(self, curNet):
+        return (curNet.ssid, curNet.security, curNet.privacy, curNet.cipher, curNet.channel, curNet.bandwidth)
+        
+    def recordScan(self, frequencyList, scanTime, wirelessNetworks):
+        # Call after each successful scan of a batch from nextBatch() with how long it took and what it found
+        self.lock.acquire()
+        
+        now = self.clock()
+        frequencyList = [curFrequency for curFrequency in frequencyList if curFrequency in self.stats]
+        
+        if len(frequencyList) == 0:
+            self.lock.release()
+            return
+            
+        # The kernel dwells about the same time on each channel
+        channelCost = max(scanTime / len(frequencyList), 0.001)
+        found = {}
+        for curFrequency in frequencyList:
+            found[curFrequency] = 0
+            
+        for curKey in wirelessNetworks.keys():
+            curNet = wirelessNetworks[curKey]
+            if curNet.frequency not in found:
+                continue
+                
+            signature = self.getSignature(curNet)
+            
+            if curKey not in self.seenNetworks:
+                self.stats[curNet.frequency]['new'] += 1
+                found[curNet.frequency] += 1
+            else:
+                lastFrequency, lastSignature, lastSignal = self.seenNetworks[curKey]
+                if (lastSignature != signature) or (abs(curNet.signal - lastSignal) >= self.signalChange):
+                    self.stats[curNet.frequency]['changed'] += 1
+                    found[curNet.frequency] += 1
+                    
+            self.seenNetworks[curKey] = (curNet.frequency, signature, curNet.signal)
+            
+        # Stride scheduling keeps a channel's share of scan time proportional to its weight.
+        # A channel coming back from being idle starts at the current minimum so it doesn't get a burst.
+        minPass = min(self.stats[curFrequency]['pass'] for curFrequency in self.channelList)
+        
+        for curFrequency in frequencyList:
+            curStats = self.stats[curFrequency]
+            yieldRate = found[curFrequency] / channelCost
+            
+            if curStats['scans'] == 0:
+                curStats['cost'] = channelCost
+                curStats['yieldrate'] = yieldRate
+            else:
+                curStats['cost'] += self.yieldAlpha * (channelCost - curStats['cost'])
+                curStats['yieldrate'] += self.yieldAlpha * (yieldRate - curStats['yieldrate'])
+                
+            curStats['scans'] += 1
+            curStats['airtime'] += channelCost
+            curStats['lastvisit'] = now
+            curStats['pass'] = max(curStats['pass'], minPass) + channelCost / self.getWeight(curFrequency)
+            
+        self.lock.release()
+        
+    def recordFailure(self, frequencyList):
+        # Call when a scan of a batch from nextBatch() fails.  The batch is charged as if it had been scanned, so a
+        # batch that keeps failing (busy device, a frequency the radio won't take) goes to the back instead of
+        # coming up first every time and starving the rest.
+        self.lock.acquire()
+        
+        now = self.clock()
+        frequencyList = [curFrequency for curFrequency in frequencyList if curFrequency in self.stats]
+        
+        if len(frequencyList) > 0:
+            minPass = min(self.stats[curFrequency]['pass'] for curFrequency in self.channelList)
+            
+            for curFrequency in frequencyList:
+                curStats = self.stats[curFrequency]
+                
+                # Channels that haven't been scanned yet have no cost, so charge them one cycle split across the batch
+                if curStats['cost'] > 0.0:
+                    channelCost = curStats['cost']
+                else:
+                    channelCost = self.cyclePeriod / len(frequencyList)
+                    
+                curStats['failures'] += 1
+                curStats['lastvisit'] = now
+                curStats['pass'] = max(curStats['pass'], minPass) + channelCost / self.getWeight(curFrequency)
+                
+        self.lock.release()
+        
+    def getCycleDelay(self):
+        # Seconds to wait so scans start every cyclePeriod.  If a scan overran, the schedule restarts from now.
+        now = self.clock()
+        
+        if self.nextDeadline is None:
+            self.nextDeadline = now
+            
+        self.nextDeadline += self.cyclePeriod
+        
+        if self.nextDeadline - now < self.minDelay:
+            self.nextDeadline = now + self.minDelay
+            
+        return self.nextDeadline - now
+        
+    def getStats(self):
+        # Per-channel statistics, keyed by frequency.  share is the fraction of total scan time the channel got.
+        self.lock.acquire()
+        
+        totalAirtime = sum(self.stats[curFrequency]['airtime'] for curFrequency in self.channelList)
+        now = self.clock()
+        retVal = {}
+        
+        for curFrequency in self.channelList:
+            curStats = self.stats[curFrequency]
+            channelStats = {}
+            channelStats['scans'] = curStats['scans']
+            channelStats['airtime'] = curStats['airtime']
+            channelStats['cost'] = curStats['cost']
+            channelStats['yieldrate'] = curStats['yieldrate']
+            channelStats['weight'] = self.getWeight(curFrequency)
+            channelStats['new'] = curStats['new']
+            channelStats['changed'] = curStats['changed']
+            if totalAirtime > 0:
+                channelStats['share'] = curStats['airtime'] / totalAirtime
+            else:
+                channelStats['share'] = 0.0
+            if curStats['lastvisit'] is None:
+                channelStats['idle'] = None
+            else:
+                channelStats['idle'] = now - curStats['lastvisit']
+            retVal[curFrequency] = channelStats
+            
+        self.lock.release()
+        
+        return retVal
+        
+    def getDecisions(self):
+        # The last maxDecisions batches handed out: time, frequencies and why ('idle', 'pass' or 'round-robin')
+        self.lock.acquire()
+        retVal = list(self.decisions)
+        self.lock.release()
+        
+        return retVal
+        
+    def getDiscoveryRate(self):
+        # New plus changed BSS per second of scan time over everything recorded so far
+        self.lock.acquire()
+        totalAirtime = sum(self.stats[curFrequency]['airtime'] for curFrequency in self.channelList)
+        totalFound = sum(self.stats[curFrequency]['new'] + self.stats[curFrequency]['changed'] for curFrequency in self.channelList)
+        self.lock.release()
+        
+        if totalAirtime > 0:
+            return totalFound / totalAirtime
+        else:
+            return 0.0
+            
+# ------------------  Shared scan cache ------------------------------
+class ScanFlight(object):
+    # One scan of an interface (list) and frequency list that any number of requests can read.  The request that
+    # started it runs the scan and the rest read the networks as they come in.  The flight keeps its own copy of
+    # each network and every reader gets another, so nobody sees changes made to anyone else's.
+    def __init__(self, interfaceName, huntChannelList):
+        self.interfaceName = interfaceName
+        self.huntChannelList = huntChannelList
+        self.networks = []
+        self.done = False
+        self.retCode = 0
+        self.errString = ""
+        self.finishTime = 0.0
+        # Requests that joined and haven't finished reading.  The leader finishes the scan for them if its own
+        # client goes away.
+        self.readers = 0
+        self.condition = Condition()
+        
+    def addReader(self):
+        self.condition.acquire()
+        self.readers += 1
+        self.condition.release()
+        
+    def removeReader(self):
+        self.condition.acquire()
+        self.readers -= 1
+        self.condition.release()
+        
+    def hasReaders(self):
+        self.condition.acquire()
+        retVal = (self.readers > 0)
+        self.condition.release()
+        
+        return retVal
+        
+    def addNetwork(self, curNet):
+        # Copied before the leader's encoder (a DeltaNetworkEncoder for instance) can change it
+        curNet = curNet.copy()
+        
+        self.condition.acquire()
+        self.networks.append(curNet)
+        self.condition.notify_all()
+        self.condition.release()
+        
+    def finish(self, retCode, errString):
+        self.condition.acquire()
+        self.retCode = retCode
+        self.errString = errString
+        self.finishTime = time()
+        self.done = True
+        self.condition.notify_all()
+        self.condition.release()
+        
+    def getAge(self):
+        # Seconds since the scan finished, 0 while it's running
+        if self.done:
+            return max(time() - self.finishTime, 0.0)
+        else:
+            return 0.0
+            
+    def readNetworks(self):
+        # Yields a copy of every network in the scan, waiting on the ones not found yet
+        index = 0
+        
+        while True:
+            self.condition.acquire()
+            while (index >= len(self.networks)) and (not self.done):
+                self.condition.wait()
+                
+            pending = self.networks[index:]
+            done = self.done
+            self.condition.release()
+            
+            for curNet in pending:
+                yield curNet.copy()
+                
+            index += len(pending)
+            
+            if done:
+                return
+                
+class ScanFlightEncoder(object):
+    # Wraps the encoder for the request running a scan so each network also goes to the ScanFlight for the
+    # requests that joined it
+    def __init__(self, encoder, flight):
+        self.encoder = encoder
+        self.contentType = encoder.contentType
+        self.flight = flight
+        
+    def begin(self):
+        return self.encoder.begin()
+        
+    def encodeNetwork(self, curNet):
+        self.flight.addNetwork(curNet)
+        return self.encoder.encodeNetwork(curNet)
+        
+    def end(self, retCode, errString, gpsdict):
+        self.flight.finish(retCode, errString)
+        return self.encoder.end(retCode, errString, gpsdict)
+        
+class ScanCache(object):
+    # Scan results by interface (list) and frequency list.  A request for a scan that's running joins it rather
+    # than waiting on the interface lock to run its own, and a successful scan is reused for ttl seconds after it
+    # finishes.  ttl 0 only joins running scans.
+    def __init__(self, ttl=0.0):
+        self.ttl = ttl
+        self.flights = {}
+        self.lock = Lock()
+        
+    def getKey(interfaceName, huntChannelList):
+        if huntChannelList is None:
+            return (interfaceName, ())
+        else:
+            return (interfaceName, tuple(sorted(set(huntChannelList))))
+            
+    def joinScan(self, interfaceName, huntChannelList):
+        # Returns the ScanFlight to read and whether this request has to run it.  A request that didn't get to run
+        # it calls leaveScan when it's done with it.
+        key = ScanCache.getKey(interfaceName, huntChannelList)
+        
+        self.lock.acquire()
+        
+        self.pruneFlights()
+        
+        flight = self.flights.get(key)
+        if (flight is not None) and ((not flight.done) or ((flight.retCode == 0) and (flight.getAge() <= self.ttl))):
+            flight.addReader()
+            isLeader = False
+        else:
+            flight = ScanFlight(interfaceName, huntChannelList)
+            self.flights[key] = flight
+            isLeader = True
+            
+        self.lock.release()
+        
+        return flight, isLeader
+        
+    def leaveScan(self, flight):
+        flight.removeReader()
+        
+    def pruneFlights(self):
+        # Called with the lock held.  Drops finished scans that can't be reused any more, so a flight per interface
+        # and frequency list (every hunt batch is one) isn't kept for the life of the agent.
+        for curKey in list(self.flights.keys()):
+            curFlight = self.flights[curKey]
+            
+            if curFlight.done and ((curFlight.retCode != 0) or (curFlight.getAge() > self.ttl)):
+                del self.flights[curKey]
+                
+    def releaseFlight(self, flight):
+        # With no ttl a finished scan is never reused, so it goes as soon as it's done.  Requests that joined it
+        # already have it.
+        if self.ttl > 0.0:
+            return
+            
+        key = ScanCache.getKey(flight.interfaceName, flight.huntChannelList)
+        
+        self.lock.acquire()
+        
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+            
+        self.lock.release()
+        
+    def getNetworksAsStream(self, flight, isLeader, gpsData, lockList=None, encoder=None, scanLock=None):
+        # WirelessEngine.getNetworksAsStream for a flight from joinScan.  scanLock is held while the leader scans.
+        if encoder is None:
+            encoder = JsonNetworkEncoder()
+            
+        if not isLeader:
+            for chunk in WirelessEngine.getNetworkListAsStream(flight.readNetworks(), flight, gpsData, encoder):
+                yield chunk
+                
+            return
+            
+        if scanLock is not None:
+            scanLock.acquire()
+            
+        scanStream = WirelessEngine.getNetworksAsStream(flight.interfaceName, gpsData, flight.huntChannelList, lockList, ScanFlightEncoder(encoder, flight))
+        
+        try:
+            for chunk in scanStream:
+                yield chunk
+        finally:
+            if not flight.done:
+                # Our client went away.  Finish the scan anyway if anyone joined it.
+                if flight.hasReaders():
+                    try:
+                        for chunk in scanStream:
+                            pass
+                    except:
+                        pass
+                        
+                if not flight.done:
+                    flight.finish(WirelessNetwork.ERR_DEVICEBUSY, 'Scan stopped before it finished')
+                    
+            self.releaseFlight(flight)
+            
+            if scanLock is not None:
+                scanLock.release()
+                
+class WirelessEngine(object):
+    def __init__(self):
+        super().__init__()
+
+    def getMacAddress(interface):
+        macaddr = ""
+        
+        try:
+            f = open('/sys/class/net/'+interface+'/address', 'r')
+            macaddr = f.readline().strip()
+            f.close()
+        except:
+            pass
+            
+        return macaddr
+        
+    def getFrequencyForChannel(channelNumber):
+        channelStr = str(channelNumber)
+        if channelStr in channelToFreq:
+            return channelToFreq[channelStr]
+        else:
+            return None
+            
+    def getSignalQualityFromDB0To5(dBm):
+        # Based on same scale tha Microsoft uses.
+        # See https://stackoverflow.com/questions/15797920/how-to-convert-wifi-signal-strength-from-quality-percent-to-rssi-dbm
+        if (dBm <= -100):
+            quality = 0
+        elif dBm >= -50:
+            quality = 100
+        else:
+            quality = 2 * (dBm + 100)      
+        
+        return int(4*quality/100)
+
+    def getSignalQualityFromDB(dBm):
+        # Based on same scale tha Microsoft uses.
+        # See https://stackoverflow.com/questions/15797920/how-to-convert-wifi-signal-strength-from-quality-percent-to-rssi-dbm
+        if (dBm <= -100):
+            quality = 0
+        elif dBm >= -50:
+            quality = 100
+        else:
+            quality = 2 * (dBm + 100)      
+        
+        return quality
+
+    def convertUnknownToString(ssid):
+        if '\\x00' not in ssid:
+            return ssid
+            
+        retVal = ssid.replace('\\x00', '')
+        numblanks = ssid.count('\\x00')
+        
+        if len(retVal) == 0:
+            if numblanks > 0:
+                return '<Unknown (' + str(numblanks )+ ')>'
+            else:
+                return '<Unknown>'
+        else:
+            return ssid
+        
+    def getSupportedFrequencies(interfaceName):
+        # Enabled frequencies (MHz) of the interface's phy, or an empty list if they can't be read
+        if interfaceName in supportedFrequencies:
+            return supportedFrequencies[interfaceName]
+            
+        retVal = []
+        
+        try:
+            result = subprocess.run(['iw', 'dev', interfaceName, 'info'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+            wiphy = re.search('wiphy ([0-9]+)', result.stdout.decode('UTF-8', 'replace'))
+            
+            if wiphy is not None:
+                result = subprocess.run(['iw', 'phy', 'phy' + wiphy.group(1), 'info'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+                
+                for curLine in result.stdout.decode('UTF-8', 'replace').splitlines():
+                    # * 2412 MHz [1] (20.0 dBm)  or  * 5260 MHz [52] (disabled)
+                    frequencyMatch = re.match('^\s*\* ([0-9]+)(\.[0-9]+)? MHz \[[0-9]+\]', curLine)
+                    if (frequencyMatch is not None) and ('disabled' not in curLine):
+                        curFrequency = int(frequencyMatch.group(1))
+                        if curFrequency not in retVal:
+                            retVal.append(curFrequency)
+        except:
+            retVal = []
+            
+        supportedFrequencies[interfaceName] = retVal
+        
+        return retVal
+        
+    def getInterfaces(printResults=False):
+        if scanBackend == SCANBACKEND_NL80211:
+            try:
+                retVal = sparrownl80211.NL80211Scanner().getInterfaces()
+                if (printResults):
+                    for curInterface in retVal:
+                        print(curInterface)
+                        
+                return retVal
+            except:
+                # Fall back to iwconfig
+                pass
+                
+        result = subprocess.run(['iwconfig'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+        wirelessResult = result.stdout.decode('ASCII')
+        p = re.compile('^(.*?) IEEE', re.MULTILINE)
+        tmpInterfaces = p.findall(wirelessResult)
+        
+        retVal = []
+        
+        if (len(tmpInterfaces) > 0):
+            for curInterface in tmpInterfaces:
+                tmpStr=curInterface.replace(' ','')
+                retVal.append(tmpStr)
+                # debug
+                if (printResults):
+                    print(tmpStr)
+        else:
+            # debug
+            if (printResults):
+                print("Error: No wireless interfaces found.")
+
+        return retVal
+
+    def getMonitoringModeInterfaces(printResults=False):
+        # Note: for standard scans with iw, this isn't required.  Just root access.
+        # This is only required for some of the more advanced pen testing capabilities
+        if scanBackend == SCANBACKEND_NL80211:
+            try:
+                retVal = sparrownl80211.NL80211Scanner().getMonitoringModeInterfaces()
+                if (printResults):
+                    for curInterface in retVal:
+                        print(curInterface)
+                        
+                return retVal
+            except:
+                # Fall back to iwconfig
+                pass
+                
+        result = subprocess.run(['iwconfig'], stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+        wirelessResult = result.stdout.decode('ASCII')
+        p = re.compile('^(.*?) IEEE.*?Mode:Monitor', re.MULTILINE)
+        tmpInterfaces = p.findall(wirelessResult)
+        
+        retVal = []
+        
+        if (len(tmpInterfaces) > 0):
+            for curInterface in tmpInterfaces:
+                tmpStr=curInterface.replace(' ','')
+                retVal.append(tmpStr)
+                # debug
+                if (printResults):
+                    print(tmpStr)
+        else:
+            # debug
+            if (printResults):
+                print("Error: No monitoring mode wireless interfaces found.")
+
+        return retVal
+
+    def getNetworksAsJson(interfaceName, gpsData, huntChannelList=None):
+        # This is only used by the remote agent to get and return networks
+        if (huntChannelList is None) or (len(huntChannelList) == 0):
+            # This code handles the thought that "what if we query for networks and the interface
+            # reports busy (it does happen if we query too fast.)
+            retries = 0
+            retCode = WirelessNetwork.ERR_DEVICEBUSY
+            
+            while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
+                # Handle retries in case we get a busy response
+                retCode, errString, wirelessNetworks = WirelessEngine.scanForNetworks(interfaceName)
+                retries += 1
+                if retCode == WirelessNetwork.ERR_DEVICEBUSY:
+                    busyRetries.inc(1, ('getNetworksAsJson',))
+                    sleep(0.4)
+        else:
+            wirelessNetworks = {}
+            for curBatch in WirelessEngine.getFrequencyBatches(huntChannelList):
+                # Handle if the device reports busy with some retries
+                retries = 0
+                retCode = WirelessNetwork.ERR_DEVICEBUSY
+                while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
+                    # Handle retries in case we get a busy response
+                    retCode, errString, tmpWirelessNetworks = WirelessEngine.scanForNetworks(interfaceName, curBatch)
+                    retries += 1
+                    if retCode == WirelessNetwork.ERR_DEVICEBUSY:
+                        busyRetries.inc(1, ('getNetworksAsJson',))
+                        sleep(0.2)
+                
+                for curKey in tmpWirelessNetworks.keys():
+                    curNet = tmpWirelessNetworks[curKey]
+                    wirelessNetworks[curNet.getKey()] = tmpWirelessNetworks[curNet.getKey()]
+            
+        serializeStart = monotonic()
+        
+        retVal = {}
+        retVal['errCode'] = retCode
+        retVal['errString'] = errString
+        
+        netList = []
+        
+        for curKey in wirelessNetworks.keys():
+            curNet = wirelessNetworks[curKey]
+            if gpsData is not None:
+                curNet.gps = gpsData
+            netList.append(curNet.toJsondict())
+            
+        gpsdict = {}
+        
+        gpsloc = SparrowGPS()
+        if (gpsData is not None):
+            gpsloc.copy(gpsData)
+        
+        gpsdict['latitude'] = gpsloc.latitude
+        gpsdict['longitude'] = gpsloc.longitude
+        gpsdict['altitude'] = gpsloc.altitude
+        gpsdict['speed'] = gpsloc.speed
+        retVal['gps'] = gpsdict
+        
+        retVal['networks'] = netList
+        
+        jsonstr = json.dumps(retVal)
+        
+        serializeSeconds.observe(monotonic() - serializeStart, ('getNetworksAsJson',))
+        
+        return retCode, errString, jsonstr
+        
+    def getNetworksAsStream(interfaceName, gpsData, huntChannelList=None, lockList=None, encoder=None):
+        # Streaming version of getNetworksAsJson.  Yields the response as bytes in pieces as iw
+        # reports each network, so it can go out while the scan is still running.  encoder picks the
+        # format (JsonNetworkEncoder if not given, or sparrowwire.BinaryNetworkEncoder).
+        # A comma-separated interface list sweeps the channels with all of them (see MultiRadioScanner).
+        if encoder is None:
+            encoder = JsonNetworkEncoder()
+            
+        if ',' in interfaceName:
+            for chunk in WirelessEngine.getMultiRadioNetworksAsStream(interfaceName.split(','), gpsData, huntChannelList, lockList, encoder):
+                yield chunk
+                
+            return
+            
+        if (huntChannelList is None) or (len(huntChannelList) == 0):
+            frequencyList = [0]
+            busyDelay = 0.4
+        else:
+            frequencyList = WirelessEngine.getFrequencyBatches(huntChannelList)
+            busyDelay = 0.2
+            
+        gpsloc = SparrowGPS()
+        if (gpsData is not None):
+            gpsloc.copy(gpsData)
+            
+        yield encoder.begin()
+        
+        # Hunt mode can see the same network on more than one frequency.  Each sighting is sent, and since
+        # clients key networks on getKey() the last one wins like it does in getNetworksAsJson.
+        retCode = 0
+        errString = ""
+        
+        for curFrequency in frequencyList:
+            # Handle if the device reports busy with some retries
+            retries = 0
+            retCode = WirelessNetwork.ERR_DEVICEBUSY
+            while (retCode == WirelessNetwork.ERR_DEVICEBUSY) and (retries < 3):
+                scanStream = WirelessEngine.scanForNetworksStreaming(interfaceName, curFrequency)
+                
+                for curNet in scanStream:
+                    if gpsData is not None:
+                        curNet.gps = gpsData
+                        
+                    yield encoder.encodeNetwork(curNet)
+                    
+                retCode = scanStream.retCode
+                errString = scanStream.errString
+                retries += 1
+                if retCode == WirelessNetwork.ERR_DEVICEBUSY:
+                    busyRetries.inc(1, ('getNetworksAsStream',))
+                    sleep(busyDelay)
+                    
+        gpsdict = {}
+        gpsdict['latitude'] = gpsloc.latitude
+        gpsdict['longitude'] = gpsloc.longitude
+        gpsdict['altitude'] = gpsloc.altitude
+        gpsdict['speed'] = gpsloc.speed
+        
+        yield encoder.end(retCode, errString, gpsdict)
+        
+    def getNetworkListAsStream(networks, scanResult, gpsData, encoder=None):
+        # Encodes networks that were already scanned (an iterable of WirelessNetwork) as a /wireless/networks
+        # response.  scanResult is anything with the scan's retCode and errString (a ScanFlight for instance),
+        # read once networks is used up.
+        if encoder is None:
+            encoder = JsonNetworkEncoder()
+            
+        yield encoder.begin()
+        
+        # Only the encoding is timed.  networks can be a running scan.
+        encodeTime = 0.0
+        
+        for curNet in networks:
+            encodeStart = monotonic()
+            chunk = encoder.encodeNetwork(curNet)
+            encodeTime += monotonic() - encodeStart
+            
+            yield chunk
+            
+        serializeSeconds.observe(encodeTime, ('getNetworkListAsStream',))
+        
+        gpsloc = SparrowGPS()
+        if (gpsData is not None):
+            gpsloc.copy(gpsData)
+            
+        gpsdict = {}
+        gpsdict['latitude'] = gpsloc.latitude
+        gpsdict['longitude'] = gpsloc.longitude
+        gpsdict['altitude'] = gpsloc.altitude
+        gpsdict['speed'] = gpsloc.speed
+        
+        yield encoder.end(scanResult.retCode, scanResult.errString, gpsdict)
+        
+    def setScanBackend(backend):
+        global scanBackend
+        
+        if backend == SCANBACKEND_IW:
+            scanBackend = backend
+            return True
+        elif backend == SCANBACKEND_NL80211 and hasNL80211 and sparrownl80211.NL80211Scanner.available():
+            scanBackend = backend
+            return True
+        else:
+            return False
+            
+    def setScanMode(mode, triggerInterval=None, maxAge=None):
+        global scanMode
+        global hybridTriggerInterval
+        global hybridMaxAge
+        
+        if mode not in [SCANMODE_TRIGGER, SCANMODE_HYBRID]:
+            return False
+            
+        if triggerInterval is not None:
+            hybridTriggerInterval = float(triggerInterval)
+            
+        if maxAge is not None:
+            hybridMaxAge = float(maxAge)
+            
+        scanMode = mode
+        
+        return True
+        
+    def isTriggerDue(interfaceName, frequency=0):
+        hybridLock.acquire()
+        lastTrigger = hybridLastTrigger.get((interfaceName, tuple(WirelessEngine.getFrequencyList(frequency))))
+        hybridLock.release()
+        
+        if lastTrigger is None:
+            return True
+            
+        return (datetime.datetime.now() - lastTrigger).total_seconds() >= hybridTriggerInterval
+        
+    def setTriggerDone(interfaceName, frequency=0):
+        hybridLock.acquire()
+        hybridLastTrigger[(interfaceName, tuple(WirelessEngine.getFrequencyList(frequency)))] = datetime.datetime.now()
+        hybridLock.release()
+        
+    def isCachedNetworkCurrent(curNetwork, frequency=0, oldestSeen=None):
+        # A cache dump covers every frequency, so a hunt only takes networks on its own frequencies
+        if isinstance(frequency, int):
+            if (frequency != 0) and (curNetwork.frequency != frequency):
+                return False
+        elif (len(frequency) > 0) and (curNetwork.frequency not in frequency):
+            return False
+            
+        if (oldestSeen is not None) and (curNetwork.lastSeen < oldestSeen):
+            return False
+            
+        return True
+        
+    def getMultiRadioNetworksAsStream(interfaceList, gpsData, huntChannelList=None, lockList=None, encoder=None):
+        if encoder is None:
+            encoder = JsonNetworkEncoder()
+            
+        scanner = MultiRadioScanner(interfaceList, huntChannelList, lockList)
+        
+        yield encoder.begin()
+        
+        for curNet in scanner:
+            if gpsData is not None:
+                curNet.gps = gpsData
+                
+            yield encoder.encodeNetwork(curNet)
+                
+        gpsloc = SparrowGPS()
+        if (gpsData is not None):
+            gpsloc.copy(gpsData)
+            
+        gpsdict = {}
+        gpsdict['latitude'] = gpsloc.latitude
+        gpsdict['longitude'] = gpsloc.longitude
+        gpsdict['altitude'] = gpsloc.altitude
+        gpsdict['speed'] = gpsloc.speed
+        
+        yield encoder.end(scanner.retCode, scanner.errString, gpsdict)
+        
+    def scanForNetworks(interfaceName, frequency=0, printResults=False):
+        if scanMode == SCANMODE_HYBRID:
+            return WirelessEngine.scanForNetworksHybrid(interfaceName, frequency, printResults)
+            
+        return WirelessEngine.runScan(interfaceName, frequency, printResults)
+        
+    def scanForNetworksHybrid(interfaceName, frequency=0, printResults=False):
+        if WirelessEngine.isTriggerDue(interfaceName, frequency):
+            retCode, errString, wirelessNetworks = WirelessEngine.runScan(interfaceName, frequency, printResults)
+            
+            if (retCode == 0):
+                WirelessEngine.setTriggerDone(interfaceName, frequency)
+                return retCode, errString, WirelessEngine.filterCachedNetworks(wirelessNetworks, frequency, hybridMaxAge)
+            elif (retCode != WirelessNetwork.ERR_DEVICEBUSY):
+                return retCode, errString, wirelessNetworks
+                
+            # Busy usually means a scan is already running.  The cache is still good.
+            
+        return WirelessEngine.dumpNetworks(interfaceName, frequency, hybridMaxAge, printResults)
+        
+    def dumpNetworks(interfaceName, frequency=0, maxAge=0, printResults=False):
+        # Reads the kernel's BSS cache without triggering a scan.  maxAge (seconds) of 0 keeps everything.
+        retCode, errString, wirelessNetworks = WirelessEngine.runScan(interfaceName, 0, printResults, True)
+        
+        if (retCode == 0):
+            wirelessNetworks = WirelessEngine.filterCachedNetworks(wirelessNetworks, frequency, maxAge)
+            
+        return retCode, errString, wirelessNetworks
+        
+    def filterCachedNetworks(wirelessNetworks, frequency=0, maxAge=0):
+        if maxAge > 0:
+            oldestSeen = datetime.datetime.now() - datetime.timedelta(seconds=maxAge)
+        else:
+            oldestSeen = None
+            
+        retVal = {}
+        
+        for curKey in wirelessNetworks.keys():
+            curNetwork = wirelessNetworks[curKey]
+            if WirelessEngine.isCachedNetworkCurrent(curNetwork, frequency, oldestSeen):
+                retVal[curKey] = curNetwork
+                
+        return retVal
+        
+    def runScan(interfaceName, frequency=0, printResults=False, dumpCache=False):
+        startTime = datetime.datetime.now()
+        
+        if scanBackend == SCANBACKEND_NL80211:
+            try:
+                if dumpCache:
+                    retCode, errString, wirelessNetworks = sparrownl80211.NL80211Scanner().dump(interfaceName)
+                else:
+                    retCode, errString, wirelessNetworks = sparrownl80211.NL80211Scanner().scan(interfaceName, frequency)
+                    
+                scanSeconds.observe((datetime.datetime.now() - startTime).total_seconds(), ('nl80211',))
+                
+                if (retCode != 0):
+                    errString = WirelessEngine.getScanErrString(retCode, errString)
+                elif not dumpCache:
+                    WirelessEngine.recordScanTime(interfaceName, frequency, (datetime.datetime.now() - startTime).total_seconds())
+                    
+                return retCode, errString, wirelessNetworks
+            except sparrownl80211.NL80211Error:
+                # Fall back to iw
+                pass
+                
+        subprocessStart = monotonic()
+        result = subprocess.run(WirelessEngine.getScanParams(interfaceName, frequency, dumpCache), stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        scanSeconds.observe(monotonic() - subprocessStart, ('subprocess',))
+
+        retCode = result.returncode
+        
+        if (retCode == 0) and (not dumpCache):
+            WirelessEngine.recordScanTime(interfaceName, frequency, (datetime.datetime.now() - startTime).total_seconds())
+        errString = ""
+        wirelessResult = result.stdout.decode('ASCII')
+        
+        # debug
+        if (printResults):
+            print('Return Code ' + str(retCode))
+            print(wirelessResult)
+        
+        wirelessNetworks = {}
+        
+        if (retCode == 0):
+            parseStart = monotonic()
+            wirelessNetworks = WirelessEngine.parseIWoutput(wirelessResult)
+            scanSeconds.observe(monotonic() - parseStart, ('parse',))
+        else:
+            errString = WirelessEngine.getScanErrString(retCode, wirelessResult)
+            
+        return retCode, errString, wirelessNetworks
+        
+    def getScanParams(interfaceName, frequency=0, dumpCache=False):
+        if dumpCache:
+            return ['iw', 'dev', interfaceName, 'scan', 'dump']
+            
+        frequencyList = WirelessEngine.getFrequencyList(frequency)
+        
+        if len(frequencyList) == 0:
+            return ['iw', 'dev', interfaceName, 'scan']
+        else:
+            return ['iw', 'dev', interfaceName, 'scan', 'freq'] + [str(curFrequency) for curFrequency in frequencyList]
+            
+    def getFrequencyList(frequency):
+        # Scan calls take either one frequency (0 for all) or a list of them
+        if isinstance(frequency, int):
+            if frequency == 0:
+                return []
+            else:
+                return [frequency]
+        else:
+            return [int(curFrequency) for curFrequency in frequency]
+            
+    def getFrequencyBatches(huntChannelList, batchSize=None):
+        # Splits a hunt list into the frequency lists to hand to each scan.  An empty list is one full scan.
+        if (huntChannelList is None) or (len(huntChannelList) == 0):
+            return [0]
+            
+        if batchSize is None:
+            batchSize = scanBatchSize
+            
+        if batchSize <= 0:
+            return [list(huntChannelList)]
+            
+        retVal = []
+        for i in range(0, len(huntChannelList), batchSize):
+            retVal.append(list(huntChannelList[i:i+batchSize]))
+            
+        return retVal
+        
+    def setScanBatchSize(batchSize):
+        global scanBatchSize
+        
+        try:
+            batchSize = int(batchSize)
+        except:
+            return False
+            
+        if batchSize < 0:
+            return False
+            
+        scanBatchSize = batchSize
+        return True
+        
+    def recordScanTime(interfaceName, frequency, scanTime):
+        # The kernel dwells about the same time on each channel, so a batch's time is split evenly across it
+        frequencyList = WirelessEngine.getFrequencyList(frequency)
+        
+        scanTimingLock.acquire()
+        if len(frequencyList) == 0:
+            scanTimings[(interfaceName, 0)] = scanTime
+        else:
+            for curFrequency in frequencyList:
+                scanTimings[(interfaceName, curFrequency)] = scanTime / len(frequencyList)
+        scanTimingLock.release()
+        
+    def getScanTimings(interfaceName):
+        # Returns frequency -> seconds per frequency from the last scan of it on interfaceName (0 is a full scan)
+        retVal = {}
+        
+        scanTimingLock.acquire()
+        for curKey in scanTimings.keys():
+            if curKey[0] == interfaceName:
+                retVal[curKey[1]] = scanTimings[curKey]
+        scanTimingLock.release()
+        
+        return retVal
+        
+    def getScanErrString(retCode, wirelessResult):
+        # errCodes:
+        # 156 = Network is down (i.e. switch may be turned off)
+        # 240  = command failed: Device or resource busy (-16)
+        errString = wirelessResult.replace("\n", "")
+        if (retCode == WirelessNetwork.ERR_NETDOWN):
+            errString = 'Interface appears down'
+        elif (retCode == WirelessNetwork.ERR_DEVICEBUSY):
+            errString = 'Device is busy'
+        elif (retCode == WirelessNetwork.ERR_OPNOTPERMITTED):
+            errString = errString + '. Did you run as root?'
+            
+        return errString
+        
+    def scanForNetworksStreaming(interfaceName, frequency=0):
+        # Same scan as scanForNetworks, but the networks are handed back one at a time as iw prints them.
+        # Iterate over the returned object, then check its retCode and errString.
+        return WirelessScanStream(interfaceName, frequency)
+        
+    def getFieldValue(p, curLine):
+        matchobj = p.search(curLine)
+        
+        if not matchobj:
+            return ""
+            
+        try:
+            retVal = matchobj.group(1)
+        except:
+            retVal = ""
+            
+        return retVal
+        
+    def setParserMode(parserMode):
+        global iwParserMode
+        
+        if parserMode in [IWPARSER_DISPATCH, IWPARSER_REGEX]:
+            iwParserMode = parserMode
+            return True
+        else:
+            return False
+            
+    def parseIWoutput(iwOutput, parserMode=None):
+        # This now supports direct from STDOUT via scanForNetworks,
+        # and input from a file as f.readlines() which returns a list
+        if parserMode is None:
+            parserMode = iwParserMode
+            
+        if parserMode == IWPARSER_REGEX:
+            return WirelessEngine.parseIWoutputRegex(iwOutput)
+        else:
+            return WirelessEngine.parseIWoutputDispatch(iwOutput)
+            
+    def parseIWoutputRegex(iwOutput):
+        # Reference parser.  Every line runs through the full regex chain.
+        retVal = {}
+        curNetwork = None
+        now=datetime.datetime.now()
+        
+        if type(iwOutput) == str:
+            inputLines = iwOutput.splitlines()
+        else:
+            inputLines = iwOutput
+            
+        for curLine in inputLines:
+            fieldValue = WirelessEngine.getFieldValue(p_bss, curLine)
                 
             if (len(fieldValue) > 0):
                 # New object
@@ -692,126 +2125,337 @@ class WirelessEngine(object):
                 # seen a BSSID so just keep going through the lines.
                 continue
 
-            fieldValue = WirelessEngine.getFieldValue(p_ssid, curLine)
-                
-            if (len(fieldValue) > 0):
-                curNetwork.ssid = WirelessEngine.convertUnknownToString(fieldValue)
+            WirelessEngine.parseIWLineRegex(curNetwork, curLine)
                 
-            fieldValue = WirelessEngine.getFieldValue(p_ess, curLine)
+        # #### End loop ######
+        
+        # Add the last network
+        if curNetwork is not None:
+            if curNetwork.channel > 0:
+                # I did see incomplete output from iw where not all the data was there
+                retVal[curNetwork.getKey()] = curNetwork
+        
+        return retVal
+        
+    def parseIWLineRegex(curNetwork, curLine):
+        # Runs a single (non-BSS) line through the reference regex chain
+        fieldValue = WirelessEngine.getFieldValue(p_ssid, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.ssid = WirelessEngine.convertUnknownToString(fieldValue)
+            
+        fieldValue = WirelessEngine.getFieldValue(p_ess, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.mode = "AP"
+            # Had issue with WEP not showing up.
+            # If capability has "ESS Privacy" there's something there.
+            # If it's PSK, etc. there will be other RSN fields, etc.
+            # So for now start by assuming WEP
+            
+            # See: https://wiki.archlinux.org/index.php/Wireless_network_configuration
+            fieldValue = WirelessEngine.getFieldValue(p_ess_privacy, curLine)
                 
             if (len(fieldValue) > 0):
-                curNetwork.mode = "AP"
-                # Had issue with WEP not showing up.
-                # If capability has "ESS Privacy" there's something there.
-                # If it's PSK, etc. there will be other RSN fields, etc.
-                # So for now start by assuming WEP
-                
-                # See: https://wiki.archlinux.org/index.php/Wireless_network_configuration
-                fieldValue = WirelessEngine.getFieldValue(p_ess_privacy, curLine)
-                    
-                if (len(fieldValue) > 0):
-                    curNetwork.security = "WEP"
-                    curNetwork.privacy = "WEP"
-                    
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_ibss, curLine)
+                curNetwork.security = "WEP"
+                curNetwork.privacy = "WEP"
                 
-            if (len(fieldValue) > 0):
-                curNetwork.mode = "Ad Hoc"
-                curNetwork.security = "[Ad-Hoc] Open"
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_ibss, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.mode = "Ad Hoc"
+            curNetwork.security = "[Ad-Hoc] Open"
 
-                fieldValue = WirelessEngine.getFieldValue(p_ibss_privacy, curLine)
-                    
-                if (len(fieldValue) > 0):
-                    curNetwork.security = "[Ad-Hoc] WEP"
-                    curNetwork.privacy = "WEP"
-                    
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_auth_suites, curLine)
+            fieldValue = WirelessEngine.getFieldValue(p_ibss_privacy, curLine)
                 
             if (len(fieldValue) > 0):
-                curNetwork.security = fieldValue
-                continue #Found the item
+                curNetwork.security = "[Ad-Hoc] WEP"
+                curNetwork.privacy = "WEP"
                 
-            # p = re.compile('.*?Group cipher: *(.*)')
-            fieldValue = WirelessEngine.getFieldValue(p_pw_ciphers, curLine)
-            fieldValue = fieldValue.replace(' ', '/')
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_auth_suites, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.security = fieldValue
+            return #Found the item
+            
+        # p = re.compile('.*?Group cipher: *(.*)')
+        fieldValue = WirelessEngine.getFieldValue(p_pw_ciphers, curLine)
+        fieldValue = fieldValue.replace(' ', '/')
+            
+        if (len(fieldValue) > 0):
+            curNetwork.privacy = fieldValue
+            curNetwork.cipher = fieldValue
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_param_channel, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.channel = int(fieldValue)
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_primary_channel, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.channel = int(fieldValue)
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_freq, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.frequency = int(fieldValue)
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_signal, curLine)
+            
+        # This test is different.  dBm is negative so can't test > 0.  10dBm is really high so lets use that
+        if (len(fieldValue) > 0):
+            curNetwork.signal = int(fieldValue)
+            curNetwork.strongestsignal = curNetwork.signal
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_ht, curLine)
+            
+        if (len(fieldValue) > 0):
+            if (curNetwork.bandwidth == 20):
+                curNetwork.bandwidth = 40
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_bw, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.bandwidth = int(fieldValue)
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_secondary, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.secondaryChannelLocation = fieldValue
+            if (fieldValue == 'above'):
+                curNetwork.secondaryChannel = curNetwork.channel + 4
+            elif (fieldValue == 'below'):
+                curNetwork.secondaryChannel = curNetwork.channel - 4
+            # else it'll say 'no secondary'
                 
-            if (len(fieldValue) > 0):
-                curNetwork.privacy = fieldValue
-                curNetwork.cipher = fieldValue
-                continue #Found the item
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_thirdfreq, curLine)
+            
+        if (len(fieldValue) > 0):
+            curNetwork.thirdChannel = int(fieldValue)
                 
-            fieldValue = WirelessEngine.getFieldValue(p_param_channel, curLine)
+            return #Found the item
+            
+        fieldValue = WirelessEngine.getFieldValue(p_lastseen, curLine)
+            
+        if (len(fieldValue) > 0):
+            WirelessEngine.setLastSeenAge(curNetwork, int(fieldValue))
                 
-            if (len(fieldValue) > 0):
-                curNetwork.channel = int(fieldValue)
-                continue #Found the item
+            return #Found the item
+            
+    def parseIWoutputDispatch(iwOutput):
+        # Produces the same results as parseIWoutputRegex, but each line is classified once
+        # by the field name in front of its first colon and handed to a single extractor.
+        retVal = {}
+        
+        if type(iwOutput) == str:
+            inputLines = iwOutput.splitlines()
+        else:
+            inputLines = iwOutput
+            
+        for curNetwork in WirelessEngine.iterIWoutput(inputLines):
+            retVal[curNetwork.getKey()] = curNetwork
+        
+        return retVal
+        
+    def iterIWoutput(inputLines, now=None):
+        # Generator version of the dispatch parser.  Each network is yielded as soon as the next
+        # BSS header (or the end of the input) shows its block is complete, so only one block is held at a time.
+        curNetwork = None
+        if now is None:
+            now=datetime.datetime.now()
+            
+        for curLine in inputLines:
+            if curLine.startswith('BSS '):
+                # Header is 'BSS <mac>(on <interface>)'.  Empty mac or no paren isn't a header.
+                parenPos = curLine.find('(', 4)
+                if parenPos > 4 and '\n' not in curLine[4:parenPos]:
+                    if curNetwork is not None:
+                        if curNetwork.channel > 0:
+                            # I did see incomplete output from iw where not all the data was there
+                            yield curNetwork
+
+                    curNetwork = WirelessNetwork()
+                    curNetwork.lastSeen = now
+                    curNetwork.firstSeen = now
+                    curNetwork.macAddr = curLine[4:parenPos]
+                    continue
+                    
+            if curNetwork is None:
+                continue
                 
-            fieldValue = WirelessEngine.getFieldValue(p_primary_channel, curLine)
+            WirelessEngine.parseIWLineDispatch(curNetwork, curLine)
+            
+        # The last network
+        if curNetwork is not None:
+            if curNetwork.channel > 0:
+                yield curNetwork
+        
+    def parseIWLineDispatch(curNetwork, curLine):
+        # Anything unusual (embedded newlines, more than one colon) falls back to the reference chain so the results always match it.
+        colonPos = curLine.find(':')
+        
+        if colonPos < 0:
+            # Every field the reference chain picks up needs a colon.  Note that p_ht has no
+            # group so getFieldValue never returns anything for it and HT20/HT40 lines are a no-op.
+            return
+            
+        fieldName = curLine[:colonPos]
+        fieldValue = curLine[colonPos+1:]
+        
+        if (':' in fieldValue) or ('\n' in curLine):
+            if p_dispatch_guard.search(curLine):
+                WirelessEngine.parseIWLineRegex(curNetwork, curLine)
+            return
+            
+        extractor = iwLineExtractors.get(fieldName.lstrip(' \t*'))
+        
+        if extractor is not None:
+            extractor(curNetwork, fieldName, fieldValue)
+        elif fieldName.endswith(iwTriggerNames):
+            WirelessEngine.parseIWLineRegex(curNetwork, curLine)
+            
+    # ------------------  Single field extractors for the dispatch parser ------------------------------
+    # Each one is called with the text before and after the only colon on the line
+    def extractSSID(curNetwork, fieldName, fieldValue):
+        # Reference needs at least one character in front of SSID and a space after the colon
+        if len(fieldName) > 4 and fieldValue.startswith(' '):
+            fieldValue = fieldValue.lstrip(' ')
+            if len(fieldValue) > 0:
+                curNetwork.ssid = WirelessEngine.convertUnknownToString(fieldValue)
                 
-            if (len(fieldValue) > 0):
+    def extractCapability(curNetwork, fieldName, fieldValue):
+        if fieldName != '\tcapability':
+            return
+            
+        if 'ESS' in fieldValue:
+            curNetwork.mode = "AP"
+            # See parseIWLineRegex for why "ESS Privacy" is treated as WEP
+            if 'ESS Privacy' in fieldValue:
+                curNetwork.security = "WEP"
+                curNetwork.privacy = "WEP"
+        elif 'IBSS' in fieldValue:
+            curNetwork.mode = "Ad Hoc"
+            curNetwork.security = "[Ad-Hoc] Open"
+            
+            if 'IBSS Privacy' in fieldValue:
+                curNetwork.security = "[Ad-Hoc] WEP"
+                curNetwork.privacy = "WEP"
+            
+    def extractAuthSuites(curNetwork, fieldName, fieldValue):
+        fieldValue = fieldValue.lstrip(' ')
+        if len(fieldValue) > 0:
+            curNetwork.security = fieldValue
+            
+    def extractPairwiseCiphers(curNetwork, fieldName, fieldValue):
+        fieldValue = fieldValue.lstrip(' ').replace(' ', '/')
+        if len(fieldValue) > 0:
+            curNetwork.privacy = fieldValue
+            curNetwork.cipher = fieldValue
+            
+    def getLeadingDigits(fieldValue):
+        # Needs at least one space, then ASCII digits
+        tmpValue = fieldValue.lstrip(' ')
+        if len(tmpValue) == len(fieldValue):
+            return ""
+            
+        matchobj = p_dispatch_digits.match(tmpValue)
+        if matchobj:
+            return matchobj.group(0)
+        else:
+            return ""
+            
+    def extractDSParameter(curNetwork, fieldName, fieldValue):
+        if fieldValue.startswith(' channel'):
+            fieldValue = WirelessEngine.getLeadingDigits(fieldValue[8:])
+            if len(fieldValue) > 0:
                 curNetwork.channel = int(fieldValue)
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_freq, curLine)
-                
-            if (len(fieldValue) > 0):
-                curNetwork.frequency = int(fieldValue)
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_signal, curLine)
-                
-            # This test is different.  dBm is negative so can't test > 0.  10dBm is really high so lets use that
-            if (len(fieldValue) > 0):
-                curNetwork.signal = int(fieldValue)
-                curNetwork.strongestsignal = curNetwork.signal
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_ht, curLine)
                 
-            if (len(fieldValue) > 0):
-                if (curNetwork.bandwidth == 20):
-                    curNetwork.bandwidth = 40
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_bw, curLine)
-                
-            if (len(fieldValue) > 0):
-                curNetwork.bandwidth = int(fieldValue)
-                continue #Found the item
-                
-            fieldValue = WirelessEngine.getFieldValue(p_secondary, curLine)
+    def extractPrimaryChannel(curNetwork, fieldName, fieldValue):
+        fieldValue = WirelessEngine.getLeadingDigits(fieldValue)
+        if len(fieldValue) > 0:
+            curNetwork.channel = int(fieldValue)
+            
+    def extractFrequency(curNetwork, fieldName, fieldValue):
+        matchobj = p_dispatch_digits.search(fieldValue)
+        if matchobj:
+            curNetwork.frequency = int(matchobj.group(0))
+            
+    def extractSignal(curNetwork, fieldName, fieldValue):
+        matchobj = p_dispatch_signal.search(fieldValue)
+        if matchobj and ('dBm' in fieldValue[matchobj.end():]):
+            curNetwork.signal = int(matchobj.group(0))
+            curNetwork.strongestsignal = curNetwork.signal
+            
+    def extractChannelWidth(curNetwork, fieldName, fieldValue):
+        # iw reports both '* channel width' (VHT) and '* STA channel width' (HT).  Only the first counts.
+        if fieldName.endswith('* channel width'):
+            matchobj = p_dispatch_bw.search(fieldValue)
+            if matchobj:
+                curNetwork.bandwidth = int(matchobj.group(1))
                 
-            if (len(fieldValue) > 0):
-                curNetwork.secondaryChannelLocation = fieldValue
-                if (fieldValue == 'above'):
-                    curNetwork.secondaryChannel = curNetwork.channel + 4
-                elif (fieldValue == 'below'):
-                    curNetwork.secondaryChannel = curNetwork.channel - 4
-                # else it'll say 'no secondary'
-                    
-                continue #Found the item
+    def getFirstWord(fieldValue):
+        fieldValue = fieldValue.lstrip(' ')
+        endPos = 0
+        while endPos < len(fieldValue) and fieldValue[endPos] not in ' \t':
+            endPos += 1
+            
+        return fieldValue[:endPos]
+        
+    def extractSecondaryChannel(curNetwork, fieldName, fieldValue):
+        fieldValue = WirelessEngine.getFirstWord(fieldValue)
+        if len(fieldValue) > 0:
+            curNetwork.secondaryChannelLocation = fieldValue
+            if (fieldValue == 'above'):
+                curNetwork.secondaryChannel = curNetwork.channel + 4
+            elif (fieldValue == 'below'):
+                curNetwork.secondaryChannel = curNetwork.channel - 4
                 
-            fieldValue = WirelessEngine.getFieldValue(p_thirdfreq, curLine)
+    def extractThirdChannel(curNetwork, fieldName, fieldValue):
+        fieldValue = WirelessEngine.getFirstWord(fieldValue)
+        if len(fieldValue) > 0:
+            curNetwork.thirdChannel = int(fieldValue)
                 
-            if (len(fieldValue) > 0):
-                curNetwork.thirdChannel = int(fieldValue)
-                    
-                continue #Found the item
+    def extractLastSeen(curNetwork, fieldName, fieldValue):
+        if fieldName == '\tlast seen':
+            matchobj = p_dispatch_lastseen.match(fieldValue)
+            if matchobj:
+                WirelessEngine.setLastSeenAge(curNetwork, int(matchobj.group(1)))
                 
-        # #### End loop ######
-        
-        # Add the last network
-        if curNetwork is not None:
-            if curNetwork.channel > 0:
-                # I did see incomplete output from iw where not all the data was there
-                retVal[curNetwork.getKey()] = curNetwork
-        
-        return retVal
+    def setLastSeenAge(curNetwork, ageMs):
+        # iw reports how long ago the BSS was last heard.  For a cache dump that can be a while.
+        curNetwork.lastSeenEpoch = time() - ageMs / 1000.0
+        curNetwork.firstSeenEpoch = curNetwork.lastSeenEpoch
         
+# Dispatch table for parseIWLineDispatch, keyed by the field name with indentation stripped
+iwLineExtractors = {}
+iwLineExtractors['SSID'] = WirelessEngine.extractSSID
+iwLineExtractors['capability'] = WirelessEngine.extractCapability
+iwLineExtractors['Authentication suites'] = WirelessEngine.extractAuthSuites
+iwLineExtractors['Pairwise ciphers'] = WirelessEngine.extractPairwiseCiphers
+iwLineExtractors['DS Parameter set'] = WirelessEngine.extractDSParameter
+iwLineExtractors['primary channel'] = WirelessEngine.extractPrimaryChannel
+iwLineExtractors['freq'] = WirelessEngine.extractFrequency
+iwLineExtractors['signal'] = WirelessEngine.extractSignal
+iwLineExtractors['channel width'] = WirelessEngine.extractChannelWidth
+iwLineExtractors['STA channel width'] = WirelessEngine.extractChannelWidth
+iwLineExtractors['secondary channel offset'] = WirelessEngine.extractSecondaryChannel
+iwLineExtractors['center freq segment 1'] = WirelessEngine.extractThirdChannel
+iwLineExtractors['last seen'] = WirelessEngine.extractLastSeen
+
 if __name__ == '__main__':
     # WirelessEngine.getMacAddress('wlan0mon')
     if os.geteuid() != 0: